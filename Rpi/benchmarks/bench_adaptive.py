@@ -0,0 +1,133 @@
+"""
+------------------------------------------------------------------------------
+CPU and samples saved by adaptive sampling (see system/adaptive.py).
+
+Runs main.py on the fake devices and the real clock, with an echo on the
+HC-SR04 and the ADC reading its fakes, for a few seconds in each of:
+
+  standby, adaptive off  - every sensor at its configured rate
+  standby, adaptive on   - the standby scales of config.json
+  enabled, adaptive off
+  enabled, adaptive on   - armed at the start; measured after the exit delay
+
+Each runs in a fresh process forked from one with no threads, as main.py
+is. CPU is the process's, plus the sensing process's in the split layout.
+The fake devices cost less than spidev and RPi.GPIO do, so on the Pi the
+share saved is larger than the seconds saved here suggest. The fake echo
+jitters by the sleeping of a thread, which is enough to trigger the alarm,
+so the thresholds are raised out of reach: nothing bursts.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_adaptive [seconds] [single|split]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import threading
+import multiprocessing
+
+from benchmarks import fakes
+
+GPIO = fakes.install()
+os.environ["SECURITY_SYSTEM_AUDIO"] = "null"
+
+import main as app
+from system.config import load_config
+from system.startup import StartupProfile
+from system.alarm import EVENT_ARM, ENABLED
+
+ECHO_DELAY = 0.0005 # s, trigger to echo rising
+ECHO_WIDTH = 0.0060 # s, ~1m
+
+TRIALS = [ ( "standby", False ), ( "standby", True ), ( "enabled", False ), ( "enabled", True ) ]
+
+class _Watcher:
+	# Configuration changes are not part of the measurement
+	def check( self ):
+		return
+
+def cpu_seconds( pid = None ):
+	# The user and system seconds of this process, or of another one
+	if pid is None:
+		return time.process_time()
+	with open( "/proc/{}/stat".format( pid ) ) as stat:
+		fields = stat.read().rsplit( ")", 1 )[1].split()
+	return (int( fields[11] ) + int( fields[12] )) / os.sysconf( "SC_CLK_TCK" )
+
+def counts():
+	cpu = cpu_seconds()
+	if app.sensing:
+		cpu += cpu_seconds( app.sensing.pid )
+	return ( time.perf_counter(), cpu, app.pressure_capture.samples, app.sonars.stats()["pings"] )
+
+def trial( state, adaptive, layout, seconds, report ):
+	"""
+	--------------------------------------------------------------------------
+	One configuration, in a process of its own; sends back the wall and CPU
+	seconds, the ADC scans and the pings over the measurement
+	--------------------------------------------------------------------------
+	"""
+	config = load_config( app.CONFIG_PATH )
+	app.apply_config( config )
+	app.PROCESS_LAYOUT = layout
+	app.ADAPTIVE.enabled = adaptive
+	app.watcher = _Watcher()
+	app.PRESSURE_THRESHOLD   = float( "inf" )
+	app.ULTRASONIC_THRESHOLD = float( "inf" )
+	GPIO.attach_echo( app.PIN_HCSR04_TRIG, app.PIN_HCSR04_ECHO, ECHO_DELAY, ECHO_WIDTH )
+
+	app.startup( StartupProfile( app.STARTED ) )
+	runner = threading.Thread( target = app.scheduler.run, daemon = True )
+	runner.start()
+	if state == "enabled":
+		app.alarm.post( EVENT_ARM )
+		while app.alarm.state != ENABLED:
+			time.sleep( 0.05 )
+	time.sleep( 1.0 ) # the rates settle
+
+	start = counts()
+	time.sleep( seconds )
+	end   = counts()
+	report.send( tuple( after - before for before, after in zip( start, end ) ) )
+
+	app.scheduler.stop()
+	runner.join()
+	app.shutdown()
+	return
+
+def main():
+	seconds = float( sys.argv[1] ) if len( sys.argv ) > 1 else 10.0
+	layout  = sys.argv[2] if len( sys.argv ) > 2 else "single"
+
+	context = multiprocessing.get_context( "fork" )
+	print( "{:.0f}s per trial, {} layout, on {} CPU{}".format(
+		seconds, layout, os.cpu_count(), "" if os.cpu_count() == 1 else "s" ) )
+	print( "{:<9} {:<9} {:>8} {:>10} {:>10} {:>8}".format(
+		"state", "adaptive", "CPU %", "ADC/s", "pings/s", "saved" ) )
+	baselines = {}
+	for state, adaptive in TRIALS:
+		report, reported = context.Pipe()
+		process = context.Process( target = trial, args = ( state, adaptive, layout, seconds, reported ) )
+		with open( os.devnull, "w" ) as quiet:
+			# The trial's own report is not part of the table
+			stdout = os.dup( 1 )
+			os.dup2( quiet.fileno(), 1 )
+			try:
+				process.start()
+				reported.close()
+				wall, cpu, scans, pings = report.recv()
+				process.join()
+			finally:
+				os.dup2( stdout, 1 )
+				os.close( stdout )
+
+		samples = scans + pings
+		baseline = baselines.setdefault( state, samples / wall )
+		print( "{:<9} {:<9} {:>8.1f} {:>10.0f} {:>10.1f} {:>7.0%}".format(
+			state, "on" if adaptive else "off", cpu / wall * 100.0, scans / wall, pings / wall,
+			1.0 - samples / wall / baseline ) )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,64 @@
+"""
+------------------------------------------------------------------------------
+Compares samples per second of per-call MCP3008.receive() against a scan of
+all eight channels read with MCP3008.receive_scan(), using a fake spidev.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_adc [seconds]
+------------------------------------------------------------------------------
+"""
+import sys
+import time
+
+from benchmarks import fakes
+
+fakes.install()
+
+import devices.adc.mcp3008 as mcp3008
+from devices.adc.mcp3008 import MCP3008
+
+CHANNELS = [
+	MCP3008.CHANNEL0, MCP3008.CHANNEL1, MCP3008.CHANNEL2, MCP3008.CHANNEL3,
+	MCP3008.CHANNEL4, MCP3008.CHANNEL5, MCP3008.CHANNEL6, MCP3008.CHANNEL7,
+]
+CONVERSIONS = [ ( channel, MCP3008.DIFF_CH0_TO_CH1 ) for channel in CHANNELS ]
+
+def rate( name, read, samples_per_read, seconds, spi ):
+	spi.transfers = 0
+	reads = 0
+	start = time.perf_counter()
+	end   = start + seconds
+	while time.perf_counter() < end:
+		for _ in range( 100 ):
+			read()
+		reads += 100
+	elapsed = time.perf_counter() - start
+	samples = reads * samples_per_read
+	print( "{:<22} {:>10.0f} samples/s {:>8.2f} us/sample {:>6.2f} transfers/sample".format(
+		name, samples / elapsed, elapsed / samples * 1e6, spi.transfers / samples ) )
+	return
+
+def main():
+	seconds = float( sys.argv[1] ) if len( sys.argv ) > 1 else 1.0
+
+	adc  = MCP3008( 0, 1 )
+	spi  = adc._spi
+	spi.set_value( 700 )
+	scan = adc.scan( CONVERSIONS )
+
+	def per_call():
+		for channel, differential in CONVERSIONS:
+			adc.receive( channel, differential )
+
+	rate( "receive() x8",        per_call,                         8, seconds, spi )
+	rate( "receive_scan() xfer2", lambda: adc.receive_scan( scan ), 8, seconds, spi )
+
+	# The ioctl path: one SPI message for all eight frames
+	adc._fd       = 0
+	mcp3008.fcntl = fakes.FakeFcntl( spi )
+	assert list( adc.receive_scan( scan ) ) == [ 700 ] * len( CONVERSIONS )
+	rate( "receive_scan() ioctl", lambda: adc.receive_scan( scan ), 8, seconds, spi )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,141 @@
+"""
+------------------------------------------------------------------------------
+Stress test of the AlarmStateMachine. Five producer threads stand in for the
+radio switches, the DE board and the two sensor checks, and post random
+events at several thousand per second in total. Every transition handled is
+checked against the transition table, and against the one before it, so a
+lost, reordered or racing transition fails the run.
+
+Reports the cost of post() and the latency from posting a detection to its
+TRIGGERED transition reaching the handler.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_alarm [seconds] [events per second]
+------------------------------------------------------------------------------
+"""
+import sys
+import time
+import random
+import threading
+
+from benchmarks import fakes
+
+fakes.install()
+
+from devices.hal import clock
+from system.alarm import AlarmStateMachine, STATE_NAMES
+from system.alarm import STANDBY, ARMING, ENABLED, TRIGGERED
+from system.alarm import EVENT_ARM, EVENT_DISARM, EVENT_ARMED, EVENT_DETECTION, EVENT_MODE
+
+EXIT_DELAY = 0.002 # s, so arming completes many times a second
+
+# ( previous, event ) -> state, for every transition that may happen; a MODE
+# event acts as the event its word stands for
+ALLOWED = {
+	( STANDBY,   EVENT_ARM       ) : ARMING,
+	( ARMING,    EVENT_ARMED     ) : ENABLED,
+	( ARMING,    EVENT_DISARM    ) : STANDBY,
+	( ENABLED,   EVENT_DETECTION ) : TRIGGERED,
+	( ENABLED,   EVENT_DISARM    ) : STANDBY,
+	( TRIGGERED, EVENT_DISARM    ) : STANDBY,
+}
+MODE_EVENTS = { STANDBY: EVENT_DISARM, ENABLED: EVENT_ARM, TRIGGERED: EVENT_DETECTION }
+
+def percentile( values, fraction ):
+	ordered = sorted( values )
+	if not ordered:
+		return 0.0
+	return ordered[min( len( ordered ) - 1, int( fraction * len( ordered ) ) )]
+
+class Producer( threading.Thread ):
+	"""
+	--------------------------------------------------------------------------
+	Posts events at a fixed rate, in small bursts
+	--------------------------------------------------------------------------
+	"""
+
+	BURST = 8
+
+	def __init__( self, name, machine, make_event, rate, seconds, seed ):
+		super().__init__( name = name )
+		self._machine    = machine
+		self._make_event = make_event
+		self._interval   = Producer.BURST / rate
+		self._seconds    = seconds
+		self._rng        = random.Random( seed )
+		self.posted      = 0
+		self.post_time   = 0.0
+		return
+
+	def run( self ):
+		start = time.perf_counter()
+		due   = start
+		while due - start < self._seconds:
+			for _ in range( Producer.BURST ):
+				event, value = self._make_event( self._rng )
+				before = time.perf_counter_ns()
+				self._machine.post( event, value )
+				self.post_time += time.perf_counter_ns() - before
+				self.posted    += 1
+			due += self._interval
+			delay = due - time.perf_counter()
+			if delay > 0:
+				time.sleep( delay )
+		return
+
+def main():
+	seconds = float( sys.argv[1] ) if len( sys.argv ) > 1 else 3.0
+	rate    = float( sys.argv[2] ) if len( sys.argv ) > 2 else 5000.0
+
+	machine     = AlarmStateMachine( clock, EXIT_DELAY )
+	transitions = []
+	latencies   = []
+
+	def on_transition( state, previous, event, value ):
+		if event == EVENT_DETECTION:
+			latencies.append( time.perf_counter_ns() - value )
+		transitions.append( ( previous, event, value, state ) )
+		return
+
+	machine.set_on_transition( on_transition )
+	machine.start()
+
+	sources = [
+		( "radio-a",    lambda rng: ( EVENT_ARM,    None ), 0.10 ),
+		( "radio-b",    lambda rng: ( EVENT_DISARM, None ), 0.05 ),
+		( "de-board",   lambda rng: ( EVENT_MODE,   rng.choice( [ STANDBY, ENABLED, TRIGGERED ] ) ), 0.05 ),
+		( "pressure",   lambda rng: ( EVENT_DETECTION, time.perf_counter_ns() ), 0.40 ),
+		( "ultrasonic", lambda rng: ( EVENT_DETECTION, time.perf_counter_ns() ), 0.40 ),
+	]
+	producers = [ Producer( name, machine, make_event, rate * share, seconds, seed )
+	              for seed, ( name, make_event, share ) in enumerate( sources ) ]
+	for producer in producers:
+		producer.start()
+	for producer in producers:
+		producer.join()
+	machine.stop()
+
+	# Every transition must follow from the state before it
+	state  = STANDBY
+	counts = {}
+	for previous, event, value, new in transitions:
+		assert previous == state, "transition from {} while {}".format( previous, state )
+		key = ( previous, MODE_EVENTS.get( value ) if event == EVENT_MODE else event )
+		assert ALLOWED.get( key ) == new, "{} -> {} on {}".format( previous, new, event )
+		counts[new] = counts.get( new, 0 ) + 1
+		state = new
+	assert machine.state == state
+
+	posted = sum( producer.posted for producer in producers )
+	print( "{:.0f} events/s for {:.1f}s from {} threads: {} posted, {} applied, {} transitions, {} ignored".format(
+		rate, seconds, len( producers ), posted, machine.events, machine.transitions, machine.ignored ) )
+	print( "transitions into " + ", ".join( "{} {}".format( STATE_NAMES[state], count )
+	                                        for state, count in sorted( counts.items() ) ) )
+	print( "post(): {:.0f}ns mean".format( sum( producer.post_time for producer in producers ) / posted ) )
+	print( "detection to handler: p50 {:.0f}us p99 {:.0f}us max {:.0f}us".format(
+		percentile( latencies, 0.50 ) / 1e3, percentile( latencies, 0.99 ) / 1e3,
+		max( latencies, default = 0 ) / 1e3 ) )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,129 @@
+"""
+------------------------------------------------------------------------------
+Runs an UltrasonicArray on the simulated backend in a room where sensors
+hear each other: each ping reaches the sensors beside it off the walls, once
+directly and twice more over longer paths. A sensor that hears a neighbour's
+pulse while it listens ends its echo early, and reads the room as closer.
+
+Compares schedules of the same four sensors, by echoes per second, the
+slowest sensor's update rate, and the share of echoes corrupted by
+crosstalk.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_array [seconds]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import random
+
+os.environ["SECURITY_SYSTEM_HAL"] = "sim"
+
+import devices.hal as hal
+from devices.hal import sim
+from devices.sensors.ultrasonic.HCSR04 import HCSR04
+from devices.sensors.ultrasonic.array import UltrasonicArray
+
+DISTANCES  = [ 1.0, 2.5, 1.5, 2.0 ] # m, in a row; neighbours hear each other
+PATHS      = [ 1.1, 1.9, 2.7 ]      # crosstalk arrivals, in echo widths of the pinging sensor
+JITTER     = 0.00002                # s of echo noise
+CORRUPTED  = 0.001                  # s of echo error that counts as crosstalk
+SCHEDULES  = [
+	( "all at once",          [ [ 0, 1, 2, 3 ] ],     0.01  ),
+	( "round robin, no guard", None,                   0.0   ),
+	( "round robin, 10ms",     None,                   0.01  ),
+	( "round robin, 40ms",     None,                   0.04  ),
+	( "pairs, 40ms",           [ [ 0, 2 ], [ 1, 3 ] ], 0.04  ),
+]
+
+class Room:
+	"""
+	--------------------------------------------------------------------------
+	Answers the pings of a row of sensors, with crosstalk between neighbours
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, simulator, pins, rng ):
+		self._GPIO      = simulator.GPIO
+		self._clock     = simulator.clock
+		self._pins      = pins
+		self._rng       = rng
+		self._falls     = [ None ] * len( pins ) # virtual time each echo pin falls
+		self._arrivals  = [ [] for _ in pins ]   # crosstalk heard by each sensor
+		for index, ( trigger, echo ) in enumerate( pins ):
+			self._GPIO.observe( trigger, lambda pin, value, index = index: value or self._ping( index ) )
+		return
+
+	def width( self, index ):
+		return sim.distance_to_echo( DISTANCES[index] )
+
+	def _ping( self, index ):
+		now = self._clock.monotonic()
+		for neighbour in ( index - 1, index + 1 ):
+			if 0 <= neighbour < len( self._pins ):
+				for path in PATHS:
+					at = now + sim.ECHO_LATENCY + path * self.width( index )
+					self._arrivals[neighbour].append( at )
+					# A neighbour already listening hears it too
+					fall = self._falls[neighbour]
+					if fall is not None and at < fall:
+						self._clock.call_later( at - now, self._fall, neighbour, fall )
+		self._clock.call_later( sim.ECHO_LATENCY, self._rise, index )
+		return
+
+	def _rise( self, index ):
+		now  = self._clock.monotonic()
+		fall = now + self.width( index ) + self._rng.gauss( 0.0, JITTER )
+		self._arrivals[index] = [ at for at in self._arrivals[index] if at > now ]
+		self._falls[index]    = fall
+		self._GPIO.drive( self._pins[index][1], 1 )
+		self._clock.call_later( fall - now, self._fall, index, fall )
+		for at in self._arrivals[index]:
+			if at < fall:
+				self._clock.call_later( at - now, self._fall, index, fall )
+		return
+
+	def _fall( self, index, fall ):
+		# Only the first of an echo's falls counts
+		if self._falls[index] != fall:
+			return
+		self._falls[index] = None
+		self._GPIO.drive( self._pins[index][1], 0 )
+		return
+
+def run( simulator, name, groups, guard, seconds, base ):
+	pins    = [ ( base + 2 * index, base + 2 * index + 1 ) for index in range( len( DISTANCES ) ) ]
+	room    = Room( simulator, pins, random.Random( base ) )
+	sensors = [ HCSR04( trigger, echo ) for trigger, echo in pins ]
+	array   = UltrasonicArray( sensors, groups, guard )
+
+	clock     = simulator.clock
+	end       = clock.monotonic() + seconds
+	corrupted = 0
+	while clock.monotonic() < end:
+		for reading in array.step():
+			if abs( reading.echo - room.width( reading.sensor ) ) > CORRUPTED:
+				corrupted += 1
+
+	stats  = array.stats()
+	errors = [ abs( array.distance( index ) - DISTANCES[index] ) for index in range( len( array ) )
+	           if array.distance( index ) is not None ]
+	print( "{:<22} {:>9.1f} {:>9.1f} {:>10.1%} {:>9} {:>10.0f}".format(
+		name, stats["throughput"], min( stats["rates"] ), corrupted / max( 1, stats["echoes"] ),
+		stats["timeouts"], max( errors, default = 0.0 ) * 1e3 ) )
+	return sensors
+
+def main():
+	seconds   = float( sys.argv[1] ) if len( sys.argv ) > 1 else 20.0
+	simulator = hal.simulator()
+
+	print( "{:<22} {:>9} {:>9} {:>10} {:>9} {:>10}".format(
+		"schedule", "echoes/s", "slowest/s", "crosstalk", "timeouts", "error mm" ) )
+	keep = []
+	for run_index, ( name, groups, guard ) in enumerate( SCHEDULES ):
+		# Each run on pins of its own, as the simulator lives for the process
+		keep.append( run( simulator, name, groups, guard, seconds, 100 + 10 * run_index ) )
+	return
+
+if __name__ == "__main__":
+	main()
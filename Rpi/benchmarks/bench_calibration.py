@@ -0,0 +1,100 @@
+"""
+------------------------------------------------------------------------------
+Learned thresholds (see system/calibration.py) against the common one, on
+pads of different noise.
+
+Each pad's samples are its level plus Gaussian noise, rounded to ADC
+counts. A Calibration learns every pad's step for a while, as main.py does
+in standby; then a detector at the common threshold and one at the learned
+thresholds are each given the same quiet batches, counting false alarms,
+and the same batches with an impact (a step lasting IMPACT_TIME samples)
+of a few sizes, counting detections. The detector's noise limit is on in
+both, as in main.py.
+
+Then the baselines are saved and loaded into a new Calibration, which must
+give the same thresholds at once, and the cost of learning one batch is
+timed.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_calibration [batches]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+from devices.sensors.fusion import FusionDetector
+from system.calibration import Calibration
+
+RATE        = 1000 # Hz
+BATCH       = 50   # samples, 50ms at 1kHz
+THRESHOLD   = 8    # ADC counts, the common threshold
+SMOOTHING   = 8
+LEVEL       = 300  # ADC counts
+NOISE       = [ 0.5, 1.5, 3.0 ] # ADC counts, the std of each pad
+IMPACTS     = [ 4, 6, 10 ]      # ADC counts
+IMPACT_TIME = 20   # samples
+
+def batch( rng, noise, impact = 0 ):
+	samples = [ round( LEVEL + rng.gauss( 0.0, noise ) ) for _ in range( BATCH ) ]
+	if impact:
+		start = rng.randrange( BATCH - IMPACT_TIME )
+		for index in range( start, start + IMPACT_TIME ):
+			samples[index] += impact
+	return samples
+
+def triggers( detector, pad, batches ):
+	count = 0
+	for samples in batches:
+		if detector.pressure_features( pad, [ samples ] ):
+			detector.evaluate_pressure( pad )
+			count += detector.evidence[pad] >= 1.0
+	return count
+
+def main():
+	batches = int( sys.argv[1] ) if len( sys.argv ) > 1 else 2000
+	rng     = random.Random( 1 )
+	pads    = len( NOISE )
+
+	with tempfile.TemporaryDirectory() as directory:
+		path        = os.path.join( directory, "calibration.json" )
+		keys        = [ "adc.{}.0".format( pad ) for pad in range( pads ) ]
+		calibration = Calibration( path, keys, [], THRESHOLD, 1.0 )
+		learner     = FusionDetector( pads, RATE, THRESHOLD, 1.0, SMOOTHING )
+		elapsed     = 0.0
+		for _ in range( batches ):
+			for pad, noise in enumerate( NOISE ):
+				if learner.pressure_features( pad, [ batch( rng, noise ) ] ):
+					learner.evaluate_pressure( pad )
+					start    = time.perf_counter()
+					calibration.learn_pressure( pad, learner.steps[pad], learner.levels[pad] )
+					elapsed += time.perf_counter() - start
+
+		calibration.save()
+		restored = Calibration( path, keys, [], THRESHOLD, 1.0 )
+		restored.load()
+		thresholds = [ calibration.pressure_threshold( pad ) for pad in range( pads ) ]
+		same       = thresholds == [ restored.pressure_threshold( pad ) for pad in range( pads ) ]
+
+	print( "{} batches of {} samples learned per pad; {:.2f}us per batch learned".format(
+		batches, BATCH, elapsed / (batches * pads) * 1e6 ) )
+	print( "Thresholds after a restart: {}".format( "the same" if same else "DIFFERENT" ) )
+	print( "{:<6} {:<8} {:>9} {:>8} {}".format( "noise", "detector", "threshold", "false", "  ".join(
+		"{:>8}".format( "step {}".format( impact ) ) for impact in IMPACTS ) ) )
+	for pad, noise in enumerate( NOISE ):
+		quiet   = [ batch( rng, noise ) for _ in range( batches ) ]
+		impacts = { impact: [ batch( rng, noise, impact ) for _ in range( batches // 10 ) ] for impact in IMPACTS }
+		for name, threshold in ( ( "common", THRESHOLD ), ( "learned", thresholds[pad] ) ):
+			detector = FusionDetector( pads, RATE, THRESHOLD, 1.0, SMOOTHING )
+			detector.set_pressure_threshold( pad, threshold )
+			detector.pressure_features( pad, [ batch( rng, noise ) ] )
+			false = triggers( detector, pad, quiet )
+			found = [ triggers( detector, pad, impacts[impact] ) / len( impacts[impact] ) for impact in IMPACTS ]
+			print( "{:<6} {:<8} {:>9.2f} {:>8} {}".format( noise, name, threshold, false, "  ".join(
+				"{:>8.0%}".format( rate ) for rate in found ) ) )
+	return
+
+if __name__ == "__main__":
+	main()
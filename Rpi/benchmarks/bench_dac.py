@@ -0,0 +1,114 @@
+"""
+------------------------------------------------------------------------------
+Streams a siren to the CPA417 on a fake spidev in real time, comparing a
+thread that calls send() once per sample against DacStream's batched SPI
+messages at several batch sizes. Reports the achieved sample rate, the
+underruns (samples more than a period late), and the CPU used.
+
+The fake ioctl sleeps out the delays of each message, and its oversleep
+stands in for the gaps between messages, so small batches fall short of
+the rate here by more than they would in the kernel.
+
+Also checks that the words written are the waveform, looped exactly.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_dac [seconds] [rate]
+------------------------------------------------------------------------------
+"""
+import sys
+import time
+
+from benchmarks import fakes
+
+fakes.install()
+
+import devices.dac.cpa417 as cpa417
+from devices.dac.cpa417 import CPA417
+from devices.dac.stream import DacStream
+from devices.dac import waveforms
+
+BATCHES = [ 16, 64, 256, CPA417.MAX_BLOCK ]
+
+def per_sample( dac, samples, rate, seconds ):
+	"""
+	--------------------------------------------------------------------------
+	The loop the DAC would need without streaming: one send() per sample,
+	each waited for
+	--------------------------------------------------------------------------
+	"""
+	period    = 1.0 / rate
+	start     = time.perf_counter()
+	deadline  = start
+	sent      = 0
+	underruns = 0
+	while deadline - start < seconds:
+		now = time.perf_counter()
+		if now - deadline > period:
+			underruns += 1
+			deadline   = now
+		dac.send( CPA417.LOAD_BOTH, samples[sent % len( samples )] )
+		sent     += 1
+		deadline += period
+		delay     = deadline - time.perf_counter()
+		if delay > 0:
+			time.sleep( delay )
+	return sent, underruns, time.perf_counter() - start
+
+def check_loops( dac, words, rate ):
+	# Without the spidev file every word is a transfer of its own
+	written = bytearray()
+	dac._fd = None
+	dac._spi.xfer2 = written.extend
+	stream = DacStream( dac, rate, 100 )
+	stream.start()
+	stream.play( words, loops = 2 )
+	while stream.plays and len( written ) < 3 * len( words ):
+		time.sleep( 0.01 )
+	time.sleep( 0.05 )
+	stream.close()
+	del dac._spi.xfer2
+	assert bytes( written[:3 * len( words )] ) == words * 3
+	assert set( written[3 * len( words ) + 1::2] ) <= { waveforms.MIDSCALE }
+	return
+
+def main():
+	seconds = float( sys.argv[1] ) if len( sys.argv ) > 1 else 2.0
+	rate    = float( sys.argv[2] ) if len( sys.argv ) > 2 else 8000.0
+
+	dac     = CPA417( 0, 0 )
+	samples = waveforms.siren( rate, 600, 1200, 1.0 )
+	words   = CPA417.encode( samples, CPA417.LOAD_BOTH )
+	print( "siren: {} samples, {} bytes encoded".format( len( samples ), len( words ) ) )
+
+	check_loops( dac, words, rate )
+
+	print( "{:<18} {:>10} {:>10} {:>10} {:>10}".format( "", "rate", "underruns", "transfers", "cpu" ) )
+	spi = dac._spi
+	spi.transfers = 0
+	cpu = time.process_time()
+	sent, underruns, wall = per_sample( dac, samples, rate, seconds )
+	cpu = time.process_time() - cpu
+	print( "{:<18} {:>9.0f}/s {:>10} {:>10} {:>10.1%}".format(
+		"send() x1", sent / wall, underruns, spi.transfers, cpu / wall ) )
+
+	# The ioctl path, with the kernel's work stood in for by the fake
+	dac._fd      = 0
+	cpa417.fcntl = fakes.FakeFcntl( spi )
+	for batch in BATCHES:
+		spi.transfers = 0
+		stream = DacStream( dac, rate, batch )
+		cpu    = time.process_time()
+		wall   = time.perf_counter()
+		stream.start()
+		stream.play( words )
+		time.sleep( seconds )
+		stream.close()
+		cpu  = time.process_time() - cpu
+		wall = time.perf_counter() - wall
+		stats = stream.stats()
+		print( "{:<18} {:>9.0f}/s {:>10} {:>10} {:>10.1%}".format(
+			"DacStream x{}".format( batch ), stats["rate"], stats["underruns"], spi.transfers, cpu / wall ) )
+	return
+
+if __name__ == "__main__":
+	main()
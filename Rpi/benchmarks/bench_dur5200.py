@@ -0,0 +1,86 @@
+"""
+------------------------------------------------------------------------------
+Runs the free-running DUR5200 driver on the simulated backend, whose PWM
+toggles the trigger pin, through a scripted room:
+
+  - an object at 1.5m
+  - nothing in range (the sensor holds its echo for ~38ms)
+  - the sensor disconnected (no echo at all)
+  - an object at 0.8m
+
+and checks that each phase comes out of the stream as the right mix of
+ranges, out of range samples and dropouts, at the configured rate.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_dur5200 [rate]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import random
+
+os.environ["SECURITY_SYSTEM_HAL"] = "sim"
+
+import devices.hal as hal
+from devices.hal import sim
+from devices.sensors.ultrasonic.DUR5200 import DUR5200, RANGE_OK, RANGE_OUT, RANGE_DROPOUT
+
+PIN_TRIG   = 21
+PIN_ECHO   = 25
+NO_OBJECT  = 0.038 # s, the echo held when nothing is seen
+PHASES     = [ # ( name, until (s), metres or None for no echo )
+	( "object at 1.5m", 5.0,  1.5       ),
+	( "nothing",        7.0,  NO_OBJECT ),
+	( "disconnected",   9.0,  None      ),
+	( "object at 0.8m", 12.0, 0.8       ),
+]
+
+def phase_of( now ):
+	for index, ( name, until, source ) in enumerate( PHASES ):
+		if now < until:
+			return index
+	return len( PHASES ) - 1
+
+def main():
+	rate      = float( sys.argv[1] ) if len( sys.argv ) > 1 else DUR5200.DEFAULT_RATE
+	simulator = hal.simulator()
+	GPIO      = simulator.GPIO
+	clock     = simulator.clock
+	rng       = random.Random( 1 )
+
+	def echo( now ):
+		source = PHASES[phase_of( now )][2]
+		if source is None or source == NO_OBJECT:
+			return source
+		return sim.distance_to_echo( source + rng.gauss( 0.0, 0.002 ) )
+
+	GPIO.attach_echo( PIN_TRIG, PIN_ECHO, echo )
+	sensor = DUR5200( PIN_TRIG, PIN_ECHO, rate = rate )
+	sensor.enable()
+
+	counts    = [ dict.fromkeys( ( RANGE_OK, RANGE_OUT, RANGE_DROPOUT ), 0 ) for _ in PHASES ]
+	distances = [ [] for _ in PHASES ]
+	end       = PHASES[-1][1]
+	while clock.monotonic() < end:
+		sample = sensor.read_sample( end - clock.monotonic() )
+		if sample is None:
+			break
+		phase = phase_of( sample.time_ns / 1e9 )
+		counts[phase][sample.status] += 1
+		if sample.status == RANGE_OK:
+			distances[phase].append( sample.distance )
+	sensor.disable()
+
+	print( "{:<16} {:>8} {:>6} {:>8} {:>8} {:>10}".format( "phase", "pings", "ok", "out", "dropout", "mean m" ) )
+	start = 0.0
+	for ( name, until, source ), count, values in zip( PHASES, counts, distances ):
+		mean = sum( values ) / len( values ) if values else float( "nan" )
+		print( "{:<16} {:>8.0f} {:>6} {:>8} {:>8} {:>10.3f}".format(
+			name, (until - start) * rate, count[RANGE_OK], count[RANGE_OUT], count[RANGE_DROPOUT], mean ) )
+		start = until
+	print( "echoes: {} out of range: {} dropouts: {} dropped: {}".format(
+		sensor.echoes, sensor.out_of_range, sensor.dropouts, sensor.dropped ) )
+	return
+
+if __name__ == "__main__":
+	main()
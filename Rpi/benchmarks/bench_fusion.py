@@ -0,0 +1,189 @@
+"""
+------------------------------------------------------------------------------
+Compares the FusionDetector's vectorized pressure evaluation against the
+scalar paths, per sample, at several batch sizes (the samples captured
+between two checks: 50 at 1kHz and the default 50ms period):
+
+  threshold - the per-sample threshold check check_pressure() used
+  scalar    - the detector's features computed one sample at a time
+  numpy     - FusionDetector.add_pressure()
+
+Then counts the triggers of the threshold check and the detector on a noisy
+stream with single-sample glitches and a few real impacts.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_fusion [samples]
+------------------------------------------------------------------------------
+"""
+import sys
+import time
+import random
+import collections
+from array import array
+
+from devices.sensors.fusion import FusionDetector
+
+BATCH_SIZES = [ 10, 50, 200, 1000, 5000 ]
+RATE        = 1000 # Hz
+THRESHOLD   = 8    # ADC counts
+SMOOTHING   = 8
+IMPACT      = 60   # ADC counts
+IMPACT_TIME = 20   # samples
+GLITCH      = 40   # ADC counts
+
+class ThresholdCheck:
+	"""
+	--------------------------------------------------------------------------
+	The original check from check_pressure(): every sample against the last
+	sample of the previous check
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self ):
+		self._baseline = None
+		return
+
+	def add( self, slices ):
+		if self._baseline is None:
+			self._baseline = slices[0][0]
+		baseline = self._baseline
+		delta    = 0
+		for samples in slices:
+			for value in samples:
+				delta = max( delta, value - baseline, baseline - value )
+		self._baseline = slices[-1][-1]
+		return delta > THRESHOLD
+
+class ScalarFeatures:
+	"""
+	--------------------------------------------------------------------------
+	The detector's pressure features, one sample at a time in Python
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, smoothing ):
+		self._k       = smoothing
+		self._window  = collections.deque()
+		self._sum     = 0.0
+		self._squares = 0.0
+		self.level    = None
+		self.step     = 0.0
+		self.variance = 0.0
+		self.rate     = 0.0
+		return
+
+	def add( self, slices ):
+		k        = self._k
+		level    = self.level
+		previous = level
+		step     = 0.0
+		rate     = 0.0
+		variance = 0.0
+		count    = 0
+		mean     = None
+		for samples in slices:
+			for value in samples:
+				self._window.append( value )
+				self._sum     += value
+				self._squares += value * value
+				if len( self._window ) > k:
+					old = self._window.popleft()
+					self._sum     -= old
+					self._squares -= old * old
+				if len( self._window ) < k:
+					continue
+
+				mean = self._sum / k
+				if level is None:
+					level = mean
+				step      = max( step, abs( mean - level ) )
+				variance += max( self._squares / k - mean * mean, 0.0 )
+				count    += 1
+				if previous is not None and count > 1:
+					rate = max( rate, abs( mean - previous ) * RATE )
+				previous = mean
+
+		if count:
+			self.level    = mean
+			self.step     = step
+			self.variance = variance / count
+			self.rate     = rate
+		return self.step >= THRESHOLD
+
+def batches( samples, size ):
+	view = memoryview( samples )
+	return [ [ view[i:i + size] ] for i in range( 0, len( samples ), size ) ]
+
+def measure( add, stream ):
+	start = time.perf_counter()
+	for slices in stream:
+		add( slices )
+	return time.perf_counter() - start
+
+def compare_cost( count, rng ):
+	samples = array( 'H', [ 300 + rng.randint( -2, 2 ) for _ in range( count ) ] )
+
+	print( "{:>8} {:>16} {:>14} {:>12} {:>8}".format(
+		"batch", "threshold (us)", "scalar (us)", "numpy (us)", "speedup" ) )
+	for size in BATCH_SIZES:
+		stream   = batches( samples, size )
+		scalar   = ScalarFeatures( SMOOTHING )
+		detector = FusionDetector( 1, RATE, THRESHOLD, 1.0, SMOOTHING )
+
+		old  = measure( ThresholdCheck().add, stream ) / count
+		slow = measure( scalar.add, stream ) / count
+		fast = measure( lambda slices: detector.add_pressure( 0, slices ), stream ) / count
+
+		assert abs( scalar.step  - detector.steps[0]  ) < 1e-6
+		assert abs( scalar.level - detector.levels[0] ) < 1e-6
+		print( "{:>8} {:>16.3f} {:>14.3f} {:>12.3f} {:>7.1f}x".format(
+			size, old * 1e6, slow * 1e6, fast * 1e6, slow / fast ) )
+	return
+
+def compare_triggers( seconds, rng ):
+	"""
+	--------------------------------------------------------------------------
+	A pad with +/-2 counts of noise, a one-sample read glitch every 2s on
+	average, and an impact every 10s
+	--------------------------------------------------------------------------
+	"""
+	count   = int( seconds * RATE )
+	samples = array( 'H', [ 300 + rng.randint( -2, 2 ) for _ in range( count ) ] )
+	impacts = set()
+	for start in range( 5 * RATE, count - IMPACT_TIME, 10 * RATE ):
+		impacts.add( start // 50 )
+		for i in range( start, start + IMPACT_TIME ):
+			samples[i] += IMPACT
+	glitches = 0
+	for i in range( count ):
+		if rng.random() < 1.0 / (2 * RATE) and i // 50 not in impacts:
+			samples[i] += GLITCH
+			glitches   += 1
+
+	check    = ThresholdCheck()
+	detector = FusionDetector( 1, RATE, THRESHOLD, 1.0, SMOOTHING )
+	results  = { "threshold": [ 0, 0 ], "numpy": [ 0, 0 ] } # [ hits, false ]
+	for index, slices in enumerate( batches( samples, 50 ) ):
+		# An impact can span two checks; the first detection is the hit
+		hit = index in impacts or index - 1 in impacts
+		if check.add( slices ):
+			results["threshold"][0 if hit else 1] += 1
+		if detector.add_pressure( 0, slices ):
+			results["numpy"][0 if hit else 1] += 1
+
+	print()
+	print( "{:.0f}s of samples, {} impacts, {} glitches".format( seconds, len( impacts ), glitches ) )
+	print( "{:>10} {:>12} {:>16}".format( "", "detections", "false triggers" ) )
+	for name, ( hits, false ) in results.items():
+		print( "{:>10} {:>12} {:>16}".format( name, hits, false ) )
+	return
+
+def main():
+	count = int( sys.argv[1] ) if len( sys.argv ) > 1 else 200000
+	rng   = random.Random( 1 )
+	compare_cost( count, rng )
+	compare_triggers( 120.0, rng )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,233 @@
+"""
+------------------------------------------------------------------------------
+End-to-end detection latency of the main.py alarm pipeline.
+
+Runs main.py on the simulated backend and repeatedly arms the system from
+radio switch A, injects an event, waits for the red LED, and disarms from
+radio switch B. Each trial starts at a random phase of the sensor periods.
+Three paths are measured:
+
+  pressure   - a 20ms step on the pressure pad larger than PRESSURE_THRESHOLD
+  ultrasonic - an intruder walking towards the sensor at 0.5m/s
+  de-board   - the DE board switching its mode pins to triggered ("10")
+
+Latency is virtual time from the event to the red LED, and to the first
+period of the alarm sound reaching the audio sink. The code under test
+takes no virtual time, so the numbers are the sampling and scheduling
+latency the design gives on real hardware.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_latency [trials per path] [--output results.json]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import contextlib
+
+os.environ["SECURITY_SYSTEM_HAL"] = "sim"
+
+import devices.hal as hal
+from devices.hal import sim
+
+import simulate
+
+PATHS        = [ "pressure", "ultrasonic", "de-board" ]
+WALL         = 2.5  # m
+WALK_SPEED   = 0.5  # m/s
+SPIKE        = 60   # ADC counts
+SPIKE_WIDTH  = 0.02 # s
+SETTLE_TIME  = 1.0  # s armed before the event
+TRIAL_GAP    = 1.0  # s disarmed between trials
+TRIAL_LIMIT  = 10.0 # s before a trial counts as undetected
+
+def percentile( values, fraction ):
+	"""
+	--------------------------------------------------------------------------
+	Nearest-rank percentile of a list of values
+	--------------------------------------------------------------------------
+	"""
+	ordered = sorted( values )
+	index   = max( 0, min( len( ordered ) - 1, math.ceil( fraction * len( ordered ) ) - 1 ) )
+	return ordered[index]
+
+def summarize( values ):
+	if not values:
+		return { "count": 0 }
+	return {
+		"count" : len( values ),
+		"min"   : min( values ),
+		"p50"   : percentile( values, 0.50 ),
+		"p99"   : percentile( values, 0.99 ),
+		"max"   : max( values ),
+		"mean"  : sum( values ) / len( values ),
+	}
+
+class LatencyBench:
+	"""
+	--------------------------------------------------------------------------
+	Drives the trials from events on the virtual clock
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, simulator, trials, rng ):
+		self._simulator = simulator
+		self._GPIO      = simulator.GPIO
+		self._clock     = simulator.clock
+		self._rng       = rng
+		self._plan      = [ path for path in PATHS for _ in range( trials ) ]
+		self._trial     = None
+		self._walk      = None
+		self._spike     = None
+
+		self.led     = { path: [] for path in PATHS }
+		self.sound   = { path: [] for path in PATHS }
+		self.missed  = { path: 0 for path in PATHS }
+
+		self._GPIO.attach_echo( simulate.PIN_HCSR04_TRIG, simulate.PIN_HCSR04_ECHO, self._echo )
+		simulate.attach_de_board( simulator )
+		simulator.spi_device( 0, 1 ).set_channel( simulate.PRESSURE_CHANNEL, self._pressure )
+
+		self._GPIO.observe( simulate.PIN_LED_RED, self._on_red_led )
+		simulator.audio.observe( self._on_sound )
+		return
+
+	def start( self ):
+		self._clock.call_later( TRIAL_GAP, self._arm )
+		return
+
+	#-------------------------------------------------------------------------
+	# Simulated world
+	#-------------------------------------------------------------------------
+
+	def _echo( self, now ):
+		meters = WALL
+		if self._walk is not None:
+			meters = max( 0.3, WALL - WALK_SPEED * (now - self._walk) )
+		return sim.distance_to_echo( meters + self._rng.gauss( 0.0, 0.002 ) )
+
+	def _pressure( self, now ):
+		value = 300 + self._rng.randint( -2, 2 )
+		if self._spike is not None and self._spike <= now < self._spike + SPIKE_WIDTH:
+			value += SPIKE
+		return value
+
+	#-------------------------------------------------------------------------
+	# Trial sequence
+	#-------------------------------------------------------------------------
+
+	def _arm( self ):
+		if not self._plan:
+			self._simulator.interrupt_at( self._clock.monotonic() )
+			return
+		path = self._plan.pop( 0 )
+		self._trial = { "path": path, "event": None, "led": None, "sound": None }
+		self._GPIO.pulse_at( self._clock.monotonic(), simulate.PIN_RADIO_SWITCH_A, simulate.BUTTON_PRESS )
+		return
+
+	def _inject( self, trial ):
+		now = self._clock.monotonic()
+		trial["event"] = now
+		if trial["path"] == "pressure":
+			self._spike = now
+		elif trial["path"] == "ultrasonic":
+			self._walk = now
+		else:
+			self._GPIO.drive( simulate.PIN_IN_MODE_1, 1 )
+			self._GPIO.drive( simulate.PIN_IN_MODE_2, 0 )
+		self._clock.call_later( TRIAL_LIMIT, self._expire, trial )
+		return
+
+	def _expire( self, trial ):
+		if trial is self._trial and trial["led"] is None:
+			self.missed[trial["path"]] += 1
+			self._disarm()
+		return
+
+	def _disarm( self ):
+		self._walk  = None
+		self._spike = None
+		self._trial = None
+		self._GPIO.pulse_at( self._clock.monotonic(), simulate.PIN_RADIO_SWITCH_B, simulate.BUTTON_PRESS )
+		self._clock.call_later( TRIAL_GAP, self._arm )
+		return
+
+	def _on_sound( self, name, action ):
+		trial = self._trial
+		if trial is None or action != "play":
+			return
+		now = self._clock.monotonic()
+		if name == "working.wav" and trial["event"] is None:
+			# Armed; inject at a random phase of the sensor periods
+			delay = SETTLE_TIME + self._rng.random() * 0.1
+			self._clock.call_later( delay, self._inject, trial )
+		elif name == "alarm.wav" and trial["event"] is not None and trial["sound"] is None:
+			trial["sound"] = now
+			self.sound[trial["path"]].append( now - trial["event"] )
+		return
+
+	def _on_red_led( self, pin, value ):
+		trial = self._trial
+		if trial is None or not value or trial["event"] is None or trial["led"] is not None:
+			return
+		trial["led"] = self._clock.monotonic()
+		self.led[trial["path"]].append( trial["led"] - trial["event"] )
+		self._clock.call_later( 0.5, self._disarm )
+		return
+
+	def results( self ):
+		return {
+			path: {
+				"led"    : summarize( self.led[path] ),
+				"sound"  : summarize( self.sound[path] ),
+				"missed" : self.missed[path],
+			} for path in PATHS
+		}
+
+def main():
+	args    = sys.argv[1:]
+	output  = None
+	if "--output" in args:
+		index  = args.index( "--output" )
+		output = args[index + 1]
+		del args[index:index + 2]
+	trials = int( args[0] ) if args else 50
+
+	simulator = hal.simulator()
+	bench     = LatencyBench( simulator, trials, random.Random( 1 ) )
+	bench.start()
+
+	start = time.perf_counter()
+	with open( os.devnull, "w" ) as null, contextlib.redirect_stdout( null ):
+		simulate.program.main()
+	wall = time.perf_counter() - start
+
+	results = {
+		"benchmark"       : "detection_latency",
+		"units"           : "seconds",
+		"trials_per_path" : trials,
+		"virtual_seconds" : simulator.clock.monotonic(),
+		"wall_seconds"    : wall,
+		"paths"           : bench.results(),
+	}
+
+	print( "{:<11} {:>6} {:>9} {:>9} {:>9} {:>7}".format( "path", "trials", "p50 (ms)", "p99 (ms)", "max (ms)", "missed" ) )
+	for path in PATHS:
+		led = results["paths"][path]["led"]
+		if led["count"]:
+			print( "{:<11} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>7}".format(
+				path, led["count"], led["p50"] * 1e3, led["p99"] * 1e3, led["max"] * 1e3, results["paths"][path]["missed"] ) )
+		else:
+			print( "{:<11} {:>6} {:>9} {:>9} {:>9} {:>7}".format( path, 0, "-", "-", "-", results["paths"][path]["missed"] ) )
+	print( "Simulated {:.0f}s in {:.1f}s".format( results["virtual_seconds"], wall ) )
+
+	if output:
+		with open( output, "w" ) as handle:
+			json.dump( results, handle, indent = 2 )
+	return
+
+if __name__ == "__main__":
+	main()
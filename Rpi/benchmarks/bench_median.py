@@ -0,0 +1,70 @@
+"""
+------------------------------------------------------------------------------
+Compares the per-sample cost of the RunningMedian filter against the sort
+based median() that check_ultrasonic() used, at several window sizes.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_median [samples]
+------------------------------------------------------------------------------
+"""
+import sys
+import time
+import random
+
+from devices.sensors.running_median import RunningMedian
+
+WINDOW_SIZES = [ 4, 16, 64, 256, 1024, 4096 ]
+
+def median(lst):
+	"""
+	--------------------------------------------------------------------------
+	The original sort-based median from main.py
+	--------------------------------------------------------------------------
+	"""
+	sortedLst=sorted(lst)
+	lstLen=len(lst)
+	index=(lstLen-1)//2
+	if(lstLen%2):
+		return sortedLst[index]
+	else:
+		return(sortedLst[index]+sortedLst[index+1])/2.0
+
+def sorted_window( samples, size ):
+	queue = []
+	result = None
+	for value in samples:
+		queue.append( value )
+		if len( queue ) > size:
+			queue.pop( 0 )
+		# check_ultrasonic() computed the median twice per sample
+		result = median( queue )
+		result = median( queue )
+	return result
+
+def running_window( samples, size ):
+	window = RunningMedian( size )
+	result = None
+	for value in samples:
+		result = window.push( value )
+	return result
+
+def measure( function, samples, size ):
+	start  = time.perf_counter()
+	result = function( samples, size )
+	return ( time.perf_counter() - start ) / len( samples ), result
+
+def main():
+	count   = int( sys.argv[1] ) if len( sys.argv ) > 1 else 20000
+	rng     = random.Random( 1 )
+	samples = [ rng.gauss( 1e-4, 2e-5 ) for _ in range( count ) ]
+
+	print( "{:>8} {:>14} {:>14} {:>8}".format( "window", "sorted (us)", "running (us)", "speedup" ) )
+	for size in WINDOW_SIZES:
+		old, expected = measure( sorted_window,  samples, size )
+		new, result   = measure( running_window, samples, size )
+		assert result == expected
+		print( "{:>8} {:>14.2f} {:>14.2f} {:>7.1f}x".format( size, old * 1e6, new * 1e6, old / new ) )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,282 @@
+"""
+------------------------------------------------------------------------------
+Echo timing jitter of the single and split process layouts (see
+system/sensing.py).
+
+A generator process stands in for the HC-SR04: on every trigger it drives
+the echo pin through a pipe, and a fake RPi.GPIO thread in the process
+owning the sensor blocks on that pipe and calls the edge callbacks, taking
+the GIL as the C thread of RPi.GPIO does. The generator notes the times it
+drove each edge, so the error of every echo time measured is known exactly:
+the measured width less the width driven.
+
+The control side runs what main.py runs beside the sensors: the audio
+engine playing a looped sound, the pressure checks into the detector every
+50ms, and telemetry. It runs with the sensors in one process, then with
+the sensors in a sensing process, each time with and without a further
+load: a thread busy in Python for part of every 10ms (half by default), standing in for the
+audio mixing of a pygame build and for the Pi's slower CPU, which make the
+control side hold the GIL for longer than it does here.
+
+Every configuration runs in a fresh process, forked from one with no
+threads, as main.py is.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_processes [pings] [busy fraction]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import bisect
+import threading
+import multiprocessing
+
+from benchmarks import fakes
+
+fakes.install()
+
+ECHO_DELAY = 0.0005 # s, trigger to echo rising
+ECHO_WIDTH = 0.0060 # s, ~1m
+PERIOD     = 0.05   # s between pings
+BUSY_SLOT  = 0.01   # s, the busy thread's cycle
+
+PIN_TRIG   = 21
+PIN_ECHO   = 25
+SWITCHES   = [ ( 17, 0.02 ), ( 27, 0.02 ) ]
+MODE_PINS  = [ 5, 6 ]
+PADS       = [ ( 0x08, 0 ) ]
+
+TRIGGER, REPORT, QUIT = b"t", b"r", b"q"
+
+class PipeGPIO( fakes.FakeGPIO ):
+	"""
+	--------------------------------------------------------------------------
+	Fake RPi.GPIO with the echo pin driven by the generator process
+	--------------------------------------------------------------------------
+	Description:
+	  A falling edge of the trigger pin is written to the generator's
+	  pipe; the echo edges it writes back are delivered by an interrupt
+	  thread, started in whichever process registers the echo callback.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, triggers, edges ):
+		super().__init__()
+		self._triggers = triggers
+		self._edges    = edges
+		self._owner    = None # the pid running the interrupt thread
+		return
+
+	def output( self, pins, values ):
+		if pins == PIN_TRIG and not values and self._levels.get( PIN_TRIG ):
+			os.write( self._triggers, TRIGGER )
+		return super().output( pins, values )
+
+	def add_event_callback( self, pin, callback ):
+		super().add_event_callback( pin, callback )
+		if pin == PIN_ECHO and self._owner != os.getpid():
+			self._owner = os.getpid()
+			threading.Thread( target = self._interrupts, name = "gpio-interrupts", daemon = True ).start()
+		return
+
+	def _interrupts( self ):
+		# Edges left over from the trial before are not this one's
+		os.set_blocking( self._edges, False )
+		try:
+			while os.read( self._edges, 64 ):
+				pass
+		except BlockingIOError:
+			pass
+		os.set_blocking( self._edges, True )
+		while True:
+			level = os.read( self._edges, 1 )
+			if not level:
+				return
+			self.drive( PIN_ECHO, level[0] )
+
+
+triggers_in, triggers_out = os.pipe()
+edges_in, edges_out       = os.pipe()
+GPIO = PipeGPIO( triggers_out, edges_in )
+sys.modules["RPi"].GPIO  = GPIO
+sys.modules["RPi.GPIO"]  = GPIO
+os.environ["SECURITY_SYSTEM_AUDIO"] = "null"
+
+from devices.hal import clock, audio
+from devices.adc.mcp3008 import MCP3008
+from devices.adc.capture import AdcCapture
+from devices.sensors.ultrasonic.HCSR04 import HCSR04
+from devices.sensors.ultrasonic.array import UltrasonicArray
+from devices.sensors.fusion import FusionDetector
+from devices.audio.engine import AudioEngine
+from system.telemetry import Telemetry
+from system.sensing import SensingProcess, LAYOUT_SINGLE, LAYOUT_SPLIT
+
+def generate( results ):
+	"""
+	--------------------------------------------------------------------------
+	The generator process: an echo for every trigger, ECHO_DELAY after it
+	and ECHO_WIDTH long, as nearly as sleeping allows; the times actually
+	driven are what the measurements are checked against
+	--------------------------------------------------------------------------
+	"""
+	echoes = [] # ( falling ns, width ns )
+	while True:
+		command = os.read( triggers_in, 1 )
+		if command == TRIGGER:
+			rising = _drive_at( time.perf_counter_ns() + int( ECHO_DELAY * 1e9 ), 1 )
+			falling = _drive_at( rising + int( ECHO_WIDTH * 1e9 ), 0 )
+			echoes.append( ( falling, falling - rising ) )
+		elif command == REPORT:
+			results.send( echoes )
+			echoes = []
+		else:
+			return
+
+def _drive_at( when_ns, level ):
+	delay = when_ns - time.perf_counter_ns()
+	if delay > 0:
+		time.sleep( delay / 1e9 )
+	now = time.perf_counter_ns()
+	os.write( edges_out, bytes( [ level ] ) )
+	return now
+
+def busy( fraction, running ):
+	# Holds the GIL in Python for 'fraction' of every slot
+	while running.is_set():
+		end = time.perf_counter() + fraction * BUSY_SLOT
+		total = 0
+		while time.perf_counter() < end:
+			total += sum( range( 200 ) )
+		time.sleep( (1.0 - fraction) * BUSY_SLOT )
+	return
+
+def trial( layout, pings, fraction, directory, results, report ):
+	"""
+	--------------------------------------------------------------------------
+	One configuration, in a process of its own; sends back the ( time ns,
+	echo s ) of every reading
+	--------------------------------------------------------------------------
+	"""
+	sensing = None
+	if layout == LAYOUT_SPLIT:
+		sensing = SensingProcess( ( 0, 0 ), PADS, 1000, 4096, [ ( PIN_TRIG, PIN_ECHO ) ], None,
+		                          UltrasonicArray.DEFAULT_GUARD, UltrasonicArray.DEFAULT_TIMEOUT,
+		                          UltrasonicArray.DEFAULT_WINDOW, PERIOD, SWITCHES, None, MODE_PINS, 0.002 )
+		sensing.start()
+		capture = sensing.capture
+		sonars  = sensing.sonars
+	else:
+		capture = AdcCapture( MCP3008( 0, 0 ), PADS, 1000 )
+		sonars  = UltrasonicArray( [ HCSR04( PIN_TRIG, PIN_ECHO ) ] )
+		capture.start()
+
+	# The control side
+	running   = threading.Event()
+	running.set()
+	engine    = AudioEngine( audio )
+	engine.play( engine.load( "alarm.wav" ), loops = -1 )
+	engine.start()
+	detector  = FusionDetector( len( PADS ), 1000, 8.0, 9.5e-5 )
+	telemetry = Telemetry( clock, os.path.join( directory, "telemetry.bin" ) )
+	pressure  = telemetry.sensor( "pressure" )
+	telemetry.start()
+
+	def check_pressure():
+		cursor = 0
+		while running.is_set():
+			slices, cursor = capture.buffers[0].read( cursor )
+			detector.add_pressure( 0, slices )
+			telemetry.record( pressure, detector.steps[0] )
+			time.sleep( 0.05 )
+		return
+	threads = [ threading.Thread( target = check_pressure, daemon = True ) ]
+	if fraction:
+		threads.append( threading.Thread( target = busy, args = ( fraction, running ), daemon = True ) )
+	for thread in threads:
+		thread.start()
+
+	readings = []
+	deadline = time.perf_counter()
+	while len( readings ) < pings:
+		for reading in sonars.step():
+			readings.append( ( reading.time_ns, reading.echo ) )
+			detector.add_echo( reading.change, reading.median )
+		if sensing is None:
+			deadline += PERIOD
+			time.sleep( max( 0.0, deadline - time.perf_counter() ) )
+
+	running.clear()
+	for thread in threads:
+		thread.join()
+	if sensing:
+		sensing.stop()
+	else:
+		capture.stop()
+	engine.close()
+	telemetry.close()
+	time.sleep( PERIOD ) # the last echo, if one is still on its way
+	os.write( triggers_out, REPORT )
+	report.send( ( readings, results.recv() ) )
+	return
+
+def errors( readings, echoes ):
+	# The echo time error of every reading, against the echo it timed: the
+	# last one driven to fall before its falling edge was stamped
+	falls = [ falling for falling, width in echoes ]
+	found = []
+	for time_ns, echo in readings:
+		index = bisect.bisect_right( falls, time_ns ) - 1
+		if index >= 0:
+			found.append( echo * 1e9 - echoes[index][1] )
+	return found
+
+def summary( values ):
+	ordered = sorted( abs( value ) for value in values )
+	mean    = sum( values ) / len( values )
+	std     = (sum( (value - mean) ** 2 for value in values ) / len( values )) ** 0.5
+	return {
+		"mean" : mean / 1e3,
+		"std"  : std / 1e3,
+		"p50"  : ordered[len( ordered ) // 2] / 1e3,
+		"p99"  : ordered[min( len( ordered ) - 1, int( len( ordered ) * 0.99 ) )] / 1e3,
+		"max"  : ordered[-1] / 1e3,
+	}
+
+def main():
+	pings    = int( sys.argv[1] ) if len( sys.argv ) > 1 else 200
+	fraction = float( sys.argv[2] ) if len( sys.argv ) > 2 else 0.5
+
+	import tempfile
+	context           = multiprocessing.get_context( "fork" )
+	results, generated = context.Pipe()
+	generator         = context.Process( target = generate, args = ( generated, ), daemon = True )
+	generator.start()
+
+	print( "{} pings of {:.1f}ms every {:.0f}ms on {} CPU{}; |error| and std in us, distance in mm".format(
+		pings, ECHO_WIDTH * 1e3, PERIOD * 1e3, os.cpu_count(), "" if os.cpu_count() == 1 else "s" ) )
+	print( "{:<8} {:<10} {:>8} {:>8} {:>8} {:>8} {:>8} {:>10}".format(
+		"layout", "load", "echoes", "std", "p50", "p99", "max", "p99 mm" ) )
+	with tempfile.TemporaryDirectory() as directory:
+		for load in ( 0.0, fraction ):
+			for layout in ( LAYOUT_SINGLE, LAYOUT_SPLIT ):
+				report, reported = context.Pipe()
+				process = context.Process( target = trial, args = ( layout, pings, load, directory, results, reported ) )
+				process.start()
+				reported.close()
+				readings, echoes = report.recv()
+				process.join()
+
+				found = errors( readings, echoes )
+				stats = summary( found )
+				print( "{:<8} {:<10} {:>8} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>10.1f}".format(
+					layout, "busy {:.0%}".format( load ) if load else "devices", len( found ),
+					stats["std"], stats["p50"], stats["p99"], stats["max"],
+					stats["p99"] * 1e-6 * 171.5 * 1e3 ) )
+	os.write( triggers_out, QUIT )
+	generator.join()
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,159 @@
+"""
+------------------------------------------------------------------------------
+Cost of PubSubServer.publish() on the detection path with no clients, with
+fast clients, and with a client that has stopped reading, which must not
+slow it down. Then checks that a fast client is sent every event in order
+while a stalled one only loses its oldest frames, and that decimation keeps
+the peak of a burst of samples.
+
+The cost loop publishes far faster than the system does and starves the
+server thread, so even the reading clients drop most frames there; what
+matters is that publish() stays cheap.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_pubsub [publishes]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+from benchmarks import fakes
+
+fakes.install()
+
+from devices.hal import clock
+from system.pubsub import PubSubServer, subscribe, KIND_EVENT, KIND_SAMPLE, KIND_DROPPED
+
+QUEUE_SIZE = 256
+
+class Reader:
+	"""
+	--------------------------------------------------------------------------
+	A client on its own thread, keeping what it is sent
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, path, topics = None ):
+		self.messages = []
+		self._thread  = threading.Thread( target = self._run, args = ( path, topics ), daemon = True )
+		self._thread.start()
+		return
+
+	def _run( self, path, topics ):
+		for message in subscribe( path, topics ):
+			self.messages.append( message )
+		return
+
+	def join( self ):
+		self._thread.join( 5.0 )
+		return
+
+def connected( server, count ):
+	deadline = time.monotonic() + 5.0
+	while server.stats()["clients"] < count and time.monotonic() < deadline:
+		time.sleep( 0.01 )
+	return
+
+def per_publish( server, topic, count ):
+	start = time.perf_counter()
+	for i in range( count ):
+		server.publish_event( topic, i )
+	return (time.perf_counter() - start) / count
+
+def cost( directory, count ):
+	print( "{:<24} {:>10} {:>10}".format( "clients", "publish", "dropped" ) )
+	for label, fast, stalled in ( ( "none", 0, 0 ), ( "1 reading", 1, 0 ), ( "8 reading", 8, 0 ),
+	                              ( "1 reading, 1 stalled", 1, 1 ) ):
+		path   = os.path.join( directory, "cost.sock" )
+		server = PubSubServer( clock, path, QUEUE_SIZE )
+		topic  = server.topic( "echo" )
+		server.start()
+		readers = [ Reader( path ) for _ in range( fast ) ]
+		stalls  = []
+		for _ in range( stalled ):
+			stall = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+			stall.connect( path )
+			stalls.append( stall )
+		connected( server, fast + stalled )
+
+		seconds = per_publish( server, topic, count )
+		time.sleep( 0.2 )
+		print( "{:<24} {:>8.2f}us {:>10}".format( label, seconds * 1e6, server.dropped ) )
+		server.close()
+		for reader in readers:
+			reader.join()
+		for stall in stalls:
+			stall.close()
+	return
+
+def delivery( directory, count ):
+	"""
+	--------------------------------------------------------------------------
+	Paced events reach a fast client in full and in order; a stalled client
+	is told how many it lost
+	--------------------------------------------------------------------------
+	"""
+	path   = os.path.join( directory, "delivery.sock" )
+	server = PubSubServer( clock, path, QUEUE_SIZE, interval = 0.1 )
+	event  = server.topic( "detection" )
+	server.topic( "pressure" )
+	server.start()
+	fast  = Reader( path, [ "detection" ] )
+	stall = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+	stall.connect( path )
+	connected( server, 2 )
+
+	for i in range( count ):
+		server.publish_event( event, i )
+		if i % 100 == 0:
+			time.sleep( 0.001 )
+	time.sleep( 0.2 )
+
+	server.close()
+	fast.join()
+	stall.close()
+
+	values  = [ value for kind, when, name, value in fast.messages if kind == KIND_EVENT ]
+	dropped = sum( value for kind, when, name, value in fast.messages if kind == KIND_DROPPED )
+	print( "fast client: {} of {} events, in order: {}, dropped: {}".format(
+		len( values ), count, values == [ float( i ) for i in range( len( values ) ) ], dropped ) )
+	# The fast client lost none, so these are the stalled client's
+	print( "stalled client: {} frames dropped, oldest first".format( server.dropped - dropped ) )
+	return
+
+def decimation( directory ):
+	# A burst at 1kHz with one spike, which must survive the decimation
+	path   = os.path.join( directory, "decimation.sock" )
+	server = PubSubServer( clock, path, QUEUE_SIZE, interval = 0.1 )
+	sample = server.topic( "pressure" )
+	server.start()
+	reader = Reader( path )
+	connected( server, 1 )
+
+	start = time.monotonic()
+	for i in range( 1000 ):
+		server.publish( sample, 500.0 if i == 437 else float( i % 7 ) )
+		time.sleep( max( 0.0, start + (i + 1) * 0.001 - time.monotonic() ) )
+	time.sleep( 0.2 )
+	server.close()
+	reader.join()
+
+	values = [ value for kind, when, name, value in reader.messages if kind == KIND_SAMPLE ]
+	print( "decimation: 1000 samples over 1s sent as {}, spike kept: {}, decimated: {}".format(
+		len( values ), 500.0 in values, server.decimated ) )
+	return
+
+def main():
+	count = int( sys.argv[1] ) if len( sys.argv ) > 1 else 20000
+	with tempfile.TemporaryDirectory() as directory:
+		cost( directory, count )
+		delivery( directory, count )
+		decimation( directory )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,139 @@
+"""
+------------------------------------------------------------------------------
+Records a synthetic stretch of sensor data as main.py would (one pressure
+pad at 1kHz checked every 50ms, an echo every 100ms, a few armed periods
+with footsteps and a walker), then replays it. Reports the cost of a record
+on the live path, and how many times faster than real time the detection
+runs: a naive replay that recomputes every feature, one with the features
+cached, and a sweep over worker processes.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_replay [hours] [processes]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy
+
+from devices.sensors.fusion import FusionDetector
+from system.recorder import Recorder
+from system.replay import Replay, PRESSURE, ECHO
+from system.config import load_config
+import system.alarm as alarm_states
+
+RATE     = 1000  # Hz
+BATCH    = 50    # samples per pressure check
+PINGS    = 10    # echoes per second
+ARMED    = 600   # s armed in every hour
+GRID     = {
+	"pressure.threshold"   : [ 6.0, 8.0, 12.0, 20.0 ],
+	"ultrasonic.threshold" : [ 6e-5, 9.5e-5, 1.5e-4 ],
+	"fusion.smoothing"     : [ 4, 8 ],
+}
+
+def record( path, seconds, rng ):
+	"""
+	--------------------------------------------------------------------------
+	Writes the synthetic recording, returning the seconds spent in record()
+	--------------------------------------------------------------------------
+	"""
+	samples = 512 + rng.normal( 0, 1.5, int( seconds * RATE ) )
+	for hit in rng.uniform( 0, seconds, int( seconds / 120 ) ):
+		start = int( hit * RATE )
+		samples[start:start + 300] += 25 # a footstep
+	samples = numpy.clip( numpy.rint( samples ), 0, 1023 ).astype( numpy.uint16 )
+
+	echoes = 2.5 / 171.5 + rng.normal( 0, 2e-5, int( seconds * PINGS ) )
+	for walk in rng.uniform( 0, seconds, int( seconds / 300 ) ):
+		start = int( walk * PINGS )
+		echoes[start:start + 30] -= numpy.linspace( 0, 0.008, len( echoes[start:start + 30] ) )
+
+	recorder = Recorder( time, path )
+	echo     = recorder.stream( "echo", "d" )
+	state    = recorder.stream( "state", "B" )
+	pressure = recorder.stream( "pressure.0", "H" )
+	view     = memoryview( samples )
+
+	spent = 0.0
+	step  = 1000000000 // (RATE // BATCH)
+	for index in range( len( samples ) // BATCH ):
+		now = index * step
+		if index % int( 3600 * RATE / BATCH ) == 0:
+			recorder.record( state, [ alarm_states.ENABLED ], time_ns = now )
+		elif index % int( 3600 * RATE / BATCH ) == int( ARMED * RATE / BATCH ):
+			recorder.record( state, [ alarm_states.STANDBY ], time_ns = now )
+		started = time.perf_counter()
+		recorder.record( pressure, view[index * BATCH:(index + 1) * BATCH], time_ns = now )
+		if index % (RATE // BATCH // PINGS) == 0:
+			recorder.record( echo, [ echoes[index * PINGS * BATCH // RATE] ], time_ns = now )
+		spent += time.perf_counter() - started
+	recorder.close()
+	return spent, recorder.records
+
+def naive( replay, settings ):
+	"""
+	--------------------------------------------------------------------------
+	A replay that computes the pressure features in every run, as the live
+	detector does
+	--------------------------------------------------------------------------
+	"""
+	detector = FusionDetector( 1, RATE, settings["pressure.threshold"], settings["ultrasonic.threshold"],
+	                           settings["fusion.smoothing"], settings["fusion.window"] )
+	readings = replay._echo_readings( settings["ultrasonic.window"] )
+	for kind, pad, index in replay._events:
+		if kind == PRESSURE:
+			detector.add_pressure( pad, [ replay._batches[pad][index] ] )
+		elif kind == ECHO and readings[index]:
+			detector.add_echo( *readings[index][0][:3] ) # the one sensor recorded
+	return dict( detector.detections )
+
+def main():
+	hours     = float( sys.argv[1] ) if len( sys.argv ) > 1 else 1.0
+	processes = int( sys.argv[2] ) if len( sys.argv ) > 2 else os.cpu_count()
+	rng       = numpy.random.default_rng( 1 )
+
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join( directory, "recording.bin" )
+		spent, records = record( path, hours * 3600, rng )
+		size = os.path.getsize( path )
+		print( "recorded {:.1f}h: {} records, {:.1f}MB, {:.2f}us per record".format(
+			hours, records, size / 1e6, spent / records * 1e6 ) )
+
+		started = time.perf_counter()
+		replay  = Replay( path, load_config() )
+		print( "loaded in {:.2f}s".format( time.perf_counter() - started ) )
+
+		settings = replay.settings()
+		started  = time.perf_counter()
+		expected = naive( replay, settings )
+		elapsed  = time.perf_counter() - started
+		print( "{:<28} {:>8.2f}s {:>8.0f}x real time".format( "naive run", elapsed, replay.seconds / elapsed ) )
+
+		for label in ( "first run (features)", "cached run" ):
+			started = time.perf_counter()
+			result  = replay.run()
+			elapsed = time.perf_counter() - started
+			print( "{:<28} {:>8.2f}s {:>8.0f}x real time".format( label, elapsed, replay.seconds / elapsed ) )
+		assert result["detections"] == expected, ( result["detections"], expected )
+
+		combos = 1
+		for values in GRID.values():
+			combos *= len( values )
+		for workers in sorted( { 1, processes } ):
+			started = time.perf_counter()
+			results = replay.sweep( GRID, workers )
+			elapsed = time.perf_counter() - started
+			print( "{:<28} {:>8.2f}s {:>8.0f}x real time".format(
+				"sweep of {}, {} process{}".format( combos, workers, "" if workers == 1 else "es" ),
+				elapsed, replay.seconds * combos / elapsed ) )
+		best = min( results, key = lambda item: ( item[1]["periods"] - item[1]["alarms"], item[1]["armed"] ) )
+		print( "fewest missed periods, then armed detections: {} ({}/{} alarms, {} detections)".format(
+			best[0], best[1]["alarms"], best[1]["periods"], best[1]["armed"] ) )
+		del replay, results # the arrays map the file
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,115 @@
+"""
+------------------------------------------------------------------------------
+Runs the Switch on the simulated backend against a noisy radio receiver:
+presses whose edges bounce for a few ms, and short RF glitches in between.
+Counts the presses delivered against the presses made, the glitches
+rejected, and the settle timers the edges cost, at several debounce windows.
+The "none" row is the old Switch, which called on_rising for every rising
+edge.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_switch [seconds]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import random
+
+os.environ["SECURITY_SYSTEM_HAL"] = "sim"
+
+import devices.hal as hal
+from devices.sensors.switches.Switch import Switch
+
+PINS           = [ 20, 21, 22, 23, 24 ] # one per row, all driven alike
+PRESS_INTERVAL = 2.0    # s between presses
+PRESS_WIDTH    = 0.2    # s
+BOUNCE_TIME    = 0.004  # s of bouncing at each press edge
+GLITCH_RATE    = 50     # glitches per second
+GLITCH_WIDTH   = 0.0005 # s, at most
+DEBOUNCES      = [ None, 0.005, 0.01, 0.02, 0.05 ]
+
+def script( simulator, seconds, rng ):
+	"""
+	--------------------------------------------------------------------------
+	Drives every pin alike and returns the number of presses
+	--------------------------------------------------------------------------
+	"""
+	GPIO  = simulator.GPIO
+	edges = []
+
+	presses = 0
+	when    = 0.5
+	while when + PRESS_WIDTH < seconds:
+		for edge, level in ( ( when, 1 ), ( when + PRESS_WIDTH, 0 ) ):
+			at = edge
+			while at < edge + BOUNCE_TIME:
+				edges.append( ( at, level ) )
+				at += rng.uniform( 0.0001, 0.001 )
+				edges.append( ( at, 1 - level ) )
+				at += rng.uniform( 0.0001, 0.001 )
+			edges.append( ( at, level ) )
+		presses += 1
+		when    += PRESS_INTERVAL
+
+	# Glitches only while the receiver is idle, clear of the presses
+	for _ in range( int( GLITCH_RATE * seconds ) ):
+		at = rng.uniform( 0.0, seconds )
+		if (at - 0.5) % PRESS_INTERVAL < PRESS_WIDTH + 0.1:
+			continue
+		edges.append( ( at, 1 ) )
+		edges.append( ( at + rng.uniform( 0.00005, GLITCH_WIDTH ), 0 ) )
+
+	for at, level in edges:
+		for pin in PINS:
+			GPIO.drive_at( at, pin, level )
+	return presses
+
+def main():
+	seconds   = float( sys.argv[1] ) if len( sys.argv ) > 1 else 60.0
+	simulator = hal.simulator()
+	GPIO      = simulator.GPIO
+	clock     = simulator.clock
+	presses   = script( simulator, seconds, random.Random( 1 ) )
+
+	# Settle timers, per pin
+	timers   = dict.fromkeys( PINS, 0 )
+	schedule = clock.call_later
+	def counting_call_later( delay, function, *args ):
+		if getattr( function, "__name__", "" ) == "_settle":
+			timers[function.__self__._pin] += 1
+		return schedule( delay, function, *args )
+	clock.call_later = counting_call_later
+
+	rows = []
+	for pin, debounce in zip( PINS, DEBOUNCES ):
+		delivered = []
+		if debounce is None:
+			# The old Switch: every rising edge it saw was a press
+			def value_callback( channel, delivered = delivered ):
+				if GPIO.input( channel ):
+					delivered.append( channel )
+				return
+			GPIO.setup( pin, GPIO.IN )
+			GPIO.add_event_detect( pin, GPIO.BOTH )
+			GPIO.add_event_callback( pin, value_callback )
+			switch = None
+		else:
+			switch = Switch( pin, debounce )
+			switch.set_on_rising( delivered.append )
+		rows.append( ( pin, debounce, switch, delivered ) )
+
+	clock.sleep( seconds + 1.0 )
+
+	print( "{:>10} {:>8} {:>10} {:>8} {:>10} {:>8}".format(
+		"debounce", "presses", "delivered", "edges", "glitches", "timers" ) )
+	for pin, debounce, switch, delivered in rows:
+		if switch is None:
+			print( "{:>10} {:>8} {:>10} {:>8} {:>10} {:>8}".format( "none", presses, len( delivered ), "", "", "" ) )
+			continue
+		print( "{:>10} {:>8} {:>10} {:>8} {:>10} {:>8}".format(
+			"{:.0f}ms".format( debounce * 1e3 ), presses, len( delivered ),
+			switch.edges, switch.glitches, timers[pin] ) )
+	return
+
+if __name__ == "__main__":
+	main()
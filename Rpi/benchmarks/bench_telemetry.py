@@ -0,0 +1,113 @@
+"""
+------------------------------------------------------------------------------
+Per-record cost of Telemetry.record() against the print() calls it replaced
+in check_ultrasonic(), and a check that records from several producer
+threads all reach the file while the writer runs.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_telemetry [records]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+
+from benchmarks import fakes
+
+fakes.install()
+
+from devices.hal import clock
+from system.telemetry import Telemetry, read_telemetry, FSYNC_BATCH
+
+PRODUCERS = 4
+
+# These loops produce far faster than the system does, and starve the writer
+# thread of the GIL, so the ring is sized to hold every record
+RING = 1 << 18
+
+def per_record( function, count ):
+	start = time.perf_counter()
+	for i in range( count ):
+		function( i )
+	return ( time.perf_counter() - start ) / count
+
+def compare_cost( count, directory ):
+	delta  = 1.23456e-4
+	median = 1.2e-4
+
+	results = [ ( "empty loop", per_record( lambda i: None, count ) ) ]
+	with open( os.devnull, "w" ) as null:
+		results.append( ( "print (/dev/null)", per_record(
+			lambda i: print( "Ultrasonic Value : {:.5f} (Median: {:.5f})".format( delta, median ), file = null ),
+			count ) ) )
+	with open( os.path.join( directory, "console.log" ), "w" ) as log:
+		results.append( ( "print (file)", per_record(
+			lambda i: print( "Ultrasonic Value : {:.5f} (Median: {:.5f})".format( delta, median ), file = log ),
+			count ) ) )
+
+	# Without the writer running the ring just wraps, at its default size
+	telemetry = Telemetry( clock, os.path.join( directory, "idle.bin" ) )
+	echo      = telemetry.sensor( "echo" )
+	results.append( ( "record", per_record( lambda i: telemetry.record( echo, delta, 1 ), count ) ) )
+
+	telemetry = Telemetry( clock, os.path.join( directory, "busy.bin" ), capacity = RING,
+	                       flush_interval = 0.01, fsync = FSYNC_BATCH )
+	echo      = telemetry.sensor( "echo" )
+	telemetry.start()
+	results.append( ( "record (writer busy)", per_record( lambda i: telemetry.record( echo, delta, 1 ), count ) ) )
+	telemetry.close()
+
+	print( "{:<22} {:>12}".format( "", "ns/record" ) )
+	for name, seconds in results:
+		print( "{:<22} {:>12.0f}".format( name, seconds * 1e9 ) )
+	print( "writer: {} records, {} dropped, {} batches, {} fsyncs".format(
+		telemetry.written, telemetry.dropped, telemetry.batches, telemetry.fsyncs ) )
+	return
+
+def check_producers( count, directory ):
+	"""
+	--------------------------------------------------------------------------
+	Every record from every producer must be in the file once, in order
+	--------------------------------------------------------------------------
+	"""
+	path      = os.path.join( directory, "producers.bin" )
+	telemetry = Telemetry( clock, path, capacity = RING, max_bytes = 1 << 30, flush_interval = 0.005 )
+	sensors   = [ telemetry.sensor( "producer.{}".format( i ) ) for i in range( PRODUCERS ) ]
+	telemetry.start()
+
+	def produce( sensor ):
+		for i in range( count ):
+			telemetry.record( sensor, i )
+		return
+
+	threads = [ threading.Thread( target = produce, args = ( sensor, ) ) for sensor in sensors ]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	telemetry.close()
+
+	names, records = read_telemetry( path )
+	sequences = [ record[0] for record in records ]
+	assert sequences == sorted( set( sequences ) )
+	assert len( records ) + telemetry.dropped == PRODUCERS * count
+	for name in names:
+		values = [ record[3] for record in records if record[2] == name ]
+		assert values == sorted( values )
+
+	print()
+	print( "{} producers x {} records: {} written, {} dropped".format(
+		PRODUCERS, count, len( records ), telemetry.dropped ) )
+	return
+
+def main():
+	count = min( int( sys.argv[1] ) if len( sys.argv ) > 1 else 200000, RING )
+	with tempfile.TemporaryDirectory() as directory:
+		compare_cost( count, directory )
+		check_producers( count // PRODUCERS, directory )
+	return
+
+if __name__ == "__main__":
+	main()
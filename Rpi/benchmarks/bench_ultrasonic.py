@@ -0,0 +1,81 @@
+"""
+------------------------------------------------------------------------------
+Compares busy-wait polling of the HC-SR04 echo pin against the interrupt
+driven HCSR04 ranging engine, using a fake RPi.GPIO.
+
+Usage (from Rpi/):
+  python -m benchmarks.bench_ultrasonic [pings]
+------------------------------------------------------------------------------
+"""
+import sys
+import time
+
+from benchmarks import fakes
+
+GPIO = fakes.install()
+
+from devices.sensors.ultrasonic.HCSR04 import HCSR04
+
+PIN_TRIG   = 21
+PIN_ECHO   = 25
+ECHO_DELAY = 0.0005 # s, trigger to echo rising
+ECHO_WIDTH = 0.0060 # s, ~1m
+PING_RATE  = 0.05   # s between pings
+
+def poll_echo():
+	"""
+	--------------------------------------------------------------------------
+	The original busy-wait from check_ultrasonic()
+	--------------------------------------------------------------------------
+	"""
+	GPIO.output( PIN_TRIG, GPIO.HIGH )
+	time.sleep( 0.0001 )
+	GPIO.output( PIN_TRIG, GPIO.LOW )
+
+	start = stop = time.time()
+	while not GPIO.input( PIN_ECHO ):
+		start = time.time()
+
+	while GPIO.input( PIN_ECHO ):
+		stop = time.time()
+
+	return stop - start
+
+def run( name, ping, pings ):
+	wall = time.perf_counter()
+	cpu  = time.process_time()
+	samples = 0
+	for _ in range( pings ):
+		begin = time.perf_counter()
+		if ping() is not None:
+			samples += 1
+		# Idle until the next ping, like the main loop does
+		remaining = PING_RATE - (time.perf_counter() - begin)
+		if remaining > 0:
+			time.sleep( remaining )
+	wall = time.perf_counter() - wall
+	cpu  = time.process_time() - cpu
+	print( "{:<10} pings={:<5} samples={:<5} wall={:7.3f}s cpu={:7.3f}s cpu/wall={:6.1%}".format(
+		name, pings, samples, wall, cpu, cpu / wall ) )
+	return
+
+def main():
+	pings = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+
+	GPIO.setup( PIN_TRIG, GPIO.OUT )
+	GPIO.setup( PIN_ECHO, GPIO.IN )
+	GPIO.attach_echo( PIN_TRIG, PIN_ECHO, ECHO_DELAY, ECHO_WIDTH )
+
+	run( "polling", poll_echo, pings )
+
+	sonar = HCSR04( PIN_TRIG, PIN_ECHO )
+	def interrupt_echo():
+		sonar.ping()
+		return sonar.read()
+
+	run( "interrupt", interrupt_echo, pings )
+	print( "timeouts={} dropped={}".format( sonar.timeouts, sonar.dropped ) )
+	return
+
+if __name__ == "__main__":
+	main()
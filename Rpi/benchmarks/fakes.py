@@ -0,0 +1,250 @@
+import sys
+import ctypes
+import time
+import types
+import threading
+
+"""
+------------------------------------------------------------------------------
+Stand-ins for RPi.GPIO and spidev so that the benchmarks can measure real
+CPU time off the Pi, where the virtual clock of the simulated backend would
+hide it. install() must be called before any device module is imported.
+------------------------------------------------------------------------------
+"""
+
+class FakeGPIO( types.ModuleType ):
+	"""
+	--------------------------------------------------------------------------
+	Fake RPi.GPIO module
+	--------------------------------------------------------------------------
+	Description:
+	  Keeps a level per pin and calls registered edge callbacks from a timer
+	  thread, like the real library does. An echo waveform can be attached
+	  to a trigger pin so the HC-SR04 can be benchmarked without hardware.
+	--------------------------------------------------------------------------
+	"""
+
+	BCM      = 11
+	BOARD    = 10
+	OUT      = 0
+	IN       = 1
+	LOW      = 0
+	HIGH     = 1
+	RISING   = 31
+	FALLING  = 32
+	BOTH     = 33
+	PUD_OFF  = 20
+	PUD_DOWN = 21
+	PUD_UP   = 22
+	UNKNOWN  = -1
+
+	class PWM:
+		def __init__( self, pin, frequency ):
+			self._pin = pin
+		def start( self, duty_cycle ):
+			return
+		def stop( self ):
+			return
+		def ChangeFrequency( self, frequency ):
+			return
+		def ChangeDutyCycle( self, duty_cycle ):
+			return
+
+	def __init__( self ):
+		super().__init__( "RPi.GPIO" )
+		self._levels    = {}
+		self._callbacks = {}
+		self._echoes    = {}
+		self._windows   = {}
+
+	def setmode( self, mode ):
+		return
+
+	def setwarnings( self, flag ):
+		return
+
+	def setup( self, pins, direction, pull_up_down = None, initial = None ):
+		for pin in _as_list( pins ):
+			self._levels.setdefault( pin, 0 )
+		return
+
+	def gpio_function( self, pin ):
+		return self.OUT if pin in self._levels else self.UNKNOWN
+
+	def input( self, pin ):
+		# Echo levels follow the wall clock, so a busy-waiting reader sees
+		# the pulse even if the timer threads are starved of the GIL
+		window = self._windows.get( pin )
+		if window:
+			now = time.perf_counter()
+			return 1 if window[0] <= now < window[1] else 0
+		return self._levels.get( pin, 0 )
+
+	def output( self, pins, values ):
+		pins   = _as_list( pins )
+		values = _as_list( values )
+		if len( values ) == 1:
+			values = values * len( pins )
+		for pin, value in zip( pins, values ):
+			previous = self._levels.get( pin, 0 )
+			self._levels[pin] = int( value )
+			if previous and not value and pin in self._echoes:
+				self._schedule_echo( *self._echoes[pin] )
+		return
+
+	def add_event_detect( self, pin, edge, callback = None, bouncetime = None ):
+		self._callbacks.setdefault( pin, [] )
+		if callback:
+			self._callbacks[pin].append( callback )
+		return
+
+	def add_event_callback( self, pin, callback ):
+		self._callbacks.setdefault( pin, [] ).append( callback )
+		return
+
+	def remove_event_detect( self, pin ):
+		self._callbacks.pop( pin, None )
+		return
+
+	def cleanup( self, pins = None ):
+		return
+
+	def attach_echo( self, trigger, echo, delay, width ):
+		"""
+		----------------------------------------------------------------------
+		Drives the echo pin high for 'width' seconds, 'delay' seconds after
+		every falling edge of the trigger pin
+		----------------------------------------------------------------------
+		"""
+		self._echoes[trigger] = ( echo, delay, width )
+		return
+
+	def drive( self, pin, value ):
+		"""
+		----------------------------------------------------------------------
+		Sets an input pin's level, calling its edge callbacks on a change
+		----------------------------------------------------------------------
+		"""
+		if self._levels.get( pin, 0 ) == value:
+			return
+		self._levels[pin] = value
+		for callback in self._callbacks.get( pin, () ):
+			callback( pin )
+		return
+
+	def _schedule_echo( self, echo, delay, width ):
+		now = time.perf_counter()
+		self._windows[echo] = ( now + delay, now + delay + width )
+		rising  = threading.Timer( delay,         self.drive, ( echo, 1 ) )
+		falling = threading.Timer( delay + width, self.drive, ( echo, 0 ) )
+		rising.daemon  = True
+		falling.daemon = True
+		rising.start()
+		falling.start()
+		return
+
+
+class FakeSpiDev:
+	"""
+	--------------------------------------------------------------------------
+	Fake spidev.SpiDev
+	--------------------------------------------------------------------------
+	Description:
+	  Answers every MCP3008 conversion frame with the same 10 bit value.
+	  Like the C extension it allocates one reply list per transfer and does
+	  no other work, so what is measured is the Python side of the driver.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self ):
+		self.transfers = 0
+		self.set_value( 512 )
+
+	def set_value( self, value ):
+		self.value  = value
+		self._frame = [ 0, (value >> 8) & 0b11, value & 0xFF ]
+		return
+
+	def open( self, device, chip_select ):
+		return
+
+	def close( self ):
+		return
+
+	def xfer( self, data ):
+		return self.xfer2( data )
+
+	def xfer2( self, data ):
+		self.transfers += 1
+		return self._frame * (len( data ) // 3)
+
+	def writebytes( self, data ):
+		self.transfers += 1
+		return
+
+	writebytes2 = writebytes
+
+
+class FakeFcntl:
+	"""
+	--------------------------------------------------------------------------
+	Fake fcntl module answering SPI_IOC_MESSAGE for a FakeSpiDev
+	--------------------------------------------------------------------------
+	Description:
+	  Fills the receive buffers of an spi_ioc_transfer array once and then
+	  only counts messages, standing in for the work the kernel does in C.
+	  A message whose transfers ask for delays (or a bus speed) blocks for
+	  as long as the bus would, with the GIL released.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, spi ):
+		self._spi       = spi
+		self._durations = {}
+
+	def ioctl( self, fd, request, transfers ):
+		self._spi.transfers += 1
+		if id( transfers ) not in self._durations:
+			reply    = bytes( self._spi._frame )
+			duration = 0.0
+			for transfer in transfers:
+				if transfer.rx_buf:
+					ctypes.memmove( transfer.rx_buf, reply, transfer.len )
+				duration += transfer.delay_usecs / 1e6
+				if transfer.speed_hz:
+					duration += 8.0 * transfer.len / transfer.speed_hz
+			# Kept with its transfers, so the id is not reused
+			self._durations[id( transfers )] = ( transfers, duration )
+		duration = self._durations[id( transfers )][1]
+		if duration:
+			time.sleep( duration )
+		return 0
+
+
+def _as_list( values ):
+	if isinstance( values, (list, tuple) ):
+		return list( values )
+	return [ values ]
+
+
+def install():
+	"""
+	--------------------------------------------------------------------------
+	Registers the fakes as the RPi.GPIO and spidev modules
+	--------------------------------------------------------------------------
+	Postconditions:
+	 returns:
+	  the fake GPIO module
+	--------------------------------------------------------------------------
+	"""
+	gpio = FakeGPIO()
+	rpi  = types.ModuleType( "RPi" )
+	rpi.GPIO = gpio
+
+	spidev = types.ModuleType( "spidev" )
+	spidev.SpiDev = FakeSpiDev
+
+	sys.modules["RPi"]          = rpi
+	sys.modules["RPi.GPIO"]     = gpio
+	sys.modules["spidev"]       = spidev
+	return gpio
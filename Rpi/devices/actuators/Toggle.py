@@ -1,14 +1,43 @@
-import time
-import RPi.GPIO as GPIO
+import threading
+import collections
+
+from devices.hal import GPIO, clock
 
 class Toggle:
-	
+	"""
+	--------------------------------------------------------------------------
+	Toggled Output
+	--------------------------------------------------------------------------
+	Description:
+	  A single output pin (LED, beeper) that can be set directly or play
+	  timed patterns. Patterns are queued and stepped from the clock's
+	  timer callbacks, so every call returns immediately.
+
+	  A pattern is a list of (value, seconds) steps, where value is either
+	  a level (True/False) or a (frequency, duty_cycle) pair to run PWM for
+	  that step. The pin is left low when the queue runs out. Setting the
+	  pin directly cancels any queued patterns.
+	--------------------------------------------------------------------------
+	"""
+
 	def __init__(self, pin):
 		self._pin = pin
 		GPIO.setmode(GPIO.BCM)
 		GPIO.setup(self._pin, GPIO.OUT)
-		
+
 		self._pwm = GPIO.PWM( self._pin, 1 ) # Default frequency 1 second
+		self._pwm_running = False
+
+		# Pattern state, guarded by _lock
+		self._lock       = threading.Lock()
+		self._queue      = collections.deque()
+		self._pattern    = None
+		self._index      = 0
+		self._repeat     = 0
+		self._then       = None
+		self._generation = 0
+		self._idle       = threading.Event()
+		self._idle.set()
 		return
 
 	def __del__(self):
@@ -16,37 +45,205 @@ class Toggle:
 		GPIO.cleanup( self._pin )
 		return
 
+	#-------------------------------------------------------------------------
+	# Patterns
+	#-------------------------------------------------------------------------
+
+	def play( self, steps, repeat = 1, then = None ):
+		"""
+		----------------------------------------------------------------------
+		Queues a pattern to play after any patterns already queued
+		----------------------------------------------------------------------
+		Preconditions:
+		  steps  - list of (value, seconds); value is a level, or a
+		           (frequency, duty_cycle) pair for PWM
+		  repeat - the number of times to play the steps (None: forever)
+		  then   - function called (with no arguments) on the timer thread
+		           once the pattern has played, unless cancelled
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._queue.append( ( list( steps ), repeat, then ) )
+			if self._pattern is not None:
+				return
+			self._idle.clear()
+			finished = self._step()
+		self._notify( finished )
+		return
+
 	def pulse( self, t ):
-		GPIO.output( self._pin, GPIO.HIGH )
-		time.sleep(t)
-		GPIO.output( self._pin, GPIO.LOW )
+		"""
+		----------------------------------------------------------------------
+		Queues a single high pulse of 't' seconds
+		----------------------------------------------------------------------
+		"""
+		self.play( [ ( True, t ) ] )
 		return
 
+	def pulse_train( self, width, gap, count, then = None ):
+		"""
+		----------------------------------------------------------------------
+		Queues 'count' high pulses of 'width' seconds, 'gap' seconds apart
+		----------------------------------------------------------------------
+		"""
+		self.play( [ ( True, width ), ( False, gap ) ], count, then )
+		return
+
+	def blink( self, frequency, count = None, duty_cycle = 0.5 ):
+		"""
+		----------------------------------------------------------------------
+		Queues blinking at 'frequency' Hz, 'count' times (None: until
+		cancelled)
+		----------------------------------------------------------------------
+		"""
+		period = 1.0 / frequency
+		self.play( [ ( True, period * duty_cycle ), ( False, period * (1.0 - duty_cycle) ) ], count )
+		return
+
+	def cancel( self ):
+		"""
+		----------------------------------------------------------------------
+		Cancels the playing and queued patterns, and sets the pin low
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._cancel()
+			self._apply( False )
+		return
+
+	@property
+	def busy( self ):
+		return not self._idle.is_set()
+
+	def wait( self, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Waits up to 'timeout' seconds for the queued patterns to finish
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  True if no pattern is playing
+		----------------------------------------------------------------------
+		"""
+		return clock.wait( self._idle, timeout )
+
+	#-------------------------------------------------------------------------
+	# Direct Output
+	#-------------------------------------------------------------------------
+
 	def set_high(self):
-		self._pwm.stop()
-		GPIO.output( self._pin, GPIO.HIGH )
+		with self._lock:
+			self._cancel()
+			self._apply( True )
 		return
 
 	def set_low(self):
-		self._pwm.stop()
-		GPIO.output( self._pin, GPIO.LOW )
+		with self._lock:
+			self._cancel()
+			self._apply( False )
 		return
 
 	def set(self, val):
-		self.output( self._pin, val )
+		with self._lock:
+			self._cancel()
+			self._apply( bool( val ) )
 		return
 
 	def toggle(self):
-		self._pwm.stop()
-		GPIO.output( self._pin, not GPIO.input( self._pin ) )
+		with self._lock:
+			self._cancel()
+			self._apply( not GPIO.input( self._pin ) )
 		return
 
 	def enable_pwm(self, frequency, duty_cycle ):
-		self._pwm.ChangeFrequency( frequency )
-		self._pwm.start( duty_cycle )
+		with self._lock:
+			self._cancel()
+			self._apply( ( frequency, duty_cycle ) )
 		return
 
 	def disable_pwm(self):
-		self._pwm.stop()
+		with self._lock:
+			self._cancel()
+			self._apply( False )
+		return
+
+	#-------------------------------------------------------------------------
+	# Private
+	#-------------------------------------------------------------------------
+
+	def _apply( self, value ):
+		if isinstance( value, tuple ):
+			frequency, duty_cycle = value
+			self._pwm.ChangeFrequency( frequency )
+			if self._pwm_running:
+				self._pwm.ChangeDutyCycle( duty_cycle )
+			else:
+				self._pwm.start( duty_cycle )
+				self._pwm_running = True
+			return
+
+		if self._pwm_running:
+			self._pwm.stop()
+			self._pwm_running = False
+		GPIO.output( self._pin, GPIO.HIGH if value else GPIO.LOW )
+		return
+
+	def _cancel( self ):
+		# Pending timer callbacks see a stale generation and do nothing
+		self._generation += 1
+		self._queue.clear()
+		self._pattern = None
+		self._idle.set()
+		return
+
+	def _advance( self, generation ):
+		with self._lock:
+			if generation != self._generation:
+				return
+			finished = self._step()
+		self._notify( finished )
 		return
 
+	def _step( self ):
+		"""
+		----------------------------------------------------------------------
+		Applies the next step and schedules the one after it. Called with
+		_lock held.
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  the 'then' functions of the patterns that finished
+		----------------------------------------------------------------------
+		"""
+		finished = []
+		while True:
+			if self._pattern is None:
+				if not self._queue:
+					self._apply( False )
+					self._idle.set()
+					return finished
+				self._pattern, self._repeat, then = self._queue.popleft()
+				self._index = 0
+				self._then  = then
+
+			steps = self._pattern
+			if self._index == len( steps ):
+				if self._repeat is not None:
+					self._repeat -= 1
+				if not steps or (self._repeat is not None and self._repeat <= 0):
+					if self._then is not None:
+						finished.append( self._then )
+					self._pattern = None
+					continue
+				self._index = 0
+
+			value, duration = steps[self._index]
+			self._index += 1
+			self._apply( value )
+			clock.call_later( duration, self._advance, self._generation )
+			return finished
+
+	def _notify( self, finished ):
+		for then in finished:
+			then()
+		return
@@ -1,23 +1,89 @@
-
-import copy
-import RPi.GPIO as GPIO
+from devices.hal import GPIO
 
 
 class generic_output:
-	
-	def __init__(self, pins):
+	"""
+	--------------------------------------------------------------------------
+	Parallel Output Bus
+	--------------------------------------------------------------------------
+	Description:
+	  Writes a group of output pins as one integer word. pins[0] is the
+	  most significant bit, so the word 0b10 drives the pins 1 and 0.
+
+	  All pins are written in a single GPIO.output call, and writing the
+	  word already on the bus does nothing. RPi.GPIO still sets the pins
+	  one after the other, so the receiver may see an intermediate word
+	  for a few microseconds; when a strobe pin is given it is pulsed once
+	  the pins are set, and a receiver that latches on the strobe only
+	  ever sees whole words.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__(self, pins, strobe = None, initial = 0):
+		"""
+		----------------------------------------------------------------------
+		Constructs a bus writer, driving 'initial' onto the pins
+		----------------------------------------------------------------------
+		Preconditions:
+		  pins    - the output pins, most significant bit first
+		  strobe  - the pin pulsed high after each write (default: none)
+		  initial - the word to write first
+		----------------------------------------------------------------------
+		"""
 		GPIO.setmode( GPIO.BCM )
 		GPIO.setup( pins, GPIO.OUT )
-		self._pins = copy.deepcopy(pins)
+		self._pins   = list( pins )
+		self._strobe = strobe
+		if strobe is not None:
+			GPIO.setup( strobe, GPIO.OUT, initial = GPIO.LOW )
+
+		# Statistics
+		self.writes  = 0
+		self.skipped = 0 # writes of the word already on the bus
+
+		self._word = None
+		self.set( initial )
 		return
 
 	def __del__(self):
-		GPIO.cleanup( self._pins )
-		return
-	
-	def set(self, binary):
-		for i in range(len(self._pins)):
-			GPIO.output( self._pins[i], int(binary[i]) )
+		GPIO.cleanup( self.pins() )
 		return
 
+	def pins(self):
+		"""
+		----------------------------------------------------------------------
+		Returns every pin used, including the strobe
+		----------------------------------------------------------------------
+		"""
+		if self._strobe is None:
+			return list( self._pins )
+		return self._pins + [ self._strobe ]
+
+	def get(self):
+		"""
+		----------------------------------------------------------------------
+		Returns the word last written
+		----------------------------------------------------------------------
+		"""
+		return self._word
+
+	def set(self, word):
+		"""
+		----------------------------------------------------------------------
+		Writes 'word' to the pins, unless it is already there
+		----------------------------------------------------------------------
+		"""
+		if word == self._word:
+			self.skipped += 1
+			return
 
+		count  = len( self._pins )
+		levels = [ (word >> (count - 1 - i)) & 1 for i in range( count ) ]
+		GPIO.output( self._pins, levels )
+		if self._strobe is not None:
+			GPIO.output( self._strobe, GPIO.HIGH )
+			GPIO.output( self._strobe, GPIO.LOW )
+
+		self._word   = word
+		self.writes += 1
+		return
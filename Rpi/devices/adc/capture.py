@@ -0,0 +1,157 @@
+import threading
+
+from devices.hal import clock
+from devices.ringbuffer import RingBuffer
+
+class AdcCapture:
+	"""
+	--------------------------------------------------------------------------
+	Continuous MCP3008 Capture
+	--------------------------------------------------------------------------
+	Description:
+	  Samples a scan of MCP3008 conversions at a fixed rate on a background
+	  thread. Each conversion gets its own RingBuffer, and the time of every
+	  scan is kept in a matching ring of perf_counter_ns() timestamps.
+
+	  Sample periods that the thread could not keep up with are counted in
+	  'missed'; consumers that fall behind see it in each ring's 'overruns'.
+
+	  A rate of 0 pauses sampling until another rate is set; the thread
+	  sleeps meanwhile, without polling.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_CAPACITY = 4096 # samples per conversion
+
+	def __init__( self, adc, conversions, rate, capacity = DEFAULT_CAPACITY, buffers = None, timestamps = None ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a capture; sampling begins with start()
+		----------------------------------------------------------------------
+		Preconditions:
+		  adc         - the MCP3008 to sample
+		  conversions - list of (channel, differential) pairs
+		  rate        - the sample rate, in Hz
+		  capacity    - the samples held per conversion (default: 4096)
+		  buffers     - a ring per conversion to fill instead of new ones,
+		                such as the SharedRings of system/sensing.py
+		  timestamps  - a 'Q' ring for the scan times, likewise
+		----------------------------------------------------------------------
+		"""
+		self._adc        = adc
+		self._scan       = adc.scan( conversions )
+		self._period_ns  = None
+		self._thread     = None
+		self._running    = False
+		self._ticking    = False
+		self._condition  = threading.Condition()
+		self.set_rate( rate )
+		self.buffers     = buffers if buffers is not None else [ RingBuffer( capacity ) for _ in conversions ]
+		self.timestamps  = timestamps if timestamps is not None else RingBuffer( capacity, 'Q' )
+
+		# Statistics
+		self.samples = 0
+		self.missed  = 0
+		return
+
+	@property
+	def rate( self ):
+		return 1000000000.0 / self._period_ns if self._period_ns else 0.0
+
+	def set_rate( self, rate ):
+		"""
+		----------------------------------------------------------------------
+		Changes the sample rate, taking effect from the next sample; 0
+		pauses sampling
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			self._period_ns = int( 1000000000 / rate ) if rate > 0 else None
+			self._condition.notify()
+			resume = clock.virtual and self._running and self._period_ns and not self._ticking
+			if resume:
+				self._ticking = True
+		if resume:
+			clock.call_later( 0, self._tick )
+		return
+
+	def start( self ):
+		"""
+		----------------------------------------------------------------------
+		Starts the sampling thread
+		----------------------------------------------------------------------
+		"""
+		if self._running:
+			return
+		self._running = True
+
+		# Virtual time only moves when the main thread waits, so on the
+		# simulated backend samples are taken from scheduled clock events
+		if clock.virtual:
+			if self._period_ns:
+				self._ticking = True
+				clock.call_later( 0, self._tick )
+			return
+
+		self._thread = threading.Thread( target = self._run, name = "adc-capture", daemon = True )
+		self._thread.start()
+		return
+
+	def stop( self ):
+		"""
+		----------------------------------------------------------------------
+		Stops the sampling thread, waiting for it to finish
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			self._running = False
+			self._condition.notify()
+		if self._thread:
+			self._thread.join()
+			self._thread = None
+		return
+
+	def sample( self ):
+		"""
+		----------------------------------------------------------------------
+		Reads one scan into the rings. Called by the sampling thread, but
+		may also be called directly when no thread is running.
+		----------------------------------------------------------------------
+		"""
+		values = self._adc.receive_scan( self._scan )
+		for i in range( len( values ) ):
+			self.buffers[i].append( values[i] )
+		self.timestamps.append( clock.perf_counter_ns() )
+		self.samples += 1
+		return
+
+	def _tick( self ):
+		if not self._running or not self._period_ns:
+			self._ticking = False
+			return
+		self.sample()
+		clock.call_later( self._period_ns / 1000000000.0, self._tick )
+		return
+
+	def _run( self ):
+		deadline = clock.perf_counter_ns()
+		while self._running:
+			period = self._period_ns
+			if not period:
+				with self._condition:
+					while self._running and not self._period_ns:
+						self._condition.wait()
+				deadline = clock.perf_counter_ns()
+				continue
+			self.sample()
+
+			deadline += period
+			delay     = deadline - clock.perf_counter_ns()
+			if delay > 0:
+				clock.sleep( delay / 1000000000.0 )
+			elif -delay > period:
+				# Fell a whole period behind; skip ahead instead of bursting
+				skipped      = -delay // period
+				self.missed += skipped
+				deadline    += skipped * period
+		return
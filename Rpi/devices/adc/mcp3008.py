@@ -1,5 +1,65 @@
-import spidev
-import time
+from devices.hal import spidev
+from devices.spi import spi_ioc_transfer, spi_ioc_message, MAX_TRANSFERS
+import ctypes
+import fcntl
+from array import array
+
+class MCP3008Scan:
+	"""
+	-------------------------------------------------------
+	A fixed list of conversions read in one SPI message
+	-------------------------------------------------------
+	Description:
+	  The transmit frames, receive buffer and the result
+	  array are allocated once, so reading a scan does not
+	  allocate per sample. Results are left in 'values'
+	  in the order the conversions were given.
+	-------------------------------------------------------
+	"""
+
+	FRAME_SIZE = 3 # bytes per conversion
+
+	def __init__( self, conversions ):
+		"""
+		-------------------------------------------------------
+		Constructs a scan
+		-------------------------------------------------------
+		Preconditions:
+		  conversions - list of (channel, differential) pairs,
+		                1 to MAX_TRANSFERS of them
+		-------------------------------------------------------
+		"""
+		self.conversions = tuple( conversions )
+		count = len( self.conversions )
+		if not 1 <= count <= MAX_TRANSFERS:
+			raise ValueError( "a scan holds 1 to {} conversions".format( MAX_TRANSFERS ) )
+
+		size = count * MCP3008Scan.FRAME_SIZE
+		self.values = array( 'H', bytes( 2 * count ) )
+		self._tx    = bytearray( size )
+		self._rx    = bytearray( size )
+
+		for i, ( channel, differential ) in enumerate( self.conversions ):
+			self._tx[3*i]     = 1
+			self._tx[3*i + 1] = channel | differential
+		self._frames = [ list( self._tx[i:i + 3] ) for i in range( 0, size, 3 ) ]
+
+		# One transfer per conversion; chip select is released between them
+		# so that the MCP3008 starts a new conversion for every frame
+		tx = ctypes.addressof( ctypes.c_uint8.from_buffer( self._tx ) )
+		rx = ctypes.addressof( ctypes.c_uint8.from_buffer( self._rx ) )
+		self._transfers = ( spi_ioc_transfer * count )()
+		for i, transfer in enumerate( self._transfers ):
+			transfer.tx_buf    = tx + 3*i
+			transfer.rx_buf    = rx + 3*i
+			transfer.len       = MCP3008Scan.FRAME_SIZE
+			transfer.cs_change = 1 if i < count - 1 else 0
+		self._request = spi_ioc_message( count )
+		return
+
+	def __len__( self ):
+		return len( self.values )
+
 
 class MCP3008:
 
@@ -37,6 +97,9 @@ class MCP3008:
 		self._spi = spidev.SpiDev()
 		self._spi.open( device, chip_select )
 
+		# Scans go straight to the spidev ioctl when the file is available
+		self._fd = self._spi.fileno() if hasattr( self._spi, "fileno" ) else None
+
 	def __del__(self):
 		"""
 		-------------------------------------------------------
@@ -64,3 +127,49 @@ class MCP3008:
 		value = (((response[1] & 0b11) << 8) | (response[2]))
 
 		return value
+
+	def scan( self, conversions ):
+		"""
+		-------------------------------------------------------
+		Prepares a scan of several conversions, to be read
+		with receive_scan()
+		-------------------------------------------------------
+		Preconditions:
+		  conversions - list of (channel, differential) pairs
+		Postconditions:
+		 returns:
+		  the MCP3008Scan
+		-------------------------------------------------------
+		"""
+		return MCP3008Scan( conversions )
+
+	def receive_scan( self, scan ):
+		"""
+		-------------------------------------------------------
+		Reads every conversion of a scan in a single SPI
+		message, decoding the results into scan.values
+		-------------------------------------------------------
+		Preconditions:
+		  scan - an MCP3008Scan from scan()
+		Postconditions:
+		 returns:
+		  values - array('H') of the values read (reused by
+		           the next call with the same scan)
+		-------------------------------------------------------
+		"""
+		rx = scan._rx
+		if self._fd is not None:
+			fcntl.ioctl( self._fd, scan._request, scan._transfers )
+		else:
+			i = 0
+			for frame in scan._frames:
+				rx[i:i + 3] = self._spi.xfer2( frame )
+				i += 3
+
+		values = scan.values
+		j = 1
+		for i in range( len( values ) ):
+			# Capture 11 bits (null bit + 10 bit result)
+			values[i] = ((rx[j] & 0b11) << 8) | rx[j + 1]
+			j += 3
+		return values
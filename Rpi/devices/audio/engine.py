@@ -0,0 +1,322 @@
+import os
+import sys
+import wave
+import threading
+import collections
+from array import array
+
+from devices.hal import clock
+
+class Clip:
+	"""
+	--------------------------------------------------------------------------
+	A sound decoded once into signed 16-bit PCM
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, name, data, rate, channels ):
+		self.name     = name
+		self.data     = data
+		self.rate     = rate
+		self.channels = channels
+		return
+
+	@property
+	def duration( self ):
+		return len( self.data ) / (2.0 * self.channels * self.rate)
+
+
+class _Voice:
+	__slots__ = ( "clip", "offset", "loops", "requested", "started" )
+
+	def __init__( self, clip, loops, requested ):
+		self.clip      = clip
+		self.offset    = 0
+		self.loops     = loops
+		self.requested = requested
+		self.started   = False
+		return
+
+
+class AudioEngine:
+	"""
+	--------------------------------------------------------------------------
+	Low-latency Sound Player
+	--------------------------------------------------------------------------
+	Description:
+	  Plays preloaded clips through a Sink, one period at a time, from a
+	  dedicated thread (or clock ticks on the simulated backend). Sounds
+	  are decoded when loaded, so play() only swaps the voice: the new
+	  sound reaches the sink on the next period, behind at most the audio
+	  already queued in the device.
+
+	  One sound plays at a time; playing another replaces it. The start
+	  latency of every sound, from play() to the time its first frame is
+	  heard, is measured from the sink's queued audio.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_RATE   = 11025
+	DEFAULT_PERIOD = 128   # frames per write
+	LATENCY_WINDOW = 1024  # start latencies kept for the percentiles
+
+	def __init__( self, sink, rate = DEFAULT_RATE, channels = 1, period_frames = DEFAULT_PERIOD ):
+		"""
+		----------------------------------------------------------------------
+		Constructs an engine; the sink is opened by start()
+		----------------------------------------------------------------------
+		Preconditions:
+		  sink          - the Sink to play through
+		  rate          - the output sample rate, in Hz
+		  channels      - the output channel count
+		  period_frames - the frames written at a time; smaller periods
+		                  start sounds sooner but wake the thread more often
+		----------------------------------------------------------------------
+		"""
+		self._sink          = sink
+		self._rate          = rate
+		self._channels      = channels
+		self._period_frames = period_frames
+		self._period_bytes  = period_frames * 2 * channels
+		self._period        = period_frames / float( rate )
+		self._silence       = bytes( self._period_bytes )
+
+		self._condition = threading.Condition()
+		self._voice     = None
+		self._running   = False
+		self._ticking   = False
+		self._thread    = None
+		self._clips     = {}
+
+		# Statistics
+		self.starts    = 0
+		self.periods   = 0
+		self.latencies = collections.deque( maxlen = AudioEngine.LATENCY_WINDOW )
+		return
+
+	def load( self, path ):
+		"""
+		----------------------------------------------------------------------
+		Decodes a .wav file into a Clip. Each path is only decoded once.
+		----------------------------------------------------------------------
+		Postconditions:
+		  raises ValueError if the file's rate or channels differ from the
+		  output
+		----------------------------------------------------------------------
+		"""
+		if path in self._clips:
+			return self._clips[path]
+
+		with wave.open( path, "rb" ) as source:
+			rate     = source.getframerate()
+			channels = source.getnchannels()
+			width    = source.getsampwidth()
+			frames   = source.readframes( source.getnframes() )
+
+		if rate != self._rate or channels != self._channels:
+			raise ValueError( "{}: {}Hz x{} does not match the {}Hz x{} output".format(
+				path, rate, channels, self._rate, self._channels ) )
+
+		if width == 1:
+			# 8-bit .wav samples are unsigned
+			samples = array( 'h', [ (sample - 128) << 8 for sample in frames ] )
+		elif width == 2:
+			samples = array( 'h', frames )
+			if sys.byteorder != "little":
+				samples.byteswap()
+		else:
+			raise ValueError( "{}: {}-bit samples are not supported".format( path, 8 * width ) )
+
+		clip = Clip( os.path.basename( path ), samples.tobytes(), rate, channels )
+		self._clips[path] = clip
+		return clip
+
+	def start( self ):
+		"""
+		----------------------------------------------------------------------
+		Opens the sink and starts the playback thread
+		----------------------------------------------------------------------
+		"""
+		if self._running:
+			return
+		self._sink.open( self._rate, self._channels, self._period_frames )
+		with self._condition:
+			self._running = True
+			tick = clock.virtual and self._voice is not None and not self._ticking
+			if tick:
+				self._ticking = True
+
+		# On the simulated backend periods are written from clock ticks
+		# while a sound plays
+		if clock.virtual:
+			if tick:
+				clock.call_later( 0, self._tick )
+			return
+
+		self._thread = threading.Thread( target = self._run, name = "audio", daemon = True )
+		self._thread.start()
+		return
+
+	def close( self ):
+		"""
+		----------------------------------------------------------------------
+		Stops playback and closes the sink
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			self._running = False
+			self._voice   = None
+			self._condition.notify()
+		if self._thread:
+			self._thread.join()
+			self._thread = None
+		self._sink.close()
+		return
+
+	def play( self, clip, loops = 0 ):
+		"""
+		----------------------------------------------------------------------
+		Starts playing a clip, replacing any sound already playing. Returns
+		immediately.
+		----------------------------------------------------------------------
+		Preconditions:
+		  clip  - a Clip from load()
+		  loops - the times to repeat the clip after the first (-1: forever)
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			replaced    = self._voice
+			self._voice = _Voice( clip, loops, clock.perf_counter_ns() )
+			self._condition.notify()
+			tick = clock.virtual and self._running and not self._ticking
+			if tick:
+				self._ticking = True
+
+		if replaced is not None and replaced.started:
+			self._sink.mark( replaced.clip.name, "stop" )
+		if tick:
+			clock.call_later( 0, self._tick )
+		return
+
+	def stop( self, clip = None ):
+		"""
+		----------------------------------------------------------------------
+		Stops the sound playing, if it is 'clip' (default: any sound)
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			voice = self._voice
+			if voice is None or (clip is not None and voice.clip is not clip):
+				return
+			self._voice = None
+
+		if voice.started:
+			self._sink.mark( voice.clip.name, "stop" )
+		return
+
+	def playing( self, clip = None ):
+		voice = self._voice
+		return voice is not None and (clip is None or voice.clip is clip)
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the start latency statistics as a dictionary, in seconds
+		----------------------------------------------------------------------
+		"""
+		ordered = sorted( self.latencies )
+		def percentile( fraction ):
+			if not ordered:
+				return 0.0
+			return ordered[min( len( ordered ) - 1, int( fraction * len( ordered ) ) )]
+		return {
+			"starts"      : self.starts,
+			"periods"     : self.periods,
+			"period"      : self._period,
+			"latency_p50" : percentile( 0.50 ),
+			"latency_p99" : percentile( 0.99 ),
+			"latency_max" : ordered[-1] if ordered else 0.0,
+		}
+
+	def _next_period( self ):
+		"""
+		----------------------------------------------------------------------
+		Takes the next period of the playing voice. Called with the
+		condition held.
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  ( data, voice ) - voice is set when the period is its first
+		  ended           - the voice that played out, or None
+		----------------------------------------------------------------------
+		"""
+		voice = self._voice
+		data  = voice.clip.data
+		first = None if voice.started else voice
+		voice.started = True
+
+		chunk = data[voice.offset:voice.offset + self._period_bytes]
+		voice.offset += len( chunk )
+		while len( chunk ) < self._period_bytes:
+			if voice.loops == 0 or not data:
+				# Played out; pad the last period with silence
+				self._voice = None
+				return ( chunk + self._silence[len( chunk ):], first ), voice
+			if voice.loops > 0:
+				voice.loops -= 1
+			more          = data[:self._period_bytes - len( chunk )]
+			voice.offset  = len( more )
+			chunk        += more
+		return ( chunk, first ), None
+
+	def _write( self, chunk, first ):
+		if first is None:
+			self._sink.write( chunk )
+			self.periods += 1
+			return
+
+		# The first frame is heard once the audio already queued has played
+		written = clock.perf_counter_ns()
+		queued  = self._sink.delay()
+		self._sink.write( chunk )
+		self.periods += 1
+		self.starts  += 1
+		self.latencies.append( (written - first.requested) / 1000000000.0 + queued )
+		self._sink.mark( first.clip.name, "play" )
+		return
+
+	def _tick( self ):
+		with self._condition:
+			if not self._running or self._voice is None:
+				self._ticking = False
+				return
+			( chunk, first ), ended = self._next_period()
+
+		self._write( chunk, first )
+		if ended is not None:
+			self._sink.mark( ended.clip.name, "stop" )
+		clock.call_later( self._period, self._tick )
+		return
+
+	def _run( self ):
+		deadline = None
+		while True:
+			with self._condition:
+				while self._running and self._voice is None:
+					deadline = None
+					self._condition.wait()
+				if not self._running:
+					break
+				( chunk, first ), ended = self._next_period()
+
+			self._write( chunk, first )
+			if ended is not None:
+				self._sink.mark( ended.clip.name, "stop" )
+
+			# Sinks that do not block at the playback rate are paced here
+			if not self._sink.paced:
+				now      = clock.monotonic()
+				deadline = (deadline if deadline is not None else now) + self._period
+				if deadline > now:
+					clock.sleep( deadline - now )
+		return
@@ -0,0 +1,182 @@
+import math
+import wave
+import fcntl
+import struct
+
+"""
+------------------------------------------------------------------------------
+Audio outputs for the AudioEngine. A sink takes signed 16-bit little-endian
+PCM one period at a time:
+
+  OssSink  - an OSS device (/dev/dsp) with a small, fixed fragment size
+  NullSink - discards the audio; for running off-device
+  FileSink - writes the audio to a .wav file, for checking what was played
+
+Every sink keeps markers of when each sound started and stopped, and calls
+observers on each one, so tests can see when a sound became audible.
+------------------------------------------------------------------------------
+"""
+
+class Sink:
+	"""
+	--------------------------------------------------------------------------
+	Base Audio Sink
+	--------------------------------------------------------------------------
+	Description:
+	  'paced' is True when write() blocks at the playback rate, as a real
+	  device does; the engine paces writes itself for sinks that do not.
+	--------------------------------------------------------------------------
+	"""
+
+	paced = False
+
+	def __init__( self, clock ):
+		self._clock     = clock
+		self._observers = []
+		self.markers    = [] # ( time, name, action )
+		self.rate       = None
+		self.channels   = None
+		return
+
+	def open( self, rate, channels, period_frames ):
+		"""
+		----------------------------------------------------------------------
+		Prepares the sink for 16-bit audio, written 'period_frames' at a time
+		----------------------------------------------------------------------
+		"""
+		self.rate     = rate
+		self.channels = channels
+		return
+
+	def write( self, data ):
+		return
+
+	def delay( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the seconds of audio queued ahead of the next write
+		----------------------------------------------------------------------
+		"""
+		return 0.0
+
+	def close( self ):
+		return
+
+	def observe( self, function ):
+		"""
+		----------------------------------------------------------------------
+		Calls 'function( name, action )' whenever a sound starts ("play") or
+		stops ("stop")
+		----------------------------------------------------------------------
+		"""
+		self._observers.append( function )
+		return
+
+	def mark( self, name, action ):
+		self.markers.append( ( self._clock.monotonic(), name, action ) )
+		for function in self._observers:
+			function( name, action )
+		return
+
+
+class NullSink( Sink ):
+	"""
+	--------------------------------------------------------------------------
+	Discards the audio, counting the frames written
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock ):
+		super().__init__( clock )
+		self.frames = 0
+		return
+
+	def write( self, data ):
+		self.frames += len( data ) // (2 * self.channels)
+		return
+
+
+class FileSink( Sink ):
+	"""
+	--------------------------------------------------------------------------
+	Writes the audio to a .wav file
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock, path ):
+		super().__init__( clock )
+		self._path = path
+		self._file = None
+		return
+
+	def open( self, rate, channels, period_frames ):
+		super().open( rate, channels, period_frames )
+		self._file = wave.open( self._path, "wb" )
+		self._file.setnchannels( channels )
+		self._file.setsampwidth( 2 )
+		self._file.setframerate( rate )
+		return
+
+	def write( self, data ):
+		self._file.writeframesraw( data )
+		return
+
+	def close( self ):
+		if self._file:
+			self._file.close()
+			self._file = None
+		return
+
+
+class OssSink( Sink ):
+	"""
+	--------------------------------------------------------------------------
+	OSS Audio Device
+	--------------------------------------------------------------------------
+	Description:
+	  Plays through ossaudiodev with the device buffer limited to 'periods'
+	  fragments of one period each, so at most that much audio is queued
+	  ahead of a new sound. On the Pi, /dev/dsp is provided by ALSA's OSS
+	  emulation (snd-pcm-oss).
+	--------------------------------------------------------------------------
+	"""
+
+	paced = True
+
+	SNDCTL_DSP_SETFRAGMENT = 0xC004500A
+	DEFAULT_DEVICE         = "/dev/dsp"
+	DEFAULT_PERIODS        = 2
+
+	def __init__( self, clock, device = DEFAULT_DEVICE, periods = DEFAULT_PERIODS ):
+		super().__init__( clock )
+		self._device  = device
+		self._periods = periods
+		self._dsp     = None
+		return
+
+	def open( self, rate, channels, period_frames ):
+		import ossaudiodev
+
+		super().open( rate, channels, period_frames )
+		self._dsp = ossaudiodev.open( self._device, "w" )
+
+		# The fragment size must be set before the format; it is given as
+		# ( count << 16 ) | log2( bytes )
+		shift = int( math.log2( period_frames * 2 * channels ) )
+		fcntl.ioctl( self._dsp.fileno(), OssSink.SNDCTL_DSP_SETFRAGMENT,
+		             struct.pack( "i", (self._periods << 16) | shift ) )
+		self._dsp.setparameters( ossaudiodev.AFMT_S16_LE, channels, rate, True )
+		return
+
+	def write( self, data ):
+		self._dsp.writeall( data )
+		return
+
+	def delay( self ):
+		return self._dsp.obufcount() / self.rate
+
+	def close( self ):
+		if self._dsp:
+			self._dsp.close()
+			self._dsp = None
+		return
@@ -1,4 +1,56 @@
-import spidev
+from devices.hal import spidev
+from devices.spi import spi_ioc_transfer, spi_ioc_message, MAX_TRANSFERS
+import ctypes
+import fcntl
+
+class CPA417Block:
+	"""
+	------------------------------------------------------------------------
+	A fixed number of DAC words written in one SPI message
+	------------------------------------------------------------------------
+	Description:
+	  Each word is its own transfer, with chip select released after it
+	  so the DAC latches every sample, and is followed by a delay so the
+	  kernel paces the samples at the block's rate, to the microsecond.
+	  The words are copied into 'tx' before each write; its address never
+	  changes.
+	------------------------------------------------------------------------
+	"""
+
+	def __init__( self, count, rate, speed_hz ):
+		"""
+		------------------------------------------------------------------------
+		Constructs a block
+		------------------------------------------------------------------------
+		Preconditions:
+		  count    - the words in the block (1 to MAX_BLOCK)
+		  rate     - the words per second the kernel paces them at
+		  speed_hz - the SPI clock
+		------------------------------------------------------------------------
+		"""
+		if not 1 <= count <= CPA417.MAX_BLOCK:
+			raise ValueError( "a block holds 1 to {} words".format( CPA417.MAX_BLOCK ) )
+		self.count = count
+		self.tx    = bytearray( CPA417.WORD_SIZE * count )
+
+		# The time a word takes on the bus is part of its sample period
+		word_us = CPA417.WORD_SIZE * 8 * 1000000.0 / speed_hz
+		delay   = max( 0, int( round( 1000000.0 / rate - word_us ) ) )
+
+		tx = ctypes.addressof( ctypes.c_uint8.from_buffer( self.tx ) )
+		self._transfers = ( spi_ioc_transfer * count )()
+		for i, transfer in enumerate( self._transfers ):
+			transfer.tx_buf      = tx + CPA417.WORD_SIZE * i
+			transfer.len         = CPA417.WORD_SIZE
+			transfer.speed_hz    = speed_hz
+			transfer.delay_usecs = delay
+			transfer.cs_change   = 1 if i < count - 1 else 0
+		self._request = spi_ioc_message( count )
+		return
+
+	def __len__( self ):
+		return self.count
+
 
 class CPA417:
 
@@ -12,28 +64,36 @@ class CPA417:
 	LOAD_B       = 0x02
 	LOAD_BOTH    = LOAD_A | LOAD_B
 
+	# Streaming
+	WORD_SIZE    = 2             # bytes: the operation, then the value
+	MAX_BLOCK    = MAX_TRANSFERS # words in one SPI message
+	SPEED_HZ     = 1000000
+
 	def __init__(self, device, chip_select ):
 		"""
-		------------------------------------------------------------------------		
+		------------------------------------------------------------------------
 		Constructs a CPA417 object on the given device from the channel select
 		------------------------------------------------------------------------
 		Preconditions:
 		  device      - the device to read
-		  chip_select - the chip selection pin to use		
-		------------------------------------------------------------------------		
+		  chip_select - the chip selection pin to use
+		------------------------------------------------------------------------
 		"""
 		self._spi = spidev.SpiDev()
 		self._spi.open( device, chip_select )
+
+		# Blocks go straight to the spidev ioctl when the file is available
+		self._fd = self._spi.fileno() if hasattr( self._spi, "fileno" ) else None
 		return
 
 	def __del__(self):
 		"""
-		------------------------------------------------------------------------		
+		------------------------------------------------------------------------
 		Destructs the CPA417 by calling to shutdown all dac registers, then
 		closing the SPI connection
-		------------------------------------------------------------------------				
+		------------------------------------------------------------------------
 		"""
-		self._spi.xfer2([ (SHUTDOWN_ALL) , 0])
+		self._spi.xfer2([ CPA417.SHUTDOWN_ALL, 0 ])
 		self._spi.close()
 		return
 
@@ -45,7 +105,7 @@ class CPA417:
 		------------------------------------------------------------------------
 		Preconditions:
 		  operation - The operation to perform (constant)
-		  value     - The value to send to the DAC [0..255]		
+		  value     - The value to send to the DAC [0..255]
 		Postconditions:
 		  DAC receives 8 bit data, converting it to analog
 		------------------------------------------------------------------------
@@ -55,7 +115,56 @@ class CPA417:
 			value = 0
 		elif value > 255:
 			value = 255
-		
+
 		self._spi.xfer2([ operation, value ])
 		return
-	
+
+	@staticmethod
+	def encode( samples, operation ):
+		"""
+		------------------------------------------------------------------------
+		Turns 8 bit samples into the words that load them, so a waveform is
+		encoded once rather than on every write
+		------------------------------------------------------------------------
+		Preconditions:
+		  samples   - the values to send, as bytes [0..255]
+		  operation - the load operation (LOAD_A, LOAD_B or LOAD_BOTH)
+		Postconditions:
+		 returns:
+		  the words, as bytes
+		------------------------------------------------------------------------
+		"""
+		words = bytearray( CPA417.WORD_SIZE * len( samples ) )
+		words[0::2] = bytes( [ operation ] ) * len( samples )
+		words[1::2] = samples
+		return bytes( words )
+
+	def block( self, count, rate, speed_hz = SPEED_HZ ):
+		"""
+		------------------------------------------------------------------------
+		Prepares a block of words to be written with write_block()
+		------------------------------------------------------------------------
+		Preconditions:
+		  count    - the words per block (1 to MAX_BLOCK)
+		  rate     - the samples per second to pace them at
+		  speed_hz - the SPI clock (default: 1MHz)
+		------------------------------------------------------------------------
+		"""
+		return CPA417Block( count, rate, speed_hz )
+
+	def write_block( self, block ):
+		"""
+		------------------------------------------------------------------------
+		Writes the words in block.tx in a single SPI message, returning when
+		the last has been sent. Without the spidev file, each word is a
+		transfer of its own, so chip select is still released between them,
+		but the words are not paced.
+		------------------------------------------------------------------------
+		"""
+		if self._fd is not None:
+			fcntl.ioctl( self._fd, block._request, block._transfers )
+		else:
+			tx = block.tx
+			for i in range( 0, len( tx ), CPA417.WORD_SIZE ):
+				self._spi.xfer2( tx[i:i + CPA417.WORD_SIZE] )
+		return
@@ -0,0 +1,244 @@
+import threading
+
+from devices.hal import clock
+from devices.dac.cpa417 import CPA417
+from devices.dac.waveforms import MIDSCALE
+
+class DacStream:
+	"""
+	--------------------------------------------------------------------------
+	DAC Waveform Streamer
+	--------------------------------------------------------------------------
+	Description:
+	  Plays encoded waveforms (see CPA417.encode()) through the DAC from a
+	  background thread, 'batch' samples per SPI message. The kernel spaces
+	  the samples of a message at 'rate', so the thread only has to start
+	  each message as the last one ends; if a write returns sooner (a bus
+	  without the delays) the thread waits out the batch itself. Nothing
+	  is sent while no waveform plays. On the simulated backend batches
+	  are written from clock ticks instead.
+
+	  A batch that starts more than a sample period after the DAC ran out
+	  of samples has left it holding the last one too long, and is counted
+	  as an underrun.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_BATCH = 256 # samples per SPI message
+
+	def __init__( self, dac, rate, batch = DEFAULT_BATCH ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a stream; batches are written once start() is called
+		----------------------------------------------------------------------
+		Preconditions:
+		  dac   - the CPA417
+		  rate  - the samples per second
+		  batch - the samples per SPI message (1 to CPA417.MAX_BLOCK)
+		----------------------------------------------------------------------
+		"""
+		self._dac       = dac
+		self._rate      = rate
+		self._block     = dac.block( batch, rate )
+		self._size      = len( self._block.tx )
+		self._batch_ns  = int( batch * 1000000000 / rate )
+		self._sample_ns = int( 1000000000 / rate )
+
+		self._condition = threading.Condition()
+		self._words     = None # the waveform playing
+		self._offset    = 0    # the byte of it sent next
+		self._loops     = 0
+		self._silence   = b""
+		self._due       = None # when the DAC runs out of samples, while playing
+		self._segment   = 0    # when the current run of batches started
+		self._running   = False
+		self._ticking   = False
+		self._thread    = None
+
+		# Statistics
+		self.plays     = 0
+		self.batches   = 0
+		self.samples   = 0
+		self.underruns = 0
+		self.active_ns = 0 # time spent playing, for the achieved rate
+		return
+
+	@property
+	def rate( self ):
+		return self._rate
+
+	def start( self ):
+		"""
+		----------------------------------------------------------------------
+		Starts the streaming thread
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			if self._running:
+				return
+			self._running = True
+			tick = clock.virtual and self._words is not None and not self._ticking
+			if tick:
+				self._ticking = True
+
+		if clock.virtual:
+			if tick:
+				clock.call_later( 0, self._tick )
+			return
+
+		self._thread = threading.Thread( target = self._run, name = "dac-stream", daemon = True )
+		self._thread.start()
+		return
+
+	def close( self ):
+		"""
+		----------------------------------------------------------------------
+		Stops playing and waits for the thread to finish
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			self._running = False
+			self._words   = None
+			self._condition.notify()
+		if self._thread:
+			self._thread.join()
+			self._thread = None
+		return
+
+	def play( self, words, loops = -1 ):
+		"""
+		----------------------------------------------------------------------
+		Starts playing a waveform, replacing any playing. Returns
+		immediately; it reaches the DAC with the next batch.
+		----------------------------------------------------------------------
+		Preconditions:
+		  words - the waveform, from CPA417.encode(); at least one word
+		  loops - the times to repeat it after the first (-1: forever)
+		----------------------------------------------------------------------
+		"""
+		if not words:
+			raise ValueError( "the waveform is empty" )
+		with self._condition:
+			self._words   = memoryview( words )
+			self._offset  = 0
+			self._loops   = loops
+			self._silence = CPA417.encode( bytes( [ MIDSCALE ] ) * self._block.count, words[0] )
+			self.plays   += 1
+			self._condition.notify()
+			tick = clock.virtual and self._running and not self._ticking
+			if tick:
+				self._ticking = True
+		if tick:
+			clock.call_later( 0, self._tick )
+		return
+
+	def stop( self ):
+		"""
+		----------------------------------------------------------------------
+		Stops the waveform after the batch being sent
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			self._words = None
+		return
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the streaming statistics as a dictionary; 'rate' is the
+		achieved samples per second while playing
+		----------------------------------------------------------------------
+		"""
+		active = self.active_ns
+		if self._due is not None:
+			active += self._due - self._segment
+		return {
+			"plays"     : self.plays,
+			"batches"   : self.batches,
+			"samples"   : self.samples,
+			"underruns" : self.underruns,
+			"target"    : self._rate,
+			"rate"      : self.samples * 1000000000.0 / active if active else 0.0,
+		}
+
+	def _fill( self ):
+		"""
+		----------------------------------------------------------------------
+		Copies the next batch of the waveform into the block, padding with
+		silence where it ends. Called with the condition held.
+		----------------------------------------------------------------------
+		"""
+		tx     = self._block.tx
+		words  = self._words
+		filled = 0
+		while filled < self._size:
+			take = min( self._size - filled, len( words ) - self._offset )
+			tx[filled:filled + take] = words[self._offset:self._offset + take]
+			filled       += take
+			self._offset += take
+			if self._offset < len( words ):
+				continue
+			self._offset = 0
+			if self._loops == 0:
+				tx[filled:] = self._silence[filled:]
+				self._words = None
+				break
+			if self._loops > 0:
+				self._loops -= 1
+		return
+
+	def _write( self ):
+		"""
+		----------------------------------------------------------------------
+		Writes the block, keeping the statistics; returns the time the DAC
+		runs out of samples
+		----------------------------------------------------------------------
+		"""
+		now = clock.perf_counter_ns()
+		if self._due is None:
+			self._segment = now
+		elif now - self._due > self._sample_ns:
+			self.underruns += 1
+			self.active_ns += self._due - self._segment
+			self._segment   = now
+
+		self._dac.write_block( self._block )
+		self.batches += 1
+		self.samples += self._block.count
+		self._due     = max( clock.perf_counter_ns(), now + self._batch_ns )
+		return self._due
+
+	def _finish( self ):
+		# The stream went idle once the last batch has played out
+		if self._due is not None:
+			self.active_ns += self._due - self._segment
+			self._due       = None
+		return
+
+	def _tick( self ):
+		with self._condition:
+			if not self._running or self._words is None:
+				self._ticking = False
+				self._finish()
+				return
+			self._fill()
+		due = self._write()
+		clock.call_later( max( 0, due - clock.perf_counter_ns() ) / 1000000000.0, self._tick )
+		return
+
+	def _run( self ):
+		while True:
+			with self._condition:
+				while self._running and self._words is None:
+					self._finish()
+					self._condition.wait()
+				if not self._running:
+					self._finish()
+					return
+				self._fill()
+
+			due   = self._write()
+			delay = due - clock.perf_counter_ns()
+			if delay > 0:
+				clock.sleep( delay / 1000000000.0 )
+		return
@@ -0,0 +1,57 @@
+import numpy
+
+"""
+------------------------------------------------------------------------------
+Waveform tables for the DAC: 8 bit samples centred on 128, as bytes, ready
+for CPA417.encode(). Each table holds a whole number of cycles, so it loops
+without a click.
+------------------------------------------------------------------------------
+"""
+
+MIDSCALE = 128
+
+def _samples( phase, amplitude ):
+	# Ends the table on a whole cycle, so its first sample follows its last
+	cycles = max( 1, round( phase[-1] / (2 * numpy.pi) ) )
+	phase  = phase * (cycles * 2 * numpy.pi / phase[-1])
+	values = MIDSCALE + amplitude * numpy.sin( phase[:-1] )
+	return numpy.clip( numpy.rint( values ), 0, 255 ).astype( numpy.uint8 ).tobytes()
+
+def _sweep( rate, frequencies, amplitude ):
+	# The phase is the running sum of the frequency, so sweeps are smooth
+	phase = numpy.concatenate( ( [ 0.0 ], numpy.cumsum( frequencies ) * (2 * numpy.pi / rate) ) )
+	return _samples( phase, amplitude )
+
+def tone( rate, frequency, seconds, amplitude = 127 ):
+	"""
+	--------------------------------------------------------------------------
+	Returns a steady tone
+	--------------------------------------------------------------------------
+	Preconditions:
+	  rate      - the sample rate, in Hz
+	  frequency - the tone, in Hz
+	  seconds   - about how long the table is
+	  amplitude - the peak, in DAC steps from midscale (default: 127)
+	--------------------------------------------------------------------------
+	"""
+	return _sweep( rate, numpy.full( int( rate * seconds ), float( frequency ) ), amplitude )
+
+def chirp( rate, start, end, seconds, amplitude = 127 ):
+	"""
+	--------------------------------------------------------------------------
+	Returns a linear sweep from 'start' to 'end' Hz
+	--------------------------------------------------------------------------
+	"""
+	return _sweep( rate, numpy.linspace( start, end, int( rate * seconds ) ), amplitude )
+
+def siren( rate, low, high, period, amplitude = 127 ):
+	"""
+	--------------------------------------------------------------------------
+	Returns one cycle of a wailing siren: a sweep from 'low' up to 'high'
+	and back down over 'period' seconds
+	--------------------------------------------------------------------------
+	"""
+	half = int( rate * period / 2 )
+	up   = numpy.linspace( low, high, half, endpoint = False )
+	down = numpy.linspace( high, low, half, endpoint = False )
+	return _sweep( rate, numpy.concatenate( ( up, down ) ), amplitude )
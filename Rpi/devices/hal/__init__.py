@@ -0,0 +1,88 @@
+import os
+
+"""
+------------------------------------------------------------------------------
+Hardware abstraction layer. Device modules take GPIO, spidev, clock and
+the audio sink from here rather than importing RPi.GPIO, spidev, time and
+ossaudiodev directly:
+
+  from devices.hal import GPIO, spidev, clock
+
+The backend is read from the SECURITY_SYSTEM_HAL environment variable:
+  pi  - RPi.GPIO, spidev, an OSS audio sink and the wall clock (default)
+  sim - simulated pins, SPI devices and a null audio sink on a virtual clock
+
+On the Pi, SECURITY_SYSTEM_AUDIO may replace the OSS sink with "null", or
+with the path of a .wav file to record the audio to.
+
+use() may select the backend instead, but only before any device module is
+imported, since they bind GPIO, spidev and clock at import time.
+------------------------------------------------------------------------------
+"""
+
+BACKEND_PI  = "pi"
+BACKEND_SIM = "sim"
+
+AUDIO_OSS  = "oss"
+AUDIO_NULL = "null"
+
+backend   = None
+simulated = False
+GPIO      = None
+spidev    = None
+clock     = None
+audio     = None
+
+_simulator = None
+
+def use( name ):
+	"""
+	--------------------------------------------------------------------------
+	Selects the hardware backend
+	--------------------------------------------------------------------------
+	Preconditions:
+	  name - BACKEND_PI or BACKEND_SIM
+	--------------------------------------------------------------------------
+	"""
+	global backend, simulated, GPIO, spidev, clock, audio, _simulator
+
+	if name == BACKEND_SIM:
+		from devices.hal.sim import Simulator
+		_simulator = Simulator()
+		GPIO       = _simulator.GPIO
+		spidev     = _simulator.spidev
+		clock      = _simulator.clock
+		audio      = _simulator.audio
+	elif name == BACKEND_PI:
+		import RPi.GPIO
+		import spidev as pi_spidev
+		from devices.hal.clocks import RealClock
+		_simulator = None
+		GPIO       = RPi.GPIO
+		spidev     = pi_spidev
+		clock      = RealClock()
+		audio      = _audio_sink( clock, os.environ.get( "SECURITY_SYSTEM_AUDIO", AUDIO_OSS ) )
+	else:
+		raise ValueError( "unknown hardware backend: " + repr( name ) )
+
+	backend   = name
+	simulated = name == BACKEND_SIM
+	return
+
+def _audio_sink( clock, name ):
+	from devices.audio.sinks import OssSink, NullSink, FileSink
+	if name == AUDIO_OSS:
+		return OssSink( clock )
+	if name == AUDIO_NULL:
+		return NullSink( clock )
+	return FileSink( clock, name )
+
+def simulator():
+	"""
+	--------------------------------------------------------------------------
+	Returns the Simulator scripting the sim backend (None on the Pi)
+	--------------------------------------------------------------------------
+	"""
+	return _simulator
+
+use( os.environ.get( "SECURITY_SYSTEM_HAL", BACKEND_PI ) )
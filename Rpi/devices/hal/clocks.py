@@ -0,0 +1,312 @@
+import math
+import time
+import heapq
+import asyncio
+import selectors
+import threading
+import traceback
+import concurrent.futures
+
+"""
+------------------------------------------------------------------------------
+Clocks used by the device drivers. Everything that sleeps, timestamps, or
+blocks waiting on another thread goes through one of these so that the
+simulated backend can run on virtual time.
+------------------------------------------------------------------------------
+"""
+
+class RealClock:
+	"""
+	--------------------------------------------------------------------------
+	Wall Clock
+	--------------------------------------------------------------------------
+	Description:
+	  Thin wrapper over the time module. The functions are bound as
+	  attributes so a call costs no more than calling time directly.
+
+	  call_later() runs short callbacks on one shared timer thread, which
+	  is started on first use. Callbacks run one at a time, so they must
+	  not block.
+	--------------------------------------------------------------------------
+	"""
+
+	virtual = False
+
+	def __init__( self ):
+		self.perf_counter_ns = time.perf_counter_ns
+		self.monotonic       = time.monotonic
+		self.time            = time.time
+		self.sleep           = time.sleep
+
+		self._events    = []
+		self._sequence  = 0
+		self._condition = threading.Condition()
+		self._thread    = None
+		return
+
+	def call_at( self, when, function, *args ):
+		"""
+		----------------------------------------------------------------------
+		Schedules 'function(*args)' to run on the timer thread at monotonic
+		time 'when' (seconds)
+		----------------------------------------------------------------------
+		"""
+		with self._condition:
+			self._sequence += 1
+			heapq.heappush( self._events, ( when, self._sequence, function, args ) )
+			if self._thread is None:
+				self._thread = threading.Thread( target = self._run_timers, name = "clock-timers", daemon = True )
+				self._thread.start()
+			self._condition.notify()
+		return
+
+	def call_later( self, delay, function, *args ):
+		"""
+		----------------------------------------------------------------------
+		Schedules 'function(*args)' to run on the timer thread 'delay'
+		seconds from now
+		----------------------------------------------------------------------
+		"""
+		self.call_at( time.monotonic() + delay, function, *args )
+		return
+
+	def get( self, source, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Takes the next item from a queue, waiting up to 'timeout' seconds
+		----------------------------------------------------------------------
+		Postconditions:
+		  raises queue.Empty if nothing arrived in time
+		----------------------------------------------------------------------
+		"""
+		return source.get( timeout = timeout )
+
+	def wait( self, event, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Waits up to 'timeout' seconds for a threading.Event to be set
+		----------------------------------------------------------------------
+		"""
+		return event.wait( timeout )
+
+	def new_event_loop( self ):
+		return asyncio.new_event_loop()
+
+	def new_executor( self, workers ):
+		return concurrent.futures.ThreadPoolExecutor( max_workers = workers )
+
+	def _run_timers( self ):
+		while True:
+			with self._condition:
+				while True:
+					if not self._events:
+						self._condition.wait()
+						continue
+					delay = self._events[0][0] - time.monotonic()
+					if delay <= 0:
+						break
+					self._condition.wait( delay )
+				_, _, function, args = heapq.heappop( self._events )
+
+			try:
+				function( *args )
+			except Exception:
+				traceback.print_exc()
+		return
+
+
+class VirtualClock:
+	"""
+	--------------------------------------------------------------------------
+	Virtual Clock
+	--------------------------------------------------------------------------
+	Description:
+	  Discrete-event clock for the simulated backend. Time only moves when
+	  something sleeps or waits, and it jumps straight to the next scheduled
+	  event, so simulated hardware runs as fast as the Python code allows
+	  and every run with the same script is identical.
+
+	  Scheduled events run on whichever thread advances the clock. The
+	  simulation is meant to be driven from a single thread; periodic
+	  background work should use call_later() instead of a thread.
+	--------------------------------------------------------------------------
+	"""
+
+	virtual = True
+
+	def __init__( self, start = 0.0 ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a clock
+		----------------------------------------------------------------------
+		Preconditions:
+		  start - the initial time, in seconds (default: 0.0)
+		----------------------------------------------------------------------
+		"""
+		self._now      = int( start * 1000000000 )
+		self._events   = []
+		self._sequence = 0
+		self._lock     = threading.RLock()
+		return
+
+	def perf_counter_ns( self ):
+		return self._now
+
+	def monotonic( self ):
+		return self._now / 1000000000.0
+
+	time = monotonic
+
+	def call_at( self, when, function, *args ):
+		"""
+		----------------------------------------------------------------------
+		Schedules 'function(*args)' to run at virtual time 'when' (seconds)
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._sequence += 1
+			heapq.heappush( self._events, ( int( when * 1000000000 ), self._sequence, function, args ) )
+		return
+
+	def call_later( self, delay, function, *args ):
+		"""
+		----------------------------------------------------------------------
+		Schedules 'function(*args)' to run 'delay' seconds from now
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._sequence += 1
+			heapq.heappush( self._events, ( self._now + int( delay * 1000000000 ), self._sequence, function, args ) )
+		return
+
+	def next_event( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the time of the next scheduled event in ns, or None
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			return self._events[0][0] if self._events else None
+
+	def advance_to( self, when_ns ):
+		"""
+		----------------------------------------------------------------------
+		Runs every event scheduled up to 'when_ns', in order, then sets the
+		time to 'when_ns'
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			while self._events and self._events[0][0] <= when_ns:
+				at, _, function, args = heapq.heappop( self._events )
+				if at > self._now:
+					self._now = at
+				function( *args )
+			if when_ns > self._now:
+				self._now = when_ns
+		return
+
+	def sleep( self, seconds ):
+		# Round up, so that a loop sleeping for less than 1ns still advances
+		self.advance_to( self._now + math.ceil( seconds * 1000000000 ) )
+		return
+
+	def get( self, source, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Takes the next item from a queue, running scheduled events until one
+		is put there or 'timeout' seconds of virtual time have passed
+		----------------------------------------------------------------------
+		Postconditions:
+		  raises queue.Empty if nothing arrived in time
+		----------------------------------------------------------------------
+		"""
+		self._run_until( lambda: not source.empty(), timeout )
+		return source.get_nowait()
+
+	def wait( self, event, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Waits for a threading.Event, running scheduled events meanwhile
+		----------------------------------------------------------------------
+		"""
+		self._run_until( event.is_set, timeout )
+		return event.is_set()
+
+	def new_event_loop( self ):
+		return VirtualEventLoop( self )
+
+	def new_executor( self, workers ):
+		return InlineExecutor()
+
+	def _run_until( self, predicate, timeout ):
+		deadline = None if timeout is None else self._now + int( timeout * 1000000000 )
+		with self._lock:
+			while not predicate():
+				upcoming = self.next_event()
+				if upcoming is None or (deadline is not None and upcoming > deadline):
+					if deadline is not None:
+						self.advance_to( deadline )
+					return
+				self.advance_to( upcoming )
+		return
+
+
+class _VirtualSelector( selectors.DefaultSelector ):
+	"""
+	--------------------------------------------------------------------------
+	Selector that advances a VirtualClock instead of blocking. Real file
+	descriptors (the loop's own wakeup pipe) are still polled.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock ):
+		super().__init__()
+		self._clock = clock
+		return
+
+	def select( self, timeout = None ):
+		ready = super().select( 0 )
+		if ready or timeout == 0:
+			return ready
+
+		if timeout is None:
+			upcoming = self._clock.next_event()
+			if upcoming is None:
+				return super().select( None )
+			self._clock.advance_to( upcoming )
+		else:
+			self._clock.sleep( timeout )
+		return super().select( 0 )
+
+
+class VirtualEventLoop( asyncio.SelectorEventLoop ):
+	"""
+	--------------------------------------------------------------------------
+	Asyncio event loop whose time is a VirtualClock
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock ):
+		super().__init__( _VirtualSelector( clock ) )
+		self._clock = clock
+		return
+
+	def time( self ):
+		return self._clock.monotonic()
+
+
+class InlineExecutor( concurrent.futures.Executor ):
+	"""
+	--------------------------------------------------------------------------
+	Executor that runs each call immediately on the submitting thread, so
+	blocking driver calls stay on the thread that owns the VirtualClock
+	--------------------------------------------------------------------------
+	"""
+
+	def submit( self, function, *args, **kwargs ):
+		future = concurrent.futures.Future()
+		try:
+			future.set_result( function( *args, **kwargs ) )
+		except Exception as error:
+			future.set_exception( error )
+		return future
@@ -0,0 +1,407 @@
+import types
+import collections
+
+from devices.hal.clocks import VirtualClock
+from devices.audio.sinks import NullSink
+from devices.sensors.ultrasonic.filter import SPEED_OF_SOUND_MPS
+
+"""
+------------------------------------------------------------------------------
+Simulated hardware backend: virtual GPIO pins with edge events, scripted
+HC-SR04 echoes, MCP3008 waveforms, a recording DAC and a null audio sink
+whose markers show when each sound would be heard, all running on a
+VirtualClock. Select it with SECURITY_SYSTEM_HAL=sim (or devices.hal.use)
+before any device module is imported, then script it through the objects
+returned by devices.hal.simulator().
+------------------------------------------------------------------------------
+"""
+
+ECHO_LATENCY = 0.0005 # s, trigger falling edge to echo rising edge
+
+def distance_to_echo( meters ):
+	"""
+	--------------------------------------------------------------------------
+	Converts a distance to the HC-SR04 echo pulse width, in seconds
+	--------------------------------------------------------------------------
+	"""
+	return 2.0 * meters / SPEED_OF_SOUND_MPS
+
+def _sample( source, now ):
+	return source( now ) if callable( source ) else source
+
+def _as_list( values ):
+	if isinstance( values, (list, tuple) ):
+		return list( values )
+	return [ values ]
+
+
+class SimGPIO( types.ModuleType ):
+	"""
+	--------------------------------------------------------------------------
+	Simulated RPi.GPIO
+	--------------------------------------------------------------------------
+	Description:
+	  Implements the parts of the RPi.GPIO API used by the drivers. Edges
+	  are detected (and 'bouncetime' applied) when the level changes, and
+	  their callbacks run one at a time from a clock event at the same
+	  virtual time, like the library's single callback thread: a callback
+	  that sleeps delays the next one instead of nesting it.
+	--------------------------------------------------------------------------
+	"""
+
+	BCM      = 11
+	BOARD    = 10
+	OUT      = 0
+	IN       = 1
+	LOW      = 0
+	HIGH     = 1
+	RISING   = 31
+	FALLING  = 32
+	BOTH     = 33
+	PUD_OFF  = 20
+	PUD_DOWN = 21
+	PUD_UP   = 22
+	UNKNOWN  = -1
+
+	def __init__( self, clock ):
+		super().__init__( "RPi.GPIO" )
+		self._clock     = clock
+		self._levels    = {}
+		self._functions = {}
+		self._detect    = {} # pin -> [ edge, bouncetime_ns, last_edge_ns, callbacks ]
+		self._echoes    = {} # trigger pin -> ( echo pin, source )
+		self._observers = {} # pin -> [ function( pin, value ) ]
+		self._pending   = collections.deque()
+		self._dispatching = False
+
+		gpio = self
+		class PWM:
+			"""
+			------------------------------------------------------------------
+			Simulated GPIO.PWM; toggles the pin on the virtual clock while
+			it runs
+			------------------------------------------------------------------
+			"""
+			def __init__( self, pin, frequency ):
+				self.pin        = pin
+				self.frequency  = frequency
+				self.duty_cycle = 0.0
+				self.running    = False
+				self._cycles    = 0 # the run the pending cycle belongs to
+			def start( self, duty_cycle ):
+				self.duty_cycle = duty_cycle
+				self.running    = True
+				self._cycles   += 1
+				self._cycle( self._cycles )
+			def stop( self ):
+				self.running  = False
+				self._cycles += 1
+				gpio._set( self.pin, 0 )
+			def ChangeFrequency( self, frequency ):
+				self.frequency = frequency
+			def ChangeDutyCycle( self, duty_cycle ):
+				self.duty_cycle = duty_cycle
+			def _cycle( self, cycles ):
+				if cycles != self._cycles:
+					return
+				period = 1.0 / self.frequency
+				high   = period * self.duty_cycle / 100.0
+				if high > 0:
+					gpio._set( self.pin, 1 )
+				if high < period:
+					gpio._clock.call_later( high, gpio._set, self.pin, 0 )
+				gpio._clock.call_later( period, self._cycle, cycles )
+		self.PWM = PWM
+		return
+
+	#-------------------------------------------------------------------------
+	# RPi.GPIO API
+	#-------------------------------------------------------------------------
+
+	def setmode( self, mode ):
+		return
+
+	def setwarnings( self, flag ):
+		return
+
+	def setup( self, pins, direction, pull_up_down = None, initial = None ):
+		for pin in _as_list( pins ):
+			self._functions[pin] = direction
+			level = initial if initial is not None else (1 if pull_up_down == self.PUD_UP else 0)
+			self._levels.setdefault( pin, level )
+		return
+
+	def gpio_function( self, pin ):
+		return self._functions.get( pin, self.UNKNOWN )
+
+	def input( self, pin ):
+		return self._levels.get( pin, 0 )
+
+	def output( self, pins, values ):
+		pins   = _as_list( pins )
+		values = _as_list( values )
+		if len( values ) == 1:
+			values = values * len( pins )
+		for pin, value in zip( pins, values ):
+			self._set( pin, 1 if value else 0 )
+		return
+
+	def add_event_detect( self, pin, edge, callback = None, bouncetime = None ):
+		bounce = int( bouncetime * 1000000 ) if bouncetime else 0
+		self._detect[pin] = [ edge, bounce, None, [] ]
+		if callback:
+			self._detect[pin][3].append( callback )
+		return
+
+	def add_event_callback( self, pin, callback ):
+		self._detect[pin][3].append( callback )
+		return
+
+	def remove_event_detect( self, pin ):
+		self._detect.pop( pin, None )
+		return
+
+	def cleanup( self, pins = None ):
+		for pin in (_as_list( pins ) if pins is not None else list( self._functions )):
+			self._functions.pop( pin, None )
+			self._detect.pop( pin, None )
+		return
+
+	#-------------------------------------------------------------------------
+	# Simulation controls
+	#-------------------------------------------------------------------------
+
+	def drive( self, pin, value ):
+		"""
+		----------------------------------------------------------------------
+		Drives an input pin to 'value' now, firing its edge callbacks
+		----------------------------------------------------------------------
+		"""
+		self._set( pin, 1 if value else 0 )
+		return
+
+	def drive_at( self, when, pin, value ):
+		"""
+		----------------------------------------------------------------------
+		Drives an input pin to 'value' at virtual time 'when' (seconds)
+		----------------------------------------------------------------------
+		"""
+		self._clock.call_at( when, self._set, pin, 1 if value else 0 )
+		return
+
+	def pulse_at( self, when, pin, width, value = 1 ):
+		"""
+		----------------------------------------------------------------------
+		Drives an input pin to 'value' at 'when' and back after 'width'
+		----------------------------------------------------------------------
+		"""
+		self.drive_at( when,         pin, value )
+		self.drive_at( when + width, pin, not value )
+		return
+
+	def attach_echo( self, trigger, echo, source ):
+		"""
+		----------------------------------------------------------------------
+		Makes the echo pin answer every falling edge of the trigger pin
+		----------------------------------------------------------------------
+		Preconditions:
+		  trigger - the HC-SR04 trigger pin
+		  echo    - the HC-SR04 echo pin
+		  source  - the echo pulse width in seconds, or a function of the
+		            virtual time returning it (None for a lost echo)
+		----------------------------------------------------------------------
+		"""
+		self._echoes[trigger] = ( echo, source )
+		return
+
+	def observe( self, pin, function ):
+		"""
+		----------------------------------------------------------------------
+		Calls 'function( pin, value )' whenever the pin changes level
+		----------------------------------------------------------------------
+		"""
+		self._observers.setdefault( pin, [] ).append( function )
+		return
+
+	def _set( self, pin, value ):
+		previous = self._levels.get( pin, 0 )
+		self._levels[pin] = value
+		if previous == value:
+			return
+
+		for function in self._observers.get( pin, () ):
+			function( pin, value )
+
+		if not value and pin in self._echoes:
+			echo, source = self._echoes[pin]
+			width = _sample( source, self._clock.monotonic() )
+			if width is not None:
+				self._clock.call_later( ECHO_LATENCY,         self._set, echo, 1 )
+				self._clock.call_later( ECHO_LATENCY + width, self._set, echo, 0 )
+
+		detect = self._detect.get( pin )
+		if detect is None:
+			return
+		edge, bounce, last, callbacks = detect
+		if (edge == self.RISING and not value) or (edge == self.FALLING and value):
+			return
+		now = self._clock.perf_counter_ns()
+		if bounce and last is not None and now - last < bounce:
+			return
+		detect[2] = now
+		self._pending.append( ( pin, list( callbacks ) ) )
+		if len( self._pending ) == 1:
+			self._clock.call_later( 0, self._dispatch )
+		return
+
+	def _dispatch( self ):
+		if self._dispatching:
+			return
+		self._dispatching = True
+		try:
+			while self._pending:
+				pin, callbacks = self._pending.popleft()
+				for callback in callbacks:
+					callback( pin )
+		finally:
+			self._dispatching = False
+		return
+
+
+class Mcp3008Model:
+	"""
+	--------------------------------------------------------------------------
+	Simulated MCP3008; each of the eight channels follows a waveform
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock ):
+		self._clock    = clock
+		self._channels = [ 0 ] * 8
+		self.transfers = 0
+		return
+
+	def set_channel( self, channel, source ):
+		"""
+		----------------------------------------------------------------------
+		Sets a channel (0-7) to a constant, or a function of virtual time
+		returning the 10 bit value
+		----------------------------------------------------------------------
+		"""
+		self._channels[channel] = source
+		return
+
+	def transfer( self, data ):
+		self.transfers += 1
+		now      = self._clock.monotonic()
+		response = [ 0 ] * len( data )
+		for i in range( 0, len( data ) - 2, 3 ):
+			value = int( _sample( self._channels[data[i + 1] & 0b111], now ) )
+			value = min( max( value, 0 ), 1023 )
+			response[i + 1] = (value >> 8) & 0b11
+			response[i + 2] = value & 0xFF
+		return response
+
+
+class DacModel:
+	"""
+	--------------------------------------------------------------------------
+	Simulated SPI DAC; records every byte written
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock ):
+		self._clock  = clock
+		self.written = bytearray()
+		self.transfers = 0
+		return
+
+	def transfer( self, data ):
+		self.transfers += 1
+		self.written.extend( data )
+		return [ 0 ] * len( data )
+
+
+class SimSpiDev:
+	"""
+	--------------------------------------------------------------------------
+	Simulated spidev.SpiDev, forwarding transfers to the model attached to
+	its bus and chip select
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, simulator ):
+		self._simulator = simulator
+		self._model     = None
+		self.max_speed_hz = 500000
+		self.mode         = 0
+		return
+
+	def open( self, device, chip_select ):
+		self._model = self._simulator.spi_device( device, chip_select )
+		return
+
+	def close( self ):
+		self._model = None
+		return
+
+	def xfer( self, data, *args ):
+		return self._model.transfer( list( data ) )
+
+	def xfer2( self, data, *args ):
+		return self._model.transfer( list( data ) )
+
+	def writebytes( self, data ):
+		self._model.transfer( list( data ) )
+		return
+
+	writebytes2 = writebytes
+
+
+class Simulator:
+	"""
+	--------------------------------------------------------------------------
+	Simulated Hardware
+	--------------------------------------------------------------------------
+	Description:
+	  Owns the virtual clock, GPIO, SPI devices and audio sink. SPI devices are created
+	  as MCP3008 models on first open unless attach_spi() put something
+	  else on that bus and chip select.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self ):
+		self.clock   = VirtualClock()
+		self.GPIO    = SimGPIO( self.clock )
+		self.spidev  = types.SimpleNamespace( SpiDev = lambda: SimSpiDev( self ) )
+		self.audio   = NullSink( self.clock )
+		self._spi    = {}
+		return
+
+	def spi_device( self, device, chip_select ):
+		"""
+		----------------------------------------------------------------------
+		Returns the model on a bus and chip select, creating an MCP3008
+		model if there is none
+		----------------------------------------------------------------------
+		"""
+		key = ( device, chip_select )
+		if key not in self._spi:
+			self._spi[key] = Mcp3008Model( self.clock )
+		return self._spi[key]
+
+	def attach_spi( self, device, chip_select, model ):
+		self._spi[( device, chip_select )] = model
+		return model
+
+	def interrupt_at( self, when ):
+		"""
+		----------------------------------------------------------------------
+		Raises KeyboardInterrupt at virtual time 'when', ending the program
+		the way Ctrl-C would
+		----------------------------------------------------------------------
+		"""
+		def interrupt():
+			raise KeyboardInterrupt
+		self.clock.call_at( when, interrupt )
+		return
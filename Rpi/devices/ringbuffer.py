@@ -0,0 +1,114 @@
+from array import array
+
+class RingBuffer:
+	"""
+	--------------------------------------------------------------------------
+	Fixed-size Ring Buffer
+	--------------------------------------------------------------------------
+	Description:
+	  A single-producer ring of numbers backed by an array. Consumers keep
+	  their own cursor (the total sample count they have read up to) and get
+	  memoryview slices of the backing storage, so reading does not copy.
+
+	  A consumer that falls more than 'capacity' samples behind the producer
+	  has lost data; the lost samples are counted in 'overruns' and the
+	  cursor is moved up to the oldest sample still held.
+
+	  Slices stay valid only until the producer wraps around onto them.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, capacity, typecode = 'H' ):
+		"""
+		----------------------------------------------------------------------
+		Constructs an empty ring buffer
+		----------------------------------------------------------------------
+		Preconditions:
+		  capacity - the number of samples held
+		  typecode - the array typecode of a sample (default: 'H')
+		----------------------------------------------------------------------
+		"""
+		if capacity < 1:
+			raise ValueError( "capacity must be at least 1" )
+		self.capacity = capacity
+		self.written  = 0 # total samples ever written
+		self.overruns = 0 # samples lost by consumers that fell behind
+		self._data    = array( typecode, bytes( array( typecode ).itemsize * capacity ) )
+		self._view    = memoryview( self._data )
+		return
+
+	def __len__( self ):
+		return min( self.written, self.capacity )
+
+	def append( self, value ):
+		"""
+		----------------------------------------------------------------------
+		Writes one sample, overwriting the oldest if the ring is full
+		----------------------------------------------------------------------
+		"""
+		self._data[self.written % self.capacity] = value
+		self.written += 1
+		return
+
+	def extend( self, values ):
+		"""
+		----------------------------------------------------------------------
+		Writes a sequence of samples
+		----------------------------------------------------------------------
+		"""
+		for value in values:
+			self._data[self.written % self.capacity] = value
+			self.written += 1
+		return
+
+	def latest( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the most recent sample, or None if nothing was written
+		----------------------------------------------------------------------
+		"""
+		if self.written == 0:
+			return None
+		return self._data[(self.written - 1) % self.capacity]
+
+	def window( self, count ):
+		"""
+		----------------------------------------------------------------------
+		Returns the last 'count' samples (or fewer, if not yet written)
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  a list of one or two memoryviews, oldest first
+		----------------------------------------------------------------------
+		"""
+		count = min( count, len( self ) )
+		return self._slices( self.written - count, self.written )
+
+	def read( self, cursor ):
+		"""
+		----------------------------------------------------------------------
+		Returns every sample written since 'cursor'
+		----------------------------------------------------------------------
+		Preconditions:
+		  cursor - the value of 'written' when this consumer last read
+		           (0 to start from the oldest sample held)
+		Postconditions:
+		 returns:
+		  ( slices, cursor ) - a list of one or two memoryviews, oldest
+		                       first, and the cursor for the next read
+		----------------------------------------------------------------------
+		"""
+		written = self.written
+		if written - cursor > self.capacity:
+			self.overruns += written - cursor - self.capacity
+			cursor         = written - self.capacity
+		return self._slices( cursor, written ), written
+
+	def _slices( self, begin, end ):
+		if begin >= end:
+			return []
+		first = begin % self.capacity
+		last  = end % self.capacity
+		if first < last or last == 0:
+			return [ self._view[first:last or self.capacity] ]
+		return [ self._view[first:], self._view[:last] ]
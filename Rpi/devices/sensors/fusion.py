@@ -0,0 +1,285 @@
+import threading
+
+import numpy
+
+class FusionDetector:
+	"""
+	--------------------------------------------------------------------------
+	Pressure and Ultrasonic Fusion Detector
+	--------------------------------------------------------------------------
+	Description:
+	  Decides when the sensors have seen an intrusion. Pressure samples are
+	  evaluated a batch at a time with NumPy rather than one comparison per
+	  sample: each batch is smoothed with a moving average over 'smoothing'
+	  samples, and the largest step of the average from its level before
+	  the batch is the pad's feature. A single-sample glitch only moves the
+	  average by 1/smoothing of its size, so SPI read errors and contact
+	  bounce no longer trigger. The step is compared against the pressure
+	  threshold, or against 'noise_sigmas' times the pad's noise (the
+	  moving variance) if a noisy pad has raised that above the threshold.
+
+	  The ultrasonic feature is the median change in echo time, as before.
+
+	  Each pad and ultrasonic sensor may be given a threshold of its own,
+	  such as one learned from its baseline (see system/calibration.py);
+	  configure() sets them all back to the common thresholds.
+
+	  Each sensor's evidence is its feature over its threshold, so 1.0
+	  triggers on its own. When both sensors show at least 'corroborate'
+	  evidence within the same ultrasonic period, and the pressure activity
+	  and echo changes of the last 'window' pings are correlated by at
+	  least 'correlation', they are taken together as a detection.
+
+	  The pressure and ultrasonic checks run on threads of their own, so
+	  the evaluations, and the changes to the thresholds, hold a lock;
+	  pressure_features() only touches the pad's own features.
+	--------------------------------------------------------------------------
+	"""
+
+	PRESSURE   = "pressure"
+	ULTRASONIC = "ultrasonic"
+	FUSED      = "pressure+ultrasonic"
+
+	def __init__( self, pads, rate, pressure_threshold, ultrasonic_threshold,
+	              smoothing = 8, window = 20, noise_sigmas = 4.0,
+	              corroborate = 0.5, correlation = 0.5, sensors = 1 ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a detector
+		----------------------------------------------------------------------
+		Preconditions:
+		  pads                 - the number of pressure pads
+		  rate                 - the pressure sample rate, in Hz
+		  pressure_threshold   - the step of the average that triggers, in
+		                         ADC counts
+		  ultrasonic_threshold - the median echo change that triggers, in s
+		  smoothing            - the samples in the moving average
+		  window               - the pings the correlation is taken over
+		  noise_sigmas         - the noise, in standard deviations, a step
+		                         must also exceed
+		  corroborate          - the evidence each sensor needs for a fused
+		                         detection
+		  correlation          - the correlation a fused detection needs
+		  sensors              - the number of ultrasonic sensors
+		----------------------------------------------------------------------
+		"""
+		if smoothing < 1 or window < 3:
+			raise ValueError( "smoothing must be at least 1 and window at least 3" )
+		self._smoothing = smoothing
+		self._rate      = rate
+		self._pads      = pads
+		self._sensors   = sensors
+		self._lock      = threading.Lock() # guards the evidence, thresholds and detections
+		self.configure( pressure_threshold, ultrasonic_threshold, noise_sigmas, corroborate, correlation )
+
+		# The last smoothing - 1 samples of each pad, so the moving average
+		# continues across batches
+		self._tails = [ numpy.empty( 0 ) ] * pads
+
+		# Features of each pad's last batch
+		self.levels    = numpy.full( pads, numpy.nan ) # the moving average at its end
+		self.steps     = numpy.zeros( pads )           # the largest step of the average
+		self.variances = numpy.zeros( pads )           # the mean moving variance
+		self.rates     = numpy.zeros( pads )           # the fastest change of the average, counts/s
+		self.noise     = numpy.zeros( pads )           # the moving variance when quiet
+		self.evidence  = numpy.zeros( pads )           # the step over its limit
+
+		# Evidence since the last ping, and the pressure activity and echo
+		# change of the last 'window' pings
+		self._pressure_evidence   = 0.0
+		self._ultrasonic_evidence = 0.0
+		self._activity = numpy.zeros( window )
+		self._echoes   = numpy.zeros( window )
+		self._pings    = 0
+
+		# Statistics
+		self.batches    = 0
+		self.samples    = 0
+		self.detections = { FusionDetector.PRESSURE: 0, FusionDetector.ULTRASONIC: 0, FusionDetector.FUSED: 0 }
+		return
+
+	def configure( self, pressure_threshold, ultrasonic_threshold, noise_sigmas, corroborate, correlation ):
+		"""
+		----------------------------------------------------------------------
+		Changes the thresholds, keeping the features already computed; every
+		pad and sensor is given the common thresholds
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self.pressure_threshold    = pressure_threshold
+			self.ultrasonic_threshold  = ultrasonic_threshold
+			self.pressure_thresholds   = numpy.full( self._pads,    float( pressure_threshold   ) )
+			self.ultrasonic_thresholds = numpy.full( self._sensors, float( ultrasonic_threshold ) )
+			self.noise_sigmas          = noise_sigmas
+			self.corroborate           = corroborate
+			self.correlation           = correlation
+		return
+
+	def set_pressure_threshold( self, pad, threshold ):
+		"""
+		----------------------------------------------------------------------
+		Changes one pad's threshold, from its next batch
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self.pressure_thresholds[pad] = threshold
+		return
+
+	def set_ultrasonic_threshold( self, sensor, threshold ):
+		"""
+		----------------------------------------------------------------------
+		Changes one ultrasonic sensor's threshold, from its next ping
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self.ultrasonic_thresholds[sensor] = threshold
+		return
+
+	def add_pressure( self, pad, slices ):
+		"""
+		----------------------------------------------------------------------
+		Evaluates a batch of new samples from one pad
+		----------------------------------------------------------------------
+		Preconditions:
+		  pad    - the pad the samples are from
+		  slices - sequences of samples in order, e.g. from RingBuffer.read()
+		Postconditions:
+		 returns:
+		  the detection (PRESSURE or FUSED), or None
+		----------------------------------------------------------------------
+		"""
+		if not self.pressure_features( pad, slices ):
+			return None
+		return self.evaluate_pressure( pad )
+
+	def pressure_features( self, pad, slices ):
+		"""
+		----------------------------------------------------------------------
+		Computes the features of a batch of new samples from one pad, into
+		levels, steps, variances and rates. They do not depend on the
+		thresholds, so a replay can compute them once for many.
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  True if the pad has enough samples for features
+		----------------------------------------------------------------------
+		"""
+		if not slices:
+			return False
+
+		new = numpy.concatenate( [ numpy.asarray( samples, dtype = numpy.float64 ) for samples in slices ] )
+		self.batches += 1
+		self.samples += len( new )
+
+		k = self._smoothing
+		x = numpy.concatenate( ( self._tails[pad], new ) )
+		if len( x ) < k:
+			self._tails[pad] = x
+			return False
+		self._tails[pad] = x[len( x ) - k + 1:]
+
+		# Moving mean and variance over k samples, from running sums
+		sums    = numpy.zeros( len( x ) + 1 )
+		squares = numpy.zeros( len( x ) + 1 )
+		numpy.cumsum( x,     out = sums[1:]    )
+		numpy.cumsum( x * x, out = squares[1:] )
+		mean    = (sums[k:] - sums[:-k]) / k
+		var     = numpy.maximum( (squares[k:] - squares[:-k]) / k - mean * mean, 0.0 )
+
+		level = self.levels[pad]
+		if numpy.isnan( level ):
+			level = mean[0]
+		self.steps[pad]     = numpy.abs( mean - level ).max()
+		self.variances[pad] = var.mean()
+		self.rates[pad]     = numpy.abs( numpy.diff( mean ) ).max() * self._rate if len( mean ) > 1 else 0.0
+		self.levels[pad]    = mean[-1]
+		return True
+
+	def evaluate_pressure( self, pad ):
+		"""
+		----------------------------------------------------------------------
+		Evaluates the features of a pad's last batch against the thresholds
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  the detection (PRESSURE or FUSED), or None
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			limit    = max( self.pressure_thresholds[pad], self.noise_sigmas * self.noise[pad] ** 0.5 )
+			evidence = self.steps[pad] / limit
+			self.evidence[pad] = evidence
+
+			# Only quiet batches count towards the noise, so impacts do not
+			# raise the limit
+			if evidence < self.corroborate:
+				self.noise[pad] += 0.1 * (self.variances[pad] - self.noise[pad])
+
+			self._pressure_evidence = max( self._pressure_evidence, evidence )
+			if evidence >= 1.0:
+				return self._detected( FusionDetector.PRESSURE )
+			if self._fused():
+				return self._detected( FusionDetector.FUSED )
+		return None
+
+	@property
+	def ultrasonic_evidence( self ):
+		# The last ping's median over its threshold
+		return self._ultrasonic_evidence
+
+	def add_echo( self, change, median, sensor = 0 ):
+		"""
+		----------------------------------------------------------------------
+		Evaluates a ping of the ultrasonic sensor
+		----------------------------------------------------------------------
+		Preconditions:
+		  change - the change in echo time since the last ping, in s
+		  median - the median of the recent changes, in s
+		  sensor - the ultrasonic sensor pinged (default: 0)
+		Postconditions:
+		 returns:
+		  the detection (ULTRASONIC or FUSED), or None
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._ultrasonic_evidence = median / self.ultrasonic_thresholds[sensor]
+
+			slot = self._pings % len( self._echoes )
+			self._activity[slot] = self._pressure_evidence
+			self._echoes[slot]   = change
+			self._pings += 1
+
+			result = None
+			if self._ultrasonic_evidence >= 1.0:
+				result = self._detected( FusionDetector.ULTRASONIC )
+			elif self._fused():
+				result = self._detected( FusionDetector.FUSED )
+
+			self._pressure_evidence = 0.0
+		return result
+
+	def cross_correlation( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the correlation of pressure activity and echo change over
+		the last 'window' pings, or 0 while there are too few or either is
+		constant
+		----------------------------------------------------------------------
+		"""
+		count = min( self._pings, len( self._echoes ) )
+		if count < 3:
+			return 0.0
+		activity = self._activity[:count]
+		echoes   = self._echoes[:count]
+		if activity.std() == 0.0 or echoes.std() == 0.0:
+			return 0.0
+		return float( numpy.corrcoef( activity, echoes )[0, 1] )
+
+	def _fused( self ):
+		if min( self._pressure_evidence, self._ultrasonic_evidence ) < self.corroborate:
+			return False
+		return self.cross_correlation() >= self.correlation
+
+	def _detected( self, reason ):
+		self.detections[reason] += 1
+		return reason
@@ -1,45 +1,114 @@
-import copy
-import RPi.GPIO as GPIO
+import threading
+from devices.hal import GPIO, clock
 
 
 class generic_input:
-	
-	def __init__(self, pins):
-		def value_callback( channel ):
-			if GPIO.input(channel):
-				if self._on_rising:
-					self._on_rising()
-			else:
-				if self._on_falling:
-					self._on_falling()
+	"""
+	--------------------------------------------------------------------------
+	Parallel Input Bus
+	--------------------------------------------------------------------------
+	Description:
+	  Reads a group of input pins as one integer word. pins[0] is the most
+	  significant bit, so pins reading 1 and 0 give the word 0b10.
+
+	  Every edge on any pin restarts a short settle window on the clock's
+	  timer; the word is read once no pin has changed for 'settle' seconds,
+	  and delivered to the on_change function only if it differs from the
+	  last word. Bits that change a little apart therefore arrive as a
+	  single transition, and glitches that return to the previous word are
+	  dropped. The GPIO callback itself never waits, so the edges of other
+	  devices sharing the callback thread are not delayed.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_SETTLE = 0.002 # s
+
+	def __init__(self, pins, settle = DEFAULT_SETTLE):
+		"""
+		----------------------------------------------------------------------
+		Constructs a bus reader
+		----------------------------------------------------------------------
+		Preconditions:
+		  pins   - the input pins, most significant bit first
+		  settle - the time the pins must be stable, in seconds
+		----------------------------------------------------------------------
+		"""
+		def edge_callback( channel ):
+			with self._lock:
+				self.edges      += 1
+				self._generation += 1
+				generation       = self._generation
+			clock.call_later( self._settle_time, self._settle, generation )
 			return
 
-		self._on_rising  = None
-		self._on_falling = None
+		self._on_change   = None
+		self._settle_time = settle
+		self._lock        = threading.Lock()
+		self._generation  = 0
 		GPIO.setmode( GPIO.BCM )
 		GPIO.setup( pins, GPIO.IN )
-		self._pins = copy.deepcopy(pins)
+		self._pins = list( pins )
+		self._word = self.read()
+
+		# Statistics
+		self.edges   = 0
+		self.changes = 0
+		self.ignored = 0 # edges that settled on the word already delivered
+
 		for pin in self._pins:
 			GPIO.add_event_detect( pin, GPIO.BOTH )
-			GPIO.add_event_callback( pin, value_callback )
+			GPIO.add_event_callback( pin, edge_callback )
 		return
 
 	def __del__(self):
 		GPIO.cleanup( self._pins )
 		return
-	
-	def get(self):
-		result = ""
+
+	def read(self):
+		"""
+		----------------------------------------------------------------------
+		Reads the pins now, without waiting for them to settle
+		----------------------------------------------------------------------
+		"""
+		word = 0
 		for pin in self._pins:
-			result += str( GPIO.input( pin ))
-		return result
+			word = (word << 1) | (1 if GPIO.input( pin ) else 0)
+		return word
 
-	def set_on_rising(self, function):
-		self._on_rising = function
-		return
-	
-	def set_on_falling(self, function):
-		self._on_falling = function
+	def get(self):
+		"""
+		----------------------------------------------------------------------
+		Returns the last settled word
+		----------------------------------------------------------------------
+		"""
+		return self._word
+
+	def set_on_change(self, function):
+		"""
+		----------------------------------------------------------------------
+		Sets the function called as function( word, previous ) on every
+		settled change of the word. It runs on the clock's timer thread,
+		once the word has been stable for the settle time, not on the GPIO
+		callback thread
+		----------------------------------------------------------------------
+		"""
+		self._on_change = function
 		return
-	
 
+	def _settle(self, generation):
+		with self._lock:
+			# A later edge restarted the settle window
+			if generation != self._generation:
+				return
+
+			word     = self.read()
+			previous = self._word
+			if word == previous:
+				self.ignored += 1
+				return
+			self._word    = word
+			self.changes += 1
+
+		if self._on_change:
+			self._on_change( word, previous )
+		return
@@ -0,0 +1,174 @@
+import heapq
+import collections
+
+class RunningMedian:
+	"""
+	--------------------------------------------------------------------------
+	Running Median Filter
+	--------------------------------------------------------------------------
+	Description:
+	  The median of the last 'size' samples, updated incrementally in
+	  O(log n) per sample. The lower half of the window is kept in a max-heap
+	  and the upper half in a min-heap; evicted samples are deleted lazily
+	  when they reach the top of their heap.
+
+	  Samples are keyed by (value, sequence) so that equal values still have
+	  a strict order, which lets an eviction find the heap it belongs to.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, size ):
+		"""
+		----------------------------------------------------------------------
+		Constructs an empty filter
+		----------------------------------------------------------------------
+		Preconditions:
+		  size - the number of samples in the window (at least 1)
+		----------------------------------------------------------------------
+		"""
+		if size < 1:
+			raise ValueError( "window size must be at least 1" )
+		self._size = size
+		self.clear()
+		return
+
+	@property
+	def size( self ):
+		return self._size
+
+	def __len__( self ):
+		return len( self._window )
+
+	def clear( self ):
+		"""
+		----------------------------------------------------------------------
+		Removes every sample from the window
+		----------------------------------------------------------------------
+		"""
+		self._window    = collections.deque()
+		self._low       = [] # max-heap of (-value, -sequence)
+		self._high      = [] # min-heap of (value, sequence)
+		self._low_size  = 0
+		self._high_size = 0
+		self._deleted   = set()
+		self._sequence  = 0
+		return
+
+	def resize( self, size ):
+		"""
+		----------------------------------------------------------------------
+		Changes the window size, evicting the oldest samples if it shrinks
+		----------------------------------------------------------------------
+		Preconditions:
+		  size - the new number of samples in the window (at least 1)
+		----------------------------------------------------------------------
+		"""
+		if size < 1:
+			raise ValueError( "window size must be at least 1" )
+		self._size = size
+		while len( self._window ) > self._size:
+			self._evict( self._window.popleft() )
+		self._rebalance()
+		return
+
+	def push( self, value ):
+		"""
+		----------------------------------------------------------------------
+		Adds a sample, evicting the oldest one if the window is full
+		----------------------------------------------------------------------
+		Preconditions:
+		  value - the sample to add
+		Postconditions:
+		 returns:
+		  the median of the window, including the new sample
+		----------------------------------------------------------------------
+		"""
+		key = ( value, self._sequence )
+		self._sequence += 1
+		self._window.append( key )
+
+		if self._low_size == 0 or key <= self._low_top():
+			heapq.heappush( self._low, ( -key[0], -key[1] ) )
+			self._low_size += 1
+		else:
+			heapq.heappush( self._high, key )
+			self._high_size += 1
+
+		if len( self._window ) > self._size:
+			self._evict( self._window.popleft() )
+
+		self._rebalance()
+
+		# Lazily deleted entries pile up deep in the heaps; rebuild when they
+		# outnumber the live ones
+		if len( self._low ) + len( self._high ) > 4 * self._size + 16:
+			self._rebuild()
+
+		return self.median()
+
+	def median( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the median of the window, averaging the two middle samples
+		when the window holds an even number of them
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  the median, or None if the window is empty
+		----------------------------------------------------------------------
+		"""
+		if self._low_size == 0:
+			return None
+		if self._low_size > self._high_size:
+			return -self._low[0][0]
+		return (-self._low[0][0] + self._high[0][0]) / 2.0
+
+	def _low_top( self ):
+		return ( -self._low[0][0], -self._low[0][1] )
+
+	def _evict( self, key ):
+		self._deleted.add( key[1] )
+		if self._low_size and key <= self._low_top():
+			self._low_size -= 1
+		else:
+			self._high_size -= 1
+		self._prune()
+		return
+
+	def _prune( self ):
+		deleted = self._deleted
+		low     = self._low
+		high    = self._high
+		while low and -low[0][1] in deleted:
+			deleted.discard( -heapq.heappop( low )[1] )
+		while high and high[0][1] in deleted:
+			deleted.discard( heapq.heappop( high )[1] )
+		return
+
+	def _rebalance( self ):
+		# Keep the lower half equal to, or one larger than, the upper half
+		while self._low_size > self._high_size + 1:
+			value, sequence = heapq.heappop( self._low )
+			heapq.heappush( self._high, ( -value, -sequence ) )
+			self._low_size  -= 1
+			self._high_size += 1
+			self._prune()
+		while self._low_size < self._high_size:
+			value, sequence = heapq.heappop( self._high )
+			heapq.heappush( self._low, ( -value, -sequence ) )
+			self._low_size  += 1
+			self._high_size -= 1
+			self._prune()
+		return
+
+	def _rebuild( self ):
+		ordered = sorted( self._window )
+		half    = (len( ordered ) + 1) // 2
+		self._low  = [ ( -value, -sequence ) for value, sequence in ordered[:half] ]
+		self._high = ordered[half:]
+		heapq.heapify( self._low )
+		heapq.heapify( self._high )
+		self._low_size  = half
+		self._high_size = len( ordered ) - half
+		self._deleted   = set()
+		return
@@ -0,0 +1,83 @@
+class RunningStats:
+	"""
+	--------------------------------------------------------------------------
+	Running Mean and Variance
+	--------------------------------------------------------------------------
+	Description:
+	  The mean and variance of a stream of samples, updated in O(1) per
+	  sample with Welford's method. Once 'memory' samples have been seen,
+	  each new one is weighted 1/memory instead of 1/count, which turns the
+	  statistics into exponentially weighted ones that follow slow drift
+	  and forget old conditions, with a time constant of 'memory' samples.
+	  With no memory they cover every sample.
+
+	  The variance is the population variance, so a single sample has a
+	  variance of 0.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, memory = None ):
+		"""
+		----------------------------------------------------------------------
+		Constructs empty statistics
+		----------------------------------------------------------------------
+		Preconditions:
+		  memory - the samples after which old ones start to be forgotten
+		           (default: never)
+		----------------------------------------------------------------------
+		"""
+		if memory is not None and memory < 1:
+			raise ValueError( "memory must be at least 1" )
+		self.memory = memory
+		self.clear()
+		return
+
+	def clear( self ):
+		self.count    = 0
+		self.mean     = 0.0
+		self.variance = 0.0
+		return
+
+	@property
+	def std( self ):
+		return self.variance ** 0.5
+
+	def add( self, value ):
+		"""
+		----------------------------------------------------------------------
+		Adds a sample
+		----------------------------------------------------------------------
+		"""
+		self.count += 1
+		weight = 1.0 / (self.count if self.memory is None else min( self.count, self.memory ))
+		delta  = value - self.mean
+		self.mean     += weight * delta
+		self.variance  = (1.0 - weight) * (self.variance + weight * delta * delta)
+		return
+
+	def bound( self, sigmas ):
+		"""
+		----------------------------------------------------------------------
+		Returns the mean plus 'sigmas' standard deviations
+		----------------------------------------------------------------------
+		"""
+		return self.mean + sigmas * self.std
+
+	def state( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the statistics as a dictionary, to be saved and restore()d
+		----------------------------------------------------------------------
+		"""
+		return { "count" : self.count, "mean" : self.mean, "variance" : self.variance }
+
+	def restore( self, state ):
+		"""
+		----------------------------------------------------------------------
+		Replaces the statistics with ones from state()
+		----------------------------------------------------------------------
+		"""
+		self.count    = int( state["count"] )
+		self.mean     = float( state["mean"] )
+		self.variance = float( state["variance"] )
+		return
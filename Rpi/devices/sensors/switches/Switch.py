@@ -1,38 +1,166 @@
-import RPi.GPIO as GPIO
+import threading
+import collections
+from devices.hal import GPIO, clock
+
+# A settled change of a switch. 'time_ns' is the interrupt time of the first
+# edge of the burst, 'settled_ns' when the level was accepted, and 'edges'
+# the edges the burst took.
+SwitchEvent = collections.namedtuple( "SwitchEvent", [ "pin", "rising", "time_ns", "settled_ns", "edges" ] )
 
 class Switch:
+	"""
+	--------------------------------------------------------------------------
+	Debounced Switch
+	--------------------------------------------------------------------------
+	Description:
+	  Delivers the settled changes of an input pin. Each edge is timestamped
+	  in its interrupt callback, and the pin must then be quiet for
+	  'debounce' seconds before its level is read and accepted. A change is
+	  delivered as a SwitchEvent stamped with the first edge of the burst,
+	  so the press time is exact however long the contacts bounce. The
+	  direction comes from the settled level against the last one
+	  delivered, not from reading the pin in the callback, by which time it
+	  may have bounced back. A burst that settles on the level already
+	  delivered is a glitch, and is only counted.
+
+	  An edge costs a timestamp and a counter, and only one settle timer is
+	  pending however fast the edges come, so a noisy radio receiver cannot
+	  flood the callback or timer threads. 'bouncetime' (ms) also has
+	  RPi.GPIO drop edges that closely follow the last one before they
+	  reach Python.
+	--------------------------------------------------------------------------
+	"""
 
-	def __init__(self, pin):
+	DEFAULT_DEBOUNCE = 0.02 # s
+
+	def __init__(self, pin, debounce = DEFAULT_DEBOUNCE, bouncetime = None):
+		"""
+		----------------------------------------------------------------------
+		Constructs a switch
+		----------------------------------------------------------------------
+		Preconditions:
+		  pin        - the input pin
+		  debounce   - the seconds the pin must be quiet to accept a level
+		  bouncetime - the RPi.GPIO bouncetime in ms (default: none)
+		----------------------------------------------------------------------
+		"""
 
 		def value_callback( channel ):
-			if GPIO.input(channel):
-				if self._on_rising:
-					self._on_rising()
-			else:
-				if self._on_falling:
-					self._on_falling()
+			now = clock.perf_counter_ns()
+			with self._lock:
+				self.edges      += 1
+				self._last_edge  = now
+				self._burst_edges += 1
+				settling = self._burst is None
+				if settling:
+					self._burst = now
+			if self._on_edge:
+				self._on_edge( now )
+			if settling:
+				clock.call_later( self._debounce, self._settle )
 			return
 
 		self._on_rising  = None
 		self._on_falling = None
+		self._on_edge    = None
 		self._pin = pin
+		self._lock = threading.Lock()
+		self._burst       = None # the first edge of the burst being settled
+		self._burst_edges = 0
+		self._last_edge   = 0
+		self.set_debounce( debounce )
 		GPIO.setmode(GPIO.BCM)
 		GPIO.setup( self._pin, GPIO.IN )
+		self._level     = GPIO.input( self._pin )
+		self.last_event = None
+
+		# Statistics
+		self.edges    = 0
+		self.changes  = 0
+		self.glitches = 0 # bursts that settled back on the delivered level
 
 		# Call function on change, passing value
-		GPIO.add_event_detect( self._pin, GPIO.BOTH )
+		if bouncetime:
+			GPIO.add_event_detect( self._pin, GPIO.BOTH, bouncetime = bouncetime )
+		else:
+			GPIO.add_event_detect( self._pin, GPIO.BOTH )
 		GPIO.add_event_callback( self._pin, value_callback )
 		return
 
 	def set_on_rising(self, function):
+		"""
+		----------------------------------------------------------------------
+		Sets the function called as function( event ) when the switch
+		settles high, on the clock's timer thread
+		----------------------------------------------------------------------
+		"""
 		self._on_rising = function
 		return
-	
+
 	def set_on_falling(self, function):
+		"""
+		----------------------------------------------------------------------
+		Sets the function called as function( event ) when the switch
+		settles low, on the clock's timer thread
+		----------------------------------------------------------------------
+		"""
 		self._on_falling = function
 		return
-	
+
+	def set_on_edge(self, function):
+		"""
+		----------------------------------------------------------------------
+		Sets the function called as function( time_ns ) on every raw edge,
+		before debouncing, on the GPIO callback thread; for recording, so
+		keep it short
+		----------------------------------------------------------------------
+		"""
+		self._on_edge = function
+		return
+
+	def set_debounce(self, debounce):
+		"""
+		----------------------------------------------------------------------
+		Changes the time the pin must be quiet; applies from the next burst
+		----------------------------------------------------------------------
+		"""
+		self._debounce    = debounce
+		self._debounce_ns = int( debounce * 1000000000 )
+		return
+
+	def get(self):
+		"""
+		----------------------------------------------------------------------
+		Returns the last settled level
+		----------------------------------------------------------------------
+		"""
+		return self._level
+
+	def _settle(self):
+		with self._lock:
+			now  = clock.perf_counter_ns()
+			wait = self._last_edge + self._debounce_ns - now
+			if wait > 0:
+				# Edges came after this timer was set; wait out the rest
+				clock.call_later( wait / 1000000000.0, self._settle )
+				return
+
+			level = GPIO.input( self._pin )
+			event = SwitchEvent( self._pin, bool( level ), self._burst, now, self._burst_edges )
+			self._burst       = None
+			self._burst_edges = 0
+			if level == self._level:
+				self.glitches += 1
+				return
+			self._level     = level
+			self.changes   += 1
+			self.last_event = event
+
+		function = self._on_rising if level else self._on_falling
+		if function:
+			function( event )
+		return
 
 	def __del__( self ):
 		GPIO.cleanup( self._pin )
-		return	
+		return
@@ -1,5 +1,7 @@
-import RPi.GPIO as GPIO
-import time
+from devices.hal import GPIO, clock
+from devices.sensors.ultrasonic.filter import HALF_SPEED_OF_SOUND_MPS
+import queue
+import collections
 
 """
 ------------------------------------------------------------------------------
@@ -7,78 +9,113 @@ Useful constants
 ------------------------------------------------------------------------------
 """
 
-MICROSEC_TO_HZ           = 1000000.0              # 1/s
 MICROSEC_TO_SEC          = 1.0/1000000.0          # s
-SPEED_OF_SOUND_MPS       = 340.29                 # m/s
-HALF_SPEED_OF_SOUND_MPS  = SPEED_OF_SOUND_MPS/2  # cm/s
+NANOSEC_TO_SEC           = 1.0/1000000000.0       # s
+SEC_TO_NANOSEC           = 1000000000             # ns
+
+# Range statuses
+RANGE_OK      = "ok"
+RANGE_OUT     = "out of range" # an echo too short or too long to be an object
+RANGE_DROPOUT = "dropout"      # no echo at all
+
+# One reading of the stream. 'time_ns' is the falling echo edge, or when a
+# dropout was noticed; 'width_ns' and 'distance' (m) are None for a dropout.
+RangeSample = collections.namedtuple( "RangeSample", [ "time_ns", "width_ns", "distance", "status" ] )
 
 class DUR5200:
 	"""
 	--------------------------------------------------------------------------
-	HC-SR04 Ultrasonic Sensor
+	Free-Running HC-SR04 Ultrasonic Sensor
 	--------------------------------------------------------------------------
 	Description:
-	  The HC-SR04 is an ultrasonic sensor for up to 400cm. 
-	  It triggers from a rising edge pulse of at least 20 microseconds, and 
-	  the delay to the echoed falling edge is proportional to the distance of 
-	  the closest object.
+	  The HC-SR04 is an ultrasonic sensor for up to 400cm. It triggers from
+	  a high pulse of at least 10 microseconds, and the width of the echo
+	  pulse that follows is proportional to the distance of the closest
+	  object.
+
+	  This driver ranges continuously without the CPU: the trigger pin is
+	  driven by PWM at 'rate' pings per second, and both edges of the echo
+	  are timestamped from GPIO interrupts with time.perf_counter_ns(). Each
+	  echo becomes a RangeSample in a bounded queue, marked out of range if
+	  its distance is outside the sensor's range (an echo held for ~38ms
+	  means nothing was seen). A watchdog adds a dropout sample whenever
+	  DROPOUT_PERIODS periods pass without an echo, so a disconnected
+	  sensor is noticed.
 	--------------------------------------------------------------------------
 	"""
 
 	# Class constants
-	MIN_TRIGGER_TIME = 20.0 # uS
+	TRIGGER_TIME    = 20.0  # uS
+	DEFAULT_RATE    = 15.0  # Hz; the datasheet asks for 60ms between pings
+	MIN_DISTANCE    = 0.02  # m
+	MAX_DISTANCE    = 4.0   # m
+	DROPOUT_PERIODS = 2     # periods without an echo that make a dropout
+	QUEUE_SIZE      = 16    # samples
 
-	def __init__( self, trigger, echo, callback ):
+	def __init__( self, trigger, echo, callback = None, rate = DEFAULT_RATE,
+	              min_distance = MIN_DISTANCE, max_distance = MAX_DISTANCE, queue_size = QUEUE_SIZE ):
 		"""
 		----------------------------------------------------------------------
-		Initializes the ultrasonic sensor when provided the pins for the 
-		trigger and echo, along with the function to call when a result is
-		retrieved
+		Initializes the ultrasonic sensor when provided the pins for the
+		trigger and echo; ranging starts with enable()
 		----------------------------------------------------------------------
 		Preconditions:
-		  trigger  - the pin to trigger the ultrasonic sensor
-		  echo     - the pin to receive data from the ultrasonic sensor
-		  callback - The function to call once echo has returned. 
-		             (the callback is a function with param for distance in m)
+		  trigger      - the pin to trigger the ultrasonic sensor
+		  echo         - the pin to receive data from the ultrasonic sensor
+		  callback     - the function to call with each RangeSample, on the
+		                 GPIO callback or clock timer thread (default: None)
+		  rate         - the pings per second (default: 15)
+		  min_distance - the shortest distance in range, in m (default: 0.02)
+		  max_distance - the longest distance in range, in m (default: 4.0)
+		  queue_size   - the number of unread samples to keep (default: 16)
 		----------------------------------------------------------------------
 		"""
-		def trigger_rising_callback( channel ):
-			"""
-			------------------------------------------------------------------
-			Internal function for threaded callback. This is called on the
-			rising edge of trigger, simply to record the start time it was sent
-			------------------------------------------------------------------
-			"""
-			self._start = time.time()
-			return
-			
-		def echo_rising_callback( channel ):
+		def echo_callback( channel ):
 			"""
 			------------------------------------------------------------------
-			Internal function for threaded callback. This is called on the
-			rising edge of echo to calculate the time delta and the 
-			approximate distance, passing it to the callback function
+			Internal function for threaded callback. This is called on both
+			edges of echo; the rising edge records the start time, and the
+			falling edge measures the pulse
 			------------------------------------------------------------------
 			"""
-			self._stop = time.time()
-			distance = abs(self._stop - self._start) * HALF_SPEED_OF_SOUND_MPS
-			callback( distance )
+			now = clock.perf_counter_ns()
+			if GPIO.input( channel ):
+				self._start = now
+			elif self._start:
+				width       = now - self._start
+				self._start = 0
+				self._echo  = now
+				self._range( now, width )
 			return
-			
-			
-		default_frequency = HCSR04.MIN_TRIGGER_TIME * MICROSEC_TO_HZ
-		
+
 		self._trigger_pin = trigger
 		self._echo_pin    = echo
-		self._pwm         = GPIO.PWM( self._trigger_pin, default_frequency )
+		self._callback    = callback
+		self._samples     = queue.Queue( queue_size )
+		self._min_width   = int( min_distance / HALF_SPEED_OF_SOUND_MPS * SEC_TO_NANOSEC )
+		self._max_width   = int( max_distance / HALF_SPEED_OF_SOUND_MPS * SEC_TO_NANOSEC )
+		self._start       = 0
+		self._echo        = 0 # the last falling echo edge
+		self._running     = 0 # the run the watchdog belongs to; 0 when stopped
+		self._runs        = 0
+		self.rate         = rate
+
+		# Statistics
+		self.echoes       = 0
+		self.out_of_range = 0
+		self.dropouts     = 0
+		self.dropped      = 0
 
 		GPIO.setmode( GPIO.BCM )
-		
+
 		GPIO.setup( self._trigger_pin, GPIO.OUT )
-		GPIO.setup( self._echo_pin, GPIO.IN )
-		
-		GPIO.add_event_detect( self._trigger_pin, GPIO.RISING_EDGE, callback = trigger_rising_callback )
-		GPIO.add_event_detect( self._echo_pin,    GPIO.RISING_EDGE, callback = echo_rising_callback    )
+		GPIO.setup( self._echo_pin,    GPIO.IN )
+
+		self._pwm = GPIO.PWM( self._trigger_pin, rate )
+
+		# Time both edges of the echo to measure its width
+		GPIO.add_event_detect( self._echo_pin, GPIO.BOTH, callback = echo_callback )
+		return
 
 	def __del__( self ):
 		"""
@@ -86,69 +123,153 @@ class DUR5200:
 		Destructs this ultrasonic sensor, closing any open GPIO pins
 		----------------------------------------------------------------------
 		"""
+		self.disable()
 		GPIO.setmode( GPIO.BCM )
-		
+
 		if( GPIO.gpio_function( self._trigger_pin ) != GPIO.UNKNOWN ):
 			GPIO.cleanup( self._trigger_pin )
 		if( GPIO.gpio_function( self._echo_pin ) != GPIO.UNKNOWN ):
 			GPIO.cleanup( self._echo_pin )
-					
-	def enable( self, microseconds, duty_cycle = 50.0 ):
+		return
+
+	def enable( self, rate = None ):
 		"""
 		----------------------------------------------------------------------
-		Enables the ultrasonic sensor using pulse-width modulation.
+		Starts ranging; the PWM pulses are TRIGGER_TIME long at any rate
 		----------------------------------------------------------------------
 		Preconditions:
-		  microseconds - the microseconds of delay between pulses
-		  duty_cycle   - the duty cycle (in percent) of the waveform (default: 50.0)
+		  rate - the pings per second (default: the rate already set)
 		Postconditions:
-		  PWM is enabled
-		----------------------------------------------------------------------
-		"""
-		if duty_cycle < 0.0:
-			duty_cycle = 0.0
-		elif duty_cycle > 100.0:
-			duty_cycle = 100.0
-
-		if microseconds < HCSR04.MIN_TRIGGER_TIME:
-			microseconds = HCSR04.MIN_TRIGGER_TIME
-			
-		frequency = microseconds * MICROSEC_TO_HZ
-			
-		self._pwm.ChangeFrequency( frequency )
-		self._pwm.start( duty_cycle )
-		
+		  PWM is enabled, and samples are queued as the echoes return
+		----------------------------------------------------------------------
+		"""
+		if rate is not None:
+			self.rate = rate
+		if self._running:
+			self.set_rate( self.rate )
+			return
+
+		self._runs   += 1
+		self._running = self._runs
+		self._echo    = clock.perf_counter_ns()
+		self._pwm.ChangeFrequency( self.rate )
+		self._pwm.start( self._duty_cycle() )
+		clock.call_later( 1.0 / self.rate, self._watch, self._running )
 		return
-		
+
 	def disable( self ):
 		"""
 		----------------------------------------------------------------------
-		Disables the ultrasonic sensor's PWM, if enabled
+		Stops ranging, if enabled
 		----------------------------------------------------------------------
 		Postconditions:
 		  PWM is disabled
 		----------------------------------------------------------------------
 		"""
+		if not self._running:
+			return
+		self._running = 0
 		self._pwm.stop()
 		return
-			
-	def trigger( self, microseconds = 0 ):
+
+	def set_rate( self, rate ):
 		"""
 		----------------------------------------------------------------------
-		Triggers the ultrasonic sensor with the specified length of pulse
+		Changes the pings per second, keeping the trigger pulse width
+		----------------------------------------------------------------------
+		"""
+		self.rate = rate
+		if self._running:
+			self._pwm.ChangeFrequency( rate )
+			self._pwm.ChangeDutyCycle( self._duty_cycle() )
+		return
+
+	def read( self, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Waits for the next distance, sleeping (not spinning) until it arrives
+		----------------------------------------------------------------------
+		Preconditions:
+		  timeout - the longest time to wait, in seconds. None waits forever,
+		            and 0 returns immediately (default: None)
+		Postconditions:
+		 returns:
+		  the distance in m, or None if no sample arrived in time or it was
+		  out of range or a dropout
+		----------------------------------------------------------------------
+		"""
+		sample = self.read_sample( timeout )
+		if sample is None:
+			return None
+		return sample.distance if sample.status == RANGE_OK else None
+
+	def read_sample( self, timeout = None ):
+		"""
+		----------------------------------------------------------------------
+		Waits for the next RangeSample
 		----------------------------------------------------------------------
 		Preconditions:
-		  microseconds - the number of microseconds to send the pulse
+		  timeout - the longest time to wait, in seconds (default: None)
 		Postconditions:
-		  ultrasonic sensor is triggered; releases 8 40khz pulses
-		----------------------------------------------------------------------
-		"""
-		if microseconds < HCSR04.MIN_TRIGGER_TIME:
-			microseconds = HCSR04.MIN_TRIGGER_TIME
-			
-		seconds = microseconds * MICROSEC_TO_SEC
-		
-		GPIO.output( self._trigger_pin, GPIO.HIGH )
-		time.sleep( seconds )
-		GPIO.output( self._trigger_pin, GPIO.LOW )
-						
\ No newline at end of file
+		 returns:
+		  the sample, or None if none arrived in time
+		----------------------------------------------------------------------
+		"""
+		try:
+			if timeout == 0:
+				return self._samples.get_nowait()
+			return clock.get( self._samples, timeout )
+		except queue.Empty:
+			return None
+
+	def _duty_cycle( self ):
+		return min( 100.0, DUR5200.TRIGGER_TIME * MICROSEC_TO_SEC * self.rate * 100.0 )
+
+	def _range( self, time_ns, width ):
+		distance = width * NANOSEC_TO_SEC * HALF_SPEED_OF_SOUND_MPS
+		if self._min_width <= width <= self._max_width:
+			self.echoes += 1
+			self._deliver( RangeSample( time_ns, width, distance, RANGE_OK ) )
+		else:
+			self.out_of_range += 1
+			self._deliver( RangeSample( time_ns, width, distance, RANGE_OUT ) )
+		return
+
+	def _watch( self, run ):
+		"""
+		----------------------------------------------------------------------
+		Adds a dropout sample if no echo has fallen for DROPOUT_PERIODS
+		periods; runs every period while enabled
+		----------------------------------------------------------------------
+		"""
+		if run != self._running:
+			return
+		period = 1.0 / self.rate
+		now    = clock.perf_counter_ns()
+		if now - self._echo > DUR5200.DROPOUT_PERIODS * period * SEC_TO_NANOSEC:
+			self._echo     = now
+			self.dropouts += 1
+			self._deliver( RangeSample( now, None, None, RANGE_DROPOUT ) )
+		clock.call_later( period, self._watch, run )
+		return
+
+	def _deliver( self, sample ):
+		"""
+		----------------------------------------------------------------------
+		Queues a sample, dropping the oldest one if the consumer has fallen
+		behind
+		----------------------------------------------------------------------
+		"""
+		try:
+			self._samples.put_nowait( sample )
+		except queue.Full:
+			try:
+				self._samples.get_nowait()
+			except queue.Empty:
+				pass
+			self.dropped += 1
+			self._samples.put_nowait( sample )
+
+		if self._callback:
+			self._callback( sample )
+		return
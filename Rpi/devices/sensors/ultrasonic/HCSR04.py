@@ -1,5 +1,5 @@
-import RPi.GPIO as GPIO
-import time
+from devices.hal import GPIO, clock
+import queue
 
 """
 ------------------------------------------------------------------------------
@@ -9,6 +9,8 @@ Useful constants
 
 MICROSEC_TO_HZ           = 1000000.0              # 1/s
 MICROSEC_TO_SEC          = 1.0/1000000.0          # s
+NANOSEC_TO_SEC           = 1.0/1000000000.0       # s
+SEC_TO_NANOSEC           = 1000000000             # ns
 
 class HCSR04:
 	"""
@@ -16,65 +18,86 @@ class HCSR04:
 	HC-SR04 Ultrasonic Sensor
 	--------------------------------------------------------------------------
 	Description:
-	  The HC-SR04 is an ultrasonic sensor for up to 400cm. 
-	  It triggers from a rising edge pulse of at least 20 microseconds, and 
-	  the delay to the echoed falling edge is proportional to the distance of 
+	  The HC-SR04 is an ultrasonic sensor for up to 400cm.
+	  It triggers from a rising edge pulse of at least 20 microseconds, and
+	  the delay to the echoed falling edge is proportional to the distance of
 	  the closest object.
+
+	  Echo edges are timed from GPIO interrupts with time.perf_counter_ns(),
+	  so a ping never busy-waits on the echo pin. Completed echo times are
+	  delivered through a bounded queue; a ping whose echo does not return
+	  within the timeout is dropped and counted.
 	--------------------------------------------------------------------------
 	"""
 
 	# Class constants
-	MIN_TRIGGER_TIME = 20.0 # uS
+	MIN_TRIGGER_TIME = 20.0  # uS
+	DEFAULT_TIMEOUT  = 0.06  # s (longest echo is ~38ms when nothing is seen)
+	QUEUE_SIZE       = 16    # samples
 
-	def __init__( self, trigger, echo, callback ):
+	def __init__( self, trigger, echo, callback = None, queue_size = QUEUE_SIZE ):
 		"""
 		----------------------------------------------------------------------
-		Initializes the ultrasonic sensor when provided the pins for the 
+		Initializes the ultrasonic sensor when provided the pins for the
 		trigger and echo, along with the function to call when a result is
 		retrieved
 		----------------------------------------------------------------------
 		Preconditions:
-		  trigger  - the pin to trigger the ultrasonic sensor
-		  echo     - the pin to receive data from the ultrasonic sensor
-		  callback - The function to call once echo has returned. (function with param for distance)
+		  trigger    - the pin to trigger the ultrasonic sensor
+		  echo       - the pin to receive data from the ultrasonic sensor
+		  callback   - The function to call once echo has returned. (function
+		               with param for echo time in seconds) (default: None)
+		  queue_size - the number of unread samples to keep (default: 16)
 		----------------------------------------------------------------------
 		"""
 		def echo_callback( channel ):
 			"""
 			------------------------------------------------------------------
-			Internal function for threaded callback. This is called on the
-			rising edge of echo, simply to record the start time it was sent
+			Internal function for threaded callback. This is called on both
+			edges of echo; the rising edge records the start time, and the
+			falling edge completes the sample
 			------------------------------------------------------------------
 			"""
-			if GPIO.input(channel) and not self._triggered:
-				self._start = time.time()
-				self._triggered = True
-				print("start")
-			elif self._triggered:
-				self._stop = time.time()
-				self._triggered = False
-				print("stop")
-				callback( self._stop - self._start )
+			now = clock.perf_counter_ns()
+			if GPIO.input(channel):
+				if self._pending:
+					self._start   = now
+					self._pending = False
+			elif self._start:
+				width       = now - self._start
+				self._start = 0
+				if width > self._timeout_ns:
+					self.timeouts += 1
+					return
+				self._deliver( now, width )
 			return
-						
+
 		default_frequency = HCSR04.MIN_TRIGGER_TIME * MICROSEC_TO_HZ
 		self._trigger_pin = trigger
 		self._echo_pin    = echo
-		self._stop        = 0
+		self._callback    = callback
+		self._samples     = queue.Queue( queue_size )
+		self._timeout_ns  = int( HCSR04.DEFAULT_TIMEOUT * SEC_TO_NANOSEC )
+		self._ping_time   = 0
 		self._start       = 0
-		self._triggered   = False
+		self._pending     = False
+
+		# Statistics
+		self.pings    = 0
+		self.timeouts = 0
+		self.dropped  = 0
 
 		GPIO.setmode( GPIO.BCM )
-		
+
 		GPIO.setup( self._trigger_pin, GPIO.OUT )
 		GPIO.setup( self._echo_pin,    GPIO.IN )
 
-		self._pwm = GPIO.PWM( self._trigger_pin, default_frequency )		
-		
+		self._pwm = GPIO.PWM( self._trigger_pin, default_frequency )
+
 		# Time the start and end of the echo to calculate distance
 		GPIO.add_event_detect( self._echo_pin, GPIO.BOTH )
 		GPIO.add_event_callback( self._echo_pin, echo_callback  )
-		
+
 	def __del__(self):
 		"""
 		----------------------------------------------------------------------
@@ -83,12 +106,11 @@ class HCSR04:
 		"""
 		GPIO.setmode( GPIO.BCM )
 		self._pwm.stop()
-		print("testing")
-		
+
 		GPIO.cleanup( self._echo_pin )
 		GPIO.cleanup( self._trigger_pin )
 		return
-					
+
 	def enable( self, frequency, duty_cycle = 50.0 ):
 		"""
 		----------------------------------------------------------------------
@@ -106,12 +128,12 @@ class HCSR04:
 		elif duty_cycle > 100.0:
 			duty_cycle = 100.0
 
-						
+
 		self._pwm.ChangeFrequency( frequency )
 		self._pwm.start( duty_cycle )
-		
+
 		return
-		
+
 	def disable( self ):
 		"""
 		----------------------------------------------------------------------
@@ -122,9 +144,8 @@ class HCSR04:
 		----------------------------------------------------------------------
 		"""
 		self._pwm.stop()
-		print("Disabled")
 		return
-			
+
 	def trigger( self, microseconds = 0 ):
 		"""
 		----------------------------------------------------------------------
@@ -139,10 +160,113 @@ class HCSR04:
 		self._pwm.stop()
 		if microseconds < HCSR04.MIN_TRIGGER_TIME:
 			microseconds = HCSR04.MIN_TRIGGER_TIME
-			
+
 		seconds = microseconds * MICROSEC_TO_SEC
-		
+
 		GPIO.output( self._trigger_pin, GPIO.HIGH )
-		time.sleep( seconds )
+		clock.sleep( seconds )
 		GPIO.output( self._trigger_pin, GPIO.LOW )
-						
+
+	def set_timeout( self, seconds ):
+		"""
+		----------------------------------------------------------------------
+		Sets the longest time a ping may wait for its echo to complete
+		----------------------------------------------------------------------
+		Preconditions:
+		  seconds - the per-ping timeout, in seconds
+		----------------------------------------------------------------------
+		"""
+		self._timeout_ns = int( seconds * SEC_TO_NANOSEC )
+		return
+
+	def ping( self, microseconds = 0 ):
+		"""
+		----------------------------------------------------------------------
+		Starts a ranging cycle without waiting for the echo. If the previous
+		ping has outlived its timeout, it is abandoned and counted.
+		----------------------------------------------------------------------
+		Preconditions:
+		  microseconds - the number of microseconds to send the pulse
+		Postconditions:
+		  ultrasonic sensor is triggered; the echo time is queued once the
+		  echo completes
+		----------------------------------------------------------------------
+		"""
+		now = clock.perf_counter_ns()
+		if (self._pending or self._start) and (now - self._ping_time > self._timeout_ns):
+			self.timeouts += 1
+			self._start    = 0
+
+		self._ping_time = now
+		self._pending   = True
+		self.pings     += 1
+		self.trigger( microseconds )
+		return
+
+	def read( self, timeout = DEFAULT_TIMEOUT ):
+		"""
+		----------------------------------------------------------------------
+		Waits for the next echo time, sleeping (not spinning) until it arrives
+		----------------------------------------------------------------------
+		Preconditions:
+		  timeout - the longest time to wait, in seconds. None waits forever,
+		            and 0 returns immediately (default: DEFAULT_TIMEOUT)
+		Postconditions:
+		 returns:
+		  the echo time in seconds, or None if no echo arrived in time
+		----------------------------------------------------------------------
+		"""
+		sample = self.read_sample( timeout )
+		if sample is None:
+			return None
+		return sample[1] * NANOSEC_TO_SEC
+
+	def read_sample( self, timeout = DEFAULT_TIMEOUT ):
+		"""
+		----------------------------------------------------------------------
+		Waits for the next raw sample from the echo queue
+		----------------------------------------------------------------------
+		Preconditions:
+		  timeout - the longest time to wait, in seconds (default: DEFAULT_TIMEOUT)
+		Postconditions:
+		 returns:
+		  (timestamp_ns, echo_ns) of the falling echo edge, or None if no echo
+		  arrived in time
+		----------------------------------------------------------------------
+		"""
+		try:
+			if timeout == 0:
+				return self._samples.get_nowait()
+			return clock.get( self._samples, timeout )
+		except queue.Empty:
+			pass
+
+		# Abandon a ping whose echo never came back
+		if (self._pending or self._start) and timeout is not None and timeout > 0:
+			if clock.perf_counter_ns() - self._ping_time > self._timeout_ns:
+				self._pending  = False
+				self._start    = 0
+				self.timeouts += 1
+		return None
+
+	def _deliver( self, timestamp, width ):
+		"""
+		----------------------------------------------------------------------
+		Queues a completed sample, dropping the oldest one if the consumer
+		has fallen behind
+		----------------------------------------------------------------------
+		"""
+		sample = ( timestamp, width )
+		try:
+			self._samples.put_nowait( sample )
+		except queue.Full:
+			try:
+				self._samples.get_nowait()
+			except queue.Empty:
+				pass
+			self.dropped += 1
+			self._samples.put_nowait( sample )
+
+		if self._callback:
+			self._callback( width * NANOSEC_TO_SEC )
+		return
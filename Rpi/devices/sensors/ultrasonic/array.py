@@ -0,0 +1,206 @@
+import collections
+
+from devices.hal import clock
+from devices.sensors.ultrasonic.filter import EchoFilter
+
+"""
+------------------------------------------------------------------------------
+Useful constants
+------------------------------------------------------------------------------
+"""
+
+NANOSEC_TO_SEC = 1.0/1000000000.0 # s
+SEC_TO_NANOSEC = 1000000000       # ns
+
+# One echo of one sensor. 'change' is the echo time less the sensor's last
+# one, 'median' the median of its recent changes, and 'distance' the median
+# of its recent echo times, in m.
+UltrasonicReading = collections.namedtuple( "UltrasonicReading",
+	[ "sensor", "time_ns", "echo", "change", "median", "distance" ] )
+
+class UltrasonicArray:
+	"""
+	--------------------------------------------------------------------------
+	Ultrasonic Sensor Array
+	--------------------------------------------------------------------------
+	Description:
+	  Shares a room between several HC-SR04 sensors without crosstalk. The
+	  sensors are split into groups whose beams do not overlap; one step()
+	  fires one group, waits for its echoes, and leaves 'guard' seconds of
+	  quiet for the reverberation to die down before the next group may
+	  fire. The groups take turns, so by default (each sensor in a group of
+	  its own) the array is time-division multiplexed, and sensors that
+	  cannot hear each other can be grouped to ping in parallel.
+
+	  Every sensor keeps its own filtered stream: the median of its echo
+	  changes, for detection, and the median of its echo times, as a
+	  distance.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_GUARD   = 0.01 # s
+	DEFAULT_TIMEOUT = 0.06 # s
+	DEFAULT_WINDOW  = 4    # samples
+	TRIGGER_TIME    = 100  # uS
+
+	def __init__( self, sensors, groups = None, guard = DEFAULT_GUARD,
+	              timeout = DEFAULT_TIMEOUT, window = DEFAULT_WINDOW ):
+		"""
+		----------------------------------------------------------------------
+		Constructs an array of sensors that are already set up
+		----------------------------------------------------------------------
+		Preconditions:
+		  sensors - the HCSR04 sensors
+		  groups  - lists of sensor indices fired together, in turn; every
+		            sensor must be in exactly one (default: one group per
+		            sensor)
+		  guard   - the seconds of quiet between a group's echoes and the
+		            next group's pings (default: 0.01)
+		  timeout - the longest wait for an echo, in seconds (default: 0.06)
+		  window  - the samples in each sensor's medians (default: 4)
+		----------------------------------------------------------------------
+		"""
+		if groups is None:
+			groups = [ [ index ] for index in range( len( sensors ) ) ]
+		if sorted( index for group in groups for index in group ) != list( range( len( sensors ) ) ):
+			raise ValueError( "every sensor must be in exactly one group" )
+
+		self._sensors  = list( sensors )
+		self._groups   = [ list( group ) for group in groups ]
+		self._slot     = 0
+		self._ready_ns = 0
+		self._started  = None
+		self._filters  = [ EchoFilter( window ) for _ in self._sensors ]
+		self.set_guard( guard )
+		self.set_timeout( timeout )
+
+		# Statistics
+		self.cycles      = 0 # turns of every group
+		self.slots       = 0
+		self.echoes      = 0
+		self.stale       = 0 # echoes that came back after their slot
+		self.guard_waits = 0 # steps that had to wait out the guard
+		self.updates     = [ 0 ] * len( self._sensors )
+		return
+
+	def __len__( self ):
+		return len( self._sensors )
+
+	@property
+	def groups( self ):
+		return [ list( group ) for group in self._groups ]
+
+	def set_guard( self, seconds ):
+		"""
+		----------------------------------------------------------------------
+		Sets the quiet time between one group's echoes and the next pings
+		----------------------------------------------------------------------
+		"""
+		self._guard_ns = int( seconds * SEC_TO_NANOSEC )
+		return
+
+	def set_timeout( self, seconds ):
+		"""
+		----------------------------------------------------------------------
+		Sets the longest time a slot waits for its echoes
+		----------------------------------------------------------------------
+		"""
+		self._timeout = seconds
+		for sensor in self._sensors:
+			sensor.set_timeout( seconds )
+		return
+
+	def set_window( self, size ):
+		"""
+		----------------------------------------------------------------------
+		Resizes every sensor's medians; call from the thread calling step()
+		----------------------------------------------------------------------
+		"""
+		for echo_filter in self._filters:
+			echo_filter.resize( size )
+		return
+
+	def step( self ):
+		"""
+		----------------------------------------------------------------------
+		Fires the next group and waits for its echoes, after first sleeping
+		out what is left of the guard of the group before
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  an UltrasonicReading for each sensor of the group that answered
+		----------------------------------------------------------------------
+		"""
+		wait = self._ready_ns - clock.perf_counter_ns()
+		if wait > 0:
+			self.guard_waits += 1
+			clock.sleep( wait * NANOSEC_TO_SEC )
+		if self._started is None:
+			self._started = clock.perf_counter_ns()
+
+		group = self._groups[self._slot]
+		for index in group:
+			sensor = self._sensors[index]
+			while sensor.read_sample( 0 ) is not None:
+				self.stale += 1
+			sensor.ping( UltrasonicArray.TRIGGER_TIME )
+
+		# The echoes come back together, so the slot waits 'timeout' in all
+		deadline = clock.perf_counter_ns() + int( self._timeout * SEC_TO_NANOSEC )
+		readings = []
+		for index in group:
+			remaining = max( 0, deadline - clock.perf_counter_ns() ) * NANOSEC_TO_SEC
+			sample    = self._sensors[index].read_sample( remaining )
+			if sample is not None:
+				readings.append( self._reading( index, *sample ) )
+
+		self._ready_ns = clock.perf_counter_ns() + self._guard_ns
+		self.slots    += 1
+		self._slot     = (self._slot + 1) % len( self._groups )
+		if self._slot == 0:
+			self.cycles += 1
+		return readings
+
+	def distance( self, index ):
+		"""
+		----------------------------------------------------------------------
+		Returns the filtered distance to a sensor's nearest object in m, or
+		None before it has answered
+		----------------------------------------------------------------------
+		"""
+		return self._filters[index].distance()
+
+	def timeouts( self ):
+		return sum( sensor.timeouts for sensor in self._sensors )
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the throughput of the array as a dictionary: echoes per
+		second in all, and per sensor
+		----------------------------------------------------------------------
+		"""
+		elapsed = 0.0
+		if self._started is not None:
+			elapsed = (clock.perf_counter_ns() - self._started) * NANOSEC_TO_SEC
+		return {
+			"sensors"    : len( self._sensors ),
+			"groups"     : len( self._groups ),
+			"cycles"     : self.cycles,
+			"slots"      : self.slots,
+			"pings"      : sum( sensor.pings for sensor in self._sensors ),
+			"echoes"     : self.echoes,
+			"timeouts"   : self.timeouts(),
+			"stale"      : self.stale,
+			"elapsed"    : elapsed,
+			"throughput" : self.echoes / elapsed if elapsed else 0.0,
+			"rates"      : [ updates / elapsed if elapsed else 0.0 for updates in self.updates ],
+		}
+
+	def _reading( self, index, time_ns, width_ns ):
+		echo = width_ns * NANOSEC_TO_SEC
+		self.echoes         += 1
+		self.updates[index] += 1
+
+		change, median = self._filters[index].push( echo )
+		return UltrasonicReading( index, time_ns, echo, change, median, self.distance( index ) )
@@ -0,0 +1,50 @@
+from devices.sensors.running_median import RunningMedian
+
+# The one definition of the speed of sound; the other ultrasonic modules
+# and the simulator import it from here
+SPEED_OF_SOUND_MPS      = 343.0 # m/s
+HALF_SPEED_OF_SOUND_MPS = SPEED_OF_SOUND_MPS/2
+
+class EchoFilter:
+	"""
+	--------------------------------------------------------------------------
+	One sensor's filtered echo stream: the median of the changes in its
+	echo time, for detection, and the median of its echo times, for its
+	distance. Shared by UltrasonicArray and system/replay.py, so recordings
+	are filtered as they were live.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, window ):
+		self.last    = None # the last echo time, in s
+		self.changes = RunningMedian( window )
+		self.echoes  = RunningMedian( window )
+		return
+
+	def resize( self, size ):
+		for median in ( self.changes, self.echoes ):
+			if median.size != size:
+				median.resize( size )
+		return
+
+	def push( self, echo ):
+		"""
+		----------------------------------------------------------------------
+		Adds an echo time, in s
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  ( change, median ) - the change since the last echo, and the
+		  median of the recent changes
+		----------------------------------------------------------------------
+		"""
+		change    = abs( echo - self.last ) if self.last is not None else 0.0
+		self.last = echo
+		self.echoes.push( echo )
+		return change, self.changes.push( change )
+
+	def distance( self ):
+		# The median echo time as a distance, in m; None before any echo
+		if not len( self.echoes ):
+			return None
+		return self.echoes.median() * HALF_SPEED_OF_SOUND_MPS
@@ -0,0 +1,37 @@
+import ctypes
+
+"""
+------------------------------------------------------------------------------
+The spidev ioctl interface, for sending many transfers in one system call.
+Each transfer may release chip select after it (cs_change), so a device
+that latches on chip select sees every frame of the message separately.
+------------------------------------------------------------------------------
+"""
+
+# The ioctl size field is 14 bits wide
+MAX_TRANSFERS = ((1 << 14) - 1) // 32
+
+class spi_ioc_transfer( ctypes.Structure ):
+	"""
+	--------------------------------------------------------------------------
+	struct spi_ioc_transfer from linux/spi/spidev.h
+	--------------------------------------------------------------------------
+	"""
+	_fields_ = [
+		( "tx_buf",           ctypes.c_uint64 ),
+		( "rx_buf",           ctypes.c_uint64 ),
+		( "len",              ctypes.c_uint32 ),
+		( "speed_hz",         ctypes.c_uint32 ),
+		( "delay_usecs",      ctypes.c_uint16 ),
+		( "bits_per_word",    ctypes.c_uint8  ),
+		( "cs_change",        ctypes.c_uint8  ),
+		( "tx_nbits",         ctypes.c_uint8  ),
+		( "rx_nbits",         ctypes.c_uint8  ),
+		( "word_delay_usecs", ctypes.c_uint8  ),
+		( "pad",              ctypes.c_uint8  ),
+	]
+
+def spi_ioc_message( count ):
+	# _IOW( SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(count)] )
+	size = count * ctypes.sizeof( spi_ioc_transfer )
+	return (1 << 30) | (size << 16) | (ord('k') << 8)
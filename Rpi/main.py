@@ -1,357 +1,874 @@
-# Time
 import time
+STARTED = time.perf_counter_ns() # Taken before the imports, for the startup profile
 
-# Audio Handling
-import wave
-import ossaudiodev as oss
+import os
+import threading
 
 # Devices
 from devices.actuators.Toggle import Toggle
 from devices.sensors.switches.Switch import Switch
 from devices.adc.mcp3008 import MCP3008
-
-1from devices.sensors.generic_input import generic_input
+from devices.adc.capture import AdcCapture
+from devices.sensors.ultrasonic.HCSR04 import HCSR04
+from devices.sensors.ultrasonic.array import UltrasonicArray
+from devices.sensors.fusion import FusionDetector
+from devices.audio.engine import AudioEngine
+from devices.dac.cpa417 import CPA417
+from devices.dac.stream import DacStream
+from devices.dac import waveforms
+
+from devices.sensors.generic_input import generic_input
 from devices.actuators.generic_output import generic_output
 
-import devices.pi as pi
-import pygame
+from system.scheduler import Scheduler
+from system.startup import StartupProfile
+from system.config import load_config, config_changes, ConfigWatcher
+from system.telemetry import Telemetry
+from system.recorder import Recorder
+from system.pubsub import PubSubServer
+from system.sensing import SensingProcess, LAYOUT_SPLIT
+from system.adaptive import AdaptiveRates
+from system.calibration import Calibration
+from system.alarm import AlarmStateMachine, EVENT_ARM, EVENT_DISARM, EVENT_DETECTION, EVENT_MODE
+import system.alarm as alarm_states
 
 # GPIO
-import RPi.GPIO as GPIO
+from devices.hal import GPIO, clock, audio
 
-# System
-from subprocess import call
+#---------------------------------------------------------------------
+# State Constants
+#---------------------------------------------------------------------
 
-# Set sound to come out of speaker
-call( ["amixer", "cset", "numid=3", "1"] )
+# The states double as the DE board mode words (PIN_IN_MODE_1 is the high
+# bit), except arming, which shows as standby; see system/alarm.py
+STATE_STANDBY   = alarm_states.STANDBY
+STATE_ARMING    = alarm_states.ARMING
+STATE_ENABLED   = alarm_states.ENABLED
+STATE_TRIGGERED = alarm_states.TRIGGERED
 
 #---------------------------------------------------------------------
-# Pin Constants (In Broadcom)
+# Settings
 #---------------------------------------------------------------------
 
-PIN_LED_RED     = 13
-PIN_LED_GREEN   = 26
-PIN_LED_YELLOW  = 19
-PIN_BEEPER      = 12
-PIN_HCSR04_TRIG = 21
-PIN_HCSR04_ECHO = 25
+# Every setting comes from the configuration file; see system/config.py
+CONFIG_PATH = os.environ.get( "SECURITY_SYSTEM_CONFIG", "config.json" )
 
-PIN_RADIO_SWITCH_A = 20
-PIN_RADIO_SWITCH_B = 16
+def apply_settings( config ):
+	"""
+	---------------------------------------
+	Sets the settings that may change while
+	running: thresholds, windows, periods
+	and beeper patterns
+	---------------------------------------
+	"""
+	global ADC_SAMPLE_RATE
+	global PRESSURE_THRESHOLD, PRESSURE_PERIOD, PRESSURE_DEADLINE
+	global ULTRASONIC_THRESHOLD, ULTRASONIC_QUEUE_SIZE, ULTRASONIC_TIMEOUT
+	global ULTRASONIC_PERIOD, ULTRASONIC_DEADLINE, ULTRASONIC_GUARD
+	global FUSION_NOISE_SIGMAS, FUSION_CORROBORATE, FUSION_CORRELATION
+	global RADIO_A_DEBOUNCE, RADIO_B_DEBOUNCE, PUBSUB_INTERVAL, ADAPTIVE, CALIBRATION
+	global ARM_BEEPS, ARMED_BEEP, STANDBY_BEEP
+
+	ADC_SAMPLE_RATE = config.adc.sample_rate # Hz, per pad
+
+	PRESSURE_THRESHOLD = config.pressure.threshold # Threshold for force detection
+	PRESSURE_PERIOD    = config.pressure.period
+	PRESSURE_DEADLINE  = config.pressure.deadline
+
+	ULTRASONIC_THRESHOLD  = config.ultrasonic.threshold # Threshold for detection
+	ULTRASONIC_QUEUE_SIZE = config.ultrasonic.window
+	ULTRASONIC_TIMEOUT    = config.ultrasonic.timeout   # Longest wait for an echo
+	ULTRASONIC_PERIOD     = config.ultrasonic.period
+	ULTRASONIC_DEADLINE   = config.ultrasonic.deadline
+	ULTRASONIC_GUARD      = config.ultrasonic.guard     # Quiet between one group's echoes and the next
+
+	FUSION_NOISE_SIGMAS = config.fusion.noise_sigmas
+	FUSION_CORROBORATE  = config.fusion.corroborate
+	FUSION_CORRELATION  = config.fusion.correlation
+
+	RADIO_A_DEBOUNCE = config.switches.debounce_a
+	RADIO_B_DEBOUNCE = config.switches.debounce_b
+
+	PUBSUB_INTERVAL = config.pubsub.interval # s between published samples of a sensor
+
+	ADAPTIVE    = config.adaptive    # the sampling rates by alarm state, when enabled; see init_rates()
+	CALIBRATION = config.calibration # thresholds learned per sensor, when enabled; see init_calibration()
+
+	# Beeper patterns, as (level, seconds) steps
+	ARM_BEEPS    = [ ( True, config.arming.beep ), ( False, config.arming.gap ) ] * config.arming.count
+	ARMED_BEEP   = config.arming.armed_beep
+	STANDBY_BEEP = config.arming.standby_beep
+	return
 
-PIN_IN_MODE_1 = 27   # Used to detect mode changes from DE board
-PIN_IN_MODE_2 = 22   # "
+def apply_config( config ):
+	"""
+	---------------------------------------
+	Sets every setting; the pins and other
+	fixed settings only take effect when
+	startup() runs
+	---------------------------------------
+	"""
+	global PIN_LED_RED, PIN_LED_GREEN, PIN_LED_YELLOW, PIN_BEEPER
+	global PIN_HCSR04_TRIG, PIN_HCSR04_ECHO, PIN_RADIO_SWITCH_A, PIN_RADIO_SWITCH_B
+	global ULTRASONIC_SENSORS, ULTRASONIC_GROUPS
+	global PIN_IN_MODE_1, PIN_IN_MODE_2, PIN_OUT_MODE_1, PIN_OUT_MODE_2, PIN_OUT_STROBE
+	global ADC_DEVICE, ADC_CHIP_SELECT, PRESSURE_PADS, ADC_BUFFER_SIZE
+	global FUSION_SMOOTHING, FUSION_WINDOW
+	global SWITCH_BOUNCETIME, MODE_SETTLE, AUDIO_RATE, AUDIO_PERIOD, CONFIG_WATCH_PERIOD, TELEMETRY, SIREN
+	global RECORDING, PUBSUB, PROCESS_LAYOUT
 
-PIN_OUT_MODE_1 = 23  # Used to send mode changes to DE board
-PIN_OUT_MODE_2 = 24  # "
+	# Pins, in Broadcom numbering
+	PIN_LED_RED     = config.pins.led_red
+	PIN_LED_GREEN   = config.pins.led_green
+	PIN_LED_YELLOW  = config.pins.led_yellow
+	PIN_BEEPER      = config.pins.beeper
+	PIN_HCSR04_TRIG = config.pins.hcsr04_trigger
+	PIN_HCSR04_ECHO = config.pins.hcsr04_echo
 
-ADC_DEVICE      = pi.DEVICE
-ADC_CHIP_SELECT = pi.CHIP_SELECT_1
+	# ( trigger, echo ) of each ultrasonic sensor, and the sensors fired
+	# together; see devices/sensors/ultrasonic/array.py
+	ULTRASONIC_SENSORS = [ ( PIN_HCSR04_TRIG, PIN_HCSR04_ECHO ) ] + \
+	                     [ ( sensor["trigger"], sensor["echo"] ) for sensor in config.ultrasonic.sensors ]
+	ULTRASONIC_GROUPS  = config.ultrasonic.groups
 
-#---------------------------------------------------------------------
-# State Constants
-#---------------------------------------------------------------------
+	PIN_RADIO_SWITCH_A = config.pins.radio_switch_a
+	PIN_RADIO_SWITCH_B = config.pins.radio_switch_b
 
-STATE_STANDBY   = 0
-STATE_ENABLED   = 1
-STATE_TRIGGERED = 2
+	PIN_IN_MODE_1, PIN_IN_MODE_2   = config.pins.in_mode  # Used to detect mode changes from DE board
+	PIN_OUT_MODE_1, PIN_OUT_MODE_2 = config.pins.out_mode # Used to send mode changes to DE board
+	PIN_OUT_STROBE = config.pins.out_strobe # Pulsed after each mode change, if the DE board latches on it
 
-STATE_STANDBY_STR   = "00"
-STATE_ENABLED_STR   = "01"
-STATE_TRIGGERED_STR = "10"
+	ADC_DEVICE      = config.adc.device
+	ADC_CHIP_SELECT = config.adc.chip_select
+	ADC_BUFFER_SIZE = config.adc.buffer_size # samples held per pad
 
-ULTRASONIC_THRESHOLD = 0.95e-4 # Threshold for detection
-PRESSURE_THRESHOLD   = 8       # Threshold for force detection
+	# One (channel, differential) pair per pressure pad, read in a single scan
+	PRESSURE_PADS = [ ( MCP3008.CHANNEL0 + pad["channel"], pad["differential"] << 4 )
+	                  for pad in config.adc.pads ]
 
-ULTRASONIC_QUEUE_SIZE = 4
-PRESSURE_QUEUE_SIZE   = 3
+	FUSION_SMOOTHING = config.fusion.smoothing # samples in the pressure moving average
+	FUSION_WINDOW    = config.fusion.window    # pings the sensors are correlated over
 
-SLEEP_TIME = 0.1 # 0.1
+	SWITCH_BOUNCETIME = config.switches.bouncetime or None
 
-#---------------------------------------------------------------------
-# Toggle assignment
-#---------------------------------------------------------------------
+	MODE_SETTLE = config.mode.settle
 
-red_led    = Toggle( PIN_LED_RED    )
-yellow_led = Toggle( PIN_LED_YELLOW )
-green_led  = Toggle( PIN_LED_GREEN  )
-beeper     = Toggle( PIN_BEEPER     )
-adc        = MCP3008( ADC_DEVICE, ADC_CHIP_SELECT )
+	# Sounds are routed to the speaker by the ALSA configuration (amixer
+	# cset numid=3 1, kept by alsactl store), not at every start
+	AUDIO_RATE   = config.audio.rate   # Hz, the rate of the .wav files
+	AUDIO_PERIOD = config.audio.period # frames per write; 128 is about 12ms
 
-red_led.set_low()
-yellow_led.set_low()
-green_led.set_high()
+	CONFIG_WATCH_PERIOD = config.config.watch_period
 
-beeper.set_low()
+	TELEMETRY = config.telemetry # passed to Telemetry as is
+	RECORDING = config.recording # the raw sensor values, when enabled; see init_recorder()
+	PUBSUB    = config.pubsub    # the state and sensors for local clients, when enabled
 
-radio_a = Switch( PIN_RADIO_SWITCH_A )
-radio_b = Switch( PIN_RADIO_SWITCH_B )
+	SIREN = config.siren # the DAC siren, when enabled; see init_siren()
 
-#state_in  = generic_input([  PIN_IN_MODE_1,  PIN_IN_MODE_2  ])
-state_in  = [ PIN_IN_MODE_1, PIN_IN_MODE_2 ]
-state_out = [ PIN_OUT_MODE_1, PIN_OUT_MODE_2 ] 
-#state_out = generic_output([ PIN_OUT_MODE_1, PIN_OUT_MODE_2 ])
+	PROCESS_LAYOUT = config.processes.layout # see system/sensing.py
 
-GPIO.setup( state_in,  GPIO.IN  )
-GPIO.setup( state_out, GPIO.OUT )
+	apply_settings( config )
+	return
 
-trigger = Toggle( PIN_HCSR04_TRIG )
+# The checks run on executor threads of their own, as the reload does;
+# each holds this while it reads the settings and thresholds, so none
+# change in the middle of a check
+settings_lock = threading.Lock()
 
-GPIO.setup( PIN_HCSR04_ECHO, GPIO.IN )
+def reload_config( config, old ):
+	"""
+	---------------------------------------
+	Applies a reloaded configuration to the
+	running system, keeping the state and
+	the samples already captured
+	---------------------------------------
+	"""
+	reloadable, restart = config_changes( old, config )
+	if restart:
+		print( "Configuration: restart to apply " + ", ".join( restart ) )
+	if not reloadable:
+		return
 
-current_state     = STATE_STANDBY
-current_state_str = STATE_STANDBY_STR
+	with settings_lock:
+		apply_settings( config )
+		scheduler.set_period( "pressure",   PRESSURE_PERIOD,   PRESSURE_DEADLINE   )
+		scheduler.set_period( "ultrasonic", ULTRASONIC_PERIOD, ULTRASONIC_DEADLINE )
+		pressure_capture.set_rate( ADC_SAMPLE_RATE )
+		sonars.set_timeout( ULTRASONIC_TIMEOUT )
+		sonars.set_guard( ULTRASONIC_GUARD )
+		if sensing:
+			sensing.set_period( ULTRASONIC_PERIOD )
+		alarm.exit_delay = exit_delay()
+		radio_a.set_debounce( RADIO_A_DEBOUNCE )
+		radio_b.set_debounce( RADIO_B_DEBOUNCE )
+		configure_detector()
+		if calibration:
+			configure_calibration()
+			scheduler.set_period( "calibration", CALIBRATION.save_period )
+		if pubsub:
+			pubsub.set_interval( PUBSUB_INTERVAL )
+		if rates:
+			# The periods and rates above are those of scale 1
+			configure_rates()
+			rates.refresh()
+	# The median windows are resized by check_ultrasonic() itself, on the
+	# thread that uses them
+	print( "Configuration: reloaded " + ", ".join( reloadable ) )
+	return
 
+apply_config( load_config() ) # The defaults, until main() reads the file
 
-#state_in  = generic_input([  PIN_IN_MODE_1,  PIN_IN_MODE_2  ])
-state_in  = [ PIN_IN_MODE_1, PIN_IN_MODE_2 ]
-state_out = [ PIN_OUT_MODE_1, PIN_OUT_MODE_2 ]
-#state_out = generic_output([ PIN_OUT_MODE_1, PIN_OUT_MODE_2 ])
+#---------------------------------------------------------------------
+# Devices (created by startup())
+#---------------------------------------------------------------------
+
+red_led    = None
+yellow_led = None
+green_led  = None
+beeper     = None
+adc        = None
+radio_a    = None
+radio_b    = None
+state_in   = None
+state_out  = None
+sonars     = None
+detector   = None
+telemetry  = None
+pubsub     = None
+scheduler  = None
+watcher    = None
+sensing    = None # the sensing process, in the split layout
+rates      = None # the adaptive sampling rates, when enabled
+
+pressure_capture = None
+calibration      = None # the learned thresholds, when enabled
+alarm      = None
+
+#---------------------------------------------------------------------
+# Telemetry
+#---------------------------------------------------------------------
 
-GPIO.setup( state_in,  GPIO.IN  )
-GPIO.setup( state_out, GPIO.OUT )
+# Sensor ids in the telemetry log; the pressure pads follow, one each, then
+# the echoes of the ultrasonic sensors after the first
+SENSOR_MODE, SENSOR_ECHO, SENSOR_ECHO_MEDIAN, SENSOR_RADIO_A, SENSOR_RADIO_B = range( 5 )
+TELEMETRY_SENSORS = [ "mode", "echo", "echo_median", "radio_a", "radio_b" ] + [ "detection." + detection for detection in
+                      ( FusionDetector.PRESSURE, FusionDetector.ULTRASONIC, FusionDetector.FUSED ) ]
 
-GPIO.output( state_out[0], int(STATE_STANDBY_STR[0]) )
-GPIO.output( state_out[1], int(STATE_STANDBY_STR[1]) )
+def pressure_sensor( pad ):
+	return len( TELEMETRY_SENSORS ) + pad
 
+# ( echo, echo median ) sensor ids of each ultrasonic sensor
+echo_sensors = []
 
-pygame.mixer.init() # Initialize python sounds
+# The sensors are published to local clients under the same ids, when
+# enabled; samples are decimated there, events are not
+def record_sample( sensor, value ):
+	telemetry.record( sensor, value, alarm.state )
+	if pubsub:
+		pubsub.publish( sensor, value )
+	return
 
-alarm   = pygame.mixer.Sound("alarm.wav")
-working = pygame.mixer.Sound("working.wav")
+def record_event( sensor, value ):
+	telemetry.record( sensor, value, alarm.state )
+	if pubsub:
+		pubsub.publish_event( sensor, value )
+	return
 
+def record_detection( detection, value ):
+	# Detections are rare, so their ids are looked up by name
+	record_event( telemetry.sensor( "detection." + detection ), value )
+	return
 
 #---------------------------------------------------------------------
-# State Changes
+# Recording
 #---------------------------------------------------------------------
 
-def notify_de_board( state ):
-	global state_out
-	global state_in
+# Streams of raw sensor values in the recording, in the order declared;
+# the pressure pads follow, one each. system/replay.py reads them back
+# by name. An echo record holds one echo time (s) per ultrasonic sensor,
+# NaN for those that did not answer.
+RECORD_ECHO, RECORD_RADIO_A, RECORD_RADIO_B, RECORD_MODE, RECORD_STATE = range( 1, 6 )
+RECORD_STREAMS = [ ( "echo", "d" ), ( "radio_a", "B" ), ( "radio_b", "B" ), ( "mode", "B" ), ( "state", "B" ) ]
+RECORD_LATCHED = [ "mode", "state" ] # repeated at the start of each rotated file
+
+def record_pressure( pad ):
+	return len( RECORD_STREAMS ) + 1 + pad
 
-	#GPIO.output( state_out[0], int(state[0]) )
-	#GPIO.output( state_out[1], int(state[1]) )
+recorder = None
 
-	GPIO.output( (state_out[0], state_out[1]), (int(state[0]) , int(state[1])) )
-	print(state_out)
-	print( "Sending state: " + state )
+def init_recorder():
+	global recorder
 
+	recorder = Recorder( clock, RECORDING.path, RECORDING.chunk, RECORDING.max_bytes, RECORDING.backups )
+	for name, typecode in RECORD_STREAMS:
+		recorder.stream( name, typecode, name in RECORD_LATCHED )
+	for pad in range( len( PRESSURE_PADS ) ):
+		recorder.stream( "pressure.{}".format( pad ), "H" )
+	recorder.record( RECORD_STATE, [ STATE_STANDBY ] )
 	return
 
-def set_state_enabled():
-	global current_state
-	global current_state_str
-	global working
+#---------------------------------------------------------------------
+# Sounds
+#---------------------------------------------------------------------
 
-	current_state     = STATE_ENABLED
-	current_state_str = STATE_ENABLED_STR
+SOUND_ALARM   = "alarm.wav"
+SOUND_WORKING = "working.wav"
+
+# The engine is loaded in the background, so the sounds asked for
+# before it is ready are remembered and played once it is
+sound         = None
+sound_clips   = {}
+sound_pending = None # ( name, loops )
+sound_lock    = threading.Lock()
+
+def play_sound( name, loops = 0 ):
+	global sound_pending
+	with sound_lock:
+		if sound is None:
+			sound_pending = ( name, loops )
+			return
+	sound.play( sound_clips[name], loops )
+	return
 
-	notify_de_board( STATE_ENABLED_STR )
+def stop_sound( name ):
+	global sound_pending
+	with sound_lock:
+		if sound is None:
+			if sound_pending and sound_pending[0] == name:
+				sound_pending = None
+			return
+	sound.stop( sound_clips[name] )
+	return
+
+def init_sound( profile, announce = False ):
+	"""
+	---------------------------------------
+	Decodes the sounds and opens the audio
+	output. 'announce' prints the time it
+	finished, for when it runs after the
+	startup profile has been printed.
+	---------------------------------------
+	"""
+	global sound
+	global sound_pending
+
+	engine = AudioEngine( audio, AUDIO_RATE, period_frames = AUDIO_PERIOD )
+	clips  = { name: engine.load( name ) for name in ( SOUND_ALARM, SOUND_WORKING ) }
+	engine.start()
+
+	with sound_lock:
+		sound_clips.update( clips )
+		sound   = engine
+		pending = sound_pending
+		sound_pending = None
+
+	if pending:
+		play_sound( *pending )
+	profile.mark( "audio" )
+	if announce:
+		print( "Audio ready after {:.1f}ms".format( profile.elapsed( "audio" ) * 1e3 ) )
+	return
+
+# The siren is streamed to the DAC, so it sounds without the audio stack
+siren       = None
+siren_sound = None
+
+def init_siren():
+	global siren, siren_sound
+
+	dac         = CPA417( SIREN.device, SIREN.chip_select )
+	samples     = waveforms.siren( SIREN.rate, SIREN.low, SIREN.high, SIREN.sweep )
+	siren_sound = CPA417.encode( samples, CPA417.LOAD_BOTH )
+	siren       = DacStream( dac, SIREN.rate, SIREN.batch )
+	siren.start()
+	return
+
+
+#---------------------------------------------------------------------
+# State Changes
+#---------------------------------------------------------------------
+
+def notify_de_board( state ):
+	# state_out skips the write if this mode was the last one sent
+	state_out.set( state )
+	telemetry.record( SENSOR_MODE, state, state )
+	return
+
+def set_state_enabled():
+	notify_de_board( STATE_ENABLED )
 
 	red_led.set_low()
 	green_led.set_low()
 	yellow_led.set_high()
 
-	working.play()
+	play_sound( SOUND_WORKING )
 
 	return
 
 def set_state_triggered():
-	global current_state
-	global current_state_str
-	global alarm
-
-	current_state     = STATE_TRIGGERED
-	current_state_str = STATE_TRIGGERED_STR
-
-	notify_de_board( STATE_TRIGGERED_STR )
+	notify_de_board( STATE_TRIGGERED )
 
 	red_led.set_high()
 	green_led.set_low()
 	yellow_led.set_low()
 
-	alarm.play(loops=-1)
+	play_sound( SOUND_ALARM, loops = -1 )
+	if siren:
+		siren.play( siren_sound )
 
 	return
 
 def set_state_standby():
-	global current_state
-	global current_state_str
-	global alarm
-	current_state     = STATE_STANDBY
-	current_state_str = STATE_STANDBY_STR
-
-	notify_de_board( STATE_STANDBY_STR )
+	notify_de_board( STATE_STANDBY )
 
-	alarm.stop()
+	stop_sound( SOUND_ALARM )
+	if siren:
+		siren.stop()
 	red_led.set_low()
 	green_led.set_high()
 	yellow_led.set_low()
 	return
 
-def check_state_change():
-	global state_in
-	global current_state
-	global current_state_str
-
-	bit_1 = GPIO.input( state_in[0] )
-	bit_2 = GPIO.input( state_in[1] )
-
-	state = str(bit_1) + str(bit_2)
-
-	if state == current_state_str:
-		return
-	
-	if state == STATE_STANDBY_STR:
-		set_state_standby()
-		beeper.pulse(0.5)
-	elif current_state == STATE_ENABLED and state == STATE_TRIGGERED_STR:
-		set_state_triggered()
-	elif current_state == STATE_STANDBY and state == STATE_ENABLED_STR:
-		beeper.pulse( 0.1 )
-		time.sleep( 0.5 )
-		beeper.pulse( 0.1 )
-		time.sleep( 0.5 )
-		beeper.pulse( 0.1 )
-		time.sleep( 0.5 )
-
+def on_transition( state, previous, event, value ):
+	"""
+	---------------------------------------
+	Shows a state change on the outputs.
+	Runs on the alarm-effects thread.
+	---------------------------------------
+	"""
+	if rates:
+		rates.set_state( state )
+	if recorder:
+		recorder.record( RECORD_STATE, [ state ] )
+	if pubsub:
+		pubsub.publish_state( state, previous )
+	if state == STATE_ARMING:
+		# Beeps the exit delay, which the state machine times
+		beeper.play( ARM_BEEPS )
+	elif state == STATE_ENABLED:
 		set_state_enabled()
-
-		beeper.pulse( 1 )
+		beeper.pulse( ARMED_BEEP )
+	elif state == STATE_TRIGGERED:
+		print( "Triggered by {}".format( value if event == EVENT_DETECTION else "the DE board" ) )
+		set_state_triggered()
+	elif previous == STATE_ARMING:
+		beeper.cancel()
+	else:
+		set_state_standby()
+		beeper.pulse( STANDBY_BEEP )
 	return
 
+def exit_delay():
+	return sum( seconds for level, seconds in ARM_BEEPS )
+
 #---------------------------------------------------------------------
-# Button Change Callbacks
+# Input Callbacks
 #---------------------------------------------------------------------
 
-def on_change_a():
+def on_change_a( event ):
 	"""
 	---------------------------------------
 	Puts the system in enabled
 	---------------------------------------
 	"""
-	if( current_state == STATE_STANDBY ):
-		beeper.pulse( 0.1 )
-		time.sleep( 0.5 )
-		beeper.pulse( 0.1 )
-		time.sleep( 0.5 )
-		beeper.pulse( 0.1 )
-		time.sleep( 0.5 )
-
-		set_state_enabled()
-
-		beeper.pulse( 1 )
+	record_event( SENSOR_RADIO_A, event.edges )
+	alarm.post( EVENT_ARM )
 	return
 		
 
-def on_change_b():
+def on_change_b( event ):
 	"""
 	---------------------------------------
 	Puts the system in standby
 	---------------------------------------
 	"""
-	global current_state
-	if( current_state != STATE_STANDBY ):
-		set_state_standby()
+	record_event( SENSOR_RADIO_B, event.edges )
+	alarm.post( EVENT_DISARM )
+	return
 
-		beeper.pulse(0.5)
+def check_state_change( state, previous = None ):
+	"""
+	---------------------------------------
+	Passes on a settled mode word from the
+	DE board
+	---------------------------------------
+	"""
+	if recorder:
+		recorder.record( RECORD_MODE, [ state ] )
+	alarm.post( EVENT_MODE, state )
 	return
 
 #---------------------------------------------------------------------
 # Sensor Checks
 #---------------------------------------------------------------------
 
-# These are glorified static variables. 
-prev_time  = 0
-ultrasonic_queue=[]
-
 def check_ultrasonic():
-	global current_state
-	global prev_time
-	global ultrasonic_queue
-
-	trigger.set_high()
-	time.sleep(0.0001)
-	trigger.set_low()
+	if rates and not rates.scale( "ultrasonic" ):
+		return
+	sonars.set_window( ULTRASONIC_QUEUE_SIZE )
 
-	while not GPIO.input( PIN_HCSR04_ECHO ):
-		start = time.time()
+	# Sleeps until the echo edges of the next group of sensors have been
+	# timed by the GPIO interrupts
+	readings = sonars.step()
+	if not readings:
+		return
+	with settings_lock:
+		if recorder:
+			echoes = [ float( "nan" ) ] * len( sonars )
+			for reading in readings:
+				echoes[reading.sensor] = reading.echo
+			recorder.record( RECORD_ECHO, echoes )
+
+		for reading in readings:
+			echo, median = echo_sensors[reading.sensor]
+			record_sample( echo,   reading.change )
+			record_sample( median, reading.median )
+			if calibration and alarm.state == STATE_STANDBY:
+				threshold = calibration.learn_echo( reading.sensor, reading.median, reading.echo )
+				detector.set_ultrasonic_threshold( reading.sensor, threshold )
+
+		# The detector follows one echo stream, so it is given the sensor of
+		# the group that saw the most change for its threshold
+		reading = max( readings, key = lambda reading: reading.median / detector.ultrasonic_thresholds[reading.sensor] )
+
+		# The state machine decides; this only saves posting while disarmed
+		detection = detector.add_echo( reading.change, reading.median, reading.sensor )
+		if rates:
+			rates.observe( "ultrasonic", detector.ultrasonic_evidence )
+		if detection and (alarm.state == STATE_ENABLED):
+			record_detection( detection, reading.change )
+			alarm.post( EVENT_DETECTION, detection )
+	return
 
-	while GPIO.input( PIN_HCSR04_ECHO ):
-		stop = time.time()
+# Each pad's read cursor in its capture ring; startup() makes one per pad
+pressure_cursors = []
+def check_pressure( adc ):
+	# Every sample captured since the last check is evaluated as one batch,
+	# so short impacts between checks are not missed
+	if rates and not rates.scale( "pressure" ):
+		return
+	with settings_lock:
+		for pad in range( len( PRESSURE_PADS ) ):
+			slices, pressure_cursors[pad] = pressure_capture.buffers[pad].read( pressure_cursors[pad] )
+			if recorder and slices:
+				recorder.record( record_pressure( pad ), *slices )
+
+			detection = None
+			if detector.pressure_features( pad, slices ):
+				detection = detector.evaluate_pressure( pad )
+				if calibration and alarm.state == STATE_STANDBY:
+					threshold = calibration.learn_pressure( pad, detector.steps[pad], detector.levels[pad] )
+					detector.set_pressure_threshold( pad, threshold )
+			if slices:
+				record_sample( pressure_sensor( pad ), detector.steps[pad] )
+				if rates:
+					rates.observe( "pressure", detector.evidence[pad] )
+			if detection and (alarm.state == STATE_ENABLED):
+				record_detection( detection, detector.steps[pad] )
+				alarm.post( EVENT_DETECTION, detection )
+	return
 
-	current_time = stop - start
-	delta = abs(current_time - prev_time)
+def configure_detector():
+	detector.configure( PRESSURE_THRESHOLD, ULTRASONIC_THRESHOLD,
+	                    FUSION_NOISE_SIGMAS, FUSION_CORROBORATE, FUSION_CORRELATION )
+	return
 
-	
-	ultrasonic_queue.append(delta)
-	if len(ultrasonic_queue) > ULTRASONIC_QUEUE_SIZE:
-		ultrasonic_queue.pop(0)
-	
+#---------------------------------------------------------------------
+# Calibration
+#---------------------------------------------------------------------
 
-	if (current_state == STATE_ENABLED) and (median(ultrasonic_queue) >  ULTRASONIC_THRESHOLD):
-		print("Ultrasonic Triggered: {}".format(delta))
-		set_state_triggered()
+def configure_calibration():
+	calibration.configure( PRESSURE_THRESHOLD, ULTRASONIC_THRESHOLD, CALIBRATION.sigmas, CALIBRATION.memory,
+	                       CALIBRATION.warmup, CALIBRATION.floor, CALIBRATION.ceiling )
 
+	# configure_detector() gives every sensor the common thresholds
+	for pad in range( len( PRESSURE_PADS ) ):
+		detector.set_pressure_threshold( pad, calibration.pressure_threshold( pad ) )
+	for sensor in range( len( ULTRASONIC_SENSORS ) ):
+		detector.set_ultrasonic_threshold( sensor, calibration.ultrasonic_threshold( sensor ) )
+	return
 
-	print("Ultrasonic Value : {:.5f} (Median: {:.5f})".format(delta, median(ultrasonic_queue)) )
+def init_calibration():
+	global calibration
+
+	# Baselines are kept by what they were measured on, so they survive
+	# pads and sensors being added, removed or reordered
+	calibration = Calibration( CALIBRATION.path,
+	                           [ "adc.{}.{}".format( *conversion ) for conversion in PRESSURE_PADS ],
+	                           [ "hcsr04.{}.{}".format( *pins ) for pins in ULTRASONIC_SENSORS ],
+	                           PRESSURE_THRESHOLD, ULTRASONIC_THRESHOLD )
+	try:
+		calibration.load()
+	except (OSError, ValueError) as error:
+		print( "Calibration: cannot load {} ({}); learning from the start".format( CALIBRATION.path, error ) )
+	configure_calibration()
+	return
 
-	prev_time = current_time
+def save_calibration():
+	# A failed save is retried at the next period
+	try:
+		calibration.save()
+	except OSError as error:
+		print( "Calibration: cannot save {} ({})".format( CALIBRATION.path, error ) )
 	return
 
-prev_pressure  = 0
-def check_pressure( adc ):
-	global current_state
-	global prev_pressure
+#---------------------------------------------------------------------
+# Adaptive Sampling
+#---------------------------------------------------------------------
 
-	val = adc.receive( MCP3008.CHANNEL0, MCP3008.DIFF_CH0_TO_CH1 )	
-	delta = abs(val - prev_pressure)
+def scale_pressure( scale ):
+	# The ADC is never sampled faster than configured, since the
+	# smoothing is counted in samples; a burst checks more often instead
+	pressure_capture.set_rate( ADC_SAMPLE_RATE * min( scale, 1.0 ) )
+	if scale:
+		scheduler.set_period( "pressure", PRESSURE_PERIOD / scale, PRESSURE_DEADLINE )
+	return
 
-	if (current_state == STATE_ENABLED) and (delta > PRESSURE_THRESHOLD):
-		print("Pressure Triggered: {}".format(delta))
-		set_state_triggered()	
+def scale_ultrasonic( scale ):
+	# At 0 the checks are skipped, and the sensing process pauses
+	if scale:
+		scheduler.set_period( "ultrasonic", ULTRASONIC_PERIOD / scale, ULTRASONIC_DEADLINE )
+	if sensing:
+		sensing.set_period( ULTRASONIC_PERIOD / scale if scale else 0 )
+	return
 
-	prev_pressure = val
+def configure_rates():
+	rates.configure( ADAPTIVE.approach, ADAPTIVE.hold )
+	rates.set_policy( "pressure",   ADAPTIVE.pressure   )
+	rates.set_policy( "ultrasonic", ADAPTIVE.ultrasonic )
 	return
 
-def median(lst):
-	sortedLst=sorted(lst)
-	lstLen=len(lst)
-	index=(lstLen-1)//2
-	if(lstLen%2):
-		return sortedLst[index]
-	else:
-		return(sortedLst[index]+sortedLst[index+1])/2.0
+def init_rates():
+	global rates
 
+	# Samples per second at scale 1: ADC scans, and pings
+	rates = AdaptiveRates( clock, ADAPTIVE.approach, ADAPTIVE.hold, alarm.state )
+	rates.add( "pressure", ADAPTIVE.pressure, lambda: ADC_SAMPLE_RATE,
+	           lambda: pressure_capture.samples, scale_pressure )
+	rates.add( "ultrasonic", ADAPTIVE.ultrasonic,
+	           lambda: len( ULTRASONIC_SENSORS ) / len( sonars.groups ) / ULTRASONIC_PERIOD,
+	           lambda: sonars.stats()["pings"], scale_ultrasonic )
+	return
 
 
 #---------------------------------------------------------------------
 # Main
 #---------------------------------------------------------------------
 
-radio_a.set_on_rising( on_change_a )
-radio_b.set_on_rising( on_change_b )
-#state_in.set_on_rising( on_state_change )
-#state_in.set_on_falling( on_state_change )
+def startup( profile ):
+	"""
+	---------------------------------------
+	Brings the devices up, most critical
+	first: the outputs go to a safe state,
+	sampling starts, and the system can be
+	armed before the sounds are loaded
+	---------------------------------------
+	"""
+	global red_led, yellow_led, green_led, beeper, adc, radio_a, radio_b
+	global state_in, state_out, sonars, scheduler, pressure_capture, detector, telemetry, pubsub, alarm
+	global sensing
+
+	profile.mark( "imports" )
+
+	# The sensing process owns the SPI bus and the input pins, and is
+	# forked first, while this process has no other thread
+	if PROCESS_LAYOUT == LAYOUT_SPLIT:
+		sensing = SensingProcess( ( ADC_DEVICE, ADC_CHIP_SELECT ), PRESSURE_PADS, ADC_SAMPLE_RATE, ADC_BUFFER_SIZE,
+		                          ULTRASONIC_SENSORS, ULTRASONIC_GROUPS, ULTRASONIC_GUARD, ULTRASONIC_TIMEOUT,
+		                          ULTRASONIC_QUEUE_SIZE, ULTRASONIC_PERIOD,
+		                          [ ( PIN_RADIO_SWITCH_A, RADIO_A_DEBOUNCE ), ( PIN_RADIO_SWITCH_B, RADIO_B_DEBOUNCE ) ],
+		                          SWITCH_BOUNCETIME, [ PIN_IN_MODE_1, PIN_IN_MODE_2 ], MODE_SETTLE,
+		                          edges = RECORDING.enabled )
+		sensing.start()
+		profile.mark( "sensing" )
+
+	telemetry = Telemetry( clock, TELEMETRY.path, TELEMETRY.capacity, TELEMETRY.max_bytes, TELEMETRY.backups,
+	                       TELEMETRY.flush_interval, TELEMETRY.fsync, TELEMETRY.fsync_interval )
+	for name in TELEMETRY_SENSORS:
+		telemetry.sensor( name )
+	for pad in range( len( PRESSURE_PADS ) ):
+		telemetry.sensor( "pressure.{}".format( pad ) )
+	echo_sensors[:] = [ ( SENSOR_ECHO, SENSOR_ECHO_MEDIAN ) ] + \
+		[ ( telemetry.sensor( "echo.{}".format( index ) ), telemetry.sensor( "echo_median.{}".format( index ) ) )
+		  for index in range( 1, len( ULTRASONIC_SENSORS ) ) ]
+	telemetry.start()
+	if PUBSUB.enabled:
+		pubsub = PubSubServer( clock, PUBSUB.path, PUBSUB.queue_size, PUBSUB_INTERVAL )
+		for name in telemetry.sensors:
+			pubsub.topic( name )
+		pubsub.start()
+	if RECORDING.enabled:
+		init_recorder()
+
+	# Show standby on the LEDs and to the DE board
+	state_out  = generic_output([ PIN_OUT_MODE_1, PIN_OUT_MODE_2 ], PIN_OUT_STROBE, STATE_STANDBY )
+	red_led    = Toggle( PIN_LED_RED    )
+	yellow_led = Toggle( PIN_LED_YELLOW )
+	green_led  = Toggle( PIN_LED_GREEN  )
+	beeper     = Toggle( PIN_BEEPER     )
 
-try:
-	check_ultrasonic() # Initialize ultrasonic sensor
+	red_led.set_low()
+	yellow_led.set_low()
+	green_led.set_high()
+
+	beeper.set_low()
+
+	# Every input and sensor reports to the state machine
+	alarm = AlarmStateMachine( clock, exit_delay() )
+	alarm.set_on_transition( on_transition )
+	alarm.start()
+	if SIREN.enabled:
+		init_siren()
+	profile.mark( "outputs" )
+
+	# Pressure pads
+	detector = FusionDetector( len( PRESSURE_PADS ), ADC_SAMPLE_RATE, PRESSURE_THRESHOLD, ULTRASONIC_THRESHOLD,
+	                           FUSION_SMOOTHING, FUSION_WINDOW, sensors = len( ULTRASONIC_SENSORS ) )
+	configure_detector()
+	if CALIBRATION.enabled:
+		init_calibration()
+	if sensing:
+		pressure_capture = sensing.capture
+	else:
+		adc              = MCP3008( ADC_DEVICE, ADC_CHIP_SELECT )
+		pressure_capture = AdcCapture( adc, PRESSURE_PADS, ADC_SAMPLE_RATE, ADC_BUFFER_SIZE )
+	pressure_cursors[:] = [ 0 ] * len( PRESSURE_PADS )
+	pressure_capture.sample()
 	check_pressure( adc )
+	pressure_capture.start()
+	profile.mark( "first sample" )
+
+	# Arming inputs
+	if sensing:
+		radio_a, radio_b = sensing.switches
+		state_in         = sensing.state_in
+	else:
+		radio_a  = Switch( PIN_RADIO_SWITCH_A, RADIO_A_DEBOUNCE, SWITCH_BOUNCETIME )
+		radio_b  = Switch( PIN_RADIO_SWITCH_B, RADIO_B_DEBOUNCE, SWITCH_BOUNCETIME )
+		state_in = generic_input([  PIN_IN_MODE_1,  PIN_IN_MODE_2  ], MODE_SETTLE )
+
+	radio_a.set_on_rising( on_change_a )
+	radio_b.set_on_rising( on_change_b )
+	if recorder:
+		radio_a.set_on_edge( lambda time_ns: recorder.record( RECORD_RADIO_A, time_ns = time_ns ) )
+		radio_b.set_on_edge( lambda time_ns: recorder.record( RECORD_RADIO_B, time_ns = time_ns ) )
+	state_in.set_on_change( check_state_change )
+	check_state_change( state_in.get() )
+	profile.mark( "armable" )
+
+	# Virtual time stands still while loading, so the simulation loads
+	# the sounds in line; on the Pi they load while sensing starts
+	if clock.virtual:
+		init_sound( profile )
+	else:
+		threading.Thread( target = init_sound, args = ( profile, True ), name = "audio-init", daemon = True ).start()
+
+	if sensing:
+		sonars = sensing.sonars
+	else:
+		sonars = UltrasonicArray( [ HCSR04( trigger, echo ) for trigger, echo in ULTRASONIC_SENSORS ],
+		                          ULTRASONIC_GROUPS, ULTRASONIC_GUARD, ULTRASONIC_TIMEOUT, ULTRASONIC_QUEUE_SIZE )
+	for group in sonars.groups:
+		check_ultrasonic() # Initialize ultrasonic sensors
+	profile.mark( "ultrasonic" )
+
+	scheduler = Scheduler()
+	scheduler.add( "pressure",   lambda: check_pressure( adc ), PRESSURE_PERIOD,     PRESSURE_DEADLINE     )
+	scheduler.add( "ultrasonic", check_ultrasonic,              ULTRASONIC_PERIOD,   ULTRASONIC_DEADLINE   )
+	scheduler.add( "config",     watcher.check,                 CONFIG_WATCH_PERIOD )
+	if calibration:
+		scheduler.add( "calibration", save_calibration, CALIBRATION.save_period )
+	if ADAPTIVE.enabled:
+		init_rates()
+	return
+
+def shutdown():
+	if sensing:
+		# Stopped first, so the statistics below are its final ones
+		sensing.stop()
+	alarm.stop()
+	print( "Alarm events: {} transitions: {} ignored: {}".format(
+		alarm.events, alarm.transitions, alarm.ignored ) )
+	for name, switch in ( ( "A", radio_a ), ( "B", radio_b ) ):
+		print( "Radio {} edges: {} changes: {} glitches: {}".format(
+			name, switch.edges, switch.changes, switch.glitches ) )
+	pressure_capture.stop()
+	print( scheduler.report() )
+	print( "ADC samples: {} missed: {} overruns: {}".format(
+		pressure_capture.samples, pressure_capture.missed,
+		sum( buffer.overruns for buffer in pressure_capture.buffers ) ) )
+	sonar_stats = sonars.stats()
+	print( "Ultrasonic echoes: {} timeouts: {} stale: {} throughput: {:.1f}/s per sensor: {}".format(
+		sonar_stats["echoes"], sonar_stats["timeouts"], sonar_stats["stale"], sonar_stats["throughput"],
+		" ".join( "{:.1f}/s".format( rate ) for rate in sonar_stats["rates"] ) ) )
+	if sensing:
+		print( "Sensing steps skipped: {}".format( sonars.skipped ) )
+	if rates:
+		rate_stats = rates.stats()
+		for name, sensor in rate_stats["sensors"].items():
+			print( "Adaptive {}: scale: {} bursts: {} samples: {} of {:.0f} at full rate".format(
+				name, sensor["scale"], sensor["bursts"], sensor["taken"], sensor["expected"] ) )
+		print( "CPU by state: " + ", ".join( "{} {:.1f}s in {:.0f}s".format(
+			name, rate_stats["cpu"][name], seconds ) for name, seconds in rate_stats["seconds"].items() if seconds ) )
+	if calibration:
+		save_calibration()
+		for kind, sensors in calibration.stats().items():
+			for sensor in sensors:
+				print( "Calibration {}: threshold: {:.3g}{} samples: {} mean: {:.3g} std: {:.3g} rejected: {}".format(
+					sensor["key"], sensor["threshold"], "" if sensor["learned"] else " (common)",
+					sensor["samples"], sensor["mean"], sensor["std"], sensor["rejected"] ) )
+		print( "Calibration baselines loaded: {} saves: {}".format( calibration.loaded, calibration.saves ) )
+	print( "Detections: " + ", ".join( "{} {}".format( reason, count )
+		for reason, count in detector.detections.items() ) )
+	if sound is not None:
+		audio_stats = sound.stats()
+		print( "Sound starts: {} latency p50: {:.1f}ms p99: {:.1f}ms max: {:.1f}ms".format(
+			audio_stats["starts"], audio_stats["latency_p50"] * 1e3,
+			audio_stats["latency_p99"] * 1e3, audio_stats["latency_max"] * 1e3 ) )
+		sound.close()
+	if siren:
+		siren_stats = siren.stats()
+		print( "Siren batches: {} underruns: {} rate: {:.0f}/{}Hz".format(
+			siren_stats["batches"], siren_stats["underruns"], siren_stats["rate"], siren_stats["target"] ) )
+		siren.close()
+	if pubsub:
+		pubsub.close()
+		pubsub_stats = pubsub.stats()
+		print( "Published: {} sent: {} dropped: {} decimated: {} clients: {}".format(
+			pubsub_stats["published"], pubsub_stats["sent"], pubsub_stats["dropped"],
+			pubsub_stats["decimated"], pubsub_stats["connects"] ) )
+	if recorder:
+		recorder.close()
+		print( "Recording records: {} bytes: {} remaps: {} rotations: {}".format(
+			recorder.records, recorder.size, recorder.remaps, recorder.rotations ) )
+	telemetry.close()
+	print( "Telemetry records: {} dropped: {} batches: {} fsyncs: {} rotations: {}".format(
+		telemetry.written, telemetry.dropped, telemetry.batches, telemetry.fsyncs, telemetry.rotations ) )
+	GPIO.cleanup( state_out.pins() )
+	if not sensing:
+		# The sensing process cleans up its own pins
+		GPIO.cleanup( [ echo for trigger, echo in ULTRASONIC_SENSORS ] )
+		GPIO.cleanup( [ PIN_IN_MODE_1, PIN_IN_MODE_2 ] )
+	return
 
-	while True:
+def main( started = STARTED ):
+	global watcher
 
-		check_pressure( adc )
-		# Check pressure sensor twice for every 1 ultrasonic
-		check_ultrasonic()		
-		time.sleep( SLEEP_TIME )
-		check_ultrasonic()
-		time.sleep( SLEEP_TIME )
-		check_state_change()
+	profile = StartupProfile( started )
+	config  = load_config( CONFIG_PATH )
+	apply_config( config )
+	watcher = ConfigWatcher( CONFIG_PATH, config, reload_config )
+	watcher.install()
 
-		
+	startup( profile )
+	print( profile.report() )
+
+	try:
+		scheduler.run()
+	except KeyboardInterrupt:
+		shutdown()
+	return
 
-except KeyboardInterrupt:
-	GPIO.cleanup( [PIN_HCSR04_ECHO] )
-	GPIO.cleanup( state_out )
-	GPIO.cleanup( state_in )
-	pass
+if __name__ == "__main__":
+	main()
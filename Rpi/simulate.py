@@ -0,0 +1,117 @@
+"""
+------------------------------------------------------------------------------
+Runs the whole main.py alarm pipeline on the simulated hardware backend, on
+virtual time, against a scripted scenario:
+
+  - a wall 2.5m from the ultrasonic sensor, with a few mm of noise
+  - the system armed from radio switch A
+  - an intruder walking towards the sensor
+  - disarm from radio switch B, re-arm, then a hit on the pressure pad
+
+Usage (from Rpi/):
+  python simulate.py [seconds] [--verbose]
+------------------------------------------------------------------------------
+"""
+import os
+import sys
+import time
+import random
+import contextlib
+
+os.environ["SECURITY_SYSTEM_HAL"] = "sim"
+
+import devices.hal as hal
+from devices.hal import sim
+
+import main as program
+
+# The pins main.py will use
+config = program.load_config( program.CONFIG_PATH )
+
+PIN_LED_RED        = config.pins.led_red
+PIN_HCSR04_TRIG    = config.pins.hcsr04_trigger
+PIN_HCSR04_ECHO    = config.pins.hcsr04_echo
+PIN_RADIO_SWITCH_A = config.pins.radio_switch_a
+PIN_RADIO_SWITCH_B = config.pins.radio_switch_b
+PIN_IN_MODE_1      = config.pins.in_mode[0]
+PIN_IN_MODE_2      = config.pins.in_mode[1]
+PIN_OUT_MODE_1     = config.pins.out_mode[0]
+PIN_OUT_MODE_2     = config.pins.out_mode[1]
+PRESSURE_CHANNEL   = config.adc.pads[0]["channel"]
+
+BUTTON_PRESS = 0.2 # s
+
+def attach_de_board( simulator ):
+	"""
+	--------------------------------------------------------------------------
+	Models the DE board, which reflects the mode it is sent back on its
+	output pins
+	--------------------------------------------------------------------------
+	"""
+	GPIO = simulator.GPIO
+	GPIO.observe( PIN_OUT_MODE_1, lambda pin, value: GPIO.drive( PIN_IN_MODE_1, value ) )
+	GPIO.observe( PIN_OUT_MODE_2, lambda pin, value: GPIO.drive( PIN_IN_MODE_2, value ) )
+	return
+
+def scenario( simulator, seconds, rng ):
+	"""
+	--------------------------------------------------------------------------
+	Scripts the simulated hardware and returns the log of events to print
+	--------------------------------------------------------------------------
+	"""
+	GPIO  = simulator.GPIO
+	clock = simulator.clock
+	log   = []
+
+	def distance( now ):
+		# Intruder walks from 2.5m to 0.5m between t=6s and t=10s
+		if 6.0 <= now < 10.0:
+			meters = 2.5 - 0.5 * (now - 6.0)
+		else:
+			meters = 2.5
+		return sim.distance_to_echo( meters + rng.gauss( 0.0, 0.002 ) )
+
+	def pressure( now ):
+		# Something heavy lands on the pad at t=20s
+		spike = 60 if 20.0 <= now < 20.02 else 0
+		return 300 + spike + rng.randint( -2, 2 )
+
+	GPIO.attach_echo( PIN_HCSR04_TRIG, PIN_HCSR04_ECHO, distance )
+	attach_de_board( simulator )
+	simulator.spi_device( 0, 1 ).set_channel( PRESSURE_CHANNEL, pressure )
+
+	GPIO.pulse_at(  1.0, PIN_RADIO_SWITCH_A, BUTTON_PRESS ) # arm
+	GPIO.pulse_at( 13.0, PIN_RADIO_SWITCH_B, BUTTON_PRESS ) # disarm
+	GPIO.pulse_at( 15.0, PIN_RADIO_SWITCH_A, BUTTON_PRESS ) # arm again
+	simulator.interrupt_at( seconds )
+
+	GPIO.observe( PIN_LED_RED, lambda pin, value: log.append(
+		( clock.monotonic(), "red LED " + ("on" if value else "off") ) ) )
+	simulator.audio.observe( lambda name, action: log.append(
+		( clock.monotonic(), action + " " + name ) ) )
+	return log
+
+def main():
+	args     = [ arg for arg in sys.argv[1:] if not arg.startswith( "--" ) ]
+	verbose  = "--verbose" in sys.argv
+	seconds  = float( args[0] ) if args else 25.0
+
+	simulator = hal.simulator()
+	log       = scenario( simulator, seconds, random.Random( 1 ) )
+
+	start = time.perf_counter()
+	with open( os.devnull, "w" ) as devnull, contextlib.redirect_stdout( sys.stdout if verbose else devnull ):
+		program.main()
+	wall = time.perf_counter() - start
+
+	print( "Simulated {:.1f}s in {:.2f}s ({:.0f}x real time)".format(
+		simulator.clock.monotonic(), wall, simulator.clock.monotonic() / wall ) )
+	print()
+	for when, event in log:
+		print( "{:8.3f}s  {}".format( when, event ) )
+	print()
+	print( program.scheduler.report() )
+	return
+
+if __name__ == "__main__":
+	main()
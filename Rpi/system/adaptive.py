@@ -0,0 +1,254 @@
+import time
+import threading
+
+import system.alarm as alarm_states
+
+"""
+------------------------------------------------------------------------------
+Sampling rates that follow the alarm state, for main.py.
+
+Readings are only acted on while the alarm is enabled, so the sensors need
+not run at full rate in standby. Each sensor has a policy: a scale of its
+configured rate for each alarm state, 0 to stop sampling it, and a scale to
+burst to while the alarm is enabled and the sensor's evidence (its feature
+over its threshold; see FusionDetector) has come within 'approach' of
+triggering. The burst lasts until the evidence has stayed below 'approach'
+for 'hold' seconds.
+
+  "adaptive" : {
+    "enabled"    : true,
+    "pressure"   : { "standby" : 0.2, "arming" : 1, "enabled" : 1,
+                     "triggered" : 0.2, "burst" : 2 },
+    "ultrasonic" : { "standby" : 0, "arming" : 1, "enabled" : 1,
+                     "triggered" : 0, "burst" : 1.5 }
+  }
+
+Arming runs at the enabled scale by default, so the filters and the noise
+estimates have settled by the time detections count. What a scale does to
+a sensor is up to the function given for it; see main.py.
+------------------------------------------------------------------------------
+"""
+
+BURST = "burst"
+
+# The scales of a policy: one per state, by name, and the burst
+POLICY = tuple( alarm_states.STATE_NAMES[state] for state in
+                ( alarm_states.STANDBY, alarm_states.ARMING, alarm_states.ENABLED, alarm_states.TRIGGERED ) ) + ( BURST, )
+
+class _Sensor:
+	__slots__ = ( "policy", "rate", "count", "apply", "scale", "burst_until", "bursts",
+	              "expected", "counted", "since" )
+
+	def __init__( self, policy, rate, count, apply, now ):
+		self.policy      = dict( policy )
+		self.rate        = rate
+		self.count       = count
+		self.apply       = apply
+		self.scale       = None
+		self.burst_until = None
+		self.bursts      = 0
+		self.expected    = 0.0     # samples at scale 1 since added
+		self.counted     = count() # samples taken before it was added
+		self.since       = now
+		return
+
+	def bank( self, now ):
+		# Adds the samples scale 1 would have taken since the last call
+		self.expected += self.rate() * (now - self.since)
+		self.since     = now
+		return
+
+
+class AdaptiveRates:
+	"""
+	--------------------------------------------------------------------------
+	Adaptive Sampling Rates
+	--------------------------------------------------------------------------
+	Description:
+	  Keeps the scale of each sensor's rate from the alarm state and the
+	  sensor's evidence, and calls the sensor's function whenever the scale
+	  changes. set_state() is called on every transition and observe()
+	  after every evaluation of a sensor, from any thread; the functions
+	  are called under a lock, in the order of the changes.
+
+	  The savings are counted against running every sensor at scale 1 all
+	  the time: the samples each sensor would have taken against those it
+	  took, and the seconds and process CPU seconds spent in each state.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock, approach = 0.5, hold = 5.0, state = alarm_states.STANDBY, cpu = time.process_time ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a controller with no sensors
+		----------------------------------------------------------------------
+		Preconditions:
+		  clock    - the HAL clock
+		  approach - the evidence that starts a burst while enabled
+		  hold     - the seconds a burst outlasts the evidence
+		  state    - the alarm state to start in
+		  cpu      - the function giving the CPU seconds used
+		----------------------------------------------------------------------
+		"""
+		self._clock     = clock
+		self._cpu       = cpu
+		self._state     = state
+		self._sensors   = {}
+		self._lock      = threading.Lock()
+		self._since     = clock.monotonic()
+		self._cpu_since = cpu()
+		self.configure( approach, hold )
+
+		# Statistics
+		self.seconds     = { state: 0.0 for state in alarm_states.STATE_NAMES }
+		self.cpu_seconds = { state: 0.0 for state in alarm_states.STATE_NAMES }
+		return
+
+	def configure( self, approach, hold ):
+		"""
+		----------------------------------------------------------------------
+		Changes when a burst starts and how long it lasts, from the next
+		observation
+		----------------------------------------------------------------------
+		"""
+		self._approach = approach
+		self._hold     = hold
+		return
+
+	def add( self, name, policy, rate, count, apply ):
+		"""
+		----------------------------------------------------------------------
+		Adds a sensor, applying its scale for the current state
+		----------------------------------------------------------------------
+		Preconditions:
+		  name   - the sensor
+		  policy - its scales, by the names of POLICY
+		  rate   - function() giving its samples per second at scale 1
+		  count  - function() giving the samples it has taken
+		  apply  - function( scale ) setting its rate
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			sensor = _Sensor( policy, rate, count, apply, self._clock.monotonic() )
+			self._sensors[name] = sensor
+			self._update( sensor, force = True )
+		return
+
+	def set_policy( self, name, policy ):
+		"""
+		----------------------------------------------------------------------
+		Changes a sensor's scales, applying the new one at once
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			sensor = self._sensors[name]
+			sensor.policy = dict( policy )
+			self._update( sensor )
+		return
+
+	def scale( self, name ):
+		"""
+		----------------------------------------------------------------------
+		Returns a sensor's scale; 0 when it is not to be sampled
+		----------------------------------------------------------------------
+		"""
+		return self._sensors[name].scale
+
+	def set_state( self, state ):
+		"""
+		----------------------------------------------------------------------
+		Applies the scales of a new alarm state; a burst ends with the
+		enabled state
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._account()
+			self._state = state
+			for sensor in self._sensors.values():
+				if state != alarm_states.ENABLED:
+					sensor.burst_until = None
+				self._update( sensor )
+		return
+
+	def observe( self, name, evidence ):
+		"""
+		----------------------------------------------------------------------
+		Notes a sensor's latest evidence, bursting it while the alarm is
+		enabled and the evidence is near 1.0
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			sensor = self._sensors[name]
+			now    = self._clock.monotonic()
+			if self._state == alarm_states.ENABLED and evidence >= self._approach:
+				if sensor.burst_until is None:
+					sensor.bursts += 1
+				sensor.burst_until = now + self._hold
+			elif sensor.burst_until is not None and now >= sensor.burst_until:
+				sensor.burst_until = None
+			self._update( sensor )
+		return
+
+	def refresh( self ):
+		"""
+		----------------------------------------------------------------------
+		Applies every scale again, as after the rates at scale 1 change
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			for sensor in self._sensors.values():
+				self._update( sensor, force = True )
+		return
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the savings as a dictionary
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  "sensors" - by sensor: its 'scale', its 'bursts', and the samples
+		              'expected' at scale 1 and 'taken'
+		  "seconds" - the seconds spent in each state, by name
+		  "cpu"     - the CPU seconds spent in each state, by name
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._account()
+			now     = self._clock.monotonic()
+			sensors = {}
+			for name, sensor in self._sensors.items():
+				sensor.bank( now )
+				sensors[name] = {
+					"scale"    : sensor.scale,
+					"bursts"   : sensor.bursts,
+					"expected" : sensor.expected,
+					"taken"    : sensor.count() - sensor.counted,
+				}
+			names = alarm_states.STATE_NAMES
+			return {
+				"sensors" : sensors,
+				"seconds" : { names[state]: seconds for state, seconds in self.seconds.items() },
+				"cpu"     : { names[state]: seconds for state, seconds in self.cpu_seconds.items() },
+			}
+
+	def _update( self, sensor, force = False ):
+		# Called with the lock held
+		scale = sensor.policy[alarm_states.STATE_NAMES[self._state]]
+		if sensor.burst_until is not None:
+			scale = max( scale, sensor.policy[BURST] )
+		if scale != sensor.scale or force:
+			sensor.bank( self._clock.monotonic() )
+			sensor.scale = scale
+			sensor.apply( scale )
+		return
+
+	def _account( self ):
+		# Called with the lock held
+		now = self._clock.monotonic()
+		cpu = self._cpu()
+		self.seconds[self._state]     += now - self._since
+		self.cpu_seconds[self._state] += cpu - self._cpu_since
+		self._since     = now
+		self._cpu_since = cpu
+		return
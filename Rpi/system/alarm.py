@@ -0,0 +1,236 @@
+import queue
+import threading
+import traceback
+
+"""
+------------------------------------------------------------------------------
+The alarm states and the events that move between them:
+
+  STANDBY   --ARM-->                     ARMING
+  ARMING    --ARMED (exit delay over)--> ENABLED
+  ARMING    --DISARM-->                  STANDBY
+  ENABLED   --DETECTION-->               TRIGGERED
+  ENABLED   --DISARM-->                  STANDBY
+  TRIGGERED --DISARM-->                  STANDBY
+
+The DE board's mode word (MODE) acts as ARM, DETECTION or DISARM when it
+is ENABLED, TRIGGERED or STANDBY and differs from the mode shown. Any
+other event leaves the state as it is.
+------------------------------------------------------------------------------
+"""
+
+# States; all but ARMING are also the DE board mode words
+STANDBY   = 0b00
+ENABLED   = 0b01
+TRIGGERED = 0b10
+ARMING    = 0b100
+
+STATE_NAMES = { STANDBY: "standby", ARMING: "arming", ENABLED: "enabled", TRIGGERED: "triggered" }
+
+# Events
+EVENT_ARM       = "arm"
+EVENT_DISARM    = "disarm"
+EVENT_ARMED     = "armed"
+EVENT_DETECTION = "detection"
+EVENT_MODE      = "mode"
+
+def mode_word( state ):
+	"""
+	--------------------------------------------------------------------------
+	Returns the DE board mode word shown for a state; arming shows standby
+	--------------------------------------------------------------------------
+	"""
+	return STANDBY if state == ARMING else state
+
+class AlarmStateMachine:
+	"""
+	--------------------------------------------------------------------------
+	Alarm State Machine
+	--------------------------------------------------------------------------
+	Description:
+	  Owns the alarm state. The radio switches, the DE board, the sensor
+	  checks and the exit delay timer all post() events, from any thread;
+	  post() never blocks. Events are applied one at a time in the order
+	  they were posted, on the "alarm" thread, so no two transitions race.
+
+	  Each transition is passed to the transition handler on a separate
+	  "alarm-effects" thread, so slow side effects (the audio, the GPIO)
+	  never hold up the events behind them. Handlers run in the order of
+	  the transitions. On the simulated backend both run from clock events
+	  instead of threads.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, clock, exit_delay, state = STANDBY ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a state machine; events are queued until start()
+		----------------------------------------------------------------------
+		Preconditions:
+		  clock      - the HAL clock
+		  exit_delay - the seconds from ARM to ENABLED
+		  state      - the state to start in
+		----------------------------------------------------------------------
+		"""
+		self._clock         = clock
+		self._events        = queue.SimpleQueue()
+		self._effects       = queue.SimpleQueue()
+		self._on_transition = None
+		self._threads       = []
+		self._running       = False
+		self._draining      = False
+		self._lock          = threading.Lock() # guards _draining
+		self._arming        = 0                # the ARMED event each arming waits for
+		self.exit_delay     = exit_delay
+		self.state          = state
+
+		# Statistics
+		self.events      = 0
+		self.transitions = 0
+		self.ignored     = 0
+		return
+
+	def set_on_transition( self, function ):
+		"""
+		----------------------------------------------------------------------
+		Sets the handler, called as function( state, previous, event, value )
+		after each transition
+		----------------------------------------------------------------------
+		"""
+		self._on_transition = function
+		return
+
+	def start( self ):
+		"""
+		----------------------------------------------------------------------
+		Starts applying events
+		----------------------------------------------------------------------
+		"""
+		if self._running:
+			return
+		self._running = True
+		if self._clock.virtual:
+			self._schedule()
+			return
+		for name, target in ( ( "alarm", self._run ), ( "alarm-effects", self._run_effects ) ):
+			thread = threading.Thread( target = target, name = name, daemon = True )
+			thread.start()
+			self._threads.append( thread )
+		return
+
+	def stop( self ):
+		"""
+		----------------------------------------------------------------------
+		Applies the events already posted, runs their effects, and stops
+		----------------------------------------------------------------------
+		"""
+		if not self._running:
+			return
+		self._running = False
+		if self._threads:
+			self._events.put( None )
+			self._threads[0].join()
+			self._effects.put( None )
+			self._threads[1].join()
+			self._threads = []
+		return
+
+	def post( self, event, value = None ):
+		"""
+		----------------------------------------------------------------------
+		Queues an event; safe from any thread
+		----------------------------------------------------------------------
+		Preconditions:
+		  event - one of the EVENT_ constants
+		  value - the mode word for EVENT_MODE, the detection for
+		          EVENT_DETECTION
+		----------------------------------------------------------------------
+		"""
+		self._events.put( ( event, value ) )
+		if self._clock.virtual and self._running:
+			self._schedule()
+		return
+
+	def _next_state( self, event, value ):
+		"""
+		----------------------------------------------------------------------
+		Returns the state an event moves to, or None to stay
+		----------------------------------------------------------------------
+		"""
+		state = self.state
+		if event == EVENT_MODE:
+			if value == mode_word( state ):
+				return None
+			event = { STANDBY: EVENT_DISARM, ENABLED: EVENT_ARM, TRIGGERED: EVENT_DETECTION }.get( value )
+
+		if event == EVENT_ARM and state == STANDBY:
+			return ARMING
+		if event == EVENT_ARMED and state == ARMING and value == self._arming:
+			return ENABLED
+		if event == EVENT_DETECTION and state == ENABLED:
+			return TRIGGERED
+		if event == EVENT_DISARM and state != STANDBY:
+			return STANDBY
+		return None
+
+	def _apply( self, event, value ):
+		self.events += 1
+		state = self._next_state( event, value )
+		if state is None:
+			self.ignored += 1
+			return
+
+		previous   = self.state
+		self.state = state
+		self.transitions += 1
+		if state == ARMING:
+			self._arming += 1
+			self._clock.call_later( self.exit_delay, self.post, EVENT_ARMED, self._arming )
+
+		if self._clock.virtual:
+			self._clock.call_later( 0, self._effect, state, previous, event, value )
+		else:
+			self._effects.put( ( state, previous, event, value ) )
+		return
+
+	def _effect( self, state, previous, event, value ):
+		if self._on_transition is None:
+			return
+		try:
+			self._on_transition( state, previous, event, value )
+		except Exception:
+			traceback.print_exc()
+		return
+
+	def _schedule( self ):
+		with self._lock:
+			if self._draining:
+				return
+			self._draining = True
+		self._clock.call_later( 0, self._drain )
+		return
+
+	def _drain( self ):
+		while True:
+			with self._lock:
+				if self._events.empty():
+					self._draining = False
+					return
+			self._apply( *self._events.get() )
+		return
+
+	def _run( self ):
+		while True:
+			item = self._events.get()
+			if item is None:
+				return
+			self._apply( *item )
+		return
+
+	def _run_effects( self ):
+		while True:
+			item = self._effects.get()
+			if item is None:
+				return
+			self._effect( *item )
+		return
@@ -0,0 +1,264 @@
+import os
+import json
+import threading
+
+from devices.sensors.running_stats import RunningStats
+
+"""
+------------------------------------------------------------------------------
+Thresholds learned from each sensor's baseline, for main.py.
+
+The common thresholds of the configuration suit no pad or room exactly: a
+noisy pad over-alarms at them and a quiet one under-detects, and the echo
+changes of a sensor move with the temperature and what is in the room.
+While the alarm is in standby, main.py gives every feature the detector
+computes to a Calibration: each pad's step (and its level), and each
+ultrasonic sensor's median echo change (and its echo time). Each feature's
+running statistics give its sensor the threshold
+
+  mean + sigmas * std, kept within floor and ceiling times the common one
+
+once 'warmup' samples have been learned; until then the common threshold
+stands. Samples over a learned threshold are not learned, so people moving
+about while the alarm is disarmed do not raise it. The statistics forget
+with a time constant of 'memory' samples, so the thresholds follow drift.
+
+The baselines are saved to a JSON file now and then and at shutdown, and
+loaded at startup, so a restart keeps its thresholds. Sensors are keyed by
+their ADC conversion and pins, and a baseline whose sensor is gone from
+the configuration is kept in the file for when it comes back.
+------------------------------------------------------------------------------
+"""
+
+PRESSURE   = "pressure"
+ULTRASONIC = "ultrasonic"
+VERSION    = 1
+
+class _Baseline:
+	__slots__ = ( "feature", "level", "rejected" )
+
+	def __init__( self, memory ):
+		self.feature  = RunningStats( memory ) # what the threshold applies to
+		self.level    = RunningStats( memory ) # the reading it comes from
+		self.rejected = 0
+		return
+
+	def state( self ):
+		return { "feature" : self.feature.state(), "level" : self.level.state() }
+
+	def restore( self, state ):
+		self.feature.restore( state["feature"] )
+		self.level.restore( state["level"] )
+		return
+
+
+class Calibration:
+	"""
+	--------------------------------------------------------------------------
+	Baseline Calibration
+	--------------------------------------------------------------------------
+	Description:
+	  Learns a baseline for every pressure pad and ultrasonic sensor, and
+	  gives each the threshold its baseline implies. The pressure and
+	  ultrasonic checks learn, and save() runs, on threads of their own,
+	  so the baselines are only touched under a lock; save() writes the
+	  file outside it, from a snapshot.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, path, pads, sensors, pressure_threshold, ultrasonic_threshold,
+	              sigmas = 6.0, memory = 10000, warmup = 200, floor = 0.25, ceiling = 4.0 ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a calibration with no baselines; see load()
+		----------------------------------------------------------------------
+		Preconditions:
+		  path                 - the file the baselines are saved in
+		  pads                 - the key of each pressure pad
+		  sensors              - the key of each ultrasonic sensor
+		  pressure_threshold   - the common pressure threshold
+		  ultrasonic_threshold - the common ultrasonic threshold
+		  sigmas               - the standard deviations over the mean a
+		                         learned threshold is
+		  memory               - the samples the statistics forget over
+		  warmup               - the samples learned before a threshold is
+		  floor                - the lowest learned threshold, as a fraction
+		                         of the common one
+		  ceiling              - the highest, as a multiple of it
+		----------------------------------------------------------------------
+		"""
+		self._path    = path
+		self._keys    = { PRESSURE: list( pads ), ULTRASONIC: list( sensors ) }
+		self._saved   = { PRESSURE: {}, ULTRASONIC: {} } # the file's baselines, by key
+		self._dirty   = False
+		self._lock    = threading.Lock() # guards the baselines and _dirty
+		self._sensors = { kind: [ _Baseline( memory ) for key in keys ] for kind, keys in self._keys.items() }
+		self.configure( pressure_threshold, ultrasonic_threshold, sigmas, memory, warmup, floor, ceiling )
+
+		# Statistics
+		self.loaded = 0 # baselines restored from the file
+		self.saves  = 0
+		return
+
+	def configure( self, pressure_threshold, ultrasonic_threshold, sigmas, memory, warmup, floor, ceiling ):
+		"""
+		----------------------------------------------------------------------
+		Changes the common thresholds and how the learned ones follow from
+		the baselines, keeping the baselines
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			self._common  = { PRESSURE: pressure_threshold, ULTRASONIC: ultrasonic_threshold }
+			self._sigmas  = sigmas
+			self._warmup  = warmup
+			self._floor   = floor
+			self._ceiling = ceiling
+			for baselines in self._sensors.values():
+				for baseline in baselines:
+					baseline.feature.memory = memory
+					baseline.level.memory   = memory
+		return
+
+	def load( self ):
+		"""
+		----------------------------------------------------------------------
+		Restores the saved baselines of the configured sensors
+		----------------------------------------------------------------------
+		Postconditions:
+		  Raises OSError or ValueError if the file exists but cannot be read
+		 returns:
+		  the number of baselines restored
+		----------------------------------------------------------------------
+		"""
+		if not os.path.exists( self._path ):
+			return 0
+		with open( self._path ) as handle:
+			saved = json.load( handle )
+		try:
+			if saved["version"] != VERSION:
+				raise ValueError( "version {} is not {}".format( saved["version"], VERSION ) )
+			for kind, keys in self._keys.items():
+				self._saved[kind] = dict( saved[kind] )
+				for index, key in enumerate( keys ):
+					if key in self._saved[kind]:
+						self._sensors[kind][index].restore( self._saved[kind][key] )
+						self.loaded += 1
+		except (KeyError, TypeError) as error:
+			raise ValueError( "malformed baselines: {!r}".format( error ) )
+		return self.loaded
+
+	def save( self ):
+		"""
+		----------------------------------------------------------------------
+		Writes the baselines if they have changed since the last save; the
+		file is replaced whole, so a crash leaves the old or the new one.
+		What is learned while the file is written is saved the next time.
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			if not self._dirty:
+				return
+			for kind, keys in self._keys.items():
+				for key, baseline in zip( keys, self._sensors[kind] ):
+					self._saved[kind][key] = baseline.state()
+			saved = json.dumps( dict( self._saved, version = VERSION ), indent = 1, sort_keys = True )
+			self._dirty = False
+
+		temporary = self._path + ".tmp"
+		try:
+			with open( temporary, "w" ) as handle:
+				handle.write( saved )
+				handle.flush()
+				os.fsync( handle.fileno() )
+			os.replace( temporary, self._path )
+		except OSError:
+			self._dirty = True # retried at the next save
+			raise
+		self.saves += 1
+		return
+
+	def learn_pressure( self, pad, step, level ):
+		"""
+		----------------------------------------------------------------------
+		Learns one batch of a pad: its step and its level
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  the pad's threshold
+		----------------------------------------------------------------------
+		"""
+		return self._learn( PRESSURE, pad, step, level )
+
+	def learn_echo( self, sensor, median, echo ):
+		"""
+		----------------------------------------------------------------------
+		Learns one ping of a sensor: its median echo change and its echo
+		time, in s
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  the sensor's threshold
+		----------------------------------------------------------------------
+		"""
+		return self._learn( ULTRASONIC, sensor, median, echo )
+
+	def pressure_threshold( self, pad ):
+		with self._lock:
+			return self._threshold( PRESSURE, self._sensors[PRESSURE][pad] )
+
+	def ultrasonic_threshold( self, sensor ):
+		with self._lock:
+			return self._threshold( ULTRASONIC, self._sensors[ULTRASONIC][sensor] )
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the baselines as a dictionary
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  by kind (PRESSURE, ULTRASONIC), a list with a dictionary for
+		  each sensor:
+		    "key"       - the sensor's key
+		    "threshold" - its threshold
+		    "learned"   - whether the threshold is a learned one
+		    "samples"   - the samples learned
+		    "mean"      - the mean of its feature
+		    "std"       - the standard deviation of its feature
+		    "level"     - the mean of its reading
+		    "rejected"  - the samples over its threshold not learned
+		----------------------------------------------------------------------
+		"""
+		stats = {}
+		with self._lock:
+			for kind, keys in self._keys.items():
+				stats[kind] = [ {
+					"key"       : key,
+					"threshold" : self._threshold( kind, baseline ),
+					"learned"   : baseline.feature.count >= self._warmup,
+					"samples"   : baseline.feature.count,
+					"mean"      : baseline.feature.mean,
+					"std"       : baseline.feature.std,
+					"level"     : baseline.level.mean,
+					"rejected"  : baseline.rejected,
+				} for key, baseline in zip( keys, self._sensors[kind] ) ]
+		return stats
+
+	def _learn( self, kind, index, feature, level ):
+		with self._lock:
+			baseline  = self._sensors[kind][index]
+			threshold = self._threshold( kind, baseline )
+			if baseline.feature.count >= self._warmup and feature > threshold:
+				baseline.rejected += 1
+				return threshold
+			baseline.feature.add( feature )
+			baseline.level.add( level )
+			self._dirty = True
+			return self._threshold( kind, baseline )
+
+	def _threshold( self, kind, baseline ):
+		common = self._common[kind]
+		if baseline.feature.count < self._warmup:
+			return common
+		learned = baseline.feature.bound( self._sigmas )
+		return min( max( learned, self._floor * common ), self._ceiling * common )
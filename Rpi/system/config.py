@@ -0,0 +1,426 @@
+import os
+import json
+import types
+import signal
+
+"""
+------------------------------------------------------------------------------
+Configuration file for main.py. Every pin, threshold, window and period is
+described by SCHEMA, with its default and whether it can change while the
+system runs. The file is JSON, sectioned like SCHEMA; anything it leaves out
+takes the default, and unknown or invalid entries are rejected:
+
+  {
+    "ultrasonic" : { "threshold" : 1.2e-4, "window" : 5 },
+    "pressure"   : { "period" : 0.02 }
+  }
+
+Settings marked reloadable are picked up by a running system when it gets
+SIGHUP or the file changes (see ConfigWatcher); the rest need a restart.
+------------------------------------------------------------------------------
+"""
+
+class ConfigError( ValueError ):
+	pass
+
+#-----------------------------------------------------------------------------
+# Checks; each returns a message if the value is invalid
+#-----------------------------------------------------------------------------
+
+def _pin( value ):
+	if not isinstance( value, int ) or isinstance( value, bool ) or not 0 <= value <= 27:
+		return "must be a BCM pin number (0-27)"
+	return None
+
+def _optional_pin( value ):
+	return None if value is None else _pin( value )
+
+def _pins( count ):
+	def check( value ):
+		if not isinstance( value, list ) or len( value ) != count:
+			return "must be a list of {} pins".format( count )
+		for pin in value:
+			if _pin( pin ):
+				return _pin( pin )
+		return None
+	return check
+
+def _positive( value ):
+	if not isinstance( value, (int, float) ) or isinstance( value, bool ) or value <= 0:
+		return "must be a number greater than 0"
+	return None
+
+def _count( value ):
+	if not isinstance( value, int ) or isinstance( value, bool ) or value < 1:
+		return "must be a whole number of at least 1"
+	return None
+
+def _index( value ):
+	if not isinstance( value, int ) or isinstance( value, bool ) or not 0 <= value <= 7:
+		return "must be 0-7"
+	return None
+
+def _fraction( value ):
+	if _positive( value ) or value > 1:
+		return "must be a number greater than 0 and at most 1"
+	return None
+
+def _power_of_two( value ):
+	if _count( value ) or value & (value - 1):
+		return "must be a power of two"
+	return None
+
+def _whole( value ):
+	if not isinstance( value, int ) or isinstance( value, bool ) or value < 0:
+		return "must be a whole number"
+	return None
+
+def _flag( value ):
+	if not isinstance( value, bool ):
+		return "must be true or false"
+	return None
+
+def _text( value ):
+	if not isinstance( value, str ) or not value:
+		return "must be a non-empty string"
+	return None
+
+def _choice( *options ):
+	def check( value ):
+		if value not in options:
+			return "must be one of " + ", ".join( '"{}"'.format( option ) for option in options )
+		return None
+	return check
+
+def _pads( value ):
+	if not isinstance( value, list ) or not value:
+		return "must be a list of at least one pad"
+	for pad in value:
+		if not isinstance( pad, dict ) or set( pad ) != { "channel", "differential" }:
+			return "each pad must have exactly a 'channel' and a 'differential'"
+		for key in ( "channel", "differential" ):
+			if _index( pad[key] ):
+				return "pad " + key + " " + _index( pad[key] )
+	return None
+
+def _sensors( value ):
+	if not isinstance( value, list ):
+		return "must be a list of sensors"
+	for sensor in value:
+		if not isinstance( sensor, dict ) or set( sensor ) != { "trigger", "echo" }:
+			return "each sensor must have exactly a 'trigger' and an 'echo'"
+		for key in ( "trigger", "echo" ):
+			if _pin( sensor[key] ):
+				return "sensor " + key + " " + _pin( sensor[key] )
+	return None
+
+def _groups( value ):
+	if value is None:
+		return None
+	if not isinstance( value, list ) or not value:
+		return "must be null or a list of groups"
+	for group in value:
+		if not isinstance( group, list ) or not group or any( _whole( index ) for index in group ):
+			return "each group must be a non-empty list of sensor indices"
+	return None
+
+def _policy( value ):
+	keys = ( "standby", "arming", "enabled", "triggered", "burst" )
+	if not isinstance( value, dict ) or set( value ) != set( keys ):
+		return "must give exactly a scale for each of " + ", ".join( keys )
+	for key in keys:
+		scale = value[key]
+		if not isinstance( scale, (int, float) ) or isinstance( scale, bool ) or scale < 0:
+			return "{} must be a number of at least 0".format( key )
+	return None
+
+# section -> key -> ( default, check, reloadable )
+SCHEMA = {
+	"pins" : {
+		"led_red"        : ( 13,         _pin,          False ),
+		"led_green"      : ( 26,         _pin,          False ),
+		"led_yellow"     : ( 19,         _pin,          False ),
+		"beeper"         : ( 12,         _pin,          False ),
+		"hcsr04_trigger" : ( 21,         _pin,          False ),
+		"hcsr04_echo"    : ( 25,         _pin,          False ),
+		"radio_switch_a" : ( 20,         _pin,          False ),
+		"radio_switch_b" : ( 16,         _pin,          False ),
+		"in_mode"        : ( [ 27, 22 ], _pins( 2 ),    False ), # From the DE board, high bit first
+		"out_mode"       : ( [ 23, 24 ], _pins( 2 ),    False ), # To the DE board, high bit first
+		"out_strobe"     : ( None,       _optional_pin, False ),
+	},
+	"adc" : {
+		"device"         : ( 0,          _index,        False ),
+		"chip_select"    : ( 1,          _index,        False ),
+		"pads"           : ( [ { "channel": 0, "differential": 0 } ], _pads, False ),
+		"sample_rate"    : ( 1000,       _positive,     True  ), # Hz, per pad
+		"buffer_size"    : ( 4096,       _count,        False ), # samples held per pad
+	},
+	"pressure" : {
+		"threshold"      : ( 8,          _positive,     True  ), # ADC counts
+		"period"         : ( 0.05,       _positive,     True  ), # s
+		"deadline"       : ( 0.05,       _positive,     True  ), # s
+	},
+	"ultrasonic" : {
+		"threshold"      : ( 0.95e-4,    _positive,     True  ), # s of echo change
+		"window"         : ( 4,          _count,        True  ), # samples in the median
+		"timeout"        : ( 0.06,       _positive,     True  ), # s, longest wait for an echo
+		"period"         : ( 0.1,        _positive,     True  ), # s
+		"deadline"       : ( 0.1,        _positive,     True  ), # s
+		"sensors"        : ( [],         _sensors,      False ), # more sensors, after the one on pins.hcsr04_*
+		"groups"         : ( None,       _groups,       False ), # sensor indices fired together (null: one each)
+		"guard"          : ( 0.01,       _positive,     True  ), # s of quiet between groups
+	},
+	"fusion" : {
+		"smoothing"      : ( 8,          _count,        False ), # samples in the pressure moving average
+		"window"         : ( 20,         _count,        False ), # pings the correlation is taken over
+		"noise_sigmas"   : ( 4.0,        _positive,     True  ), # noise a pressure step must also exceed
+		"corroborate"    : ( 0.5,        _fraction,     True  ), # evidence each sensor needs to fuse
+		"correlation"    : ( 0.5,        _fraction,     True  ), # correlation a fused detection needs
+	},
+	"adaptive" : {
+		"enabled"        : ( False,      _flag,         False ), # sampling rates by alarm state; see system/adaptive.py
+		"pressure"       : ( { "standby": 0.2, "arming": 1.0, "enabled": 1.0, "triggered": 0.2, "burst": 2.0 },
+		                     _policy,                   True  ), # scales of the ADC and check rates (0: off)
+		"ultrasonic"     : ( { "standby": 0.2, "arming": 1.0, "enabled": 1.0, "triggered": 0.2, "burst": 1.5 },
+		                     _policy,                   True  ), # scales of the ping rate (0: off)
+		"approach"       : ( 0.5,        _fraction,     True  ), # evidence that starts a burst while enabled
+		"hold"           : ( 5.0,        _positive,     True  ), # s a burst outlasts the evidence
+	},
+	"calibration" : {
+		"enabled"        : ( False,      _flag,         False ), # thresholds learned in standby; see system/calibration.py
+		"path"           : ( "calibration.json", _text, False ), # the baselines, kept across restarts
+		"sigmas"         : ( 6.0,        _positive,     True  ), # standard deviations over the mean of a threshold
+		"memory"         : ( 10000,      _count,        True  ), # samples the baselines forget over
+		"warmup"         : ( 200,        _count,        True  ), # samples learned before a threshold is
+		"floor"          : ( 0.25,       _fraction,     True  ), # lowest threshold, of the common one
+		"ceiling"        : ( 4.0,        _positive,     True  ), # highest threshold, in common ones
+		"save_period"    : ( 60.0,       _positive,     True  ), # s between saves of the baselines
+	},
+	"switches" : {
+		"debounce_a"     : ( 0.02,       _positive,     True  ), # s radio switch A must be quiet
+		"debounce_b"     : ( 0.02,       _positive,     True  ), # s radio switch B must be quiet
+		"bouncetime"     : ( 0,          _whole,        False ), # ms RPi.GPIO drops edges for (0: off)
+	},
+	"mode" : {
+		"settle"         : ( 0.002,      _positive,     False ), # s the DE board pins must be stable
+	},
+	"arming" : {
+		"beep"           : ( 0.1,        _positive,     True  ), # s, exit delay beeps
+		"gap"            : ( 0.5,        _positive,     True  ), # s between them
+		"count"          : ( 3,          _count,        True  ),
+		"armed_beep"     : ( 1.0,        _positive,     True  ), # s
+		"standby_beep"   : ( 0.5,        _positive,     True  ), # s
+	},
+	"audio" : {
+		"rate"           : ( 11025,      _count,        False ), # Hz, the rate of the .wav files
+		"period"         : ( 128,        _count,        False ), # frames per write
+	},
+	"siren" : {
+		"enabled"        : ( False,      _flag,         False ), # a siren on the CPA417 DAC when triggered
+		"device"         : ( 0,          _index,        False ),
+		"chip_select"    : ( 0,          _index,        False ),
+		"rate"           : ( 8000,       _count,        False ), # Hz
+		"batch"          : ( 256,        _count,        False ), # samples per SPI message
+		"low"            : ( 600,        _positive,     False ), # Hz, the bottom of the sweep
+		"high"           : ( 1200,       _positive,     False ), # Hz, the top of the sweep
+		"sweep"          : ( 1.0,        _positive,     False ), # s, up and back down
+	},
+	"recording" : {
+		"enabled"        : ( False,      _flag,         False ), # raw sensor values, for system/replay.py
+		"path"           : ( "recording.bin", _text,    False ), # rotated files get .1, .2, ...
+		"chunk"          : ( 4194304,    _count,        False ), # bytes the file grows by
+		"max_bytes"      : ( 268435456,  _count,        False ), # size a file is rotated at
+		"backups"        : ( 7,          _whole,        False ), # rotated files kept
+	},
+	"pubsub" : {
+		"enabled"        : ( False,      _flag,         False ), # the state and sensors on a Unix socket
+		"path"           : ( "pubsub.sock", _text,      False ),
+		"queue_size"     : ( 256,        _count,        False ), # frames held for each client
+		"interval"       : ( 0.1,        _positive,     True  ), # s between samples of a sensor
+	},
+	"telemetry" : {
+		"path"           : ( "telemetry.bin", _text,    False ), # rotated files get .1, .2, ...
+		"capacity"       : ( 4096,       _power_of_two, False ), # records held for the writer
+		"max_bytes"      : ( 1048576,    _count,        False ), # size a file is rotated at
+		"backups"        : ( 3,          _whole,        False ), # rotated files kept
+		"flush_interval" : ( 0.5,        _positive,     False ), # s between writes
+		"fsync"          : ( "interval", _choice( "never", "batch", "interval" ), False ),
+		"fsync_interval" : ( 5.0,        _positive,     False ), # s between fsyncs, for "interval"
+	},
+	"config" : {
+		"watch_period"   : ( 1.0,        _positive,     False ), # s between checks of the file
+	},
+	"processes" : {
+		"layout"         : ( "single",   _choice( "single", "split" ), False ), # "split" runs the sensors in a process of their own
+	},
+}
+
+def parse_config( data ):
+	"""
+	--------------------------------------------------------------------------
+	Validates a configuration and fills in the defaults
+	--------------------------------------------------------------------------
+	Preconditions:
+	  data - the decoded file, a dict of sections
+	Postconditions:
+	 returns:
+	  a namespace per section, e.g. config.ultrasonic.threshold
+	  raises ConfigError naming the first invalid entry
+	--------------------------------------------------------------------------
+	"""
+	if not isinstance( data, dict ):
+		raise ConfigError( "the configuration must be an object of sections" )
+	for name in data:
+		if name not in SCHEMA:
+			raise ConfigError( "unknown section '{}'".format( name ) )
+
+	config = types.SimpleNamespace()
+	for name, keys in SCHEMA.items():
+		given = data.get( name, {} )
+		if not isinstance( given, dict ):
+			raise ConfigError( "section '{}' must be an object".format( name ) )
+		for key in given:
+			if key not in keys:
+				raise ConfigError( "unknown setting '{}.{}'".format( name, key ) )
+
+		section = types.SimpleNamespace()
+		for key, ( default, check, reloadable ) in keys.items():
+			value = given.get( key, default )
+			error = check( value )
+			if error:
+				raise ConfigError( "{}.{} {}".format( name, key, error ) )
+			setattr( section, key, value )
+		setattr( config, name, section )
+
+	if config.pressure.deadline > config.pressure.period or config.ultrasonic.deadline > config.ultrasonic.period:
+		raise ConfigError( "a task deadline cannot be longer than its period" )
+	sensors = len( config.ultrasonic.sensors ) + 1
+	if config.ultrasonic.groups is not None and \
+	   sorted( index for group in config.ultrasonic.groups for index in group ) != list( range( sensors ) ):
+		raise ConfigError( "ultrasonic.groups must hold each of the {} sensors exactly once".format( sensors ) )
+	if config.siren.batch > 511:
+		raise ConfigError( "siren.batch must be at most 511, the transfers in one SPI message" )
+	if config.fusion.window < 3:
+		raise ConfigError( "fusion.window must be at least 3" )
+	return config
+
+def load_config( path = None ):
+	"""
+	--------------------------------------------------------------------------
+	Reads and validates a configuration file. A missing file, or no path,
+	gives the defaults.
+	--------------------------------------------------------------------------
+	Postconditions:
+	  raises ConfigError if the file cannot be parsed or is invalid
+	--------------------------------------------------------------------------
+	"""
+	data = {}
+	if path is not None and os.path.exists( path ):
+		try:
+			with open( path ) as handle:
+				data = json.load( handle )
+		except ValueError as error:
+			raise ConfigError( "{}: {}".format( path, error ) )
+	return parse_config( data )
+
+def config_changes( old, new ):
+	"""
+	--------------------------------------------------------------------------
+	Returns the settings that differ as "section.key" names, split into
+	( reloadable, restart_needed )
+	--------------------------------------------------------------------------
+	"""
+	reloadable = []
+	restart    = []
+	for name, keys in SCHEMA.items():
+		for key, ( default, check, can_reload ) in keys.items():
+			if getattr( getattr( old, name ), key ) != getattr( getattr( new, name ), key ):
+				( reloadable if can_reload else restart ).append( name + "." + key )
+	return reloadable, restart
+
+
+class ConfigWatcher:
+	"""
+	--------------------------------------------------------------------------
+	Configuration Reloader
+	--------------------------------------------------------------------------
+	Description:
+	  Reloads the configuration when the process gets SIGHUP or the file's
+	  modification time changes. The signal handler only sets a flag; the
+	  file is read by check(), which is meant to run as a scheduler task.
+	  That task runs alongside the sensor checks, so on_change must hold
+	  whatever lock the checks hold while applying the settings (main.py's
+	  settings_lock).
+
+	  An invalid file is reported and ignored, and the running settings
+	  are kept.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, path, config, on_change ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a watcher
+		----------------------------------------------------------------------
+		Preconditions:
+		  path      - the configuration file
+		  config    - the configuration in use
+		  on_change - called as on_change( new, old ) after a reload
+		----------------------------------------------------------------------
+		"""
+		self._path      = path
+		self._on_change = on_change
+		self._mtime     = self._modified()
+		self._hangup    = False
+		self.config     = config
+
+		# Statistics
+		self.reloads  = 0
+		self.failures = 0
+		return
+
+	def install( self ):
+		"""
+		----------------------------------------------------------------------
+		Handles SIGHUP. Must be called from the main thread.
+		----------------------------------------------------------------------
+		"""
+		if hasattr( signal, "SIGHUP" ):
+			signal.signal( signal.SIGHUP, self._on_hangup )
+		return
+
+	def check( self ):
+		"""
+		----------------------------------------------------------------------
+		Reloads the file if it was signalled or has changed
+		----------------------------------------------------------------------
+		"""
+		mtime = self._modified()
+		if not self._hangup and mtime == self._mtime:
+			return
+		self._hangup = False
+		self._mtime  = mtime
+
+		try:
+			config = load_config( self._path )
+		except (ConfigError, OSError) as error:
+			self.failures += 1
+			print( "Configuration not reloaded: {}".format( error ) )
+			return
+
+		old         = self.config
+		self.config = config
+		self.reloads += 1
+		self._on_change( config, old )
+		return
+
+	def _modified( self ):
+		try:
+			return os.stat( self._path ).st_mtime_ns
+		except OSError:
+			return None
+
+	def _on_hangup( self, signum, frame ):
+		self._hangup = True
+		return
@@ -0,0 +1,207 @@
+import os
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+"""
+------------------------------------------------------------------------------
+Rings shared between processes, for system/sensing.py.
+
+A SharedRing is the RingBuffer of devices/ringbuffer.py kept in a block of
+multiprocessing.shared_memory, written by one process and read by another
+that was forked after it was made. Its items are numbers of an array
+typecode, as a RingBuffer's are, or records of a struct format.
+
+  block : the count of items written ('Q'), then 'capacity' items
+
+The count is stored after the items are, and read before they are loaded,
+under a multiprocessing lock: on the Pi's ARM cores plain stores may be
+seen by the other core out of order, and the lock's barriers keep a reader
+from seeing the count before the items it covers. Nothing else is done
+under it, so neither side waits on the other for longer than a store.
+------------------------------------------------------------------------------
+"""
+
+COUNT = struct.Struct( "Q" )
+
+class SharedRing:
+	"""
+	--------------------------------------------------------------------------
+	Shared-memory Ring Buffer
+	--------------------------------------------------------------------------
+	Description:
+	  A single-producer ring in shared memory. Like a RingBuffer, consumers
+	  keep their own cursor and read() gives memoryview slices of the
+	  shared block, without copying; records() unpacks the items of a
+	  struct format as tuples instead.
+
+	  A consumer that falls more than 'capacity' items behind has lost
+	  them; they are counted in its process's 'overruns', and the cursor
+	  is moved up to the oldest item still held. Slices stay valid only
+	  until the producer wraps around onto them.
+
+	  The process that made the ring unlinks the block on close().
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, capacity, format = 'H', context = None ):
+		"""
+		----------------------------------------------------------------------
+		Makes an empty ring; fork the processes sharing it after this
+		----------------------------------------------------------------------
+		Preconditions:
+		  capacity - the number of items held
+		  format   - an array typecode, or a struct format for records
+		             (default: 'H')
+		  context  - the multiprocessing context the lock comes from
+		             (default: fork)
+		----------------------------------------------------------------------
+		"""
+		if capacity < 1:
+			raise ValueError( "capacity must be at least 1" )
+		if context is None:
+			context = multiprocessing.get_context( "fork" )
+		self._item    = struct.Struct( format if len( format ) == 1 else "<" + format.lstrip( "<=@" ) )
+		self.capacity = capacity
+		self.overruns = 0 # items lost by this process's consumers
+		self._owner   = os.getpid()
+		self._lock    = context.Lock()
+		self._memory  = shared_memory.SharedMemory( create = True, size = COUNT.size + capacity * self._item.size )
+		self._written = 0 # the producer's count, published under the lock
+
+		buffer        = self._memory.buf
+		self._count   = buffer[:COUNT.size].cast( "Q" )
+		self._data    = buffer[COUNT.size:COUNT.size + capacity * self._item.size]
+		self._values  = self._data.cast( format ) if len( format ) == 1 else None
+		self._count[0] = 0
+		return
+
+	def __len__( self ):
+		return min( self.written, self.capacity )
+
+	@property
+	def name( self ):
+		return self._memory.name
+
+	@property
+	def written( self ):
+		# The total items ever written, as published by the producer
+		with self._lock:
+			return self._count[0]
+
+	def append( self, item ):
+		"""
+		----------------------------------------------------------------------
+		Writes one item, overwriting the oldest if the ring is full; an item
+		of a struct format is a tuple of its fields
+		----------------------------------------------------------------------
+		"""
+		self._store( self._written, item )
+		self._written += 1
+		self._publish()
+		return
+
+	def extend( self, items ):
+		"""
+		----------------------------------------------------------------------
+		Writes a sequence of items, published together
+		----------------------------------------------------------------------
+		"""
+		for item in items:
+			self._store( self._written, item )
+			self._written += 1
+		self._publish()
+		return
+
+	def read( self, cursor ):
+		"""
+		----------------------------------------------------------------------
+		Returns every item written since 'cursor', as RingBuffer.read()
+		does; only for rings of an array typecode
+		----------------------------------------------------------------------
+		Preconditions:
+		  cursor - the value of 'written' when this consumer last read
+		           (0 to start from the oldest item held)
+		Postconditions:
+		 returns:
+		  ( slices, cursor ) - a list of one or two memoryviews, oldest
+		                       first, and the cursor for the next read
+		----------------------------------------------------------------------
+		"""
+		begin, end = self._span( cursor )
+		return self._slices( self._values, begin, end ), end
+
+	def records( self, cursor ):
+		"""
+		----------------------------------------------------------------------
+		Returns every item written since 'cursor', unpacked
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  ( items, cursor ) - a list of the items as tuples, oldest first,
+		                      and the cursor for the next read
+		----------------------------------------------------------------------
+		"""
+		begin, end = self._span( cursor )
+		size  = self._item.size
+		items = []
+		for view in self._slices( self._data, begin * size, end * size, size ):
+			items.extend( self._item.iter_unpack( view ) )
+
+		# Items the producer wrapped onto while they were unpacked are lost
+		lapped = self.written - self.capacity - begin
+		if lapped > 0:
+			self.overruns += lapped
+			items          = items[lapped:]
+		return items, end
+
+	def close( self ):
+		"""
+		----------------------------------------------------------------------
+		Frees the block if this process made the ring, and unmaps it unless
+		slices of it are still held, in which case it is unmapped at exit
+		----------------------------------------------------------------------
+		"""
+		if self._memory is None:
+			return
+		if os.getpid() == self._owner:
+			self._memory.unlink()
+		try:
+			for view in ( self._values, self._data, self._count ):
+				if view is not None:
+					view.release()
+			self._memory.close()
+		except BufferError:
+			pass
+		self._memory = None
+		return
+
+	def _store( self, index, item ):
+		if self._values is not None:
+			self._values[index % self.capacity] = item
+		else:
+			self._item.pack_into( self._data, (index % self.capacity) * self._item.size, *item )
+		return
+
+	def _publish( self ):
+		with self._lock:
+			self._count[0] = self._written
+		return
+
+	def _span( self, cursor ):
+		written = self.written
+		if written - cursor > self.capacity:
+			self.overruns += written - cursor - self.capacity
+			cursor         = written - self.capacity
+		return cursor, written
+
+	def _slices( self, view, begin, end, unit = 1 ):
+		# Slices of 'view' for items begin to end, counted in 'unit's
+		if begin >= end:
+			return []
+		span  = self.capacity * unit
+		first = begin % span
+		last  = end % span
+		if first < last or last == 0:
+			return [ view[first:last or span] ]
+		return [ view[first:], view[:last] ]
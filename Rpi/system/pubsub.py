@@ -0,0 +1,479 @@
+import os
+import json
+import errno
+import socket
+import struct
+import argparse
+import threading
+import selectors
+import collections
+
+"""
+------------------------------------------------------------------------------
+Local publish/subscribe of the alarm state and sensor streams, over a Unix
+domain socket, so other programs on the Pi can follow the system without
+scraping its console.
+
+Every message is a frame: a header of its kind and payload length, then the
+payload. On connecting, a client is sent the topic names; it is then sent
+every state change, event and (decimated) sample, on every topic unless it
+subscribes to some.
+
+  header    : kind, 0, payload length
+  TOPICS    : the topic names as JSON; a topic's id is its index
+  SAMPLE    : time (ns, on the HAL clock), value, topic
+  EVENT     : time, value, topic; never decimated, e.g. detections
+  STATE     : time, state, previous state
+  DROPPED   : the frames dropped since the last, because the client was
+              slow; sent before the next frame it gets
+  SUBSCRIBE : (client to server) the topic ids to be sent; none for all
+
+Follow a running system with:
+
+  python -m system.pubsub pubsub.sock [--topic name]
+------------------------------------------------------------------------------
+"""
+
+HEADER  = struct.Struct( "<BxH" )
+SAMPLE  = struct.Struct( "<qdH" )
+STATE   = struct.Struct( "<qBB" )
+DROPPED = struct.Struct( "<I" )
+TOPIC   = struct.Struct( "<H" )
+
+KIND_TOPICS, KIND_SAMPLE, KIND_EVENT, KIND_STATE, KIND_DROPPED, KIND_SUBSCRIBE = range( 1, 7 )
+
+class _Client:
+	"""
+	--------------------------------------------------------------------------
+	A connected client: the frames queued for it, and what is left of the
+	write in progress. The queue drops its oldest frame when full.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, connection, queue_size ):
+		self.connection = connection
+		self.frames     = collections.deque( maxlen = queue_size )
+		self.pending    = b""
+		self.topics     = None # subscribed topic ids; None for every topic
+		self.received   = b""
+		self.dropped    = 0    # frames dropped in all
+		self.reported   = 0    # of those, the ones DROPPED frames have told of
+		self.writing    = False
+		return
+
+
+class PubSubServer:
+	"""
+	--------------------------------------------------------------------------
+	Publish/Subscribe Server
+	--------------------------------------------------------------------------
+	Description:
+	  publish(), publish_event() and publish_state() never block and take
+	  no lock: a frame is packed once and appended to each client's bounded
+	  queue, and a full queue drops its oldest frame and counts it, so a
+	  slow or stalled client can never delay the detection. With no
+	  clients, publishing costs a check. A server thread (or clock events
+	  on the simulated backend) accepts clients and writes their queues
+	  with non-blocking sends.
+
+	  Samples are decimated per topic: each 'interval' at most one is sent,
+	  the largest since the last, so a short peak is not lost to the
+	  decimation.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_QUEUE_SIZE = 256 # frames per client
+	DEFAULT_INTERVAL   = 0.1 # s between samples of a topic
+	POLL_INTERVAL      = 0.01 # s between polls on the simulated backend
+	WRITE_SIZE         = 65536 # bytes of frames sent at once
+
+	def __init__( self, clock, path, queue_size = DEFAULT_QUEUE_SIZE, interval = DEFAULT_INTERVAL ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a server; the socket is opened by start()
+		----------------------------------------------------------------------
+		Preconditions:
+		  clock      - the HAL clock frames are timed by
+		  path       - the Unix socket to listen on
+		  queue_size - the frames held for each client
+		  interval   - the seconds between samples of a topic
+		----------------------------------------------------------------------
+		"""
+		self._clock      = clock
+		self._now        = clock.perf_counter_ns
+		self._path       = path
+		self._queue_size = queue_size
+		self._topics     = []
+		self._peaks      = []   # the largest sample of each topic since the last sent
+		self._due        = []   # when each topic's next sample may be sent
+		self._clients    = ()   # replaced, never changed, so publishers need no lock
+		self._listener   = None
+		self._selector   = None
+		self._wake       = None # ( read, write ) ends of a pipe that wakes the thread
+		self._waking     = False
+		self._running    = False
+		self._thread     = None
+		self.set_interval( interval )
+
+		# Statistics
+		self.connects  = 0
+		self.published = 0
+		self.decimated = 0 # samples folded into a later one
+		self.sent      = 0 # frames sent, to all clients
+		self.dropped   = 0 # frames dropped, for all clients
+		return
+
+	def topic( self, name ):
+		"""
+		----------------------------------------------------------------------
+		Returns the id of the topic 'name', registering it if it is new.
+		Register every topic before start(), so clients are told them all.
+		----------------------------------------------------------------------
+		"""
+		if name not in self._topics:
+			self._topics.append( name )
+			self._peaks.append( None )
+			self._due.append( 0 )
+		return self._topics.index( name )
+
+	def set_interval( self, seconds ):
+		"""
+		----------------------------------------------------------------------
+		Changes the seconds between samples of a topic
+		----------------------------------------------------------------------
+		"""
+		self._interval_ns = int( seconds * 1000000000 )
+		return
+
+	def start( self ):
+		"""
+		----------------------------------------------------------------------
+		Listens on the socket, replacing any left by an earlier run
+		----------------------------------------------------------------------
+		"""
+		if self._running:
+			return
+		try:
+			os.unlink( self._path )
+		except FileNotFoundError:
+			pass
+		self._listener = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+		self._listener.bind( self._path )
+		self._listener.listen()
+		self._listener.setblocking( False )
+
+		self._selector = selectors.DefaultSelector()
+		self._selector.register( self._listener, selectors.EVENT_READ )
+		self._running  = True
+		if self._clock.virtual:
+			self._clock.call_later( PubSubServer.POLL_INTERVAL, self._tick )
+			return
+
+		self._wake = os.pipe()
+		os.set_blocking( self._wake[1], False )
+		self._selector.register( self._wake[0], selectors.EVENT_READ )
+		self._thread = threading.Thread( target = self._run, name = "pubsub", daemon = True )
+		self._thread.start()
+		return
+
+	def close( self ):
+		"""
+		----------------------------------------------------------------------
+		Disconnects every client and removes the socket
+		----------------------------------------------------------------------
+		"""
+		if not self._running:
+			return
+		self._running = False
+		if self._thread:
+			self._notify()
+			self._thread.join()
+			self._thread = None
+		for client in self._clients:
+			self._disconnect( client )
+		self._selector.close()
+		self._listener.close()
+		if self._wake:
+			os.close( self._wake[0] )
+			os.close( self._wake[1] )
+			self._wake = None
+		try:
+			os.unlink( self._path )
+		except FileNotFoundError:
+			pass
+		return
+
+	def publish( self, topic, value ):
+		"""
+		----------------------------------------------------------------------
+		Publishes a sample, decimated; safe from any thread, and never
+		blocks
+		----------------------------------------------------------------------
+		"""
+		if not self._clients:
+			return
+		now  = self._now()
+		peak = self._peaks[topic]
+		if peak is not None and peak > value:
+			value = peak
+		if now < self._due[topic]:
+			self._peaks[topic] = value
+			self.decimated    += 1
+			return
+		self._peaks[topic] = None
+		self._due[topic]   = now + self._interval_ns
+		self._send( topic, HEADER.pack( KIND_SAMPLE, SAMPLE.size ) + SAMPLE.pack( now, value, topic ) )
+		return
+
+	def publish_event( self, topic, value ):
+		"""
+		----------------------------------------------------------------------
+		Publishes a value that is not decimated, such as a detection
+		----------------------------------------------------------------------
+		"""
+		if not self._clients:
+			return
+		self._send( topic, HEADER.pack( KIND_EVENT, SAMPLE.size ) + SAMPLE.pack( self._now(), value, topic ) )
+		return
+
+	def publish_state( self, state, previous ):
+		"""
+		----------------------------------------------------------------------
+		Publishes a change of the alarm state, to every client
+		----------------------------------------------------------------------
+		"""
+		if not self._clients:
+			return
+		self._send( None, HEADER.pack( KIND_STATE, STATE.size ) + STATE.pack( self._now(), state, previous ) )
+		return
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the publishing statistics as a dictionary
+		----------------------------------------------------------------------
+		"""
+		return {
+			"clients"   : len( self._clients ),
+			"connects"  : self.connects,
+			"published" : self.published,
+			"decimated" : self.decimated,
+			"sent"      : self.sent,
+			"dropped"   : self.dropped,
+		}
+
+	def _send( self, topic, frame ):
+		"""
+		----------------------------------------------------------------------
+		Queues a frame for the clients subscribed to 'topic' (None: all),
+		dropping their oldest if full, and wakes the thread
+		----------------------------------------------------------------------
+		"""
+		self.published += 1
+		for client in self._clients:
+			if topic is not None and client.topics is not None and topic not in client.topics:
+				continue
+			if len( client.frames ) == self._queue_size:
+				client.dropped += 1
+				self.dropped   += 1
+			client.frames.append( frame )
+		self._notify()
+		return
+
+	def _notify( self ):
+		# One wake-up is enough however many frames are queued before the
+		# thread runs
+		if self._wake is None or self._waking:
+			return
+		self._waking = True
+		try:
+			os.write( self._wake[1], b"\0" )
+		except BlockingIOError:
+			pass
+		return
+
+	def _accept( self ):
+		while True:
+			try:
+				connection, _ = self._listener.accept()
+			except BlockingIOError:
+				return
+			connection.setblocking( False )
+			client = _Client( connection, self._queue_size )
+			names  = json.dumps( self._topics ).encode()
+			client.pending = HEADER.pack( KIND_TOPICS, len( names ) ) + names
+			self._selector.register( connection, selectors.EVENT_READ, client )
+			self._clients  = self._clients + ( client, )
+			self.connects += 1
+		return
+
+	def _disconnect( self, client ):
+		self._clients = tuple( other for other in self._clients if other is not client )
+		try:
+			self._selector.unregister( client.connection )
+		except (KeyError, ValueError):
+			pass
+		client.connection.close()
+		return
+
+	def _receive( self, client ):
+		"""
+		----------------------------------------------------------------------
+		Reads a client's SUBSCRIBE frames; returns False once it has gone
+		----------------------------------------------------------------------
+		"""
+		try:
+			data = client.connection.recv( 4096 )
+		except BlockingIOError:
+			return True
+		except OSError:
+			return False
+		if not data:
+			return False
+		client.received += data
+		while len( client.received ) >= HEADER.size:
+			kind, length = HEADER.unpack_from( client.received )
+			if len( client.received ) < HEADER.size + length:
+				break
+			payload         = client.received[HEADER.size:HEADER.size + length]
+			client.received = client.received[HEADER.size + length:]
+			if kind == KIND_SUBSCRIBE:
+				topics        = { topic for ( topic, ) in TOPIC.iter_unpack( payload ) }
+				client.topics = topics or None
+		return True
+
+	def _write( self, client ):
+		"""
+		----------------------------------------------------------------------
+		Sends what a client has queued, until its socket would block;
+		returns False once it has gone
+		----------------------------------------------------------------------
+		"""
+		while True:
+			if not client.pending:
+				frames = []
+				size   = 0
+				if client.dropped > client.reported:
+					frames.append( HEADER.pack( KIND_DROPPED, DROPPED.size ) +
+					               DROPPED.pack( client.dropped - client.reported ) )
+					client.reported = client.dropped
+				while client.frames and size < PubSubServer.WRITE_SIZE:
+					frame  = client.frames.popleft()
+					size  += len( frame )
+					frames.append( frame )
+				if not frames:
+					break
+				client.pending = b"".join( frames )
+				self.sent     += len( frames )
+			try:
+				sent = client.connection.send( client.pending )
+			except BlockingIOError:
+				break
+			except OSError as error:
+				if error.errno in ( errno.EPIPE, errno.ECONNRESET ):
+					return False
+				raise
+			client.pending = client.pending[sent:]
+
+		# Wait for the socket to drain before sending more
+		writing = bool( client.pending )
+		if writing != client.writing:
+			client.writing = writing
+			events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+			self._selector.modify( client.connection, events, client )
+		return True
+
+	def _service( self, timeout ):
+		for key, events in self._selector.select( timeout ):
+			if key.fileobj is self._listener:
+				self._accept()
+			elif self._wake and key.fileobj == self._wake[0]:
+				os.read( self._wake[0], 4096 )
+			elif events & selectors.EVENT_READ and not self._receive( key.data ):
+				self._disconnect( key.data )
+
+		# Cleared before writing, so frames published while writing wake
+		# the next pass
+		self._waking = False
+		for client in self._clients:
+			if not self._write( client ):
+				self._disconnect( client )
+		return
+
+	def _tick( self ):
+		if not self._running:
+			return
+		self._service( 0 )
+		self._clock.call_later( PubSubServer.POLL_INTERVAL, self._tick )
+		return
+
+	def _run( self ):
+		while self._running:
+			self._service( None )
+		return
+
+#-----------------------------------------------------------------------------
+# Client
+#-----------------------------------------------------------------------------
+
+def subscribe( path, topics = None ):
+	"""
+	--------------------------------------------------------------------------
+	Connects to a server and yields its messages as they arrive
+	--------------------------------------------------------------------------
+	Preconditions:
+	  path   - the server's socket
+	  topics - the topic names to be sent (default: every topic)
+	Postconditions:
+	 yields:
+	  ( kind, time ns, name, value ) for samples and events,
+	  ( KIND_STATE, time ns, state, previous ) for state changes, and
+	  ( KIND_DROPPED, None, None, count ) for frames lost
+	--------------------------------------------------------------------------
+	"""
+	connection = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+	connection.connect( path )
+	with connection:
+		stream = connection.makefile( "rb" )
+		names  = []
+		while True:
+			header = stream.read( HEADER.size )
+			if len( header ) < HEADER.size:
+				return
+			kind, length = HEADER.unpack( header )
+			payload      = stream.read( length )
+			if kind == KIND_TOPICS:
+				names = json.loads( payload.decode() )
+				if topics:
+					ids = [ names.index( name ) for name in topics if name in names ]
+					connection.sendall( HEADER.pack( KIND_SUBSCRIBE, TOPIC.size * len( ids ) ) +
+					                    b"".join( TOPIC.pack( topic ) for topic in ids ) )
+			elif kind in ( KIND_SAMPLE, KIND_EVENT ):
+				when, value, topic = SAMPLE.unpack( payload )
+				yield kind, when, names[topic] if topic < len( names ) else str( topic ), value
+			elif kind == KIND_STATE:
+				yield ( kind, ) + STATE.unpack( payload )
+			elif kind == KIND_DROPPED:
+				yield kind, None, None, DROPPED.unpack( payload )[0]
+	return
+
+def main( argv = None ):
+	parser = argparse.ArgumentParser( description = "Follows the alarm state and sensor streams" )
+	parser.add_argument( "path", nargs = "?", default = "pubsub.sock" )
+	parser.add_argument( "--topic", action = "append", help = "only show this topic (repeatable)" )
+	args = parser.parse_args( argv )
+
+	try:
+		for kind, when, name, value in subscribe( args.path, args.topic ):
+			if kind == KIND_STATE:
+				print( "{:>16.6f} state {} (from {})".format( when / 1e9, name, value ) )
+			elif kind == KIND_DROPPED:
+				print( "# {} frames dropped".format( value ) )
+			else:
+				print( "{:>16.6f} {:<20} {:>14.6g}{}".format( when / 1e9, name, value, " event" if kind == KIND_EVENT else "" ) )
+	except KeyboardInterrupt:
+		pass
+	return
+
+if __name__ == "__main__":
+	main()
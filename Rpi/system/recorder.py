@@ -0,0 +1,349 @@
+import os
+import json
+import mmap
+import time
+import array
+import struct
+import argparse
+import threading
+
+import numpy
+
+"""
+------------------------------------------------------------------------------
+Raw sensor recording, for replay (see system/replay.py).
+
+Where telemetry logs what the system decided, a recording keeps what the
+sensors gave it: every batch of ADC samples, every echo time, every switch
+edge and every mode word, so the detection can be run again on them with
+other settings. Records are appended to a memory-mapped file, so recording
+is a copy into the page cache under a lock, with no system call; the file
+grows by 'chunk' bytes at a time.
+
+A recording already at the path when recording starts is kept, rotated to
+path.1 as telemetry's files are, and so is the file being written once it
+reaches 'max_bytes': older ones move up to path.2, path.3 and so on, and
+the oldest beyond 'backups' is deleted. Every file stands on its own: a new
+one declares the streams again, and repeats the last record of each latched
+stream (such as the alarm state), so a replay of it starts in the state the
+system was in.
+
+  header : MAGIC, version, the wall and clock times recording started at
+           (ns), then the bytes of records committed
+  record : time (ns, on the HAL clock), stream, count, then 'count' values
+           of the stream's type, padded to 8 bytes
+
+Streams are declared by records of stream 0, whose values are the bytes of
+{ "name", "type" } as JSON, the type being an array typecode. The committed
+length is updated after every record, so a reader (or a recording cut off
+by a crash) never sees half of one.
+
+Summarize a recording with:
+
+  python -m system.recorder recording.bin
+------------------------------------------------------------------------------
+"""
+
+MAGIC   = b"SSRC"
+VERSION = 1
+HEADER  = struct.Struct( "<4sH2xqqQ" )
+RECORD  = struct.Struct( "<qH2xI" )
+LENGTH  = struct.Struct( "<Q" )
+
+LENGTH_OFFSET = HEADER.size - LENGTH.size
+DECLARATIONS  = 0 # the stream declaring the others
+
+class Recorder:
+	"""
+	--------------------------------------------------------------------------
+	Sensor Recorder
+	--------------------------------------------------------------------------
+	Description:
+	  Appends timestamped records of raw sensor values to a memory-mapped
+	  file. record() is safe from any thread; records are written in the
+	  order they are made, which is the order a replay feeds them back.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_CHUNK     = 4 << 20   # bytes the file grows by
+	DEFAULT_MAX_BYTES = 256 << 20 # bytes a file is rotated at
+	DEFAULT_BACKUPS   = 7         # rotated files kept
+
+	def __init__( self, clock, path, chunk = DEFAULT_CHUNK, max_bytes = DEFAULT_MAX_BYTES,
+	              backups = DEFAULT_BACKUPS ):
+		"""
+		----------------------------------------------------------------------
+		Creates the file, rotating any recording already there to path.1
+		----------------------------------------------------------------------
+		Preconditions:
+		  clock     - the HAL clock records are timed by
+		  path      - the file to write
+		  chunk     - the bytes the file grows by
+		  max_bytes - the size a file is rotated at
+		  backups   - the rotated files kept (0: none)
+		----------------------------------------------------------------------
+		"""
+		directory = os.path.dirname( path )
+		if directory:
+			os.makedirs( directory, exist_ok = True )
+
+		self._now       = clock.perf_counter_ns
+		self._path      = path
+		self._chunk     = max( mmap.PAGESIZE, chunk )
+		self._max_bytes = max_bytes
+		self._backups   = backups
+		self._types     = { DECLARATIONS : ( "B", 1 ) }
+		self._names     = {}
+		self._latched   = {} # the last record of each latched stream, by id
+		self._lock      = threading.Lock()
+
+		# Statistics
+		self.records   = 0
+		self.remaps    = 0
+		self.rotations = 0
+
+		if os.path.exists( path ):
+			self._shift()
+		self._open()
+		self._head = self._end
+		return
+
+	@property
+	def size( self ):
+		# The bytes committed to the current file, header included
+		return self._end
+
+	def stream( self, name, typecode, latched = False ):
+		"""
+		----------------------------------------------------------------------
+		Declares a stream, returning its id; a name already declared keeps
+		its id
+		----------------------------------------------------------------------
+		Preconditions:
+		  name     - the stream name, e.g. "pressure.0"
+		  typecode - the array typecode of its values, e.g. 'H' or 'd'
+		  latched  - whether its last record is repeated at the start of
+		             each new file, for a stream of states
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			if name in self._names:
+				return self._names[name]
+			stream = len( self._types )
+			self._types[stream] = ( typecode, array.array( typecode ).itemsize )
+			self._names[name]   = stream
+			if latched:
+				self._latched[stream] = None
+			if self._map is not None:
+				self._declare( stream, self._now() )
+		return stream
+
+	def record( self, stream, *parts, time_ns = None ):
+		"""
+		----------------------------------------------------------------------
+		Appends one record
+		----------------------------------------------------------------------
+		Preconditions:
+		  stream  - the id from stream()
+		  parts   - the values, in order: buffers of the stream's type (e.g.
+		            RingBuffer slices), or sequences of numbers; none for a
+		            bare event such as an edge
+		  time_ns - the time of the record (default: now)
+		----------------------------------------------------------------------
+		"""
+		if time_ns is None:
+			time_ns = self._now()
+		typecode, itemsize = self._types[stream]
+
+		views = []
+		for part in parts:
+			view = memoryview( part ) if _is_buffer( part, typecode ) else memoryview( array.array( typecode, part ) )
+			views.append( view.cast( "B" ) )
+
+		with self._lock:
+			if self._map is None:
+				return
+			if stream in self._latched:
+				self._latched[stream] = b"".join( views )
+			self._append( stream, time_ns, views )
+		return
+
+	def flush( self ):
+		"""
+		----------------------------------------------------------------------
+		Writes the recording to disk; it survives a crash of the process
+		without this, but not a loss of power
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			if self._map is not None:
+				self._map.flush()
+		return
+
+	def close( self ):
+		"""
+		----------------------------------------------------------------------
+		Flushes the recording and trims the file to the records committed
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			if self._map is not None:
+				self._close()
+		return
+
+	def _append( self, stream, time_ns, views ):
+		# Called with the lock held; a record that would take the file past
+		# max_bytes starts a new one, unless the file holds no records yet
+		length = sum( view.nbytes for view in views )
+		size   = RECORD.size + ((length + 7) & ~7)
+		if self._head is not None and self._end + size > self._max_bytes and self._end > self._head:
+			self._rotate( time_ns )
+
+		start = self._end
+		if start + size > len( self._map ):
+			self._grow( start + size )
+		RECORD.pack_into( self._map, start, time_ns, stream, length // self._types[stream][1] )
+		offset = start + RECORD.size
+		for view in views:
+			self._map[offset:offset + view.nbytes] = view
+			offset += view.nbytes
+		self._end = start + size
+		LENGTH.pack_into( self._map, LENGTH_OFFSET, self._end - HEADER.size )
+		self.records += 1
+		return
+
+	def _declare( self, stream, time_ns ):
+		# Called with the lock held
+		name     = next( name for name, id in self._names.items() if id == stream )
+		typecode = self._types[stream][0]
+		self._append( DECLARATIONS, time_ns, [ memoryview( json.dumps( { "name" : name, "type" : typecode } ).encode() ) ] )
+		return
+
+	def _open( self ):
+		# Called with the lock held, or from __init__
+		self._file = open( self._path, "w+b" )
+		self._file.truncate( self._chunk )
+		self._map  = mmap.mmap( self._file.fileno(), self._chunk )
+		HEADER.pack_into( self._map, 0, MAGIC, VERSION, time.time_ns(), self._now(), 0 )
+		self._end  = HEADER.size
+		self._head = None # where the records after the preamble start, once written
+		return
+
+	def _close( self ):
+		# Called with the lock held
+		self._map.flush()
+		self._map.close()
+		self._map = None
+		self._file.truncate( self._end )
+		self._file.close()
+		return
+
+	def _shift( self ):
+		# Moves the file at the path and its backups up by one
+		for index in range( self._backups - 1, 0, -1 ):
+			older = "{}.{}".format( self._path, index )
+			if os.path.exists( older ):
+				os.replace( older, "{}.{}".format( self._path, index + 1 ) )
+		if self._backups > 0:
+			os.replace( self._path, self._path + ".1" )
+		else:
+			os.remove( self._path )
+		return
+
+	def _rotate( self, time_ns ):
+		# Called with the lock held; the new file declares every stream
+		# again, then repeats the latched records
+		self._close()
+		self._shift()
+		self._open()
+		for stream in range( 1, len( self._types ) ):
+			self._declare( stream, time_ns )
+		for stream, values in self._latched.items():
+			if values is not None:
+				self._append( stream, time_ns, [ memoryview( values ) ] )
+		self._head = self._end
+		self.rotations += 1
+		return
+
+	def _grow( self, needed ):
+		# Called with the lock held
+		size = max( needed, len( self._map ) + self._chunk )
+		self._map.resize( size )
+		self.remaps += 1
+		return
+
+
+def _is_buffer( part, typecode ):
+	try:
+		return memoryview( part ).format.lstrip( "<=@" ) == typecode
+	except TypeError:
+		return False
+
+#-----------------------------------------------------------------------------
+# Reader
+#-----------------------------------------------------------------------------
+
+def read_recording( path ):
+	"""
+	--------------------------------------------------------------------------
+	Maps a recording for reading. The values are numpy arrays viewing the
+	mapped file, not copies, so a recording larger than memory can be read.
+	--------------------------------------------------------------------------
+	Postconditions:
+	 returns:
+	  ( streams, records, started ) - the stream names by id, a list of
+	  ( time ns, stream id, values ) tuples in the order recorded, and the
+	  wall time in ns of the clock time 0
+	  raises ValueError if the file is not a recording
+	--------------------------------------------------------------------------
+	"""
+	with open( path, "rb" ) as handle:
+		data = mmap.mmap( handle.fileno(), 0, access = mmap.ACCESS_READ )
+	if len( data ) < HEADER.size:
+		raise ValueError( "{}: too short for a recording header".format( path ) )
+	magic, version, wall, started, length = HEADER.unpack_from( data )
+	if magic != MAGIC or version != VERSION:
+		raise ValueError( "{}: not a version {} recording".format( path, VERSION ) )
+
+	streams = {}
+	dtypes  = { DECLARATIONS : numpy.dtype( "B" ) }
+	records = []
+	unpack  = RECORD.unpack_from
+	offset  = HEADER.size
+	end     = min( len( data ), HEADER.size + length )
+	while offset + RECORD.size <= end:
+		time_ns, stream, count = unpack( data, offset )
+		dtype  = dtypes[stream]
+		values = numpy.frombuffer( data, dtype, count, offset + RECORD.size )
+		offset += RECORD.size + ((count * dtype.itemsize + 7) & ~7)
+		if stream == DECLARATIONS:
+			declaration = json.loads( values.tobytes().decode() )
+			streams[len( dtypes )] = declaration["name"]
+			dtypes[len( dtypes )]  = numpy.dtype( "<" + declaration["type"] )
+			continue
+		records.append( ( time_ns, stream, values ) )
+	return streams, records, wall - started
+
+def main( argv = None ):
+	parser = argparse.ArgumentParser( description = "Summarizes a sensor recording" )
+	parser.add_argument( "path" )
+	args = parser.parse_args( argv )
+
+	streams, records, wall = read_recording( args.path )
+	if not records:
+		print( "{}: no records".format( args.path ) )
+		return
+	first, last = records[0][0], records[-1][0]
+	print( "{}: {} records over {:.1f}s from {}".format( args.path, len( records ), (last - first) / 1e9,
+		time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime( (wall + first) / 1e9 ) ) ) )
+	counts = {}
+	values = {}
+	for time_ns, stream, data in records:
+		counts[stream] = counts.get( stream, 0 ) + 1
+		values[stream] = values.get( stream, 0 ) + len( data )
+	for stream, name in sorted( streams.items() ):
+		print( "  {:<16} {:>10} records {:>12} values".format( name, counts.get( stream, 0 ), values.get( stream, 0 ) ) )
+	return
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,353 @@
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+
+from devices.sensors.fusion import FusionDetector
+from devices.sensors.ultrasonic.filter import EchoFilter
+from system.calibration import Calibration
+from system.recorder import read_recording
+from system.config import SCHEMA, load_config
+import system.alarm as alarm_states
+
+"""
+------------------------------------------------------------------------------
+Offline replay of sensor recordings (see system/recorder.py).
+
+Runs the detection of main.py over a recording as many times as wanted,
+each with other thresholds and windows, to tune them against what really
+happened instead of on the live system. A sweep tries every combination of
+the values given and reports what each would have detected:
+
+  python -m system.replay recording.bin --set pressure.threshold=6,8,12 \
+      --set ultrasonic.window=4,8 [--config config.json] [--processes N]
+
+Settings not given come from the configuration file. With calibration
+enabled in it, each run learns the thresholds as main.py does in standby.
+------------------------------------------------------------------------------
+"""
+
+# The streams main.py records that the detection reads
+STREAM_ECHO     = "echo"
+STREAM_STATE    = "state"
+STREAM_PRESSURE = "pressure.{}"
+
+# The settings a replay can vary, as section.key
+SETTINGS = ( "pressure.threshold", "ultrasonic.threshold", "ultrasonic.window", "fusion.smoothing",
+             "fusion.window", "fusion.noise_sigmas", "fusion.corroborate", "fusion.correlation" )
+
+# Kinds of event, in the order recorded
+PRESSURE, ECHO, STATE = range( 3 )
+
+class Replay:
+	"""
+	--------------------------------------------------------------------------
+	Recording Replay
+	--------------------------------------------------------------------------
+	Description:
+	  Feeds a recording to a FusionDetector as main.py fed the live one: a
+	  batch of samples per pad at each pressure check, and the echo of the
+	  group's sensor with the most change for its threshold at each
+	  ultrasonic step. A detection while the recorded state was enabled is
+	  one the system would have acted on; the first in each armed period
+	  is an alarm.
+
+	  With calibration enabled in the configuration, each run also learns
+	  every pad's and sensor's threshold while the recorded state is
+	  standby, as main.py does. The baselines main.py loaded at startup
+	  are not in the recording, so a run learns from none: the common
+	  thresholds stand for the first 'warmup' samples of each.
+
+	  Most of the work does not depend on the thresholds, so it is done
+	  once and kept: the moving averages of the pressure samples for each
+	  'fusion.smoothing', and the echo medians for each
+	  'ultrasonic.window'. Each run is then only the evidence and fusion
+	  over those features, which is what makes sweeps fast. A sweep runs
+	  in worker processes, forked after the features are ready so they
+	  share them.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, path, config = None ):
+		"""
+		----------------------------------------------------------------------
+		Loads a recording
+		----------------------------------------------------------------------
+		Preconditions:
+		  path   - the recording
+		  config - the configuration the settings not varied come from
+		           (default: the defaults)
+		----------------------------------------------------------------------
+		"""
+		streams, records, wall = read_recording( path )
+		self._config = config if config is not None else load_config()
+		ids          = { name: stream for stream, name in streams.items() }
+
+		pads = 0
+		while STREAM_PRESSURE.format( pads ) in ids:
+			pads += 1
+		kinds = { ids.get( STREAM_ECHO ) : ECHO, ids.get( STREAM_STATE ) : STATE }
+		kinds.update( { ids[STREAM_PRESSURE.format( pad )] : ( PRESSURE, pad ) for pad in range( pads ) } )
+
+		self._pads     = pads
+		self._sensors  = 1 # the echo records' widest
+		self._batches  = [ [] for _ in range( pads ) ]
+		self._echoes   = []
+		self._states   = []
+		self._events   = [] # ( kind, pad, index )
+		for time_ns, stream, values in records:
+			kind = kinds.get( stream )
+			if kind == ECHO:
+				self._events.append( ( ECHO, 0, len( self._echoes ) ) )
+				self._echoes.append( values )
+				self._sensors = max( self._sensors, len( values ) )
+			elif kind == STATE:
+				self._events.append( ( STATE, 0, len( self._states ) ) )
+				self._states.append( int( values[0] ) )
+			elif kind is not None:
+				pad = kind[1]
+				self._events.append( ( PRESSURE, pad, len( self._batches[pad] ) ) )
+				self._batches[pad].append( values )
+
+		self.seconds   = (records[-1][0] - records[0][0]) / 1e9 if records else 0.0
+		self.samples   = sum( len( values ) for batches in self._batches for values in batches )
+		self._features = {} # smoothing -> ( steps, variances, levels ) per pad
+		self._readings = {} # window -> the ( change, median, sensor, echo ) of each echo record
+		return
+
+	def settings( self, overrides = None ):
+		"""
+		----------------------------------------------------------------------
+		Returns every setting a run uses, as section.key, with 'overrides'
+		in place of the configuration's
+		----------------------------------------------------------------------
+		"""
+		settings = {}
+		for name in SETTINGS:
+			section, key = name.split( "." )
+			settings[name] = getattr( getattr( self._config, section ), key )
+		settings.update( overrides or {} )
+		return settings
+
+	def run( self, overrides = None ):
+		"""
+		----------------------------------------------------------------------
+		Replays the recording with some settings changed
+		----------------------------------------------------------------------
+		Postconditions:
+		 returns:
+		  a dictionary of the detections by reason, and while enabled: the
+		  'armed' detections, and the 'alarms' out of the armed 'periods'
+		----------------------------------------------------------------------
+		"""
+		settings  = self.settings( overrides )
+		smoothing = settings["fusion.smoothing"]
+		features  = self._pressure_features( smoothing )
+		readings  = self._echo_readings( settings["ultrasonic.window"] )
+
+		detector = FusionDetector( self._pads, self._config.adc.sample_rate,
+		                           settings["pressure.threshold"], settings["ultrasonic.threshold"],
+		                           smoothing, settings["fusion.window"], sensors = self._sensors )
+		detector.configure( settings["pressure.threshold"], settings["ultrasonic.threshold"],
+		                    settings["fusion.noise_sigmas"], settings["fusion.corroborate"],
+		                    settings["fusion.correlation"] )
+
+		calibration = None
+		if self._config.calibration.enabled:
+			learning    = self._config.calibration
+			calibration = Calibration( None, range( self._pads ), range( self._sensors ),
+			                           settings["pressure.threshold"], settings["ultrasonic.threshold"],
+			                           learning.sigmas, learning.memory, learning.warmup,
+			                           learning.floor, learning.ceiling )
+
+		state   = alarm_states.STANDBY
+		armed   = 0
+		alarms  = 0
+		periods = 0
+		alarmed = False
+		for kind, pad, index in self._events:
+			if kind == PRESSURE:
+				steps, variances, levels = features[pad]
+				if steps[index] is None:
+					continue
+				detector.steps[pad]     = steps[index]
+				detector.variances[pad] = variances[index]
+				detection = detector.evaluate_pressure( pad )
+				if calibration and state == alarm_states.STANDBY:
+					threshold = calibration.learn_pressure( pad, steps[index], levels[index] )
+					detector.set_pressure_threshold( pad, threshold )
+			elif kind == ECHO:
+				if not readings[index]:
+					continue
+				if calibration and state == alarm_states.STANDBY:
+					for change, median, sensor, echo in readings[index]:
+						detector.set_ultrasonic_threshold( sensor, calibration.learn_echo( sensor, median, echo ) )
+				# The sensor main.py gave the detector: the most change for its threshold
+				change, median, sensor, echo = max( readings[index],
+				                                    key = lambda reading: reading[1] / detector.ultrasonic_thresholds[reading[2]] )
+				detection = detector.add_echo( change, median, sensor )
+			else:
+				if self._states[index] == alarm_states.ENABLED and state != alarm_states.ENABLED:
+					periods += 1
+					alarmed  = False
+				state = self._states[index]
+				continue
+
+			if detection and state == alarm_states.ENABLED:
+				armed += 1
+				if not alarmed:
+					alarms += 1
+					alarmed = True
+
+		return {
+			"detections" : dict( detector.detections ),
+			"armed"      : armed,
+			"alarms"     : alarms,
+			"periods"    : periods,
+		}
+
+	def sweep( self, grid, processes = None ):
+		"""
+		----------------------------------------------------------------------
+		Replays every combination of the settings in 'grid'
+		----------------------------------------------------------------------
+		Preconditions:
+		  grid      - section.key -> the values to try
+		  processes - the worker processes (default: one per CPU; 1 runs
+		              in this process)
+		Postconditions:
+		 returns:
+		  a list of ( overrides, result ) in the order of the grid
+		----------------------------------------------------------------------
+		"""
+		names  = list( grid )
+		combos = [ dict( zip( names, values ) ) for values in itertools.product( *( grid[name] for name in names ) ) ]
+
+		# Ready every feature before forking, so the workers share them
+		for combo in combos:
+			settings = self.settings( combo )
+			self._pressure_features( settings["fusion.smoothing"] )
+			self._echo_readings( settings["ultrasonic.window"] )
+
+		if processes == 1 or len( combos ) < 2:
+			return [ ( combo, self.run( combo ) ) for combo in combos ]
+
+		global _replay
+		_replay = self
+		try:
+			with multiprocessing.get_context( "fork" ).Pool( processes ) as pool:
+				results = pool.map( _run, combos, chunksize = 1 )
+		finally:
+			_replay = None
+		return list( zip( combos, results ) )
+
+	def _pressure_features( self, smoothing ):
+		# The step, variance and level of every batch of every pad; None
+		# for the batches before there were 'smoothing' samples
+		if smoothing in self._features:
+			return self._features[smoothing]
+		detector = FusionDetector( self._pads, self._config.adc.sample_rate, 1.0, 1.0, smoothing )
+		features = []
+		for pad, batches in enumerate( self._batches ):
+			steps     = []
+			variances = []
+			levels    = []
+			for values in batches:
+				if detector.pressure_features( pad, [ values ] ):
+					steps.append( float( detector.steps[pad] ) )
+					variances.append( float( detector.variances[pad] ) )
+					levels.append( float( detector.levels[pad] ) )
+				else:
+					steps.append( None )
+					variances.append( None )
+					levels.append( None )
+			features.append( ( steps, variances, levels ) )
+		self._features[smoothing] = features
+		return features
+
+	def _echo_readings( self, window ):
+		# The ( change, median, sensor, echo ) of every sensor that answered
+		# in each step; run() picks the one main.py gave the detector, as
+		# that depends on the thresholds
+		if window in self._readings:
+			return self._readings[window]
+		filters  = [ EchoFilter( window ) for _ in range( self._sensors ) ]
+		readings = []
+		for values in self._echoes:
+			step = []
+			for sensor, echo in enumerate( values.tolist() ):
+				if echo != echo: # NaN: no echo
+					continue
+				change, median = filters[sensor].push( echo )
+				step.append( ( change, median, sensor, echo ) )
+			readings.append( step )
+		self._readings[window] = readings
+		return readings
+
+
+_replay = None # the Replay a sweep's workers run, inherited when they fork
+
+def _run( overrides ):
+	return _replay.run( overrides )
+
+def _parse_setting( text ):
+	"""
+	--------------------------------------------------------------------------
+	Parses "section.key=value,value,..." for --set, checking each value as
+	the configuration would
+	--------------------------------------------------------------------------
+	"""
+	name, _, values = text.partition( "=" )
+	if name not in SETTINGS:
+		raise argparse.ArgumentTypeError( "{} cannot be replayed; try one of {}".format( name, ", ".join( SETTINGS ) ) )
+	section, key = name.split( "." )
+	check        = SCHEMA[section][key][1]
+	parsed       = []
+	for value in values.split( "," ):
+		try:
+			value = json.loads( value )
+		except ValueError:
+			raise argparse.ArgumentTypeError( "{}: '{}' is not a number".format( name, value ) )
+		error = check( value )
+		if error:
+			raise argparse.ArgumentTypeError( "{}: {} {}".format( name, value, error ) )
+		parsed.append( value )
+	return name, parsed
+
+def main( argv = None ):
+	parser = argparse.ArgumentParser( description = "Replays a sensor recording through the detection" )
+	parser.add_argument( "path" )
+	parser.add_argument( "--config", default = "config.json", help = "the settings not varied (default: config.json)" )
+	parser.add_argument( "--set", action = "append", default = [], type = _parse_setting, metavar = "SECTION.KEY=V1,V2",
+	                     help = "values to try for a setting (repeatable)" )
+	parser.add_argument( "--processes", type = int, default = None, help = "worker processes (default: one per CPU)" )
+	args = parser.parse_args( argv )
+
+	started = time.perf_counter()
+	replay  = Replay( args.path, load_config( args.config ) )
+	loaded  = time.perf_counter()
+	try:
+		results = replay.sweep( dict( args.set ), args.processes )
+	except ValueError as error:
+		parser.error( str( error ) )
+	elapsed = time.perf_counter() - loaded
+
+	print( "{}: {:.1f}s of recording, {} samples, loaded in {:.2f}s".format(
+		args.path, replay.seconds, replay.samples, loaded - started ) )
+	print( "{} runs in {:.2f}s, {:.0f}x real time".format(
+		len( results ), elapsed, replay.seconds * len( results ) / elapsed if elapsed else 0.0 ) )
+
+	names   = [ name for name, values in args.set ]
+	reasons = ( FusionDetector.PRESSURE, FusionDetector.ULTRASONIC, FusionDetector.FUSED )
+	columns = names + list( reasons ) + [ "armed", "alarms" ]
+	print( " ".join( "{:>20}".format( column ) for column in columns ) )
+	for overrides, result in results:
+		row = [ overrides[name] for name in names ] + [ result["detections"][reason] for reason in reasons ]
+		row.append( result["armed"] )
+		row.append( "{}/{}".format( result["alarms"], result["periods"] ) )
+		print( " ".join( "{:>20}".format( str( value ) ) for value in row ) )
+	return
+
+if __name__ == "__main__":
+	main()
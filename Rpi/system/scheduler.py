@@ -0,0 +1,234 @@
+import asyncio
+import traceback
+
+from devices.hal import clock
+
+class SensorTask:
+	"""
+	--------------------------------------------------------------------------
+	Periodic Sensor Task
+	--------------------------------------------------------------------------
+	Description:
+	  A blocking function (SPI or GPIO access) released every 'period'
+	  seconds, which must complete within 'deadline' seconds of its release.
+	  Timing statistics are kept so the rates can be tuned per deployment.
+	  A release that raises is printed and counted in 'failed', and the
+	  task is released again on its next period.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, name, function, period, deadline = None ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a task
+		----------------------------------------------------------------------
+		Preconditions:
+		  name     - the name used when reporting
+		  function - the function to call (takes no arguments)
+		  period   - the time between releases, in seconds
+		  deadline - the time from release to completion, in seconds
+		             (default: period)
+		----------------------------------------------------------------------
+		"""
+		self.name     = name
+		self.function = function
+		self.period   = period
+		self.deadline = deadline
+
+		self.runs         = 0
+		self.missed       = 0   # completions after the deadline
+		self.skipped      = 0   # releases dropped because of an overrun
+		self.failed       = 0   # releases that raised
+		self.jitter_max   = 0.0
+		self.jitter_total = 0.0
+		self.runtime_max  = 0.0
+		return
+
+	def record( self, jitter, response ):
+		"""
+		----------------------------------------------------------------------
+		Records the timing of one release
+		----------------------------------------------------------------------
+		Preconditions:
+		  jitter   - the delay from release to start, in seconds
+		  response - the delay from release to completion, in seconds
+		----------------------------------------------------------------------
+		"""
+		deadline = self.deadline if self.deadline is not None else self.period
+
+		self.runs         += 1
+		self.jitter_total += jitter
+		if jitter > self.jitter_max:
+			self.jitter_max = jitter
+		if response > self.runtime_max:
+			self.runtime_max = response
+		if response > deadline:
+			self.missed += 1
+		return
+
+	def stats( self ):
+		"""
+		----------------------------------------------------------------------
+		Returns the timing statistics of this task as a dictionary
+		----------------------------------------------------------------------
+		"""
+		return {
+			"name"        : self.name,
+			"period"      : self.period,
+			"runs"        : self.runs,
+			"missed"      : self.missed,
+			"skipped"     : self.skipped,
+			"failed"      : self.failed,
+			"jitter_mean" : self.jitter_total / self.runs if self.runs else 0.0,
+			"jitter_max"  : self.jitter_max,
+			"response_max": self.runtime_max,
+		}
+
+
+class Scheduler:
+	"""
+	--------------------------------------------------------------------------
+	Asyncio Sensor Scheduler
+	--------------------------------------------------------------------------
+	Description:
+	  Runs every SensorTask on its own period. The blocking body of each
+	  task runs in an executor thread so that one slow sensor does not
+	  stall the others; a task never overlaps with itself.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, executor = None ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a scheduler
+		----------------------------------------------------------------------
+		Preconditions:
+		  executor - the executor for the blocking calls (default: a thread
+		             pool with one worker per task, or inline calls on the
+		             simulated backend)
+		----------------------------------------------------------------------
+		"""
+		self._tasks    = {}
+		self._executor = executor
+		self._loop     = None
+		self._stop     = None
+		return
+
+	def add( self, name, function, period, deadline = None ):
+		"""
+		----------------------------------------------------------------------
+		Adds a periodic task. Tasks must be added before run() is called.
+		----------------------------------------------------------------------
+		Preconditions:
+		  name     - the unique name of the task
+		  function - the blocking function to call
+		  period   - the time between releases, in seconds
+		  deadline - the time from release to completion (default: period)
+		Postconditions:
+		 returns:
+		  the SensorTask
+		----------------------------------------------------------------------
+		"""
+		task = SensorTask( name, function, period, deadline )
+		self._tasks[name] = task
+		return task
+
+	def task( self, name ):
+		return self._tasks[name]
+
+	def set_period( self, name, period, deadline = None ):
+		"""
+		----------------------------------------------------------------------
+		Changes the period of a task. Takes effect from its next release.
+		----------------------------------------------------------------------
+		"""
+		task = self._tasks[name]
+		task.period   = period
+		task.deadline = deadline
+		return
+
+	def run( self ):
+		"""
+		----------------------------------------------------------------------
+		Runs all tasks until stop() is called
+		----------------------------------------------------------------------
+		"""
+		loop = clock.new_event_loop()
+		main = loop.create_task( self._main() )
+		try:
+			loop.run_until_complete( main )
+		finally:
+			# Let the tasks unwind (e.g. after Ctrl-C) before closing the loop
+			main.cancel()
+			loop.run_until_complete( asyncio.gather( main, return_exceptions = True ) )
+			loop.close()
+		return
+
+	def stop( self ):
+		"""
+		----------------------------------------------------------------------
+		Stops the scheduler. Safe to call from any thread.
+		----------------------------------------------------------------------
+		"""
+		if self._loop and self._stop:
+			self._loop.call_soon_threadsafe( self._stop.set )
+		return
+
+	def stats( self ):
+		return [ task.stats() for task in self._tasks.values() ]
+
+	def report( self ):
+		"""
+		----------------------------------------------------------------------
+		Formats the per-task jitter and deadline statistics as a table
+		----------------------------------------------------------------------
+		"""
+		lines = [ "{:<12} {:>8} {:>8} {:>7} {:>7} {:>7} {:>10} {:>10} {:>10}".format(
+			"task", "period", "runs", "missed", "skipped", "failed", "jit-mean", "jit-max", "resp-max" ) ]
+		for s in self.stats():
+			lines.append( "{:<12} {:>7.3f}s {:>8} {:>7} {:>7} {:>7} {:>9.2f}ms {:>9.2f}ms {:>9.2f}ms".format(
+				s["name"], s["period"], s["runs"], s["missed"], s["skipped"], s["failed"],
+				s["jitter_mean"] * 1e3, s["jitter_max"] * 1e3, s["response_max"] * 1e3 ) )
+		return "\n".join( lines )
+
+	async def _main( self ):
+		self._loop = asyncio.get_running_loop()
+		self._stop = asyncio.Event()
+
+		executor = self._executor
+		if executor is None:
+			executor = clock.new_executor( max( 1, len( self._tasks ) ) )
+
+		runners = [ asyncio.ensure_future( self._run_task( task, executor ) ) for task in self._tasks.values() ]
+		try:
+			await self._stop.wait()
+		finally:
+			for runner in runners:
+				runner.cancel()
+			await asyncio.gather( *runners, return_exceptions = True )
+			if self._executor is None:
+				executor.shutdown( wait = True )
+		return
+
+	async def _run_task( self, task, executor ):
+		loop    = self._loop
+		release = loop.time()
+		while True:
+			start = loop.time()
+			try:
+				await loop.run_in_executor( executor, task.function )
+			except Exception:
+				# One bad release must not stop the sensor for good
+				traceback.print_exc()
+				task.failed += 1
+			finish = loop.time()
+			task.record( start - release, finish - release )
+
+			# Drop the releases that passed while the task overran
+			release += task.period
+			if release < finish:
+				skipped       = int( (finish - release) / task.period ) + 1
+				task.skipped += skipped
+				release      += skipped * task.period
+
+			await asyncio.sleep( release - loop.time() )
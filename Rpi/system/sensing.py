@@ -0,0 +1,544 @@
+import os
+import math
+import signal
+import threading
+import functools
+import multiprocessing
+
+from devices.hal import GPIO, clock
+from devices.adc.mcp3008 import MCP3008
+from devices.adc.capture import AdcCapture
+from devices.sensors.switches.Switch import Switch
+from devices.sensors.generic_input import generic_input
+from devices.sensors.ultrasonic.HCSR04 import HCSR04
+from devices.sensors.ultrasonic.array import UltrasonicArray, UltrasonicReading
+from system.ipc import SharedRing
+
+"""
+------------------------------------------------------------------------------
+The sensors in a process of their own, for the split layout of main.py.
+
+In one process, the echo edges of the HC-SR04s are timed by GPIO callbacks
+that must take the GIL from whatever else is running: the audio mixing,
+the outputs, the detection, telemetry. A callback that waits for it stamps
+the edge late, and the echo time is off by the wait. The sensing process
+runs only the sensors, so its callbacks wait on nothing but each other,
+and it asks for a higher priority than the main process for the CPU:
+
+  sensing process : the MCP3008 capture, the ultrasonic array, the radio
+                    switches and the DE board mode pins
+  main process    : detection, the state machine, the outputs, the audio,
+                    telemetry, recording and pubsub
+
+The ADC samples and the ultrasonic readings come back through SharedRings;
+the rest goes over pipes, commands one way (settings, stop) and events the
+other (switch changes and edges, mode words, a note after each ultrasonic
+step, and the statistics once stopped).
+------------------------------------------------------------------------------
+"""
+
+LAYOUT_SINGLE = "single" # every device in the main process
+LAYOUT_SPLIT  = "split"  # the sensors in a sensing process
+
+# An ultrasonic reading as recorded in the shared ring: the step it was
+# taken in, then the fields of an UltrasonicReading; the distance is NaN
+# before the sensor has one
+ECHO_RECORD   = "QHqdddd"
+ECHO_CAPACITY = 256 # readings
+
+# Commands to the sensing process, as ( command, values... )
+COMMAND_RATE, COMMAND_TIMEOUT, COMMAND_GUARD, COMMAND_WINDOW, COMMAND_PERIOD, \
+	COMMAND_DEBOUNCE, COMMAND_STOP = range( 7 )
+
+# Events from it, as ( event, values... )
+EVENT_READY, EVENT_RISING, EVENT_EDGE, EVENT_MODE, EVENT_STEP, EVENT_STATS = range( 6 )
+
+class SensingProcess:
+	"""
+	--------------------------------------------------------------------------
+	Sensing Process
+	--------------------------------------------------------------------------
+	Description:
+	  Forks a process that owns the SPI bus and the input pins, and stands
+	  in for its devices in this one. 'capture', 'sonars', 'switches' and
+	  'state_in' have the parts of the AdcCapture, UltrasonicArray, Switch
+	  and generic_input interfaces that main.py uses, so the detection
+	  runs the same on either layout:
+
+	    capture.buffers  - the pads' SharedRings, read in place
+	    sonars.step()    - waits for the next step of the process and
+	                       returns its readings, oldest step first
+	    set_on_rising(), set_on_change(), ...
+	                     - called on the 'sensing-events' thread
+
+	  Settings are sent to the process and apply from its next step or
+	  sample; the statistics of the stand-ins are the process's, as of
+	  stop().
+
+	  The process pings on its own, every 'period' seconds. A consumer
+	  more than a cycle of groups behind skips to the latest cycle, and the
+	  steps skipped are counted in sonars.skipped.
+	--------------------------------------------------------------------------
+	"""
+
+	STEP_WAIT = 1.0 # s, the longest sonars.step() waits
+	NICE      = -10 # the priority asked for the process
+
+	def __init__( self, adc, pads, rate, capacity, sensors, groups, guard, timeout, window, period,
+	              switches, bouncetime, mode_pins, mode_settle, edges = False ):
+		"""
+		----------------------------------------------------------------------
+		Makes the shared rings; the process is forked by start()
+		----------------------------------------------------------------------
+		Preconditions:
+		  adc         - ( device, chip select ) of the MCP3008
+		  pads        - the ( channel, differential ) conversions captured
+		  rate        - the sample rate, in Hz
+		  capacity    - the samples held per pad
+		  sensors     - ( trigger, echo ) pins of each HC-SR04
+		  groups      - the sensors fired together (see UltrasonicArray)
+		  guard       - the seconds of quiet between groups
+		  timeout     - the longest wait for an echo, in seconds
+		  window      - the samples in each sensor's medians
+		  period      - the seconds between ultrasonic steps
+		  switches    - ( pin, debounce ) of each radio switch
+		  bouncetime  - the RPi.GPIO bouncetime of the switches in ms, or
+		                None
+		  mode_pins   - the DE board mode pins, most significant first
+		  mode_settle - the seconds the mode pins must be stable
+		  edges       - whether to send every raw switch edge too, for
+		                recording
+		----------------------------------------------------------------------
+		"""
+		self._context     = multiprocessing.get_context( "fork" )
+		self._adc         = adc
+		self._pads        = list( pads )
+		self._rate        = rate
+		self._sensors     = list( sensors )
+		self._groups      = groups
+		self._guard       = guard
+		self._timeout     = timeout
+		self._window      = window
+		self._period      = period
+		self._switch_pins = list( switches )
+		self._bouncetime  = bouncetime
+		self._mode_pins   = list( mode_pins )
+		self._mode_settle = mode_settle
+		self._edges       = edges
+
+		self._events_in, self._events_out     = self._context.Pipe( False )
+		self._commands_in, self._commands_out = self._context.Pipe( False )
+		self._send_lock = threading.Lock()
+		self._ready     = threading.Event()
+		self._process   = None
+		self._thread    = None
+
+		rings = [ SharedRing( capacity, 'H', self._context ) for _ in self._pads ]
+		self.capture  = _RemoteCapture( self, rings, SharedRing( capacity, 'Q', self._context ) )
+		self.sonars   = _RemoteArray( self, SharedRing( ECHO_CAPACITY, ECHO_RECORD, self._context ),
+		                              len( self._sensors ), groups, window )
+		self.switches = [ _RemoteSwitch( self, index ) for index in range( len( self._switch_pins ) ) ]
+		self.state_in = _RemoteInput()
+		return
+
+	@property
+	def pid( self ):
+		return self._process.pid if self._process else None
+
+	def start( self, timeout = 5.0 ):
+		"""
+		----------------------------------------------------------------------
+		Forks the sensing process and waits for its devices to be set up.
+		Call it before this process starts a thread: the fork copies the
+		memory of every thread but only the calling one runs, so a lock
+		another thread held stays held in the child.
+		----------------------------------------------------------------------
+		"""
+		if clock.virtual:
+			raise RuntimeError( "the sensing process needs the real clock; the simulation runs in one process" )
+		self._process = self._context.Process( target = self._serve, name = "sensing", daemon = True )
+		self._process.start()
+		# The child's ends; closing them here lets each side see the other exit
+		self._events_out.close()
+		self._commands_in.close()
+
+		self._thread = threading.Thread( target = self._dispatch, name = "sensing-events", daemon = True )
+		self._thread.start()
+		if not self._ready.wait( timeout ):
+			self._process.terminate()
+			raise RuntimeError( "the sensing process did not start" )
+		return
+
+	def stop( self, timeout = 2.0 ):
+		"""
+		----------------------------------------------------------------------
+		Stops the process, waiting for its final statistics, and frees the
+		rings
+		----------------------------------------------------------------------
+		"""
+		if self._process is None:
+			return
+		self.send( COMMAND_STOP )
+		self._process.join( timeout )
+		if self._process.is_alive():
+			self._process.terminate()
+			self._process.join()
+		self._thread.join( timeout )
+		self._process = None
+		self.sonars._close()
+		self.capture._close()
+		return
+
+	def set_period( self, seconds ):
+		"""
+		----------------------------------------------------------------------
+		Changes the seconds between ultrasonic steps; 0 pauses them
+		----------------------------------------------------------------------
+		"""
+		self.send( COMMAND_PERIOD, seconds )
+		return
+
+	def send( self, *command ):
+		# From any thread of this process
+		with self._send_lock:
+			try:
+				self._commands_out.send( command )
+			except (BrokenPipeError, OSError):
+				pass
+		return
+
+	def _dispatch( self ):
+		# The 'sensing-events' thread: every event from the process
+		while True:
+			try:
+				event = self._events_in.recv()
+			except (EOFError, OSError):
+				break
+			kind = event[0]
+			if kind == EVENT_STEP:
+				self.sonars._stepped( event[1] )
+			elif kind == EVENT_RISING:
+				self.switches[event[1]]._rising( event[2] )
+			elif kind == EVENT_EDGE:
+				self.switches[event[1]]._edge( event[2] )
+			elif kind == EVENT_MODE:
+				self.state_in._change( event[1], event[2] )
+			elif kind == EVENT_READY:
+				self.state_in._word = event[1]
+				self._ready.set()
+			elif kind == EVENT_STATS:
+				self._statistics( event[1] )
+		self.sonars._stepped( None )
+		return
+
+	def _statistics( self, stats ):
+		self.capture._samples = stats["samples"]
+		self.capture.missed   = stats["missed"]
+		self.sonars._stats    = stats["sonars"]
+		for switch, ( edges, changes, glitches ) in zip( self.switches, stats["switches"] ):
+			switch.edges    = edges
+			switch.changes  = changes
+			switch.glitches = glitches
+		return
+
+	#-------------------------------------------------------------------------
+	# The sensing process
+	#-------------------------------------------------------------------------
+
+	def _serve( self ):
+		# The main process takes Ctrl-C and SIGHUP, and stops this one
+		signal.signal( signal.SIGINT, signal.SIG_IGN )
+		if hasattr( signal, "SIGHUP" ):
+			signal.signal( signal.SIGHUP, signal.SIG_IGN )
+		self._events_in.close()
+		self._commands_out.close()
+		self._event_lock = threading.Lock()
+
+		# Ahead of the main process for the CPU, where allowed (as root)
+		try:
+			os.setpriority( os.PRIO_PROCESS, 0, SensingProcess.NICE )
+		except OSError:
+			pass
+
+		adc     = MCP3008( *self._adc )
+		capture = AdcCapture( adc, self._pads, self._rate,
+		                      buffers = self.capture.buffers, timestamps = self.capture.timestamps )
+		capture.sample()
+		capture.start()
+
+		switches = []
+		for index, ( pin, debounce ) in enumerate( self._switch_pins ):
+			switch = Switch( pin, debounce, self._bouncetime )
+			switch.set_on_rising( functools.partial( self._event, EVENT_RISING, index ) )
+			if self._edges:
+				switch.set_on_edge( functools.partial( self._event, EVENT_EDGE, index ) )
+			switches.append( switch )
+		mode = generic_input( self._mode_pins, self._mode_settle )
+		mode.set_on_change( functools.partial( self._event, EVENT_MODE ) )
+
+		sonars = UltrasonicArray( [ HCSR04( trigger, echo ) for trigger, echo in self._sensors ],
+		                          self._groups, self._guard, self._timeout, self._window )
+		self._event( EVENT_READY, mode.get() )
+
+		step     = 0
+		deadline = clock.perf_counter_ns()
+		while self._commands( capture, sonars, switches ):
+			if not self._period:
+				# Paused until a command sets a period
+				self._commands_in.poll( None )
+				deadline = clock.perf_counter_ns()
+				continue
+			step    += 1
+			readings = sonars.step()
+			self.sonars._ring.extend( ( step, reading.sensor, reading.time_ns, reading.echo, reading.change,
+			                            reading.median, math.nan if reading.distance is None else reading.distance )
+			                          for reading in readings )
+			self._event( EVENT_STEP, step )
+
+			deadline += int( self._period * 1e9 )
+			delay     = deadline - clock.perf_counter_ns()
+			if delay > 0:
+				clock.sleep( delay / 1e9 )
+			else:
+				deadline -= delay # late; the next period starts now
+
+		capture.stop()
+		self._event( EVENT_STATS, {
+			"samples"  : capture.samples,
+			"missed"   : capture.missed,
+			"sonars"   : sonars.stats(),
+			"switches" : [ ( switch.edges, switch.changes, switch.glitches ) for switch in switches ],
+		} )
+		GPIO.cleanup( [ echo for trigger, echo in self._sensors ] + self._mode_pins )
+		return
+
+	def _commands( self, capture, sonars, switches ):
+		# Applies the commands sent since the last step; False to stop
+		while self._commands_in.poll():
+			try:
+				command = self._commands_in.recv()
+			except EOFError:
+				return False # the main process has gone
+			kind = command[0]
+			if kind == COMMAND_STOP:
+				return False
+			elif kind == COMMAND_RATE:
+				capture.set_rate( command[1] )
+			elif kind == COMMAND_TIMEOUT:
+				sonars.set_timeout( command[1] )
+			elif kind == COMMAND_GUARD:
+				sonars.set_guard( command[1] )
+			elif kind == COMMAND_WINDOW:
+				sonars.set_window( command[1] )
+			elif kind == COMMAND_PERIOD:
+				self._period = command[1]
+			elif kind == COMMAND_DEBOUNCE:
+				switches[command[1]].set_debounce( command[2] )
+		return True
+
+	def _event( self, *event ):
+		# From the stepping, GPIO callback and clock timer threads
+		with self._event_lock:
+			try:
+				self._events_out.send( event )
+			except (BrokenPipeError, OSError):
+				pass
+		return
+
+
+#-----------------------------------------------------------------------------
+# Stand-ins for the devices of the sensing process
+#-----------------------------------------------------------------------------
+
+class _RemoteCapture:
+	# The AdcCapture of the sensing process, which samples from its start
+
+	def __init__( self, process, buffers, timestamps ):
+		self._process   = process
+		self.buffers    = buffers
+		self.timestamps = timestamps
+
+		self._samples   = None # the process's count, once it has stopped
+
+		# Statistics
+		self.missed = 0
+		return
+
+	@property
+	def samples( self ):
+		# Until the process stops, every scan is timestamped as it is stored
+		if self._samples is not None:
+			return self._samples
+		return self.timestamps.written
+
+	def set_rate( self, rate ):
+		self._process.send( COMMAND_RATE, rate )
+		return
+
+	def sample( self ):
+		return
+
+	def start( self ):
+		return
+
+	def stop( self ):
+		return
+
+	def _close( self ):
+		for ring in self.buffers + [ self.timestamps ]:
+			ring.close()
+		return
+
+
+class _RemoteArray:
+	# The UltrasonicArray of the sensing process
+
+	def __init__( self, process, ring, sensors, groups, window ):
+		self._process   = process
+		self._ring      = ring
+		self._sensors   = sensors
+		self._groups    = [ list( group ) for group in groups ] if groups else [ [ index ] for index in range( sensors ) ]
+		self._window    = window
+		self._cursor    = 0
+		self._pending   = [] # records of steps not yet returned
+		self._taken     = 0  # the last step returned
+		self._latest    = 0  # the last step the process finished
+		self._running   = True
+		self._condition = threading.Condition()
+		self._stats     = None
+
+		# Statistics
+		self.skipped = 0 # steps passed over to catch up
+		return
+
+	def __len__( self ):
+		return self._sensors
+
+	@property
+	def groups( self ):
+		return [ list( group ) for group in self._groups ]
+
+	def set_window( self, size ):
+		# Called every check, so only changes are sent
+		if size != self._window:
+			self._window = size
+			self._process.send( COMMAND_WINDOW, size )
+		return
+
+	def set_timeout( self, seconds ):
+		self._process.send( COMMAND_TIMEOUT, seconds )
+		return
+
+	def set_guard( self, seconds ):
+		self._process.send( COMMAND_GUARD, seconds )
+		return
+
+	def step( self ):
+		with self._condition:
+			self._condition.wait_for( lambda: self._latest > self._taken or not self._running,
+			                          SensingProcess.STEP_WAIT )
+			latest = self._latest
+		if latest <= self._taken:
+			return []
+
+		records, self._cursor = self._ring.records( self._cursor )
+		self._pending.extend( records )
+		step = max( self._taken + 1, latest - len( self._groups ) + 1 )
+		self.skipped += step - self._taken - 1
+		self._taken   = step
+
+		readings = []
+		pending  = []
+		for record in self._pending:
+			if record[0] == step:
+				distance = None if math.isnan( record[6] ) else record[6]
+				readings.append( UltrasonicReading( *record[1:6], distance ) )
+			elif record[0] > step:
+				pending.append( record )
+		self._pending = pending
+		return readings
+
+	def timeouts( self ):
+		return self.stats()["timeouts"]
+
+	def stats( self ):
+		if self._stats is not None:
+			return self._stats
+		return { "sensors" : self._sensors, "groups" : len( self._groups ), "cycles" : 0, "slots" : 0,
+		         "pings" : self._ring.written, "echoes" : 0, "timeouts" : 0, "stale" : 0, "elapsed" : 0.0,
+		         "throughput" : 0.0, "rates" : [ 0.0 ] * self._sensors }
+
+	def _stepped( self, step ):
+		# None once the process has gone
+		with self._condition:
+			if step is None:
+				self._running = False
+			else:
+				self._latest = step
+			self._condition.notify_all()
+		return
+
+	def _close( self ):
+		self._ring.close()
+		return
+
+
+class _RemoteSwitch:
+	# A Switch of the sensing process
+
+	def __init__( self, process, index ):
+		self._process   = process
+		self._index     = index
+		self._on_rising = None
+		self._on_edge   = None
+
+		# Statistics
+		self.edges    = 0
+		self.changes  = 0
+		self.glitches = 0
+		return
+
+	def set_on_rising( self, function ):
+		self._on_rising = function
+		return
+
+	def set_on_edge( self, function ):
+		# Only called if the process was made with 'edges'
+		self._on_edge = function
+		return
+
+	def set_debounce( self, debounce ):
+		self._process.send( COMMAND_DEBOUNCE, self._index, debounce )
+		return
+
+	def _rising( self, event ):
+		if self._on_rising:
+			self._on_rising( event )
+		return
+
+	def _edge( self, time_ns ):
+		if self._on_edge:
+			self._on_edge( time_ns )
+		return
+
+
+class _RemoteInput:
+	# The generic_input of the DE board mode pins
+
+	def __init__( self ):
+		self._word      = 0
+		self._on_change = None
+		return
+
+	def get( self ):
+		return self._word
+
+	def set_on_change( self, function ):
+		self._on_change = function
+		return
+
+	def _change( self, word, previous ):
+		self._word = word
+		if self._on_change:
+			self._on_change( word, previous )
+		return
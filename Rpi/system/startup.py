@@ -0,0 +1,84 @@
+import os
+import time
+
+class StartupProfile:
+	"""
+	--------------------------------------------------------------------------
+	Startup Profile
+	--------------------------------------------------------------------------
+	Description:
+	  Records the wall time of each step of startup, so the time from
+	  power-on to the first sample and to being armable can be tracked.
+	  Where Linux provides them, the time the interpreter took before the
+	  profile started and the time since boot of each step are included.
+	--------------------------------------------------------------------------
+	"""
+
+	def __init__( self, start_ns = None ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a profile
+		----------------------------------------------------------------------
+		Preconditions:
+		  start_ns - the time.perf_counter_ns() startup began at (default:
+		             now); take it before the imports to include them
+		----------------------------------------------------------------------
+		"""
+		now = time.perf_counter_ns()
+		self._start = start_ns if start_ns is not None else now
+		self._marks = []
+
+		# Seconds since boot at self._start, and when the process began
+		self._boot        = None
+		self._interpreter = None
+		try:
+			self._boot = time.clock_gettime( time.CLOCK_BOOTTIME ) - (now - self._start) / 1000000000.0
+			with open( "/proc/self/stat" ) as stat:
+				# The start time is field 22, counted after the ")" ending field 2
+				fields  = stat.read().rsplit( ")", 1 )[1].split()
+				started = int( fields[19] ) / os.sysconf( "SC_CLK_TCK" )
+			self._interpreter = max( 0.0, self._boot - started )
+		except (AttributeError, OSError, ValueError, IndexError):
+			pass
+		return
+
+	def mark( self, name ):
+		"""
+		----------------------------------------------------------------------
+		Records that the step 'name' has just finished
+		----------------------------------------------------------------------
+		"""
+		self._marks.append( ( name, time.perf_counter_ns() ) )
+		return
+
+	def elapsed( self, name ):
+		"""
+		----------------------------------------------------------------------
+		Returns the seconds from the start of the profile to the end of the
+		step 'name', or None if it has not finished
+		----------------------------------------------------------------------
+		"""
+		for mark, when in self._marks:
+			if mark == name:
+				return (when - self._start) / 1000000000.0
+		return None
+
+	def report( self ):
+		"""
+		----------------------------------------------------------------------
+		Formats the steps as a table
+		----------------------------------------------------------------------
+		"""
+		lines = [ "{:<16} {:>10} {:>10} {:>10}".format( "startup", "step", "total", "boot" ) ]
+		if self._interpreter is not None:
+			lines.append( "{:<16} {:>8.1f}ms {:>10} {:>9.2f}s".format(
+				"interpreter", self._interpreter * 1e3, "", self._boot ) )
+
+		previous = self._start
+		for name, when in self._marks:
+			total = (when - self._start) / 1000000000.0
+			boot  = "{:>9.2f}s".format( self._boot + total ) if self._boot is not None else ""
+			lines.append( "{:<16} {:>8.1f}ms {:>8.1f}ms {:>10}".format(
+				name, (when - previous) / 1e6, total * 1e3, boot ) )
+			previous = when
+		return "\n".join( lines )
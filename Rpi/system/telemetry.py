@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import itertools
+import threading
+
+"""
+------------------------------------------------------------------------------
+Binary event and telemetry log.
+
+Producers call Telemetry.record( sensor, value, state ), which packs one
+fixed-size record into a preallocated ring; a background writer copies the
+records to a file in batches, rotating it by size. Each file starts with a
+header naming the sensors, so it can be decoded on its own:
+
+  header : MAGIC, version, record size, header length, the wall and clock
+           times the file was opened at (ns), then the sensor names as JSON
+  record : sequence, time (ns, on the HAL clock), value, sensor, state
+
+Decode a file with:
+
+  python -m system.telemetry telemetry.bin [--sensor name] [--csv]
+------------------------------------------------------------------------------
+"""
+
+MAGIC   = b"SSTL"
+VERSION = 1
+HEADER  = struct.Struct( "<4sHHIqq" )
+RECORD  = struct.Struct( "<QqdHH4x" ) # padded so sequences are 8-byte aligned
+
+FSYNC_NEVER    = "never"
+FSYNC_BATCH    = "batch"
+FSYNC_INTERVAL = "interval"
+
+class Telemetry:
+	"""
+	--------------------------------------------------------------------------
+	Telemetry Log
+	--------------------------------------------------------------------------
+	Description:
+	  record() takes no lock. Each record claims a slot from an
+	  itertools.count, whose next() is atomic, and is packed into the slot
+	  by a single struct.pack_into call, which holds the GIL, so no record
+	  is ever seen half-written. The slot's sequence number tells the
+	  writer whether it has been written yet (a producer may be preempted
+	  between claiming and packing) and whether it has been lapped; a
+	  writer that falls more than 'capacity' records behind counts the
+	  records lost in 'dropped'.
+
+	  The writer runs every 'flush_interval' seconds on its own thread (or
+	  from clock events on the simulated backend). fsync is done after
+	  every batch, at most every 'fsync_interval' seconds, or never.
+	--------------------------------------------------------------------------
+	"""
+
+	DEFAULT_CAPACITY = 4096 # records
+
+	def __init__( self, clock, path, capacity = DEFAULT_CAPACITY, max_bytes = 1 << 20, backups = 3,
+	              flush_interval = 0.5, fsync = FSYNC_INTERVAL, fsync_interval = 5.0 ):
+		"""
+		----------------------------------------------------------------------
+		Constructs a log; nothing is written until start()
+		----------------------------------------------------------------------
+		Preconditions:
+		  clock          - the HAL clock records are timed by
+		  path           - the file to write; rotated files get .1, .2, ...
+		  capacity       - the records the ring holds; a power of two
+		  max_bytes      - the size a file is rotated at
+		  backups        - the rotated files kept
+		  flush_interval - the seconds between batches
+		  fsync          - FSYNC_NEVER, FSYNC_BATCH or FSYNC_INTERVAL
+		  fsync_interval - the seconds between fsyncs, for FSYNC_INTERVAL
+		----------------------------------------------------------------------
+		"""
+		if capacity < 1 or capacity & (capacity - 1):
+			raise ValueError( "capacity must be a power of two" )
+		if fsync not in ( FSYNC_NEVER, FSYNC_BATCH, FSYNC_INTERVAL ):
+			raise ValueError( "unknown fsync policy '{}'".format( fsync ) )
+
+		self._clock          = clock
+		self._path           = path
+		self._capacity       = capacity
+		self._max_bytes      = max_bytes
+		self._backups        = backups
+		self._flush_interval = flush_interval
+		self._fsync          = fsync
+		self._fsync_interval = fsync_interval
+
+		self._ring     = bytearray( capacity * RECORD.size )
+		self._sequence = itertools.count( 1 ) # 0 marks an empty slot
+		self._next     = 1                    # the next sequence to write
+		self._sensors  = []
+
+		# The writer reads sequences through a view of the ring as 8-byte
+		# words (the Pi is little-endian, like the records)
+		self._words = memoryview( self._ring ).cast( "Q" )
+
+		# Bound once, since record() is on every hot path
+		self._pack  = RECORD.pack_into
+		self._now   = clock.perf_counter_ns
+		self._mask  = capacity - 1
+		self._shift = RECORD.size.bit_length() - 1 # the record size is a power of two
+
+		self._file     = None
+		self._header   = 0
+		self._synced   = 0.0
+		self._lock     = threading.Lock() # serializes flushes
+		self._stop     = threading.Event()
+		self._thread   = None
+		self._running  = False
+
+		# Statistics
+		self.written   = 0
+		self.dropped   = 0
+		self.batches   = 0
+		self.fsyncs    = 0
+		self.rotations = 0
+		return
+
+	def sensor( self, name ):
+		"""
+		----------------------------------------------------------------------
+		Returns the id of the sensor 'name', registering it if it is new.
+		Register every sensor before start(), so the first file names them
+		all.
+		----------------------------------------------------------------------
+		"""
+		if name not in self._sensors:
+			self._sensors.append( name )
+		return self._sensors.index( name )
+
+	@property
+	def sensors( self ):
+		# The sensor names, in id order
+		return list( self._sensors )
+
+	def record( self, sensor, value, state = 0 ):
+		"""
+		----------------------------------------------------------------------
+		Logs one record. Safe from any thread, and never blocks.
+		----------------------------------------------------------------------
+		Preconditions:
+		  sensor - an id from sensor()
+		  value  - the reading, as a float
+		  state  - the alarm state, or any small integer
+		----------------------------------------------------------------------
+		"""
+		sequence = next( self._sequence )
+		self._pack( self._ring, (sequence & self._mask) << self._shift, sequence, self._now(), value, sensor, state )
+		return
+
+	def start( self ):
+		"""
+		----------------------------------------------------------------------
+		Opens the file and starts writing batches
+		----------------------------------------------------------------------
+		"""
+		if self._running:
+			return
+		self._running = True
+		self._open()
+		if self._clock.virtual:
+			self._clock.call_later( self._flush_interval, self._tick )
+			return
+		self._thread = threading.Thread( target = self._run, name = "telemetry", daemon = True )
+		self._thread.start()
+		return
+
+	def close( self ):
+		"""
+		----------------------------------------------------------------------
+		Writes the records still in the ring, syncs and closes the file
+		----------------------------------------------------------------------
+		"""
+		self._running = False
+		self._stop.set()
+		if self._thread:
+			self._thread.join()
+			self._thread = None
+		if self._file:
+			self.flush()
+			os.fsync( self._file.fileno() )
+			self.fsyncs += 1
+			self._file.close()
+			self._file = None
+		return
+
+	def flush( self ):
+		"""
+		----------------------------------------------------------------------
+		Writes the records produced since the last flush as one batch
+		----------------------------------------------------------------------
+		"""
+		with self._lock:
+			batch = self._collect()
+			if not batch:
+				return
+			if self._file.tell() > self._header and self._file.tell() + len( batch ) > self._max_bytes:
+				self._rotate()
+
+			self._file.write( batch )
+			self._file.flush()
+			self.written += len( batch ) // RECORD.size
+			self.batches += 1
+
+			now = self._clock.monotonic()
+			if self._fsync == FSYNC_BATCH or (self._fsync == FSYNC_INTERVAL and
+			                                  now - self._synced >= self._fsync_interval):
+				os.fsync( self._file.fileno() )
+				self._synced = now
+				self.fsyncs += 1
+		return
+
+	def _collect( self ):
+		"""
+		----------------------------------------------------------------------
+		Takes the written records from the ring, in sequence order, up to
+		the first slot that has not been written yet, and at most one ring
+		at a time
+		----------------------------------------------------------------------
+		"""
+		size   = RECORD.size
+		words  = size // 8
+		chunks = []
+		first  = self._next
+		while self._next - first < self._capacity:
+			# The sequences from the next slot to the end of the ring
+			slot      = self._next & self._mask
+			sequences = self._words[slot * words::words].tolist()
+			count     = 0
+			for sequence in sequences:
+				if sequence != self._next + count:
+					break
+				count += 1
+
+			if count:
+				chunk = bytes( self._ring[slot * size:(slot + count) * size] )
+				# A producer may have lapped the slots while they were read
+				if memoryview( chunk ).cast( "Q" )[::words].tolist() == sequences[:count]:
+					chunks.append( chunk )
+					self._next += count
+					if count == len( sequences ):
+						continue # wrap around to the start of the ring
+					sequence = sequences[count]
+				else:
+					sequence = self._words[slot * words]
+
+			if sequence <= self._next:
+				break # not written yet
+			# Lapped: the oldest record still held follows this one
+			oldest        = sequence - self._capacity + 1
+			self.dropped += oldest - self._next
+			self._next    = oldest
+		return b"".join( chunks )
+
+	def _open( self ):
+		directory = os.path.dirname( self._path )
+		if directory:
+			os.makedirs( directory, exist_ok = True )
+		names        = json.dumps( self._sensors ).encode()
+		self._header = HEADER.size + len( names )
+		self._file   = open( self._path, "wb" )
+		self._file.write( HEADER.pack( MAGIC, VERSION, RECORD.size, self._header,
+		                               time.time_ns(), self._clock.perf_counter_ns() ) + names )
+		self._synced = self._clock.monotonic()
+		return
+
+	def _rotate( self ):
+		os.fsync( self._file.fileno() )
+		self._file.close()
+		for index in range( self._backups - 1, 0, -1 ):
+			older = "{}.{}".format( self._path, index )
+			if os.path.exists( older ):
+				os.replace( older, "{}.{}".format( self._path, index + 1 ) )
+		if self._backups > 0:
+			os.replace( self._path, self._path + ".1" )
+		self.rotations += 1
+		self._open()
+		return
+
+	def _tick( self ):
+		if not self._running:
+			return
+		self.flush()
+		self._clock.call_later( self._flush_interval, self._tick )
+		return
+
+	def _run( self ):
+		while not self._stop.wait( self._flush_interval ):
+			self.flush()
+		return
+
+#-----------------------------------------------------------------------------
+# Reader
+#-----------------------------------------------------------------------------
+
+def read_telemetry( path ):
+	"""
+	--------------------------------------------------------------------------
+	Decodes a telemetry file
+	--------------------------------------------------------------------------
+	Postconditions:
+	 returns:
+	  ( sensors, records ) - the sensor names, and a list of ( sequence,
+	  wall time in s, sensor name, value, state ) tuples
+	  raises ValueError if the file is not a telemetry log
+	--------------------------------------------------------------------------
+	"""
+	with open( path, "rb" ) as handle:
+		data = handle.read()
+	if len( data ) < HEADER.size:
+		raise ValueError( "{}: too short for a telemetry header".format( path ) )
+	magic, version, size, length, wall, started = HEADER.unpack_from( data )
+	if magic != MAGIC or version != VERSION or size != RECORD.size:
+		raise ValueError( "{}: not a version {} telemetry log".format( path, VERSION ) )
+	sensors = json.loads( data[HEADER.size:length].decode() )
+
+	records = []
+	end     = length + (len( data ) - length) // size * size # ignores a torn last record
+	for sequence, when, value, sensor, state in RECORD.iter_unpack( data[length:end] ):
+		name = sensors[sensor] if sensor < len( sensors ) else str( sensor )
+		records.append( ( sequence, (wall + when - started) / 1000000000.0, name, value, state ) )
+	return sensors, records
+
+def main( argv = None ):
+	parser = argparse.ArgumentParser( description = "Decodes a telemetry log" )
+	parser.add_argument( "path" )
+	parser.add_argument( "--sensor", action = "append", help = "only show this sensor (repeatable)" )
+	parser.add_argument( "--csv", action = "store_true", help = "print comma-separated values" )
+	args = parser.parse_args( argv )
+
+	sensors, records = read_telemetry( args.path )
+	if args.csv:
+		print( "sequence,time,sensor,value,state" )
+	previous = None
+	for sequence, when, name, value, state in records:
+		if previous is not None and sequence != previous + 1:
+			print( "# {} records lost".format( sequence - previous - 1 ), file = sys.stderr )
+		previous = sequence
+		if args.sensor and name not in args.sensor:
+			continue
+		if args.csv:
+			print( "{},{:.6f},{},{!r},{}".format( sequence, when, name, value, state ) )
+		else:
+			print( "{:>8} {} {:<20} {:>14.6g} {:>3}".format(
+				sequence, time.strftime( "%H:%M:%S", time.localtime( when ) ) + "{:.6f}".format( when % 1 )[1:],
+				name, value, state ) )
+	return
+
+if __name__ == "__main__":
+	main()